@@ -267,6 +267,7 @@ setup_args = {
                             'bin/radicalpilot-bson2json',
                             'bin/radicalpilot-cleanup',
                             'bin/radicalpilot-close-session',
+                            'bin/radicalpilot-convert-profiles',
                             'bin/radicalpilot-create-static-ve',
                             'bin/radicalpilot-deploy-ompi.sh',
                             'bin/radicalpilot-fetch-db',
@@ -295,7 +296,7 @@ setup_args = {
                             'msgpack-python',
                             'pyzmq'
                            ],
-    'tests_require'      : [],
+    'tests_require'      : ['numpy', 'pandas'],
     'test_suite'         : '%s.tests' % name,
     'zip_safe'           : False,
 #   'build_sphinx'       : {
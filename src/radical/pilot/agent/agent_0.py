@@ -152,6 +152,7 @@ class Agent_0(rpu.Worker):
 
         # register idle callback to pull for units -- which is the only action
         # we have to perform, really
+        self._claim_size = self._cfg.get('db_claim_size', 1024)
         self.register_timed_cb(self._check_units_cb,
                                timer=self._cfg['db_poll_sleeptime'])
 
@@ -213,12 +214,13 @@ class Agent_0(rpu.Worker):
         ret = self._session._dbs._c.update(
                 {'type'   : 'pilot',
                  "uid"    : self._pid},
-                {"$push"  : {"states"        : state},
-                 "$set"   : {"state"         : state,
-                             "stdout"        : rpu.tail(out),
-                             "stderr"        : rpu.tail(err),
-                             "logfile"       : rpu.tail(log),
-                             "finished"      : now}
+                {"$push"        : {"states"   : state},
+                 "$set"         : {"state"    : state,
+                                   "stdout"   : rpu.tail(out),
+                                   "stderr"   : rpu.tail(err),
+                                   "logfile"  : rpu.tail(log),
+                                   "finished" : now},
+                 "$currentDate" : {"_mtime"   : True}
                 })
         self._log.debug('update ret: %s', ret)
 
@@ -396,7 +398,8 @@ class Agent_0(rpu.Worker):
         # FIXME: this is disabled right now
         retdoc = self._session._dbs._c.find_and_modify(
                     query  = {"uid"  : self._pid},
-                    update = {"$set" : {'cmd': []}}, # Wipe content of array
+                    update = {"$set"         : {'cmd'   : []}, # Wipe content of array
+                              "$currentDate" : {'_mtime': True}},
                     fields = ['cmd']
                     )
 
@@ -422,9 +425,9 @@ class Agent_0(rpu.Worker):
                 self.stop()
                 return False  # we are done
 
-            elif cmd == 'cancel_unit':
-                self._log.info('cancel unit cmd')
-                self.publish(rpc.CONTROL_PUBSUB, {'cmd' : 'cancel_unit',
+            elif cmd in ['cancel_unit', 'cancel_units']:
+                self._log.info('%s cmd', cmd)
+                self.publish(rpc.CONTROL_PUBSUB, {'cmd' : cmd,
                                                   'arg' : arg})
             else:
                 self._log.error('could not interpret cmd "%s" - ignore', cmd)
@@ -460,58 +463,41 @@ class Agent_0(rpu.Worker):
             self._log.warn('db connection gone - abort')
             return False
 
-        # Check if there are compute units waiting for input staging
-        # and log that we pulled it.
-        #
-        # FIXME: Unfortunately, 'find_and_modify' is not bulkable, so we have
-        #        to use 'find'.  To avoid finding the same units over and over
-        #        again, we update the 'control' field *before* running the next
-        #        find -- so we do it right here.
-        #        This also blocks us from using multiple ingest threads, or from
-        #        doing late binding by unit pull :/
-        unit_cursor = self._session._dbs._c.find(spec = {'type'    : 'unit',
-                                                         'pilot'   : self._pid,
-                                                         'control' : 'agent_pending'})
-        if not unit_cursor.count():
-            # no units whatsoever...
-            self._log.info("units pulled:    0")
-            return True  # this is not an error
-
-        # update the units to avoid pulling them again next time.
-        unit_list = list(unit_cursor)
-        unit_uids = [unit['uid'] for unit in unit_list]
-
-        self._log.info("units PULLED: %4d", len(unit_list))
-
-        self._session._dbs._c.update(multi    = True,
-                        spec     = {'type'  : 'unit',
-                                    'uid'   : {'$in'     : unit_uids}},
-                        document = {'$set'  : {'control' : 'agent'}})
-
-        self._log.info("units pulled: %4d", len(unit_list))
-        self._prof.prof('get', msg="bulk size: %d" % len(unit_list), uid=self._pid)
-
-        for unit in unit_list:
-
-            # we need to make sure to have the correct state:
-            unit['state'] = rps._unit_state_collapse(unit['states'])
-            self._prof.prof('get', msg="bulk size: %d" % len(unit_list), uid=unit['uid'])
-
-            # FIXME: raise or fail unit!
-            if unit['control'] != 'agent_pending':
-                self._log.error(' === invalid control: %s', (pprint.pformat(unit)))
-
-            if unit['state'] != rps.AGENT_STAGING_INPUT_PENDING:
-                self._log.error(' === invalid state: %s', (pprint.pformat(unit)))
-
-            unit['control'] = 'agent'
-
-        # now we really own the CUs, and can start working on them (ie. push
-        # them into the pipeline).  We don't publish nor profile as advance,
-        # since that happened already on the module side when the state was set.
-        self.advance(unit_list, publish=False, push=True, prof=False)
-
-        return True
+        # Claim compute units waiting for input staging.  The claim is atomic,
+        # so concurrent ingesters never pull the same unit twice.  If we got
+        # a full batch, more units are likely waiting, so we don't wait for
+        # the next poll.
+        while True:
+
+            unit_list = self._session._dbs.claim_units(
+                                pattern = {'pilot' : self._pid},
+                                control = 'agent',
+                                limit   = self._claim_size)
+            if not unit_list:
+                self._log.info("units pulled:    0")
+                return True  # this is not an error
+
+            self._log.info("units pulled: %4d", len(unit_list))
+            self._prof.prof('get', msg="bulk size: %d" % len(unit_list), uid=self._pid)
+
+            for unit in unit_list:
+
+                # we need to make sure to have the correct state:
+                unit['state'] = rps._unit_state_collapse(unit['states'])
+                self._prof.prof('get', msg="bulk size: %d" % len(unit_list), uid=unit['uid'])
+
+                # FIXME: raise or fail unit!
+                if unit['state'] != rps.AGENT_STAGING_INPUT_PENDING:
+                    self._log.error(' === invalid state: %s', (pprint.pformat(unit)))
+
+            # now we really own the CUs, and can start working on them (ie. push
+            # them into the pipeline).  We don't publish nor profile as advance,
+            # since that happened already on the module side when the state was
+            # set.
+            self.advance(unit_list, publish=False, push=True, prof=False)
+
+            if len(unit_list) < self._claim_size:
+                return True
 
 
 # ------------------------------------------------------------------------------
@@ -50,6 +50,7 @@ SDISTS=
 RUNTIME=
 VIRTENV=
 VIRTENV_MODE=
+VIRTENV_CACHE=
 CCM=
 PILOT_ID=
 RP_VERSION=
@@ -483,6 +484,56 @@ run_cmd()
 
 
 
+# ------------------------------------------------------------------------------
+#
+# pack files into a pilot bundle (the profile or logfile tarball), which is
+# fetched by the client (see `rpu.fetch_profiles()`).  The tarball is written to
+# a temporary file and then renamed, so that a client never sees a partial
+# bundle, even if it fetches while the pilot is still running.  Files which
+# change while they are packed are included as far as written.
+#
+bundle()
+{
+    tarball="$1"; shift
+    files=`ls $* 2>/dev/null`
+
+    if test -z "$files"
+    then
+        return
+    fi
+
+    tar -czf "$tarball.tmp" $files || true
+    mv -f    "$tarball.tmp" "$tarball"
+}
+
+
+# ------------------------------------------------------------------------------
+#
+# refresh the profile and logfile bundles every $1 seconds, so that clients can
+# fetch them during the run.  We stop when 'bundle.signal' appears, but don't
+# get killed, to avoid corrupted bundles.
+#
+bundler()
+{
+    interval="$1"
+
+    echo "start bundling profiles / logfiles [`date`]"
+    while ! test -e bundle.signal
+    do
+        bundle "$PROFILES_TARBALL" $PROFILES
+        bundle "$LOGFILES_TARBALL" $LOGFILES
+
+        n=0
+        while test "$n" -lt "$interval" && ! test -e bundle.signal
+        do
+            sleep 1
+            n=$((n+1))
+        done
+    done
+    echo "stop  bundling profiles / logfiles [`date`]"
+}
+
+
 # ------------------------------------------------------------------------------
 #
 # create and/or update a virtenv, depending on mode specifier:
@@ -492,9 +543,12 @@ run_cmd()
 #   'create'  : use    if it exists, otherwise create, then use
 #   'use'     : use    if it exists, otherwise error,  then exit
 #   'recreate': delete if it exists, otherwise create, then use
+#   'cache'   : unpack the cached bundle, create it if needed, then use
+#   'pack'    : create the cached bundle if needed,              then exit
 #
 # create and update ops will be locked and thus protected against concurrent
-# bootstrap_1 invokations.
+# bootstrap_1 invokations.  Cached virtenvs don't need locks (see
+# virtenv_cache()).
 #
 # (private + location in pilot sandbox == old behavior)
 #
@@ -552,6 +606,18 @@ virtenv_setup()
         test -d "$virtenv/" && rm -r "$virtenv"
         ve_create=TRUE
         ve_update=FALSE
+
+    elif test "$virtenv_mode" = "cache" -o "$virtenv_mode" = "pack"
+    then
+        # conda envs can't be relocated by rewriting the prefix
+        if test "$python_dist" = "anaconda"
+        then
+            printf "\nERROR: cannot cache anaconda virtenvs\n\n"
+            exit 1
+        fi
+        ve_create=FALSE
+        ve_update=FALSE
+
     else
         ve_create=FALSE
         ve_update=FALSE
@@ -647,6 +713,37 @@ virtenv_setup()
         fi
     fi
 
+    # Cached virtenvs come with the RP stack installed if it is installed from
+    # sdists (which pin the versions) -- otherwise, RP is installed as usual.
+    if test "$virtenv_mode" = "cache" -o "$virtenv_mode" = "pack"
+    then
+        virtenv_cache "$virtenv" "$virtenv_mode" "$python_dist" "$virtenv_dist"
+        if ! test "$?" = 0
+        then
+            echo "Error on virtenv cache -- abort"
+            exit 1
+        fi
+
+        if test "$virtenv_mode" = "pack"
+        then
+            profile_event 'virtenv_setup end'
+            exit 0
+        fi
+
+        # we use the unpacked virtenv from here on
+        virtenv="$VIRTENV"
+
+        if test "$RP_INSTALL_SDIST" = "TRUE"
+        then
+            for src in $RP_INSTALL_SOURCES
+            do
+                rm -rf "$src"
+            done
+            RP_INSTALL_SOURCES=''
+            RP_INSTALL_TARGET=''
+        fi
+    fi
+
     # A ve lock is not needed (nor desired) on sandbox installs.
     RP_INSTALL_LOCK='FALSE'
     if test "$RP_INSTALL_TARGET" = "VIRTENV"
@@ -718,6 +815,274 @@ virtenv_setup()
 }
 
 
+# ------------------------------------------------------------------------------
+#
+# Cached virtenvs are kept as tarballs ('bundles') in $VIRTENV_CACHE, which by
+# default lives in the resource sandbox.  Bundles are content-addressed: their
+# name contains a hash over everything which determines the virtenv content (RP
+# version, the content of the sdists, python and virtenv distribution, and
+# dependencies).  A bundle thus never needs updating, and is safe to share
+# between pilots.
+#
+# Pilots unpack the bundle to "$virtenv.<hash>" (which can be node-local) with
+# a single `tar` call, and then rename it into place, so that no pilot ever sees
+# a partial virtenv: the first rename wins, and all other pilots use that
+# virtenv.  If the bundle does not exist, yet, the first pilot to claim it
+# creates it, and the others wait for it to appear.  Bundles are renamed into
+# place, too.
+#
+# A claim is a directory (mkdir is atomic) with an 'owner' file, which holds the
+# ID of the claiming pilot and a timestamp.  The claiming pilot refreshes the
+# timestamp while it builds the bundle.  A claim which has not been refreshed
+# for $LOCK_TIMEOUT seconds is stale (its pilot likely died), and is reclaimed.
+#
+# On success, VIRTENV points to the unpacked virtenv (not in 'pack' mode).
+#
+virtenv_cache()
+{
+    virtenv="$1"
+    virtenv_mode="$2"
+    python_dist="$3"
+    virtenv_dist="$4"
+
+    # sdists are found where `rp_install()` looks for them
+    sdist_sums=''
+    for sdist in `echo $SDISTS | tr ':' ' '`
+    do
+        if test -f "$SESSION_SANDBOX/$sdist"
+        then
+            sum=`md5sum "$SESSION_SANDBOX/$sdist" | cut -f 1 -d ' '`
+        elif test -f "./$sdist"
+        then
+            sum=`md5sum "./$sdist" | cut -f 1 -d ' '`
+        else
+            echo "WARNING: sdist $sdist not found, hash its name"
+            sum="$sdist"
+        fi
+        sdist_sums="$sdist_sums $sum"
+    done
+
+    py_version=`$PYTHON -c 'import sys; print "%d.%d.%d" % sys.version_info[:3]'`
+    ve_hash=`echo "$RP_VERSION $sdist_sums $python_dist $virtenv_dist $py_version $VIRTENV_RADICAL_DEPS" \
+           | md5sum | cut -f 1 -d ' '`
+    ve_tag=`echo "$RP_VERSION" | tr -c 'a-zA-Z0-9.\n' '_'`
+
+    bundle="$VIRTENV_CACHE/ve.$ve_tag.$ve_hash.tgz"
+    target="$virtenv.$ve_hash"
+
+    echo "virtenv bundle   : $bundle"
+    echo "virtenv target   : $target"
+
+    if test "$virtenv_mode" = "cache" -a -d "$target/"
+    then
+        echo "virtenv $target exists"
+        VIRTENV="$target"
+        return 0
+    fi
+
+    if test -f "$bundle"
+    then
+        echo "found bundle $bundle"
+    else
+        mkdir -p "$VIRTENV_CACHE"
+
+        claim="$bundle.claim"
+        count=0
+        waiting=''
+        until test -f "$bundle"
+        do
+            # whoever creates the claim creates the bundle
+            if mkdir "$claim" 2>/dev/null
+            then
+                echo "$PILOT_ID `date +%s`" > "$claim/owner"
+                virtenv_heartbeat "$claim" &
+                heartbeat=$!
+
+                virtenv_pack "$bundle" "$python_dist" "$virtenv_dist"
+                ret=$?
+
+                kill "$heartbeat" 2>/dev/null
+                wait "$heartbeat" 2>/dev/null
+
+                # don't remove the claim if it was reclaimed meanwhile
+                owner=`cut -f 1 -d ' ' "$claim/owner" 2>/dev/null`
+                if test "$owner" = "$PILOT_ID"
+                then
+                    rm -rf "$claim"
+                fi
+
+                test "$ret" = 0 || return 1
+                continue
+            fi
+
+            owner=`cat "$claim/owner" 2>/dev/null`
+            stamp=`echo "$owner" | cut -f 2 -d ' ' -s`
+            now=`date +%s`
+
+            # a claim without owner is stale if it stays that way
+            if test -z "$stamp"
+            then
+                count=$((count+1))
+                stamp=$((now - count))
+            fi
+
+            if test $((now - stamp)) -gt "$LOCK_TIMEOUT"
+            then
+                echo "### WARNING ###"
+                echo "stale claim for $bundle -- reclaim from '$owner'"
+                # mv is atomic: only one pilot removes the stale claim
+                rm -rf "$claim.$PILOT_ID"
+                if mv "$claim" "$claim.$PILOT_ID" 2>/dev/null
+                then
+                    rm -rf "$claim.$PILOT_ID"
+                fi
+                count=0
+                continue
+            fi
+
+            if test -z "$waiting" -o "$((now % 60))" = 0
+            then
+                echo "wait for bundle $bundle (claimed by '$owner')"
+                waiting='true'
+            fi
+            sleep 1
+        done
+    fi
+
+    if test "$virtenv_mode" = "pack"
+    then
+        return 0
+    fi
+
+    virtenv_unpack "$bundle" "$target" || return 1
+    VIRTENV="$target"
+}
+
+
+# ------------------------------------------------------------------------------
+#
+# Refresh the timestamp of our claim on a bundle (see `virtenv_cache()`) every
+# 10 seconds, for as long as we own it.
+#
+virtenv_heartbeat()
+{
+    claim="$1"
+
+    # sleep in the background, so that we can be killed while we sleep
+    while sleep 10 & wait $!
+    do
+        owner=`cut -f 1 -d ' ' "$claim/owner" 2>/dev/null`
+        test "$owner" = "$PILOT_ID" || break
+
+        echo "$PILOT_ID `date +%s`" > "$claim/owner.$PILOT_ID" \
+            && mv -f "$claim/owner.$PILOT_ID" "$claim/owner"    \
+            || break
+    done
+}
+
+
+# ------------------------------------------------------------------------------
+#
+# Create a virtenv (with the RP stack, if installed from sdists), and pack it
+# into the given bundle.  We build in a subshell, so that the virtenv
+# activation does not leak into the pilot environment.
+#
+virtenv_pack()
+{
+    profile_event 'virtenv_pack start'
+
+    bundle="$1"
+    python_dist="$2"
+    virtenv_dist="$3"
+
+    build="$bundle.$PILOT_ID.build"
+    tmp="$bundle.$PILOT_ID.tmp"
+
+    (
+        VIRTENV="$build"
+        virtenv_create "$build" "$python_dist" "$virtenv_dist" || exit 1
+
+        if test "$RP_INSTALL_SDIST" = "TRUE"
+        then
+            rp_install "$RP_INSTALL_SOURCES" "VIRTENV" "$RP_INSTALL_SDIST"
+        fi
+
+        # record the prefix, so that the virtenv can be relocated on unpack
+        echo "$build" > "$build/rp_ve_prefix"
+        run_cmd "pack virtenv" "tar -C '$build' -czf '$tmp' ."
+    )
+    ret=$?
+    rm -rf "$build"
+
+    if test "$ret" = 0 && mv -f "$tmp" "$bundle"
+    then
+        echo "packed virtenv into $bundle"
+    else
+        echo "ERROR: could not pack virtenv into $bundle"
+        rm -f "$tmp"
+        ret=1
+    fi
+
+    profile_event 'virtenv_pack done'
+    return $ret
+}
+
+
+# ------------------------------------------------------------------------------
+#
+# Unpack a virtenv bundle to the given target.  Scripts, .pth files and symlinks
+# refer to the path the virtenv was created at, so we rewrite those to the
+# target path before renaming the virtenv into place.
+#
+virtenv_unpack()
+{
+    profile_event 'virtenv_unpack start'
+
+    bundle="$1"
+    target="$2"
+
+    tmp="$target.$PILOT_ID.tmp"
+    rm -rf   "$tmp"
+    mkdir -p "$tmp"
+
+    run_cmd "unpack virtenv" "tar -C '$tmp' -xzf '$bundle'"
+    if ! test "$?" = 0
+    then
+        rm -rf "$tmp"
+        return 1
+    fi
+
+    prefix=`cat "$tmp/rp_ve_prefix"`
+    for f in `grep -lI "$prefix" "$tmp"/bin/* "$tmp"/rp_install/bin/* \
+                    "$tmp"/lib*/python*/site-packages/*.pth 2>/dev/null`
+    do
+        sed -i -e "s|$prefix|$target|g" "$f"
+    done
+
+    for link in `find "$tmp" -type l`
+    do
+        dest=`readlink "$link"`
+        case "$dest" in
+            "$prefix"*)
+                ln -sfn "$target${dest#$prefix}" "$link"
+                ;;
+        esac
+    done
+    echo "$target" > "$tmp/rp_ve_prefix"
+
+    # the rename fails if another pilot was faster -- we use its virtenv then
+    if mv -T "$tmp" "$target" 2>/dev/null
+    then
+        echo "unpacked virtenv to $target"
+    else
+        echo "virtenv $target was unpacked concurrently"
+        rm -rf "$tmp"
+    fi
+
+    profile_event 'virtenv_unpack done'
+}
+
+
 # ------------------------------------------------------------------------------
 #
 virtenv_activate()
@@ -1364,7 +1729,7 @@ echo "# -------------------------------------------------------------------"
 #    -x   exit cleanup - delete pilot sandbox, virtualenv etc. after completion
 #    -y   runtime limit
 # 
-while getopts "a:b:cd:e:f:g:h:i:m:p:r:s:t:v:w:x:y:" OPTION; do
+while getopts "a:b:cd:e:f:g:h:i:k:m:p:r:s:t:v:w:x:y:" OPTION; do
     case $OPTION in
         a)  SESSION_SANDBOX="$OPTARG"  ;;
         b)  PYTHON_DIST="$OPTARG"  ;;
@@ -1375,6 +1740,7 @@ while getopts "a:b:cd:e:f:g:h:i:m:p:r:s:t:v:w:x:y:" OPTION; do
         g)  VIRTENV_DIST="$OPTARG"  ;;
         h)  HOSTPORT="$OPTARG"  ;;
         i)  PYTHON="$OPTARG"  ;;
+        k)  VIRTENV_CACHE="$OPTARG"  ;;
         m)  VIRTENV_MODE="$OPTARG"  ;;
         p)  PILOT_ID="$OPTARG"  ;;
         r)  RP_VERSION="$OPTARG"  ;;
@@ -1407,9 +1773,17 @@ then
     SESSION_SANDBOX="$PILOT_SANDBOX/.."
 fi
 
+# virtenv bundles are cached in the resource sandbox by default
+if test -z "$VIRTENV_CACHE"
+then
+    VIRTENV_CACHE="$SESSION_SANDBOX/../ve_cache"
+fi
+
 # TODO: Move earlier, because if pre_bootstrap fails, this is not yet set
 LOGFILES_TARBALL="$PILOT_ID.log.tgz"
 PROFILES_TARBALL="$PILOT_ID.prof.tgz"
+LOGFILES="*.log *.out *.err *.cfg"
+PROFILES="*.prof *.bprof *.bprof.idx"
 
 # some backends (condor) never finalize a job when output files are missing --
 # so we touch them here to prevent that
@@ -1683,49 +2057,13 @@ profile_event 'agent start'
 profile_event 'sync rel' 'agent start'
 
 
-# # I am ashamed that we have to resort to this -- lets hope it's temporary...
-# cat > packer.sh <<EOT
-# #!/bin/sh
-# 
-# PROFILES_TARBALL="$PILOT_ID.prof.tgz"
-# LOGFILES_TARBALL="$PILOT_ID.log.tgz"
-# 
-# echo "start packing profiles / logfiles [\$(date)]"
-# while ! test -e exit.signal
-# do
-#     
-#     if test -z "\$(ls *.prof )"
-#     then 
-#         echo "skip  packing profiles [\$(date)]"
-#     else
-#         echo "check packing profiles [\$(date)]"
-#         mkdir prof/
-#         cp  *.prof prof/
-#         tar -czf "\$PROFILES_TARBALL.tmp" prof/ || true
-#         mv       "\$PROFILES_TARBALL.tmp" "\$PROFILES_TARBALL"
-#         rm -rf prof/
-#     fi
-# 
-# 
-#     # we always have a least the cfg file
-#     if true
-#     then
-#         echo "check packing logfiles [\$(date)]"
-#         mkdir log/
-#         cp  *.log *.out *.err *,cfg log/
-#         tar -czf "\$LOGFILES_TARBALL.tmp" log/ || true
-#         mv       "\$LOGFILES_TARBALL.tmp" "\$LOGFILES_TARBALL"
-#         rm -rf log/
-#     fi
-# 
-#     ls -l *.tgz
-#     sleep 10
-# done
-# echo "stop  packing profiles / logfiles [\$(date)]"
-# EOT
-# chmod 0755 packer.sh
-# ./packer.sh 2>&1 >> bootstrap_1.out &
-# PACKER_ID=$!
+# refresh the profile and logfile bundles during the run, if so requested
+BUNDLER_PID=
+if ! test -z "$RADICAL_PILOT_BUNDLE_INTERVAL"
+then
+    bundler "$RADICAL_PILOT_BUNDLE_INTERVAL" >> bundler.out 2>&1 &
+    BUNDLER_PID=$!
+fi
 
 # TODO: Can this be generalized with our new split-agent now?
 if test -z "$CCM"; then
@@ -1776,9 +2114,13 @@ then
     fi
 fi
 
-# # stop the packer.  We don't want to just kill it, as that might leave us with
-# # corrupted tarballs...
-# touch exit.signal
+# stop the bundler.  We don't want to just kill it, as that might leave us with
+# corrupted bundles...
+if ! test -z "$BUNDLER_PID"
+then
+    touch bundle.signal
+    wait $BUNDLER_PID
+fi
 
 profile_event 'cleanup start'
 
@@ -1838,7 +2180,7 @@ then
     echo "# -------------------------------------------------------------------"
     echo "#"
     echo "# Tarring profiles ..."
-    tar -czf $PROFILES_TARBALL *.prof || true
+    bundle "$PROFILES_TARBALL" $PROFILES
     ls -l $PROFILES_TARBALL
     echo "#"
     echo "# -------------------------------------------------------------------"
@@ -1852,7 +2194,7 @@ then
     echo "# -------------------------------------------------------------------"
     echo "#"
     echo "# Tarring logfiles ..."
-    tar -czf $LOGFILES_TARBALL *.{log,out,err,cfg} || true
+    bundle "$LOGFILES_TARBALL" $LOGFILES
     ls -l $LOGFILES_TARBALL
     echo "#"
     echo "# -------------------------------------------------------------------"
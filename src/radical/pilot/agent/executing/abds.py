@@ -54,7 +54,7 @@ class ABDS(AgentExecutingComponent):
         self.register_subscriber(rpc.CONTROL_PUBSUB, self.command_cb)
 
         self._cancel_lock    = threading.RLock()
-        self._cus_to_cancel  = list()
+        self._cus_to_cancel  = set()
         self._cus_to_watch   = list()
         self._watch_queue    = Queue.Queue ()
 
@@ -114,11 +114,14 @@ class ABDS(AgentExecutingComponent):
         cmd = msg['cmd']
         arg = msg['arg']
 
-        if cmd == 'cancel_unit':
+        if cmd in ['cancel_unit', 'cancel_units']:
 
-            self._log.info("cancel unit command (%s)" % arg)
+            if cmd == 'cancel_unit': uids = [arg]
+            else                   : uids = arg['uids']
+
+            self._log.info("cancel units command (%d uids)", len(uids))
             with self._cancel_lock:
-                self._cus_to_cancel.append(arg)
+                self._cus_to_cancel.update(uids)
 
         return True
 
@@ -493,7 +496,7 @@ class ABDS(AgentExecutingComponent):
                         cu['proc'].wait() # make sure proc is collected
 
                         with self._cancel_lock:
-                            self._cus_to_cancel.remove(cu['uid'])
+                            self._cus_to_cancel.discard(cu['uid'])
 
                         self._prof.prof('final', msg="execution canceled", uid=cu['uid'])
 
@@ -80,7 +80,7 @@ class ORTE(AgentExecutingComponent):
         self.register_subscriber(rpc.CONTROL_PUBSUB, self.command_cb)
 
         self._cancel_lock    = threading.RLock()
-        self._cus_to_cancel  = list()
+        self._cus_to_cancel  = set()
         self._watch_queue    = Queue.Queue ()
 
         self._pilot_id = self._cfg['pilot_id']
@@ -122,11 +122,14 @@ class ORTE(AgentExecutingComponent):
         cmd = msg['cmd']
         arg = msg['arg']
 
-        if cmd == 'cancel_unit':
+        if cmd in ['cancel_unit', 'cancel_units']:
 
-            self._log.info("cancel unit command (%s)" % arg)
+            if cmd == 'cancel_unit': uids = [arg]
+            else                   : uids = arg['uids']
+
+            self._log.info("cancel units command (%d uids)", len(uids))
             with self._cancel_lock:
-                self._cus_to_cancel.append(arg)
+                self._cus_to_cancel.update(uids)
 
         return True
 
@@ -502,7 +505,7 @@ class ORTE(AgentExecutingComponent):
                         # cu['proc'].kill()
 
                         with self._cancel_lock:
-                            self._cus_to_cancel.remove(cu['_id'])
+                            self._cus_to_cancel.discard(cu['_id'])
 
                         self._prof.prof('final', msg="execution canceled", uid=cu['_id'])
 
@@ -4,11 +4,17 @@ __license__   = "MIT"
 
 
 import os
+import sys
 import copy
-import stat
+import json
 import time
 import Queue
+import fcntl
+import errno
+import ctypes
+import select
 import tempfile
+import multiprocessing.pool
 import threading
 import traceback
 import subprocess
@@ -23,6 +29,176 @@ from ...  import constants as rpc
 from .base import AgentExecutingComponent
 
 
+# ------------------------------------------------------------------------------
+#
+# syscall number of `pidfd_open()` (Linux >= 5.3, same on all common archs)
+_SYS_PIDFD_OPEN = 434
+
+_libc = None
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+except Exception:
+    pass
+
+
+def _pidfd_open(pid):
+    """
+    Return a file descriptor which becomes readable when the process `pid`
+    exits, or `None` if the kernel does not support that.
+    """
+
+    if not _libc:
+        return None
+
+    fd = _libc.syscall(_SYS_PIDFD_OPEN, pid, 0)
+    if fd < 0:
+        return None
+
+    return fd
+
+
+# ------------------------------------------------------------------------------
+#
+def _exit_code(status):
+
+    # same convention as `subprocess`: negative values denote signals
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    else:
+        return os.WEXITSTATUS(status)
+
+
+# ------------------------------------------------------------------------------
+#
+class _SpawnerProc(object):
+    """
+    Stands in for the `subprocess.Popen` instance of units which are spawned
+    via a spawner helper.
+    """
+
+    def __init__(self, spawner, uid):
+
+        self.pid        = None
+        self.returncode = None
+
+        self._spawner   = spawner
+        self._uid       = uid
+
+
+    def kill(self):
+
+        self._spawner.kill(self._uid)
+
+
+# ------------------------------------------------------------------------------
+#
+class _Spawner(object):
+    """
+    Executor side of a spawner helper process (see `popen_spawner.py`).
+    Requests are written by the executor and the watcher thread, events are
+    only read by the watcher thread.
+    """
+
+    def __init__(self, log):
+
+        self._log  = log
+        self._buf  = ''
+        self._lock = threading.Lock()
+
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'popen_spawner.py')
+        self._proc = subprocess.Popen(args      = [sys.executable, script],
+                                      stdin     = subprocess.PIPE,
+                                      stdout    = subprocess.PIPE,
+                                      close_fds = True)
+        self._in   = self._proc.stdin.fileno()
+        self._out  = self._proc.stdout.fileno()
+
+        fcntl.fcntl(self._out, fcntl.F_SETFL,
+                    fcntl.fcntl(self._out, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self._log.info('started spawner helper (%s)', self._proc.pid)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def fileno(self):
+
+        return self._out
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _send(self, req):
+
+        data = json.dumps(req) + '\n'
+        with self._lock:
+            while data:
+                n    = os.write(self._in, data)
+                data = data[n:]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def spawn(self, uid, args, cwd, stdout, stderr):
+
+        self._send({'cmd'    : 'spawn',
+                    'uid'    : uid,
+                    'args'   : args,
+                    'cwd'    : cwd,
+                    'stdout' : stdout,
+                    'stderr' : stderr})
+
+
+    # --------------------------------------------------------------------------
+    #
+    def kill(self, uid):
+
+        self._send({'cmd' : 'kill', 'uid' : uid})
+
+
+    # --------------------------------------------------------------------------
+    #
+    def events(self):
+        """
+        Return all events available without blocking, or `None` if the helper
+        is gone.
+        """
+
+        events = list()
+        while True:
+            try:
+                data = os.read(self._out, 65536)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+
+            if not data:
+                if events:
+                    break
+                return None
+
+            self._buf += data
+            lines      = self._buf.split('\n')
+            self._buf  = lines.pop()
+            events    += [json.loads(line) for line in lines if line.strip()]
+
+        return events
+
+
+    # --------------------------------------------------------------------------
+    #
+    def stop(self):
+
+        # the helper terminates on EOF
+        try:
+            self._proc.stdin.close()
+            self._proc.wait()
+        except Exception:
+            self._log.exception('could not stop spawner helper')
+
+
 # ==============================================================================
 #
 class Popen(AgentExecutingComponent) :
@@ -52,10 +228,7 @@ class Popen(AgentExecutingComponent) :
         self.register_publisher (rpc.AGENT_UNSCHEDULE_PUBSUB)
         self.register_subscriber(rpc.CONTROL_PUBSUB, self.command_cb)
 
-        self._cancel_lock    = threading.RLock()
-        self._cus_to_cancel  = list()
-        self._cus_to_watch   = list()
-        self._watch_queue    = Queue.Queue ()
+        self._configure_watch()
 
         self._pilot_id = self._cfg['pilot_id']
 
@@ -93,6 +266,70 @@ class Popen(AgentExecutingComponent) :
                         if key in self._cfg['export_to_cu']:
                             self._env_cu_export[key] = val
 
+        self._configure_spawn()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def finalize_child(self):
+
+        # terminate watcher thread
+        self._terminate.set()
+        if self._watcher:
+            self._watcher.join()
+
+        for spawner in self._spawners:
+            spawner.stop()
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Set up the state the watcher thread needs to detect exiting units.
+    #
+    def _configure_watch(self):
+
+        self._cancel_lock    = threading.RLock()
+        self._cus_to_cancel  = set()
+        self._cancel_new     = False   # got new cancel requests
+        self._cus_to_watch   = dict()  # pid -> cu
+        self._watch_queue    = Queue.Queue ()
+
+        # The watcher sleeps in epoll until a watched unit exits, a new unit
+        # is spawned, or a cancel request arrives -- the latter two write to
+        # the wakeup pipe.
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in [self._wake_r, self._wake_w]:
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self._epoll  = select.epoll()
+        self._epoll.register(self._wake_r, select.EPOLLIN)
+        self._pidfds = dict()  # pidfd -> pid
+        self._nofds  = set()   # pids we could not get a pidfd for
+
+        # spawner helpers are added by `_configure_spawn()`.  Dead helpers are
+        # removed by the watcher, so the list is guarded by a lock.
+        self._spawners      = list()
+        self._spawners_lock = threading.Lock()
+        self._spawner_fds   = dict()  # fd -> spawner
+
+        # Exiting units are detected via pidfds if the kernel supports them.
+        # Otherwise, the watcher polls all watched units every
+        # `db_poll_sleeptime` seconds.  We don't use SIGCHLD for that: its
+        # handler would be process wide, and could only be installed by
+        # whichever component happens to run in the main thread.
+        fd = _pidfd_open(os.getpid())
+        if fd is not None:
+            os.close(fd)
+            self._use_pidfd  = True
+            self._poll_delay = 1.0  # only used to check for termination
+            self._log.info('watch units via pidfd')
+        else:
+            self._use_pidfd  = False
+            self._poll_delay = self._cfg['db_poll_sleeptime']
+            self._log.info('watch units by polling (every %.2fs)',
+                           self._poll_delay)
+
 
     # --------------------------------------------------------------------------
     #
@@ -103,11 +340,16 @@ class Popen(AgentExecutingComponent) :
         cmd = msg['cmd']
         arg = msg['arg']
 
-        if cmd == 'cancel_unit':
+        if cmd in ['cancel_unit', 'cancel_units']:
+
+            if cmd == 'cancel_unit': uids = [arg]
+            else                   : uids = arg['uids']
 
-            self._log.info("cancel unit command (%s)" % arg)
+            self._log.info("cancel units command (%d uids)", len(uids))
             with self._cancel_lock:
-                self._cus_to_cancel.append(arg)
+                self._cus_to_cancel.update(uids)
+                self._cancel_new = True
+            self._wakeup()
 
         return True
 
@@ -165,13 +407,20 @@ class Popen(AgentExecutingComponent) :
 
         ru.raise_on('work bulk')
 
-        for unit in units:
-            self._handle_unit(unit)
+        # prepare all sandboxes before spawning any unit -- this is dominated
+        # by file system metadata ops, which we can run concurrently.
+        if self._sandbox_pool:
+            prepared = self._sandbox_pool.map(self._prepare_sandbox, units)
+        else:
+            prepared = [None] * len(units)
+
+        for unit, prep in zip(units, prepared):
+            self._handle_unit(unit, prep)
 
 
     # --------------------------------------------------------------------------
     #
-    def _handle_unit(self, cu):
+    def _handle_unit(self, cu, prepared=None):
 
         ru.raise_on('work unit')
 
@@ -190,7 +439,7 @@ class Popen(AgentExecutingComponent) :
             self._prof.prof('exec', msg='unit launch', uid=cu['uid'])
 
             # Start a new subprocess to launch the unit
-            self.spawn(launcher=launcher, cu=cu)
+            self.spawn(launcher=launcher, cu=cu, prepared=prepared)
 
         except Exception as e:
             # append the startup error to the units stderr.  This is
@@ -210,7 +459,151 @@ class Popen(AgentExecutingComponent) :
 
     # --------------------------------------------------------------------------
     #
-    def spawn(self, launcher, cu):
+    # Set up everything needed to render launch scripts: the static parts of
+    # the unit environment, a cache for script templates, the directory for
+    # launch scripts, and the thread pool for sandbox preparation.
+    #
+    def _configure_spawn(self):
+
+        # we only check for profiling once, not per unit and script line
+        self._prof_script = 'RADICAL_PILOT_PROFILE' in os.environ
+        self._templates   = dict()
+
+        # environment settings are the same for all units, apart from the unit
+        # specific ones (RP_UNIT_ID, RP_PROF, and the unit's own environment)
+        self._env_head  = 'export RP_SESSION_ID="%s"\n' % self._cfg['session_id']
+        self._env_head += 'export RP_PILOT_ID="%s"\n'   % self._cfg['pilot_id']
+        self._env_head += 'export RP_AGENT_ID="%s"\n'   % self._cfg['agent_name']
+        self._env_head += 'export RP_SPAWNER_ID="%s"\n' % self.uid
+        self._env_gtod  = 'export RP_GTOD="%s"\n'       % self.gtod
+        self._env_tail  = 'export RP_TMP="%s"\n'        % self._cu_tmp
+
+        # also add any env vars requested for export by the resource config
+        for k,v in self._env_cu_export.iteritems():
+            self._env_tail += "export %s=%s\n" % (k,v)
+
+        # launch scripts usually live in the unit sandbox -- but on shared
+        # file systems, node-local tmp space can be much faster.  That only
+        # works for launch methods which run the script on the agent node.
+        if self._cfg.get('launch_script_tmp'):
+            self._script_dir = '%s/rp.%s.%s' % (self._cu_tmp,
+                                                self._cfg['session_id'],
+                                                self._cfg['pilot_id'])
+            rpu.rec_makedir(self._script_dir)
+        else:
+            self._script_dir = None
+
+        # sandboxes for a bulk of units are prepared concurrently
+        n_threads = self._cfg.get('sandbox_threads', 0)
+        if n_threads > 1:
+            self._sandbox_pool = multiprocessing.pool.ThreadPool(n_threads)
+        else:
+            self._sandbox_pool = None
+
+        # Instead of forking the (large) agent process for each unit, units
+        # can be spawned by small helper processes (see `popen_spawner.py`).
+        # Their events are picked up by the watcher.
+        self._spawner_idx = 0
+
+        for _ in range(self._cfg.get('spawner_helpers', 0)):
+            spawner = _Spawner(self._log)
+            self._spawners.append(spawner)
+            self._spawner_fds[spawner.fileno()] = spawner
+            self._epoll.register(spawner.fileno(), select.EPOLLIN)
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Create the sandbox for a unit, and determine its stdout/stderr files.
+    # Returns the sandbox -- or, since this runs on the thread pool, the
+    # exception if that failed.  The stdout/stderr files are only opened when
+    # the unit is spawned, so that a bulk does not hold two open files per
+    # unit.
+    #
+    def _prepare_sandbox(self, cu):
+
+        try:
+            # NOTE: see documentation of cu['sandbox'] semantics in the
+            #       ComputeUnit class definition.
+            sandbox = '%s/%s' % (self._pwd, cu['uid'])
+            descr   = cu['description']
+
+            # make sure the sandbox exists
+            rpu.rec_makedir(sandbox)
+
+            # prepare stdout/stderr
+            stdout_file = descr.get('stdout') or 'STDOUT'
+            stderr_file = descr.get('stderr') or 'STDERR'
+
+            cu['stdout_file'] = os.path.join(sandbox, stdout_file)
+            cu['stderr_file'] = os.path.join(sandbox, stderr_file)
+
+            return sandbox
+
+        except Exception as e:
+            return e
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Return the launch script template for units of the given launcher and
+    # description shape (with or without pre/post exec).  Templates are built
+    # once, and rendered with a single string interpolation per unit.
+    #
+    def _get_template(self, launcher, descr):
+
+        key = (launcher.name, bool(descr['pre_exec']), bool(descr['post_exec']))
+
+        if key in self._templates:
+            return self._templates[key]
+
+        def prof(event):
+            if not self._prof_script:
+                return ''
+            return 'echo "`$RP_GTOD`,unit_script,%%(uid)s,%s,%s," >> $RP_PROF\n' \
+                 % (rps.AGENT_EXECUTING, event)
+
+        tpl  = '#!/bin/sh\n\n'
+        tpl += '\n# Environment variables\n%(env)s\n'
+        tpl += '\ntouch $RP_PROF\n'
+        tpl += prof('start_script')
+
+        tpl += '\n# Change to unit sandbox\ncd %(sandbox)s\n'
+        tpl += prof('after_cd')
+
+        # Before the Big Bang there was nothing
+        for val in self._cfg.get('cu_pre_exec') or []:
+            tpl += "%s\n" % val.replace('%', '%%')
+
+        if descr['pre_exec']:
+            tpl += "\n# Pre-exec commands\n"
+            tpl += prof('pre_start')
+            tpl += '%(pre)s'
+            tpl += prof('pre_stop')
+
+        tpl += "\n# The command to run\n"
+        tpl += "%(cmd)s\n"
+        tpl += "RETVAL=$?\n"
+        tpl += prof('after_exec')
+
+        # After the universe dies the infrared death, there will be nothing
+        if descr['post_exec']:
+            tpl += "\n# Post-exec commands\n"
+            tpl += prof('post_start')
+            tpl += '%(post)s\n'
+            tpl += prof('post_stop')
+
+        tpl += "\n# Exit the script with the return code from the command\n"
+        tpl += "exit $RETVAL\n"
+
+        self._templates[key] = tpl
+
+        return tpl
+
+
+    # --------------------------------------------------------------------------
+    #
+    def spawn(self, launcher, cu, prepared=None):
 
         self._prof.prof('spawn', msg='unit spawn', uid=cu['uid'])
 
@@ -218,145 +611,147 @@ class Popen(AgentExecutingComponent) :
         #       class definition.
         sandbox = '%s/%s' % (self._pwd, cu['uid'])
 
-        # make sure the sandbox exists
-        rpu.rec_makedir(sandbox)
-        launch_script_name = '%s/radical_pilot_cu_launch_script.sh' % sandbox
+        # the sandbox is usually prepared in bulk, before spawning
+        if prepared is None:
+            prepared = self._prepare_sandbox(cu)
+
+        if isinstance(prepared, Exception):
+            raise prepared
+
+        if self._script_dir:
+            launch_script_name = '%s/%s.sh' % (self._script_dir, cu['uid'])
+        else:
+            launch_script_name = '%s/radical_pilot_cu_launch_script.sh' % sandbox
 
         # prep stdout/err so that we can append w/o checking for None
         cu['stdout'] = ''
         cu['stderr'] = ''
 
-        self._log.debug("Created launch_script: %s", launch_script_name)
+        descr = cu['description']
 
-        with open(launch_script_name, "w") as launch_script:
-            launch_script.write('#!/bin/sh\n\n')
-
-            # Create string for environment variable setting
-            env_string = ''
-            env_string += 'export RP_SESSION_ID="%s"\n' % self._cfg['session_id']
-            env_string += 'export RP_PILOT_ID="%s"\n'   % self._cfg['pilot_id']
-            env_string += 'export RP_AGENT_ID="%s"\n'   % self._cfg['agent_name']
-            env_string += 'export RP_SPAWNER_ID="%s"\n' % self.uid
-            env_string += 'export RP_UNIT_ID="%s"\n'    % cu['uid']
-            env_string += 'export RP_GTOD="%s"\n'       % self.gtod
-            env_string += 'export RP_PROF="%s/PROF"\n'  % sandbox
-            env_string += 'export RP_TMP="%s"\n'        % self._cu_tmp
-
-            # also add any env vars requested for export by the resource config
-            for k,v in self._env_cu_export.iteritems():
-                env_string += "export %s=%s\n" % (k,v)
-
-            descr = cu['description']
-
-            # also add any env vars requested in the unit description
-            if descr['environment']:
-                for key,val in descr['environment'].iteritems():
-                    env_string += 'export "%s=%s"\n' % (key, val)
-
-            launch_script.write('\n# Environment variables\n%s\n' % env_string)
-            launch_script.write('\ntouch $RP_PROF\n')
-
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                launch_script.write('echo "`$RP_GTOD`,unit_script,%s,%s,start_script," >> $RP_PROF\n' %  \
-                                    (cu['uid'], rps.AGENT_EXECUTING))
-
-            launch_script.write('\n# Change to unit sandbox\ncd %s\n' % sandbox)
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                launch_script.write('echo "`$RP_GTOD`,unit_script,%s,%s,after_cd," >> $RP_PROF\n' %  \
-                                    (cu['uid'], rps.AGENT_EXECUTING))
-
-            # Before the Big Bang there was nothing
-            if self._cfg.get('cu_pre_exec'):
-                for val in self._cfg['cu_pre_exec']:
-                    launch_script.write("%s\n"  % val)
-
-            if descr['pre_exec']:
-                fail = ' (echo "pre_exec failed"; false) || exit'
-                pre  = ''
-                for elem in descr['pre_exec']:
-                    pre += "%s || %s\n" % (elem, fail)
-                # Note: extra spaces below are for visual alignment
-                launch_script.write("\n# Pre-exec commands\n")
-                if 'RADICAL_PILOT_PROFILE' in os.environ:
-                    launch_script.write('echo "`$RP_GTOD`,unit_script,%s,%s,pre_start," >> $RP_PROF\n' %  \
-                                        (cu['uid'], rps.AGENT_EXECUTING))
-                launch_script.write(pre)
-                if 'RADICAL_PILOT_PROFILE' in os.environ:
-                    launch_script.write('echo "`$RP_GTOD`,unit_script,%s,%s,pre_stop," >> $RP_PROF\n' %  \
-                                        (cu['uid'], rps.AGENT_EXECUTING))
-
-            # The actual command line, constructed per launch-method
-            try:
-                launch_command, hop_cmd = launcher.construct_command(cu, launch_script_name)
-
-                if hop_cmd : cmdline = hop_cmd
-                else       : cmdline = launch_script_name
-
-            except Exception as e:
-                msg = "Error in spawner (%s)" % e
-                self._log.exception(msg)
-                raise RuntimeError(msg)
-
-            launch_script.write("\n# The command to run\n")
-            launch_script.write("%s\n" % launch_command)
-            launch_script.write("RETVAL=$?\n")
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                launch_script.write('echo "`$RP_GTOD`,unit_script,%s,%s,after_exec," >> $RP_PROF\n' %  \
-                                    (cu['uid'], rps.AGENT_EXECUTING))
-
-            # After the universe dies the infrared death, there will be nothing
-            if descr['post_exec']:
-                fail = ' (echo "post_exec failed"; false) || exit'
-                post = ''
-                for elem in descr['post_exec']:
-                    post += "%s || %s\n" % (elem, fail)
-                launch_script.write("\n# Post-exec commands\n")
-                if 'RADICAL_PILOT_PROFILE' in os.environ:
-                    launch_script.write('echo "`$RP_GTOD`,unit_script,%s,%s,post_start," >> $RP_PROF\n' %  \
-                                        (cu['uid'], rps.AGENT_EXECUTING))
-                launch_script.write('%s\n' % post)
-                if 'RADICAL_PILOT_PROFILE' in os.environ:
-                    launch_script.write('echo "`$RP_GTOD`,unit_script,%s,%s,post_stop," >> $RP_PROF\n' %  \
-                                        (cu['uid'], rps.AGENT_EXECUTING))
-
-            launch_script.write("\n# Exit the script with the return code from the command\n")
-            launch_script.write("exit $RETVAL\n")
-
-        # done writing to launch script, get it ready for execution.
-        st = os.stat(launch_script_name)
-        os.chmod(launch_script_name, st.st_mode | stat.S_IEXEC)
-        self._prof.prof('command', msg='launch script constructed', uid=cu['uid'])
+        # The actual command line, constructed per launch-method
+        try:
+            launch_command, hop_cmd = launcher.construct_command(cu, launch_script_name)
 
-        # prepare stdout/stderr
-        stdout_file = descr.get('stdout') or 'STDOUT'
-        stderr_file = descr.get('stderr') or 'STDERR'
+            if hop_cmd : cmdline = hop_cmd
+            else       : cmdline = launch_script_name
 
-        cu['stdout_file'] = os.path.join(sandbox, stdout_file)
-        cu['stderr_file'] = os.path.join(sandbox, stderr_file)
+        except Exception as e:
+            msg = "Error in spawner (%s)" % e
+            self._log.exception(msg)
+            raise RuntimeError(msg)
+
+        # Create string for environment variable setting
+        env_string  = self._env_head
+        env_string += 'export RP_UNIT_ID="%s"\n'    % cu['uid']
+        env_string += self._env_gtod
+        env_string += 'export RP_PROF="%s/PROF"\n'  % sandbox
+        env_string += self._env_tail
+
+        # also add any env vars requested in the unit description
+        if descr['environment']:
+            for key,val in descr['environment'].iteritems():
+                env_string += 'export "%s=%s"\n' % (key, val)
+
+        pre  = ''
+        post = ''
+
+        if descr['pre_exec']:
+            fail = ' (echo "pre_exec failed"; false) || exit'
+            for elem in descr['pre_exec']:
+                pre += "%s || %s\n" % (elem, fail)
+
+        if descr['post_exec']:
+            fail = ' (echo "post_exec failed"; false) || exit'
+            for elem in descr['post_exec']:
+                post += "%s || %s\n" % (elem, fail)
+
+        script = self._get_template(launcher, descr) % {'uid'     : cu['uid'],
+                                                        'env'     : env_string,
+                                                        'sandbox' : sandbox,
+                                                        'pre'     : pre,
+                                                        'cmd'     : launch_command,
+                                                        'post'    : post}
+
+        # write the script in one go, and create it executable right away
+        fd = os.open(launch_script_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o744)
+        try:
+            os.write(fd, script)
+        finally:
+            os.close(fd)
 
-        _stdout_file_h = open(cu['stdout_file'], "w")
-        _stderr_file_h = open(cu['stderr_file'], "w")
-        self._prof.prof('command', msg='stdout and stderr files created', uid=cu['uid'])
+        self._log.debug("Created launch_script: %s", launch_script_name)
+        self._prof.prof('command', msg='launch script constructed', uid=cu['uid'])
 
         self._log.info("Launching unit %s via %s in %s", cu['uid'], cmdline, sandbox)
 
-        cu['proc'] = subprocess.Popen(args               = cmdline,
-                                      bufsize            = 0,
-                                      executable         = None,
-                                      stdin              = None,
-                                      stdout             = _stdout_file_h,
-                                      stderr             = _stderr_file_h,
-                                      preexec_fn         = None,
-                                      close_fds          = True,
-                                      shell              = True,
-                                      cwd                = sandbox,
-                                    # env                = self._cu_environment,
-                                      universal_newlines = False,
-                                      startupinfo        = None,
-                                      creationflags      = 0)
+        # if spawner helpers are used but all of them died, we fork ourself
+        with self._spawners_lock:
+            if self._spawners:
+                spawner = self._spawners[self._spawner_idx % len(self._spawners)]
+                self._spawner_idx += 1
+            else:
+                spawner = None
+
+        if spawner:
+
+            # The spawner helper opens stdout/stderr itself.  The watcher needs
+            # to know the unit before its events can arrive.
+            cu['proc'] = _SpawnerProc(spawner, cu['uid'])
+            self._watch_queue.put(cu)
+
+            try:
+                spawner.spawn(cu['uid'], cmdline, sandbox,
+                              cu['stdout_file'], cu['stderr_file'])
+            except OSError as e:
+                # The helper died.  The watcher will fail the unit, together
+                # with all other units of that helper.
+                self._log.warn('cannot pass %s to spawner helper: %s',
+                               cu['uid'], e)
+
+            self._prof.prof('spawn', msg='spawning passed to helper', uid=cu['uid'])
+            self._wakeup()
+            return
+
+        handles = list()
+        try:
+            handles.append(open(cu['stdout_file'], "w"))
+            handles.append(open(cu['stderr_file'], "w"))
+
+            cu['proc'] = subprocess.Popen(args               = cmdline,
+                                          bufsize            = 0,
+                                          executable         = None,
+                                          stdin              = None,
+                                          stdout             = handles[0],
+                                          stderr             = handles[1],
+                                          preexec_fn         = None,
+                                          close_fds          = True,
+                                          shell              = True,
+                                          cwd                = sandbox,
+                                        # env                = self._cu_environment,
+                                          universal_newlines = False,
+                                          startupinfo        = None,
+                                          creationflags      = 0)
+        finally:
+            # the unit has its own copies of the handles now
+            for handle in handles:
+                handle.close()
 
         self._prof.prof('spawn', msg='spawning passed to popen', uid=cu['uid'])
         self._watch_queue.put(cu)
+        self._wakeup()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _wakeup(self):
+
+        try:
+            os.write(self._wake_w, 'x')
+        except OSError as e:
+            # pipe is full, so the watcher will wake up anyway
+            if e.errno != errno.EAGAIN:
+                raise
 
 
     # --------------------------------------------------------------------------
@@ -367,34 +762,93 @@ class Popen(AgentExecutingComponent) :
 
             while not self._terminate.is_set():
 
-                cus = list()
-
+                # wait for something to happen.  Unless we poll for exited
+                # units, the timeout is only used to check for termination.
                 try:
-                    # we don't want to only wait for one CU -- then we would
-                    # pull CU state too frequently.  OTOH, we also don't want to
-                    # learn about CUs until all slots are filled, because then
-                    # we may not be able to catch finishing CUs in time -- so
-                    # there is a fine balance here.  Balance means 100 (FIXME).
-                  # self._prof.prof('ExecWorker popen watcher pull cu from queue')
-                    MAX_QUEUE_BULKSIZE = 100
-                    while len(cus) < MAX_QUEUE_BULKSIZE :
-                        cus.append (self._watch_queue.get_nowait())
-
-                except Queue.Empty:
-                    # nothing found -- no problem, see if any CUs finished
-                    pass
-
-                # add all cus we found to the watchlist
-                for cu in cus :
-                    self._prof.prof('passed', msg="ExecWatcher picked up unit", uid=cu['uid'])
-                    self._cus_to_watch.append (cu)
-
-                # check on the known cus.
-                action = self._check_running()
+                    events = self._epoll.poll(self._poll_delay)
+                except IOError as e:
+                    # signals interrupt the wait
+                    if e.errno != errno.EINTR:
+                        raise
+                    events = list()
+
+                exited  = list()
+                spawned = list()
+                for fd, _ in events:
+
+                    if fd == self._wake_r:
+                        try:
+                            while os.read(self._wake_r, 1024):
+                                pass
+                        except OSError as e:
+                            if e.errno != errno.EAGAIN:
+                                raise
+
+                    elif fd in self._spawner_fds:
+                        # events from a spawner helper
+                        spawner = self._spawner_fds[fd]
+                        evs     = spawner.events()
+                        if evs is None:
+                            self._epoll.unregister(fd)
+                            del(self._spawner_fds[fd])
+                            spawned.append([spawner, None])
+                        else:
+                            spawned.append([spawner, evs])
+
+                    else:
+                        # a watched unit exited
+                        self._epoll.unregister(fd)
+                        os.close(fd)
+                        exited.append(self._pidfds.pop(fd))
+
+                # add all new cus to the watchlist
+                watched = list()
+                while True:
+                    try:
+                        cu = self._watch_queue.get_nowait()
+                    except Queue.Empty:
+                        break
 
-                if not action and not cus :
-                    # nothing happened at all!  Zzz for a bit.
-                    time.sleep(self._cfg['db_poll_sleeptime'])
+                    self._prof.prof('passed', msg="ExecWatcher picked up unit", uid=cu['uid'])
+                    watched.append(cu)
+
+                    if isinstance(cu['proc'], _SpawnerProc):
+                        # the spawner helper reports on this one -- unless it
+                        # died since the unit was passed to it
+                        self._cus_to_watch[cu['uid']] = cu
+                        if cu['proc']._spawner not in self._spawners:
+                            cu['stderr'] += "\nPilot lost the spawner of this unit\n"
+                            self._unit_exited(cu['uid'], -1, None)
+                        continue
+
+                    pid = cu['proc'].pid
+                    self._cus_to_watch[pid] = cu
+
+                    if self._use_pidfd:
+                        # if the unit is already gone, the fd is readable
+                        # right away
+                        fd = _pidfd_open(pid)
+                        if fd is None:
+                            # out of fds?  Check this one on each iteration.
+                            self._log.warn('no pidfd for %s', cu['uid'])
+                            self._nofds.add(pid)
+                        else:
+                            self._pidfds[fd] = pid
+                            self._epoll.register(fd, select.EPOLLIN)
+
+                self._cancel_units(watched)
+
+                for spawner, evs in spawned:
+                    self._handle_spawner_events(spawner, evs)
+
+                if self._use_pidfd:
+                    self._reap(exited, block=True)
+                    if self._nofds:
+                        self._nofds -= set(self._reap(list(self._nofds), block=False))
+
+                elif not self._spawners:
+                    # we don't know who exited, check them all
+                    self._reap(self._cus_to_watch.keys(), block=False)
 
         except Exception as e:
             self._log.exception("Error in ExecWorker watch loop (%s)" % e)
@@ -402,75 +856,154 @@ class Popen(AgentExecutingComponent) :
 
 
     # --------------------------------------------------------------------------
-    # Iterate over all running tasks, check their status, and decide on the
-    # next step.  Also check for a requested cancellation for the tasks.
-    def _check_running(self):
+    #
+    # Kill all watched units for which a cancellation was requested.  They are
+    # reaped like all other units, and are then advanced to CANCELED.  Only new
+    # cancel requests are matched against all watched units -- otherwise, we
+    # only check the newly watched ones.
+    #
+    def _cancel_units(self, watched):
 
-        action = 0
+        with self._cancel_lock:
 
-        for cu in self._cus_to_watch:
+            if not self._cus_to_cancel:
+                return
 
-            # poll subprocess object
-            exit_code = cu['proc'].poll()
-            now       = time.time()
+            if self._cancel_new:
+                watched = self._cus_to_watch.values()
+                self._cancel_new = False
 
-            if exit_code is None:
-                # Process is still running
+            for cu in watched:
 
-                if cu['uid'] in self._cus_to_cancel:
+                if cu['uid'] in self._cus_to_cancel and not cu.get('canceled'):
+                    cu['canceled'] = True
+                    cu['proc'].kill()
 
-                    # FIXME: there is a race condition between the state poll
-                    # above and the kill command below.  We probably should pull
-                    # state after kill again?
 
-                    # We got a request to cancel this cu
-                    action += 1
-                    cu['proc'].kill()
-                    cu['proc'].wait() # make sure proc is collected
+    # --------------------------------------------------------------------------
+    #
+    # Collect exit code and resource usage for the given pids, and advance the
+    # respective units.  Unless `block` is set, pids of processes which are
+    # still running are skipped.  Returns the list of reaped pids.
+    #
+    def _reap(self, pids, block):
 
-                    with self._cancel_lock:
-                        self._cus_to_cancel.remove(cu['uid'])
+        reaped = list()
+        for pid in pids:
 
-                    self._prof.prof('final', msg="execution canceled", uid=cu['uid'])
+            if block: ret = os.wait4(pid, 0)
+            else    : ret = os.wait4(pid, os.WNOHANG)
 
-                    del(cu['proc'])  # proc is not json serializable
-                    self.publish(rpc.AGENT_UNSCHEDULE_PUBSUB, cu)
-                    self.advance(cu, rps.CANCELED, publish=True, push=False)
+            if not ret[0]:
+                # still running
+                continue
 
-                    # we don't need to watch canceled CUs
-                    self._cus_to_watch.remove(cu)
+            _, status, rusage = ret
+            reaped.append(pid)
 
-            else:
-                self._prof.prof('exec', msg='execution complete', uid=cu['uid'])
+            self._unit_exited(pid, _exit_code(status),
+                              {'utime'  : rusage.ru_utime,
+                               'stime'  : rusage.ru_stime,
+                               'maxrss' : rusage.ru_maxrss})
 
-                # make sure proc is collected
-                cu['proc'].wait()
+        return reaped
 
-                # we have a valid return code -- unit is final
-                action += 1
-                self._log.info("Unit %s has return code %s.", cu['uid'], exit_code)
 
-                cu['exit_code'] = exit_code
+    # --------------------------------------------------------------------------
+    #
+    # Handle the events a spawner helper reported since the last call.  `evs`
+    # is `None` if the helper died, which takes all its units with it.
+    #
+    def _handle_spawner_events(self, spawner, evs):
 
-                # Free the Slots, Flee the Flots, Ree the Frots!
-                self._cus_to_watch.remove(cu)
-                del(cu['proc'])  # proc is not json serializable
-                self.publish(rpc.AGENT_UNSCHEDULE_PUBSUB, cu)
+        if evs is None:
+
+            self._log.error('spawner helper died')
+            with self._spawners_lock:
+                self._spawners.remove(spawner)
+            for key, cu in self._cus_to_watch.items():
+                if cu['proc']._spawner is spawner:
+                    cu['stderr'] += "\nPilot lost the spawner of this unit\n"
+                    self._unit_exited(key, -1, None)
+            return
+
+        for ev in evs:
+
+            uid = str(ev['uid'])
+            cu  = self._cus_to_watch.get(uid)
+
+            if not cu:
+                self._log.error('spawner event for unknown unit: %s', ev)
+
+            elif ev['ev'] == 'started':
+                cu['proc'].pid = ev['pid']
+                self._log.debug('unit %s has pid %s', uid, ev['pid'])
+
+            elif ev['ev'] == 'exited':
+                self._unit_exited(uid, _exit_code(ev['status']),
+                                  {'utime'  : ev['utime'],
+                                   'stime'  : ev['stime'],
+                                   'maxrss' : ev['maxrss']})
+
+            elif ev['ev'] == 'failed':
+                cu['stderr'] += "\nPilot cannot start compute unit:\n%s\n" \
+                              % ev['error']
+                self._unit_exited(uid, -1, None)
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Advance a unit which is done executing.  `key` is the unit's pid, or its
+    # uid for units spawned via a spawner helper.
+    #
+    def _unit_exited(self, key, exit_code, rusage):
+
+        cu = self._cus_to_watch.pop(key)
+
+        # let the Popen object know, so that it does not try to wait
+        cu['proc'].returncode = exit_code
+        del(cu['proc'])  # proc is not json serializable
+
+        if rusage:
+            cu['rusage'] = rusage
+
+        # the unit is gone, so there is nothing left to cancel
+        if self._cus_to_cancel:
+            with self._cancel_lock:
+                self._cus_to_cancel.discard(cu['uid'])
+
+        if cu.pop('canceled', False):
+
+            self._prof.prof('final', msg="execution canceled", uid=cu['uid'])
+
+            self.publish(rpc.AGENT_UNSCHEDULE_PUBSUB, cu)
+            self.advance(cu, rps.CANCELED, publish=True, push=False)
+            return
+
+        self._prof.prof('exec', msg='execution complete', uid=cu['uid'])
+
+        # we have a valid return code -- unit is final
+        self._log.info("Unit %s has return code %s.", cu['uid'], exit_code)
+
+        cu['exit_code'] = exit_code
+
+        # Free the Slots, Flee the Flots, Ree the Frots!
+        self.publish(rpc.AGENT_UNSCHEDULE_PUBSUB, cu)
 
-                if exit_code != 0:
-                    # The unit failed - fail after staging output
-                    self._prof.prof('final', msg="execution failed", uid=cu['uid'])
-                    cu['target_state'] = rps.FAILED
+        if exit_code != 0:
+            # The unit failed - fail after staging output
+            self._prof.prof('final', msg="execution failed", uid=cu['uid'])
+            cu['target_state'] = rps.FAILED
 
-                else:
-                    # The unit finished cleanly, see if we need to deal with
-                    # output data.  We always move to stageout, even if there are no
-                    # directives -- at the very least, we'll upload stdout/stderr
-                    self._prof.prof('final', msg="execution succeeded", uid=cu['uid'])
-                    cu['target_state'] = rps.DONE
+        else:
+            # The unit finished cleanly, see if we need to deal with
+            # output data.  We always move to stageout, even if there are no
+            # directives -- at the very least, we'll upload stdout/stderr
+            self._prof.prof('final', msg="execution succeeded", uid=cu['uid'])
+            cu['target_state'] = rps.DONE
 
-                self.advance(cu, rps.AGENT_STAGING_OUTPUT_PENDING, publish=True, push=True)
+        self.advance(cu, rps.AGENT_STAGING_OUTPUT_PENDING, publish=True, push=True)
 
-        return action
 
+# ------------------------------------------------------------------------------
 
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+"""
+Spawner helper for the Popen executor.
+
+Forking the agent process for every unit is expensive: the agent is a large
+Python process, and `subprocess.Popen(close_fds=True)` needs to tear all that
+down again in the child.  This helper is a tiny, long-lived process which is
+started once per executor.  It reads launch requests from stdin, forks from its
+own small address space, and reports pid and exit events on stdout.  It does
+not import radical.pilot, and only relies on the standard library.
+
+The protocol is line based, one JSON document per line.  Requests:
+
+    {"cmd": "spawn", "uid": <uid>, "args": <cmd line>, "cwd": <dir>,
+                     "stdout": <file>, "stderr": <file>}
+    {"cmd": "kill",  "uid": <uid>}
+
+Events:
+
+    {"ev": "started", "uid": <uid>, "pid": <pid>}
+    {"ev": "exited",  "uid": <uid>, "pid": <pid>, "status": <wait status>,
+                      "utime": <sec>, "stime": <sec>, "maxrss": <kb>}
+    {"ev": "failed",  "uid": <uid>, "error": <msg>}
+
+The command line is run via `/bin/sh -c`, as `subprocess.Popen(shell=True)`
+would do.  The helper terminates when stdin is closed.  Running units are not
+killed then -- they are inherited by init, like orphaned Popen children.
+"""
+
+__copyright__ = "Copyright 2013-2016, http://radical.rutgers.edu"
+__license__   = "MIT"
+
+
+import os
+import sys
+import json
+import errno
+import fcntl
+import select
+import signal
+
+
+# ------------------------------------------------------------------------------
+#
+def _set_flags(fd, flags):
+
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | flags)
+
+
+def _str(val):
+
+    # json gives us unicode, but paths and args go to the OS as bytes
+    if isinstance(val, str):
+        return val
+    return val.encode('utf-8')
+
+
+def _set_cloexec(fd):
+
+    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+
+# ------------------------------------------------------------------------------
+#
+class Spawner(object):
+
+    def __init__(self, fd_in, fd_out):
+
+        self._in   = fd_in
+        self._out  = fd_out
+        self._buf  = ''      # incomplete request
+        self._obuf = ''      # pending events
+        self._pids = dict()  # pid -> uid
+        self._uids = dict()  # uid -> pid
+
+        # exec'ed units must only inherit stdin/stdout/stderr
+        for fd in [self._in, self._out]:
+            _set_cloexec(fd)
+        # we never block on either pipe: if the executor is busy writing
+        # requests, it can't read events, and vice versa.
+        _set_flags(self._in,  os.O_NONBLOCK)
+        _set_flags(self._out, os.O_NONBLOCK)
+
+        # SIGCHLD wakes up the select loop
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in [self._wake_r, self._wake_w]:
+            _set_cloexec(fd)
+            _set_flags(fd, os.O_NONBLOCK)
+
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        signal.siginterrupt(signal.SIGCHLD, False)
+        signal.set_wakeup_fd(self._wake_w)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _send(self, event):
+
+        self._obuf += json.dumps(event) + '\n'
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _flush(self):
+
+        while self._obuf:
+            try:
+                n = os.write(self._out, self._obuf)
+                self._obuf = self._obuf[n:]
+            except OSError as e:
+                if e.errno == errno.EINTR : continue
+                if e.errno == errno.EAGAIN: break
+                raise
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _spawn(self, req):
+
+        uid = req['uid']
+
+        try:
+            pid = os.fork()
+        except OSError as e:
+            self._send({'ev' : 'failed', 'uid' : uid, 'error' : str(e)})
+            return
+
+        if not pid:
+            # child -- we must not return from here
+            try:
+                signal.set_wakeup_fd(-1)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+                os.chdir(_str(req['cwd']))
+
+                flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+                fds   = [os.open(os.devnull, os.O_RDONLY),
+                         os.open(_str(req['stdout']), flags, 0o644),
+                         os.open(_str(req['stderr']), flags, 0o644)]
+
+                for target, fd in enumerate(fds):
+                    os.dup2(fd, target)
+                for fd in fds:
+                    os.close(fd)
+
+                os.execv('/bin/sh', ['/bin/sh', '-c', _str(req['args'])])
+
+            except Exception as e:
+                try:
+                    os.write(2, 'spawner: cannot run unit %s: %s\n' % (uid, e))
+                finally:
+                    os._exit(127)
+
+        self._pids[pid] = uid
+        self._uids[uid] = pid
+        self._send({'ev' : 'started', 'uid' : uid, 'pid' : pid})
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _kill(self, req):
+
+        pid = self._uids.get(req['uid'])
+
+        # units which are gone already are reported via their exit event
+        if pid:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _reap(self):
+
+        while self._pids:
+
+            try:
+                pid, status, rusage = os.wait4(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR : continue
+                if e.errno == errno.ECHILD: break
+                raise
+
+            if not pid:
+                break
+
+            uid = self._pids.pop(pid, None)
+            if not uid:
+                continue
+
+            del(self._uids[uid])
+            self._send({'ev'     : 'exited',
+                        'uid'    : uid,
+                        'pid'    : pid,
+                        'status' : status,
+                        'utime'  : rusage.ru_utime,
+                        'stime'  : rusage.ru_stime,
+                        'maxrss' : rusage.ru_maxrss})
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _read(self):
+        """
+        Read and handle all pending requests.  Returns `False` on EOF.
+        """
+
+        while True:
+            try:
+                data = os.read(self._in, 65536)
+            except OSError as e:
+                if e.errno in [errno.EAGAIN, errno.EINTR]:
+                    return True
+                raise
+
+            if not data:
+                return False
+
+            self._buf += data
+            lines      = self._buf.split('\n')
+            self._buf  = lines.pop()
+
+            for line in lines:
+                if not line.strip():
+                    continue
+                req = json.loads(line)
+                if   req['cmd'] == 'spawn': self._spawn(req)
+                elif req['cmd'] == 'kill' : self._kill(req)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def run(self):
+
+        while True:
+
+            if self._obuf: wlist = [self._out]
+            else         : wlist = []
+
+            try:
+                readable, _, _ = select.select([self._in, self._wake_r], wlist, [])
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            if self._wake_r in readable:
+                try:
+                    while os.read(self._wake_r, 1024):
+                        pass
+                except OSError as e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+
+            # requests before exits: a unit can only be killed while known
+            if self._in in readable:
+                if not self._read():
+                    break
+
+            self._reap()
+            self._flush()
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    # we talk over fds 0 and 1 -- make sure no stray output ends up in there
+    fd_in  = os.dup(0)
+    fd_out = os.dup(1)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    sys.stdout = sys.stderr
+
+    Spawner(fd_in, fd_out).run()
+
+
+# ------------------------------------------------------------------------------
+
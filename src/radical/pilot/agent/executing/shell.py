@@ -136,7 +136,7 @@ class Shell(AgentExecutingComponent):
         self._registry      = dict()
         self._registry_lock = threading.RLock()
 
-        self._cus_to_cancel  = list()
+        self._cus_to_cancel  = set()
         self._cancel_lock    = threading.RLock()
 
         self._cached_events = list() # keep monitoring events for pid's which
@@ -185,11 +185,14 @@ class Shell(AgentExecutingComponent):
         cmd = msg['cmd']
         arg = msg['arg']
 
-        if cmd == 'cancel_unit':
+        if cmd in ['cancel_unit', 'cancel_units']:
 
-            self._log.info("cancel unit command (%s)" % arg)
+            if cmd == 'cancel_unit': uids = [arg]
+            else                   : uids = arg['uids']
+
+            self._log.info("cancel units command (%d uids)", len(uids))
             with self._cancel_lock:
-                self._cus_to_cancel.append(arg)
+                self._cus_to_cancel.update(uids)
 
         return True
 
@@ -216,7 +219,7 @@ class Shell(AgentExecutingComponent):
         if cu['uid'] in self._cus_to_cancel:
 
             with self._cancel_lock:
-                self._cus_to_cancel.remove(cu['uid'])
+                self._cus_to_cancel.discard(cu['uid'])
 
             self.publish(rpc.AGENT_UNSCHEDULE_PUBSUB, cu)
             self.advance(cu, rps.CANCELED, publish=True, push=False)
@@ -234,7 +237,7 @@ class Shell(AgentExecutingComponent):
                 # inverse registry for quick lookups:
                 inv_registry = {v: k for k, v in self._registry.items()}
 
-                for cu_uid in self._cus_to_cancel:
+                for cu_uid in list(self._cus_to_cancel):
                     pid = inv_registry.get(cu_uid)
                     if pid:
                         # we own that cu, cancel it!
@@ -246,7 +249,7 @@ class Shell(AgentExecutingComponent):
                         del(self._registry[pid])
 
                         with self._cancel_lock:
-                            self._cus_to_cancel.remove(cu_uid)
+                            self._cus_to_cancel.discard(cu_uid)
 
             # The state advance will be managed by the watcher, which will pick
             # up the cancel notification.
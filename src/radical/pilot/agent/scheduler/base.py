@@ -3,9 +3,12 @@ __copyright__ = "Copyright 2013-2016, http://radical.rutgers.edu"
 __license__   = "MIT"
 
 
-import logging
 import time
+import heapq
+import bisect
+import logging
 import threading
+import collections
 
 import radical.utils as ru
 
@@ -16,11 +19,128 @@ from ... import constants as rpc
 
 # ------------------------------------------------------------------------------
 # 'enum' for RPs's pilot scheduler types
-SCHEDULER_NAME_CONTINUOUS   = "CONTINUOUS"
-SCHEDULER_NAME_SCATTERED    = "SCATTERED"
-SCHEDULER_NAME_TORUS        = "TORUS"
-SCHEDULER_NAME_YARN         = "YARN"
-SCHEDULER_NAME_SPARK        = "SPARK"
+SCHEDULER_NAME_CONTINUOUS      = "CONTINUOUS"
+SCHEDULER_NAME_CONTINUOUS_FAST = "CONTINUOUS_FAST"
+SCHEDULER_NAME_SCATTERED       = "SCATTERED"
+SCHEDULER_NAME_TORUS           = "TORUS"
+SCHEDULER_NAME_YARN            = "YARN"
+SCHEDULER_NAME_SPARK           = "SPARK"
+
+# max number of units which may be backfilled past a blocked unit before
+# backfilling is suspended in favor of that unit
+BACKFILL_LIMIT_DEFAULT         = 1024
+
+
+# ==============================================================================
+#
+class WaitPool(object):
+    """
+    Units which wait for resources, indexed by the number of requested cores.
+
+    Units are kept in one FIFO per core count, plus a heap over arrival order
+    across all core counts.  The oldest unit and the oldest unit of any
+    given size are thus found in O(log n), and removing a scheduled unit is
+    O(log n) as well (heap entries of removed units are dropped lazily).
+    Units are only ever taken from the head of their FIFO.
+    """
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self):
+
+        self._seq    = 0
+        self._queues = dict()   # cores -> deque of [seq, cu]
+        self._sizes  = list()   # sorted core counts with waiting units
+        self._order  = list()   # heap of [seq, cores]
+        self._count  = 0
+
+
+    # --------------------------------------------------------------------------
+    #
+    def __len__(self):
+
+        return self._count
+
+
+    # --------------------------------------------------------------------------
+    #
+    def append(self, cu):
+
+        cores = cu['description']['cores']
+
+        if cores not in self._queues:
+            self._queues[cores] = collections.deque()
+            bisect.insort(self._sizes, cores)
+
+        self._queues[cores].append([self._seq, cu])
+        heapq.heappush(self._order, [self._seq, cores])
+
+        self._seq   += 1
+        self._count += 1
+
+
+    # --------------------------------------------------------------------------
+    #
+    def head(self):
+        """
+        return the oldest waiting unit, or `None`
+        """
+
+        while self._order:
+
+            seq, cores = self._order[0]
+            queue      = self._queues.get(cores)
+
+            if queue and queue[0][0] == seq:
+                return queue[0][1]
+
+            # stale entry of an already removed unit
+            heapq.heappop(self._order)
+
+        return None
+
+
+    # --------------------------------------------------------------------------
+    #
+    def head_of(self, cores):
+        """
+        return the oldest waiting unit which requests `cores` cores, or `None`
+        """
+
+        queue = self._queues.get(cores)
+        if queue:
+            return queue[0][1]
+
+        return None
+
+
+    # --------------------------------------------------------------------------
+    #
+    def sizes_below(self, cores):
+        """
+        return the waiting core counts smaller than `cores`, ascending
+        """
+
+        return self._sizes[:bisect.bisect_left(self._sizes, cores)]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def pop(self, cores):
+        """
+        remove and return the oldest unit which requests `cores` cores
+        """
+
+        queue   = self._queues[cores]
+        _, cu   = queue.popleft()
+        self._count -= 1
+
+        if not queue:
+            del(self._queues[cores])
+            del(self._sizes[bisect.bisect_left(self._sizes, cores)])
+
+        return cu
+
 
 
 # ==============================================================================
@@ -45,8 +165,12 @@ class AgentSchedulingComponent(rpu.Component):
     #
     def initialize_child(self):
 
+        # slot allocation and the wait pool are guarded by their own locks, so
+        # unit arrival, unscheduling and rescheduling don't need to serialize
+        # against each other.
         self.register_input(rps.AGENT_SCHEDULING_PENDING, 
-                            rpc.AGENT_SCHEDULING_QUEUE, self.work)
+                            rpc.AGENT_SCHEDULING_QUEUE, self.work,
+                            lock=rpu.CB_LOCK_CHANNEL)
 
         self.register_output(rps.AGENT_EXECUTING_PENDING,  
                              rpc.AGENT_EXECUTING_QUEUE)
@@ -54,11 +178,13 @@ class AgentSchedulingComponent(rpu.Component):
         # we need unschedule updates to learn about units which free their
         # allocated cores.  Those updates need to be issued after execution, ie.
         # by the AgentExecutionComponent.
-        self.register_subscriber(rpc.AGENT_UNSCHEDULE_PUBSUB, self.unschedule_cb)
+        self.register_subscriber(rpc.AGENT_UNSCHEDULE_PUBSUB, self.unschedule_cb,
+                                 lock=rpu.CB_LOCK_CHANNEL)
 
         # we create a pubsub pair for reschedule trigger
         self.register_publisher (rpc.AGENT_RESCHEDULE_PUBSUB)
-        self.register_subscriber(rpc.AGENT_RESCHEDULE_PUBSUB, self.reschedule_cb)
+        self.register_subscriber(rpc.AGENT_RESCHEDULE_PUBSUB, self.reschedule_cb,
+                                 lock=rpu.CB_LOCK_CHANNEL)
 
         # The scheduler needs the LRMS information which have been collected
         # during agent startup.  We dig them out of the config at this point.
@@ -69,10 +195,21 @@ class AgentSchedulingComponent(rpu.Component):
         self._lrms_cores_per_node = self._cfg['lrms_info']['cores_per_node']
         # FIXME: this information is insufficient for the torus scheduler!
 
-        self._wait_pool = list()            # set of units which wait for the resource
+        self._wait_pool = WaitPool()        # set of units which wait for the resource
         self._wait_lock = threading.RLock() # look on the above set
         self._slot_lock = threading.RLock() # look for slot allocation/deallocation
 
+        # With backfilling enabled, smaller units can get scheduled while the
+        # oldest waiting unit is blocked for lack of resources.  To avoid
+        # starvation of that unit, we suspend backfilling once
+        # `backfill_limit` units passed it, so that freed resources accumulate
+        # until it fits.
+        self._backfill       = self._cfg.get('scheduler_backfill', False)
+        self._backfill_limit = self._cfg.get('scheduler_backfill_limit',
+                                             BACKFILL_LIMIT_DEFAULT)
+        self._blocked_uid    = None   # oldest unit, if it is blocked
+        self._blocked_passed = 0      # number of units backfilled past it
+
         # configure the scheduler instance
         self._configure()
 
@@ -98,19 +235,21 @@ class AgentSchedulingComponent(rpu.Component):
 
         name = cfg['scheduler']
 
-        from .continuous import Continuous
-        from .scattered  import Scattered
-        from .torus      import Torus
-        from .yarn       import Yarn
-        from .spark      import Spark
+        from .continuous      import Continuous
+        from .continuous_fast import ContinuousFast
+        from .scattered       import Scattered
+        from .torus           import Torus
+        from .yarn            import Yarn
+        from .spark           import Spark
 
         try:
             impl = {
-                SCHEDULER_NAME_CONTINUOUS : Continuous,
-                SCHEDULER_NAME_SCATTERED  : Scattered,
-                SCHEDULER_NAME_TORUS      : Torus,
-                SCHEDULER_NAME_YARN       : Yarn,
-                SCHEDULER_NAME_SPARK      : Spark
+                SCHEDULER_NAME_CONTINUOUS      : Continuous,
+                SCHEDULER_NAME_CONTINUOUS_FAST : ContinuousFast,
+                SCHEDULER_NAME_SCATTERED       : Scattered,
+                SCHEDULER_NAME_TORUS           : Torus,
+                SCHEDULER_NAME_YARN            : Yarn,
+                SCHEDULER_NAME_SPARK           : Spark
             }[name]
 
             impl = impl(cfg, session)
@@ -172,7 +311,8 @@ class AgentSchedulingComponent(rpu.Component):
         self._prof.prof('schedule', msg="allocated", uid=cu['uid'])
 
         if self._log.isEnabledFor(logging.DEBUG):
-            self._log.debug("slot status after allocated  : %s", self.slot_status())
+            with self._slot_lock:
+                self._log.debug("slot status after allocated  : %s", self.slot_status())
 
         self._log.debug("%s [%s] : %s [%s]", 
                         cu['uid'], cu['description']['cores'], 
@@ -190,38 +330,101 @@ class AgentSchedulingComponent(rpu.Component):
         # right now.  This will become interesting once reschedule becomes too
         # expensive.
 
-        cu = msg
-
         self._prof.prof('reschedule', uid=self._pilot_id)
         if self._log.isEnabledFor(logging.DEBUG):
-            self._log.debug("slot status before reschedule: %s", self.slot_status())
-
-        # cycle through wait queue, and see if we get anything running now.  We
-        # cycle over a copy of the list, so that we can modify the list on the
-        # fly
-        for cu in self._wait_pool[:]:
-
-            if self._try_allocation(cu):
+            with self._slot_lock:
+                self._log.debug("slot status before reschedule: %s", self.slot_status())
 
-                # allocated cu -- advance it
-                self.advance(cu, rps.AGENT_EXECUTING_PENDING, publish=True, push=True)
-
-                # remove it from the wait queue
-                with self._wait_lock :
-                    self._wait_pool.remove(cu)
-                    self._prof.prof('unqueue', msg="re-allocation done", uid=cu['uid'])
-            else:
-                # Break out of this loop if we didn't manage to schedule a task
-                break
+        with self._wait_lock:
+            self._schedule_waiting()
 
         # Note: The extra space below is for visual alignment
         if self._log.isEnabledFor(logging.DEBUG):
-            self._log.debug("slot status after  reschedule: %s", self.slot_status())
+            with self._slot_lock:
+                self._log.debug("slot status after  reschedule: %s", self.slot_status())
         self._prof.prof('reschedule done')
 
         return True
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _schedule_waiting(self):
+        """
+        Schedule waiting units in arrival order, until the oldest unit cannot
+        be placed.  Smaller units may then be backfilled.  The caller must hold
+        `self._wait_lock`.
+        """
+
+        # cycle through wait queue in arrival order, and see if we get
+        # anything running now.
+        while True:
+
+            cu = self._wait_pool.head()
+            if not cu:
+                break
+
+            if not self._try_allocation(cu):
+                break
+
+            self._unqueue(cu)
+
+        # if the oldest unit is blocked, smaller units may be able to use the
+        # freed resources
+        if cu and self._backfill:
+            self._backfill_units(cu)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _unqueue(self, cu):
+        """
+        remove a successfully allocated unit from the wait pool and advance it
+        """
+
+        self._wait_pool.pop(cu['description']['cores'])
+        self._prof.prof('unqueue', msg="re-allocation done", uid=cu['uid'])
+
+        # allocated cu -- advance it
+        self.advance(cu, rps.AGENT_EXECUTING_PENDING, publish=True, push=True)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _backfill_units(self, blocked):
+        """
+        Schedule waiting units which are smaller than the blocked unit
+        `blocked`, oldest first per size and smallest size first.  If the
+        oldest unit of a size cannot be placed, the other units of that size
+        keep waiting behind it, but larger sizes are still tried: a larger
+        unit may span nodes where a smaller one needs free cores on a single
+        node.
+        """
+
+        if self._blocked_uid != blocked['uid']:
+            self._blocked_uid    = blocked['uid']
+            self._blocked_passed = 0
+
+        for cores in self._wait_pool.sizes_below(blocked['description']['cores']):
+
+            while self._blocked_passed < self._backfill_limit:
+
+                cu = self._wait_pool.head_of(cores)
+                if not cu:
+                    break
+
+                if not self._try_allocation(cu):
+                    break
+
+                self._prof.prof('backfill', msg=blocked['uid'], uid=cu['uid'])
+                self._unqueue(cu)
+                self._blocked_passed += 1
+
+            if self._blocked_passed >= self._backfill_limit:
+                self._log.debug('backfill limit reached for %s', blocked['uid'])
+                return
+
+
     # --------------------------------------------------------------------------
     #
     def unschedule_cb(self, topic, msg):
@@ -238,7 +441,8 @@ class AgentSchedulingComponent(rpu.Component):
             return True
 
         if self._log.isEnabledFor(logging.DEBUG):
-            self._log.debug("slot status before unschedule: %s", self.slot_status())
+            with self._slot_lock:
+                self._log.debug("slot status before unschedule: %s", self.slot_status())
 
         # needs to be locked as we try to release slots, but slots are acquired
         # in a different thread....
@@ -252,7 +456,8 @@ class AgentSchedulingComponent(rpu.Component):
 
         # Note: The extra space below is for visual alignment
         if self._log.isEnabledFor(logging.DEBUG):
-            self._log.debug("slot status after  unschedule: %s", self.slot_status())
+            with self._slot_lock:
+                self._log.debug("slot status after  unschedule: %s", self.slot_status())
 
         return True
 
@@ -277,16 +482,27 @@ class AgentSchedulingComponent(rpu.Component):
 
         # we got a new unit to schedule.  Either we can place it
         # straight away and move it to execution, or we have to
-        # put it on the wait queue.
-        if self._try_allocation(cu):
-            self._prof.prof('schedule', msg="allocation succeeded", uid=cu['uid'])
-            self.advance(cu, rps.AGENT_EXECUTING_PENDING, publish=True, push=True)
-
-        else:
-            # No resources available, put in wait queue
-            self._prof.prof('schedule', msg="allocation failed", uid=cu['uid'])
-            with self._wait_lock :
+        # put it on the wait queue.  We hold the wait lock for both, so that
+        # a concurrent reschedule can't miss the unit.
+        with self._wait_lock :
+
+            # with backfilling, a new unit must not pass waiting units unless
+            # the backfill limit allows it -- otherwise a steady stream of
+            # small units would starve a blocked unit.
+            if self._backfill and len(self._wait_pool):
+                self._prof.prof('schedule', msg="queued", uid=cu['uid'])
                 self._wait_pool.append(cu)
+                self._schedule_waiting()
+                return
+
+            if not self._try_allocation(cu):
+                # No resources available, put in wait queue
+                self._prof.prof('schedule', msg="allocation failed", uid=cu['uid'])
+                self._wait_pool.append(cu)
+                return
+
+        self._prof.prof('schedule', msg="allocation succeeded", uid=cu['uid'])
+        self.advance(cu, rps.AGENT_EXECUTING_PENDING, publish=True, push=True)
 
 
 # ------------------------------------------------------------------------------
@@ -0,0 +1,334 @@
+
+__copyright__ = "Copyright 2017, http://radical.rutgers.edu"
+__license__   = "MIT"
+
+
+import time
+
+from ... import constants as rpc
+
+from .continuous import Continuous
+
+
+# ==============================================================================
+#
+# Continuous agent scheduler with an indexed core allocator.
+#
+# This scheduler places units exactly like the `Continuous` scheduler (same
+# `task_slots`, same `task_offsets`), but it does not scan the complete slot
+# list for each allocation.  Instead, each node keeps a bitmap of free cores
+# (bit `i` set means core `i` is free), and a segment tree over all nodes keeps
+# track of the free runs:
+#
+#   - `pre`  : number of free cores at the start of the segment
+#   - `suf`  : number of free cores at the end of the segment
+#   - `best` : longest free run in the segment (may cross node boundaries)
+#   - `nbest`: longest free run which lies within a single node
+#
+# With that index, the first fitting slot is found by descending the tree
+# (O(log nodes)), and allocating / releasing a set of cores only updates the
+# touched nodes' bitmaps plus their O(log nodes) tree paths.
+#
+class ContinuousFast(Continuous):
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, cfg, session):
+
+        self._bitmaps    = None
+        self._node_index = None
+
+        Continuous.__init__(self, cfg, session)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _configure(self):
+
+        if not self._lrms_node_list:
+            raise RuntimeError("LRMS %s didn't _configure node_list." % \
+                               self._lrms_info['name'])
+
+        if not self._lrms_cores_per_node:
+            raise RuntimeError("LRMS %s didn't _configure cores_per_node." % \
+                               self._lrms_info['name'])
+
+        self._nodes    = list(self._lrms_node_list)
+        self._n_nodes  = len(self._nodes)
+        self._n_cores  = self._lrms_cores_per_node
+        self._all_free = (1 << self._n_cores) - 1
+
+        # node name -> node index.  If a node name shows up more than once, we
+        # (like the `Continuous` scheduler) only ever address the first one.
+        self._node_index = dict()
+        for idx, node in enumerate(self._nodes):
+            self._node_index.setdefault(node, idx)
+
+        # all cores start out free
+        self._bitmaps = [self._all_free] * self._n_nodes
+
+        # size the segment tree to the next power of 2.  Padding leaves have
+        # zero length and never contribute free cores.
+        self._size = 1
+        while self._size < self._n_nodes:
+            self._size *= 2
+
+        self._len   = [0] * (2 * self._size)
+        self._pre   = [0] * (2 * self._size)
+        self._suf   = [0] * (2 * self._size)
+        self._best  = [0] * (2 * self._size)
+        self._nbest = [0] * (2 * self._size)
+
+        for idx in range(self._n_nodes):
+            leaf = self._size + idx
+            self._len  [leaf] = self._n_cores
+            self._pre  [leaf] = self._n_cores
+            self._suf  [leaf] = self._n_cores
+            self._best [leaf] = self._n_cores
+            self._nbest[leaf] = self._n_cores
+
+        for pos in range(self._size - 1, 0, -1):
+            self._combine(pos)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def slot_status(self):
+        """Returns a multi-line string corresponding to slot status.
+        """
+
+        slot_matrix = ""
+        for bitmap in self._bitmaps:
+            slot_matrix += "|"
+            for core in range(self._n_cores):
+                if bitmap & (1 << core):
+                    slot_matrix += "-"
+                else:
+                    slot_matrix += "+"
+        slot_matrix += "|"
+        return {'timestamp' : time.time(),
+                'slotstate' : slot_matrix}
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _allocate_slot(self, cores_requested):
+
+        # same single / multi node distinction as the `Continuous` scheduler
+        if cores_requested <= self._n_cores:
+            offset = self._find_offset_single(cores_requested)
+        else:
+            offset = self._find_offset_multi(cores_requested)
+
+        if offset is None:
+            # allocation failed
+            return {}
+
+        task_slots = list()
+        for core in range(offset, offset + cores_requested):
+            task_slots.append('%s:%d' % (self._nodes[core // self._n_cores],
+                                                     core %  self._n_cores))
+
+        self._mark_range(offset, cores_requested, rpc.BUSY)
+
+        return {'task_slots'   : task_slots,
+                'task_offsets' : offset,
+                'lm_info'      : self._lrms_lm_info}
+
+
+    # --------------------------------------------------------------------------
+    #
+    def slots2offset(self, task_slots):
+
+        node, core = task_slots[0].split(':')
+        return self._node_index[node] * self._n_cores + int(core)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _release_slot(self, opaque_slots):
+
+        if not 'task_slots' in opaque_slots:
+            raise RuntimeError('insufficient information to release slots via %s: %s' \
+                    % (self.uid, opaque_slots))
+
+        self._change_slot_states(opaque_slots['task_slots'], rpc.FREE)
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Change the state of a list of 'node:core' slots (rpc.FREE or rpc.BUSY),
+    # touching each node only once.
+    #
+    def _change_slot_states(self, task_slots, new_state):
+
+        masks = dict()
+        for slot in task_slots:
+            node, core = slot.split(':')
+            idx = self._node_index[node]
+            masks[idx] = masks.get(idx, 0) | (1 << int(core))
+
+        for idx, mask in masks.iteritems():
+            if new_state == rpc.FREE: self._bitmaps[idx] |=  mask
+            else                    : self._bitmaps[idx] &= ~mask
+            self._update_node(idx)
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Change the state of `count` cores starting at global core `offset`
+    # (rpc.FREE or rpc.BUSY).
+    #
+    def _mark_range(self, offset, count, new_state):
+
+        end = offset + count
+        while offset < end:
+            idx   = offset // self._n_cores
+            first = offset %  self._n_cores
+            last  = min(self._n_cores, first + end - offset)
+            mask  = ((1 << (last - first)) - 1) << first
+
+            if new_state == rpc.FREE: self._bitmaps[idx] |=  mask
+            else                    : self._bitmaps[idx] &= ~mask
+            self._update_node(idx)
+
+            offset += last - first
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Find the first node which has a free run of the requested size, and
+    # return the global offset of the first such run on that node.
+    #
+    def _find_offset_single(self, cores_requested):
+
+        if self._nbest[1] < cores_requested:
+            return None
+
+        pos = 1
+        while pos < self._size:
+            if self._nbest[2 * pos] >= cores_requested: pos = 2 * pos
+            else                                      : pos = 2 * pos + 1
+
+        idx = pos - self._size
+        return idx * self._n_cores + \
+               self._first_run(self._bitmaps[idx], cores_requested)
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Find the first global offset where the requested number of cores are
+    # free, possibly spanning node boundaries.
+    #
+    def _find_offset_multi(self, cores_requested):
+
+        if self._best[1] < cores_requested:
+            return None
+
+        pos  = 1
+        lo   = 0          # index of the first node covered by `pos`
+        span = self._size # number of leaves covered by `pos`
+
+        while pos < self._size:
+
+            left  = 2 * pos
+            right = 2 * pos + 1
+            span //= 2
+
+            if self._best[left] >= cores_requested:
+                pos = left
+
+            elif self._suf[left] + self._pre[right] >= cores_requested:
+                # the run starts in the left half and spills into the right
+                return (lo + span) * self._n_cores - self._suf[left]
+
+            else:
+                pos = right
+                lo += span
+
+        idx = pos - self._size
+        return idx * self._n_cores + \
+               self._first_run(self._bitmaps[idx], cores_requested)
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Return the lowest core index at which `count` consecutive bits are set in
+    # `bitmap`.  The caller guarantees that such a run exists.
+    #
+    def _first_run(self, bitmap, count):
+
+        # fold the bitmap so that bit `i` remains set iff the bits `i` to
+        # `i+count-1` are all set (O(log count) shift/and operations)
+        have = 1
+        while have < count:
+            step    = min(have, count - have)
+            bitmap &= bitmap >> step
+            have   += step
+
+        return (bitmap & -bitmap).bit_length() - 1
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Recompute the run information for node `idx` and its tree path.
+    #
+    def _update_node(self, idx):
+
+        bitmap = self._bitmaps[idx]
+        leaf   = self._size + idx
+
+        if bitmap == self._all_free:
+            pre = suf = best = self._n_cores
+
+        else:
+            # lowest and highest busy core bound the free runs at either end
+            busy = ~bitmap & self._all_free
+            pre  = (busy & -busy).bit_length() - 1
+            suf  = self._n_cores - busy.bit_length()
+            best = max(pre, suf)
+            run  = 0
+            for core in range(pre + 1, self._n_cores - suf):
+                if bitmap & (1 << core):
+                    run += 1
+                    if run > best:
+                        best = run
+                else:
+                    run = 0
+
+        self._pre  [leaf] = pre
+        self._suf  [leaf] = suf
+        self._best [leaf] = best
+        self._nbest[leaf] = best
+
+        pos = leaf // 2
+        while pos:
+            self._combine(pos)
+            pos //= 2
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _combine(self, pos):
+
+        left  = 2 * pos
+        right = 2 * pos + 1
+
+        l_len = self._len[left]
+        r_len = self._len[right]
+
+        self._len[pos] = l_len + r_len
+
+        if self._pre[left] < l_len: self._pre[pos] = self._pre[left]
+        else                      : self._pre[pos] = l_len + self._pre[right]
+
+        if self._suf[right] < r_len: self._suf[pos] = self._suf[right]
+        else                       : self._suf[pos] = r_len + self._suf[left]
+
+        self._best [pos] = max(self._best[left], self._best[right],
+                               self._suf [left] + self._pre [right])
+        self._nbest[pos] = max(self._nbest[left], self._nbest[right])
+
+
+# ------------------------------------------------------------------------------
+
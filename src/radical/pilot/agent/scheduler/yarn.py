@@ -199,16 +199,18 @@ class Yarn(AgentSchedulingComponent):
 
         # we got a new unit to schedule.  Either we can place it
         # straight away and move it to execution, or we have to
-        # put it on the wait queue.
-        if self._try_allocation(cu):
-            self._prof.prof('schedule', msg="allocation succeeded", uid=cu['uid'])
-            self.advance(cu, rps.AGENT_EXECUTING_PENDING, publish=True, push=True)
+        # put it on the wait queue.  We hold the wait lock for both, so that
+        # a concurrent reschedule can't miss the unit.
+        with self._wait_lock :
 
-        else:
-            # No resources available, put in wait queue
-            self._prof.prof('schedule', msg="allocation failed", uid=cu['uid'])
-            with self._wait_lock :
+            if not self._try_allocation(cu):
+                # No resources available, put in wait queue
+                self._prof.prof('schedule', msg="allocation failed", uid=cu['uid'])
                 self._wait_pool.append(cu)
+                return
+
+        self._prof.prof('schedule', msg="allocation succeeded", uid=cu['uid'])
+        self.advance(cu, rps.AGENT_EXECUTING_PENDING, publish=True, push=True)
 
 
 # ------------------------------------------------------------------------------
@@ -16,7 +16,11 @@ from ...  import constants as rpc
 
 from .base import AgentStagingInputComponent
 
-from ...staging_directives import complete_url
+from ...staging_directives import complete_url, get_sandbox_context
+
+
+# number of threads which work on units concurrently
+STAGING_WORKERS = 1
 
 
 # ==============================================================================
@@ -41,10 +45,16 @@ class Default(AgentStagingInputComponent):
     #
     def initialize_child(self):
 
-        self._pwd = os.getcwd()
+        self._pwd       = os.getcwd()
+        self._sandboxes = dict()  # cache of pilot sandbox contexts
 
+        # staging is stateless, so we can work on several bulks of units
+        # concurrently
         self.register_input(rps.AGENT_STAGING_INPUT_PENDING,
-                            rpc.AGENT_STAGING_INPUT_QUEUE, self.work)
+                            rpc.AGENT_STAGING_INPUT_QUEUE, self.work,
+                            threads=self._cfg.get('staging_workers',
+                                                  STAGING_WORKERS),
+                            lock=rpu.CB_LOCK_NONE)
 
         self.register_output(rps.AGENT_SCHEDULING_PENDING, 
                              rpc.AGENT_SCHEDULING_QUEUE)
@@ -113,28 +123,17 @@ class Default(AgentStagingInputComponent):
         #   * paths are directly translatable across schemas
         #   * resource level storage is in fact accessible via file://
         #
-        # FIXME: this is costly and should be cached.
-
-        unit_sandbox     = ru.Url(unit['unit_sandbox'])
-        pilot_sandbox    = ru.Url(unit['pilot_sandbox'])
-        resource_sandbox = ru.Url(unit['resource_sandbox'])
-
-        unit_sandbox.schema     = 'file'
-        pilot_sandbox.schema    = 'file'
-        resource_sandbox.schema = 'file'
-
-        unit_sandbox.host       = 'localhost'
-        pilot_sandbox.host      = 'localhost'
-        resource_sandbox.host   = 'localhost'
-
-        src_context = {'pwd'      : str(unit_sandbox),       # !!!
-                       'unit'     : str(unit_sandbox), 
-                       'pilot'    : str(pilot_sandbox), 
-                       'resource' : str(resource_sandbox)}
-        tgt_context = {'pwd'      : str(unit_sandbox),       # !!!
-                       'unit'     : str(unit_sandbox), 
-                       'pilot'    : str(pilot_sandbox), 
-                       'resource' : str(resource_sandbox)}
+        # The translated pilot context is cached.
+        context = get_sandbox_context(unit, self._sandboxes, local=True)
+
+        src_context = {'pwd'      : context['unit'],         # !!!
+                       'unit'     : context['unit'], 
+                       'pilot'    : context['pilot'], 
+                       'resource' : context['resource']}
+        tgt_context = {'pwd'      : context['unit'],         # !!!
+                       'unit'     : context['unit'], 
+                       'pilot'    : context['pilot'], 
+                       'resource' : context['resource']}
 
 
         # we can now handle the actionable staging directives
@@ -6,7 +6,6 @@ __license__   = "MIT"
 import os
 import sys
 import copy
-import time
 import threading
 
 import saga          as rs
@@ -494,15 +493,13 @@ class ComputePilot(object):
             # raise RuntimeError("can't wait on a pilot in final state")
             return self.state
 
-        start_wait = time.time()
-        while self.state not in states:
-
-            time.sleep(0.1)
-            if timeout and (timeout <= (time.time() - start_wait)):
-                break
-
-          # if self._pmgr._terminate.is_set():
-          #     break
+        # the pmgr notifies us about state changes, no need to poll
+        waiter = self._pmgr._add_waiter([self.uid], states)
+        try:
+            for _ in waiter.iterate(timeout):
+                pass
+        finally:
+            self._pmgr._remove_waiter(waiter)
 
         return self.state
 
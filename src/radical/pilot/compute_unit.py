@@ -5,7 +5,6 @@ __license__   = "MIT"
 
 import os
 import copy
-import time
 import threading
 
 import radical.utils as ru
@@ -15,10 +14,28 @@ from . import states    as rps
 from . import constants as rpc
 from . import types     as rpt
 
-from .staging_directives import expand_description
+from .staging_directives import expand_description, expand_descriptions
 from .staging_directives import TRANSFER, COPY, LINK, MOVE, STAGING_AREA
 
 
+# ------------------------------------------------------------------------------
+#
+def _copy_descr(data):
+
+    # unit descriptions contain dicts, lists and scalars, which we can copy
+    # a lot faster than `copy.deepcopy()` can
+    if isinstance(data, dict):
+        return dict([[k, _copy_descr(v)] for k, v in data.iteritems()])
+
+    if isinstance(data, list):
+        return [_copy_descr(v) for v in data]
+
+    if data is None or isinstance(data, (basestring, int, long, float, bool)):
+        return data
+
+    return copy.deepcopy(data)
+
+
 # ------------------------------------------------------------------------------
 #
 class ComputeUnit(object):
@@ -52,17 +69,45 @@ class ComputeUnit(object):
     # --------------------------------------------------------------------------
 
 
+    # --------------------------------------------------------------------------
+    #
+    # Units are created in large numbers, so the unit callback registry and its
+    # lock are only created once a unit callback is registered.  This lock
+    # protects their creation.
+    #
+    _cb_init_lock = threading.Lock()
+
+
     # --------------------------------------------------------------------------
     #
     def __init__(self, umgr, descr):
 
+        descr = descr.as_dict()
+
+        ComputeUnit._check_description(descr)
+
+        # If staging directives exist, expand them to the full dict version.  Do
+        # not, however, expand any URLs as of yet, as we likely don't have
+        # sufficient information about pilot sandboxes etc.
+        expand_description(descr)
+
+        self._init(umgr, descr,
+                   ru.generate_id('unit.%(counter)06d', ru.ID_CUSTOM))
+
+        self._umgr.advance(self.as_dict(), rps.NEW, publish=False, push=False)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _init(self, umgr, descr, uid):
+
         # 'static' members
-        self._descr = descr.as_dict()
+        self._descr = descr
         self._umgr  = umgr
 
         # initialize state
-        self._session          = self._umgr.session
-        self._uid              = ru.generate_id('unit.%(counter)06d', ru.ID_CUSTOM)
+        self._session          = umgr.session
+        self._uid              = uid
         self._state            = rps.NEW
         self._log              = umgr._log
         self._exit_code        = None
@@ -73,33 +118,24 @@ class ComputeUnit(object):
         self._pilot_sandbox    = None
         self._unit_sandbox     = None
         self._client_sandbox   = None
-        self._callbacks        = dict()
-        self._cb_lock          = threading.RLock()
+        self._callbacks        = None
+        self._cb_lock          = None
 
-        for m in rpt.UMGR_METRICS:
-            self._callbacks[m] = dict()
 
-        # we always invke the default state cb
-        self._callbacks[rpt.UNIT_STATE][self._default_state_cb.__name__] = {
-                'cb'      : self._default_state_cb, 
-                'cb_data' : None}
+    # --------------------------------------------------------------------------
+    #
+    @staticmethod
+    def _check_description(descr):
 
         # sanity checks on description
         for check in ['cores']:
-            if not self._descr.get(check):
+            if not descr.get(check):
                 raise ValueError("ComputeUnitDescription needs '%s'" % check)
 
-        if  not self._descr.get('executable') and \
-            not self._descr.get('kernel')     :
+        if  not descr.get('executable') and \
+            not descr.get('kernel')     :
             raise ValueError("CU description needs 'executable' or 'kernel'")
 
-        # If staging directives exist, expand them to the full dict version.  Do
-        # not, however, expand any URLs as of yet, as we likely don't have
-        # sufficient information about pilot sandboxes etc.
-        expand_description(self._descr)
-
-        self._umgr.advance(self.as_dict(), rps.NEW, publish=False, push=False)
-
 
     # --------------------------------------------------------------------------
     #
@@ -112,6 +148,34 @@ class ComputeUnit(object):
         return ComputeUnit(umgr=umgr, descr=descr)
 
 
+    # --------------------------------------------------------------------------
+    #
+    @staticmethod
+    def create_bulk(umgr, descrs):
+        """ 
+        PRIVATE: Create a bulk of new compute units (in NEW state) from a list
+        of description dicts, which are expanded in place.  Returns the units,
+        and their unit dicts.
+        """
+
+        for descr in descrs:
+            ComputeUnit._check_description(descr)
+
+        expand_descriptions(descrs)
+
+        uids  = rpu.generate_id_block('unit.%(counter)06d', len(descrs))
+        units = list()
+        for uid, descr in zip(uids, descrs):
+            unit = ComputeUnit.__new__(ComputeUnit)
+            unit._init(umgr, descr, uid)
+            units.append(unit)
+
+        unit_dicts = [unit.as_dict() for unit in units]
+        umgr.advance(unit_dicts, rps.NEW, publish=False, push=False)
+
+        return units, unit_dicts
+
+
     # --------------------------------------------------------------------------
     #
     def __repr__(self):
@@ -130,7 +194,7 @@ class ComputeUnit(object):
     #
     def _default_state_cb(self, unit, state):
 
-        self._log.info("[Callback]: unit %s state: %s.", self.uid, self.state)
+        self._log.info("[Callback]: unit %s state: %s.", self.uid, state)
 
 
     # --------------------------------------------------------------------------
@@ -167,17 +231,53 @@ class ComputeUnit(object):
             if val != None:
                 setattr(self, "_%s" % key, val)
 
-        # invoke unit specific callbacks
-        for cb_name, cb_val in self._callbacks[rpt.UNIT_STATE].iteritems():
+        # NOTE: callbacks are not invoked here, but by the umgr's callback
+        #       dispatcher, via `_call_callbacks()`.
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _call_callbacks(self, state):
+        """
+        Invoke the unit specific callbacks for the given state.  Note that the
+        unit may have progressed beyond that state by now.
+        """
+
+        if self._callbacks is None:
+            # no unit callbacks registered, only invoke the default one
+            self._default_state_cb(self, state)
+            return
 
-            cb      = cb_val['cb']
-            cb_data = cb_val['cb_data']
+        with self._cb_lock:
+            for cb_name, cb_val in self._callbacks[rpt.UNIT_STATE].iteritems():
 
-            if cb_data: cb(self, self.state, cb_data)
-            else      : cb(self, self.state)
+                cb      = cb_val['cb']
+                cb_data = cb_val['cb_data']
 
-        # ask umgr to invoke any global callbacks
-        self._umgr._call_unit_callbacks(self, self.state)
+                if cb_data: cb(self, state, cb_data)
+                else      : cb(self, state)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _init_callbacks(self):
+
+        with ComputeUnit._cb_init_lock:
+
+            if self._callbacks is not None:
+                return
+
+            callbacks = dict()
+            for m in rpt.UMGR_METRICS:
+                callbacks[m] = dict()
+
+            # we always invoke the default state cb
+            callbacks[rpt.UNIT_STATE][self._default_state_cb.__name__] = {
+                    'cb'      : self._default_state_cb,
+                    'cb_data' : None}
+
+            self._cb_lock   = threading.RLock()
+            self._callbacks = callbacks
 
 
     # --------------------------------------------------------------------------
@@ -189,18 +289,18 @@ class ComputeUnit(object):
 
         ret = {
             'type':             'unit',
-            'umgr':             self.umgr.uid,
-            'uid':              self.uid,
-            'name':             self.name,
-            'state':            self.state,
-            'exit_code':        self.exit_code,
-            'stdout':           self.stdout,
-            'stderr':           self.stderr,
-            'pilot':            self.pilot,
-            'resource_sandbox': self.resource_sandbox,
-            'pilot_sandbox':    self.pilot_sandbox,
-            'unit_sandbox':     self.unit_sandbox,
-            'client_sandbox':   self.client_sandbox,
+            'umgr':             self._umgr.uid,
+            'uid':              self._uid,
+            'name':             self._descr.get('name'),
+            'state':            self._state,
+            'exit_code':        self._exit_code,
+            'stdout':           self._stdout,
+            'stderr':           self._stderr,
+            'pilot':            self._pilot,
+            'resource_sandbox': self._resource_sandbox,
+            'pilot_sandbox':    self._pilot_sandbox,
+            'unit_sandbox':     self._unit_sandbox,
+            'client_sandbox':   self._client_sandbox,
             'description':      self.description   # this is a deep copy
         }
 
@@ -405,7 +505,7 @@ class ComputeUnit(object):
             * description (dict)
         """
 
-        return copy.deepcopy(self._descr)
+        return _copy_descr(self._descr)
 
 
     # --------------------------------------------------------------------------
@@ -427,8 +527,17 @@ class ComputeUnit(object):
 
         and 'cb_data' are passed along.
 
+        Callbacks are invoked in order of state transitions, but not in the
+        thread which ingests the state updates (see
+        :meth:`radical.pilot.UnitManager.register_callback`).
         """
-        self._umgr.register_callback(self.uid, rpt.UNIT_STATE, cb, cb_data)
+
+        if self._callbacks is None:
+            self._init_callbacks()
+
+        with self._cb_lock:
+            self._callbacks[rpt.UNIT_STATE][cb.__name__] = {'cb'      : cb,
+                                                            'cb_data' : cb_data}
 
 
     # --------------------------------------------------------------------------
@@ -458,33 +567,20 @@ class ComputeUnit(object):
 
         if not state:
             states = rps.FINAL
-        if not isinstance(state, list):
+        elif not isinstance(state, list):
             states = [state]
         else:
             states = state
 
 
-        if self.state in rps.FINAL:
-            # we will never see another state progression.  Raise an error
-            # (unless we waited for this)
-            if self.state in states:
-                return
-
-            # FIXME: do we want a raise here, really?  This introduces a race,
-            #        really, on application level
-            # raise RuntimeError("can't wait on a unit in final state")
-            return self.state
-
-        start_wait = time.time()
-        while self.state not in states:
-
-            time.sleep(0.1)
-
-            if timeout and (timeout <= (time.time() - start_wait)):
-                break
-
-          # if self._umgr._terminate.is_set():
-          #     break
+        # the umgr notifies us about state changes, no need to poll.  Final
+        # units are ticked off right away, but only once their callbacks ran.
+        waiter = self._umgr._add_waiter([self.uid], states)
+        try:
+            for _ in waiter.iterate(timeout):
+                pass
+        finally:
+            self._umgr._remove_waiter(waiter)
 
         return self.state
 
@@ -4,18 +4,44 @@ __license__   = "MIT"
 
 
 import os 
+import bson
 import copy
 import saga
 import time
 import gridfs
 import pprint
 import pymongo
+import datetime
 import radical.utils     as ru
 
 from .. import utils     as rpu
 from .. import states    as rps
 
 
+# ------------------------------------------------------------------------------
+#
+# State updates are, in addition to being applied to the entity documents,
+# appended to a capped 'state event' collection, which consumers can tail to
+# learn about state changes incrementally.  The collection is named after the
+# session, with the postfix below.
+STATE_EVENTS_POSTFIX      = '.events'
+STATE_EVENTS_SIZE_DEFAULT = 64 * 1024 * 1024  # bytes
+STATE_EVENTS_SENTINEL     = 'sentinel'
+
+# max number of documents returned per tailing iteration
+TAIL_BATCH_SIZE           = 1024
+
+# max number of units claimed per `claim_units()` call
+CLAIM_BATCH_SIZE          = 1024
+
+# fields of claimed unit docs which are of no use to the claimer: the lease
+# token, the list of (pilot) commands, and the modification time (a datetime,
+# which can't be passed on over the component queues)
+CLAIM_FIELDS              = {'lease'  : False,
+                             'cmd'    : False,
+                             '_mtime' : False}
+
+
 #-----------------------------------------------------------------------------
 #
 class DBSession(object):
@@ -44,6 +70,8 @@ class DBSession(object):
         self._connected  = None
         self._closed     = None
         self._c          = None
+        self._e          = None       # capped state event collection
+        self._tails      = dict()     # state of tailing cursors
         self._can_remove = False
 
         if not connect:
@@ -70,14 +98,30 @@ class DBSession(object):
             self._c.create_index([('type',  pymongo.ASCENDING)], unique=False, sparse=False)
             self._c.create_index([('state', pymongo.ASCENDING)], unique=False, sparse=False)
 
-            # insert the session doc
+            # claimed units are fetched by their lease token
+            self._c.create_index([('lease', pymongo.ASCENDING)], unique=False, sparse=True)
+
+            # session readers fetch docs modified since their last read
+            self._c.create_index([('_mtime', pymongo.ASCENDING)], unique=False, sparse=True)
+
+            # create the capped collection for state events.  We insert
+            # a sentinel document which matches all tailing queries, so that
+            # a tailing cursor never dies for lack of matches.
+            size = cfg.get('db_state_events_size', STATE_EVENTS_SIZE_DEFAULT)
+            self._e = self._db.create_collection(sid + STATE_EVENTS_POSTFIX,
+                                                 capped=True, size=size)
+            self._e.insert({'type' : STATE_EVENTS_SENTINEL})
+
+            # insert the session doc.  The '_mtime' field marks that docs in
+            # this session carry modification times.
             self._can_delete = True
             self._c.insert({'type'      : 'session',
                             '_id'       : sid,
                             'uid'       : sid,
                             'cfg'       : copy.deepcopy(cfg),
                             'created'   : self._created,
-                            'connected' : self._connected})
+                            'connected' : self._connected,
+                            '_mtime'    : datetime.datetime.utcnow()})
             self._can_remove = True
         else:
             docs = self._c.find({'type' : 'session', 
@@ -85,6 +129,10 @@ class DBSession(object):
             if not docs.count():
                 raise ValueError('cannot reconnect to session %s' % sid)
 
+            # sessions created by older versions have no state events
+            if sid + STATE_EVENTS_POSTFIX in self._db.collection_names():
+                self._e = self._db[sid + STATE_EVENTS_POSTFIX]
+
             doc = docs[0]
             self._can_delete = False
             self._created    = doc['created']
@@ -166,12 +214,15 @@ class DBSession(object):
         if delete and self._can_remove:
             self._log.info('delete session')
             self._c.drop()
+            if self._e is not None:
+                self._e.drop()
 
         if self._mongo:
             self._mongo.close()
 
         self._closed = time.time()
         self._c = None
+        self._e = None
 
 
     #--------------------------------------------------------------------------
@@ -247,7 +298,8 @@ class DBSession(object):
             # FIXME: evaluate res
             res = self._c.update({'type'  : 'pilot',
                                   'uid'   : {'$in' : pids}},
-                                 {'$push' : {'cmd' : cmd_spec}},
+                                 {'$push'        : {'cmd'    : cmd_spec},
+                                  '$currentDate' : {'_mtime' : True}},
                                  multi = True)
 
         except pymongo.errors.OperationFailure as e:
@@ -324,6 +376,157 @@ class DBSession(object):
         return docs
 
 
+    #--------------------------------------------------------------------------
+    #
+    def claim_units(self, pattern, control, limit=CLAIM_BATCH_SIZE,
+                    fields=CLAIM_FIELDS):
+        """
+        Claim units which match the given pattern and which are waiting to be
+        picked up by `control` (ie. have their 'control' field set to
+        `control + '_pending'`).  The units are switched to `control`, and
+        are returned with the fields given (a mongodb projection, `None` for
+        complete docs).
+
+        The claim is atomic per unit: the update re-checks the 'control' field
+        and tags the unit with a fresh lease token.  Concurrent claims (from
+        several ingest threads or agents) thus never return the same unit
+        twice.  At most `limit` units are claimed per call -- callers should
+        call again if they got a full batch.
+
+        MongoDB has no find-and-modify for multiple documents, so a claim takes
+        two round trips: the candidate docs are fetched first (nobody else
+        writes to units while they wait to be claimed), and are then claimed
+        by their ids.  Only if another claimer got some of them in between,
+        a third round trip finds out which ones are ours.
+        """
+
+        if self.closed:
+            return []
+
+        pending = '%s_pending' % control
+        token   = str(bson.ObjectId())
+        spec    = dict(pattern)
+        spec['type']    = 'unit'
+        spec['control'] = pending
+
+        docs = list(self._c.find(spec, fields, limit=limit or 0))
+        if not docs:
+            return []
+
+        ids = [doc['_id'] for doc in docs]
+        res = self._c.update({'_id'     : {'$in' : ids},
+                              'control' : pending},
+                             {'$set'         : {'control' : control,
+                                                'lease'   : token},
+                              '$currentDate' : {'_mtime'  : True}},
+                             multi=True)
+
+        if not res.get('n'):
+            return []
+
+        if res['n'] < len(docs):
+            ours = self._c.find({'lease' : token}, {'_id' : True})
+            ours = set([doc['_id'] for doc in ours])
+            docs = [doc for doc in docs if doc['_id'] in ours]
+
+        for doc in docs:
+            doc['control'] = control
+
+        return docs
+
+
+    #--------------------------------------------------------------------------
+    #
+    @property
+    def has_state_events(self):
+        """
+        Returns True if the session supports the incremental state event feed
+        """
+        return self._e is not None
+
+
+    #--------------------------------------------------------------------------
+    #
+    def get_unit_events(self, umgr_uid):
+        """
+        Get the unit state events for the given umgr which arrived since the
+        last call.  Other than `get_units()`, this only returns the changes,
+        as partial unit docs (see `worker.update.STATE_EVENT_KEYS`).
+
+        Returns `None` if events were lost (the capped event collection wrapped
+        around before we could read them).  The caller should then fall back to
+        a full `get_units()` call.
+        """
+
+        if self.closed:
+            return []
+
+        if self._e is None:
+            raise RuntimeError('session does not support state events')
+
+        return self._tail(key     = 'units.%s' % umgr_uid,
+                          pattern = {'type' : 'unit',
+                                     'umgr' : umgr_uid})
+
+
+    #--------------------------------------------------------------------------
+    #
+    def _tail(self, key, pattern, fields=None):
+        """
+        Return all documents from the state event collection which match the
+        given pattern and which have been inserted since the last call with the
+        same key.  This does not block: if no new documents are available, an
+        empty list is returned.  If documents have been lost since the last
+        call, `None` is returned, and tailing continues from the oldest
+        available document.
+
+        We keep a tailable cursor per key alive between calls.  Should that
+        cursor die (which happens if the collection wraps around the cursor
+        position), we re-open it and skip all documents up to and including the
+        last document we returned.
+        """
+
+        # always match the sentinel, so that the cursor stays alive
+        spec = {'$or' : [pattern, {'type' : STATE_EVENTS_SENTINEL}]}
+        tail = self._tails.setdefault(key, {'cursor' : None, 'last' : None})
+        lost = False
+
+        if not tail['cursor'] or not tail['cursor'].alive:
+
+            tail['cursor'] = self._e.find(spec, fields, tailable=True)
+
+            if tail['last']:
+                # skip what we have seen before.  The last doc should still be
+                # around, otherwise we lost documents and need to tell the
+                # caller.
+                lost = True
+                for doc in tail['cursor']:
+                    if doc['_id'] == tail['last']:
+                        lost = False
+                        break
+
+                if lost:
+                    tail['cursor'] = self._e.find(spec, fields, tailable=True)
+
+        docs = list()
+        try:
+            while len(docs) < TAIL_BATCH_SIZE:
+                doc = tail['cursor'].next()
+                tail['last'] = doc.pop('_id')
+                if doc.get('type') != STATE_EVENTS_SENTINEL:
+                    docs.append(doc)
+
+        except StopIteration:
+            # no more documents, for now
+            pass
+
+        if lost:
+            self._log.warn('state events lost for %s', key)
+            return None
+
+        return docs
+
+
     #--------------------------------------------------------------------------
     #
     def insert_umgr(self, umgr_doc):
@@ -405,12 +608,40 @@ class DBSession(object):
         Specifically, the callback is also invoked when *no* document currently 
         matches the pattern.  Documents are returned as partial docs, which only
         contain the set of field names given.  If 'fields' is an empty list
-        though, then complete documents are returned.
+        though, then complete documents are returned.  If documents got lost
+        since the last invocation, 'docs' is `None`.
 
-        This method is blocking, and will never return.  It is adviseable to
-        call it in a thread.
+        This method is blocking, and will only return once the callback returns
+        `False`, or the session gets closed.  It is adviseable to call it in
+        a thread.
+
+        NOTE: the only capped collection supported at this point is the state
+              event collection, ie. 'collection' must be 'events'.
         """
-        raise NotImplementedError('duh!')
+
+        if collection != 'events':
+            raise ValueError('cannot tail collection %s' % collection)
+
+        if not fields:
+            fields = None
+
+        key = ru.generate_id('tail.%(counter)04d', ru.ID_CUSTOM)
+
+        while not self.closed:
+
+            docs = self._tail(key, pattern, fields)
+
+            if cb_data is not None: ret = cb(docs, cb_data)
+            else                  : ret = cb(docs)
+
+            if not ret:
+                break
+
+            if not docs:
+                # avoid busy polling on an idle collection
+                time.sleep(0.1)
+
+        self._tails.pop(key, None)
 
 
     # --------------------------------------------------------------------------
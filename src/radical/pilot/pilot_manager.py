@@ -5,7 +5,6 @@ __license__   = "MIT"
 
 import os
 import copy
-import time
 import pprint
 import threading
 
@@ -82,6 +81,7 @@ class PilotManager(rpu.Component):
         self._components  = dict()
         self._pilots      = dict()
         self._pilots_lock = threading.RLock()
+        self._waiters     = list()  # see `_add_waiter()`
         self._callbacks   = dict()
         self._pcb_lock    = threading.RLock()
         self._terminate   = threading.Event()
@@ -119,7 +119,9 @@ class PilotManager(rpu.Component):
                                timer=self._cfg['db_poll_sleeptime'])
 
         # also listen to the state pubsub for pilot state changes
-        self.register_subscriber(rpc.STATE_PUBSUB, self._state_sub_cb)
+        # we only subscribe to state updates of our own pilots
+        self.register_state_subscriber(self._state_sub_cb,
+                                       {'type' : 'pilot', 'owner' : self.uid})
 
         # let session know we exist
         self._session._register_pmgr(self)
@@ -174,6 +176,11 @@ class PilotManager(rpu.Component):
             return
         self._terminate.set()
 
+        # wake up anybody waiting for pilots
+        with self._pilots_lock:
+            for waiter in self._waiters:
+                waiter.wake()
+
         self._log.report.info('<<close pilot manager')
 
         # we don't want any callback invokations during shutdown
@@ -324,6 +331,9 @@ class PilotManager(rpu.Component):
                 pilot_dict['state'] = s
                 self._pilots[pid]._update(pilot_dict)
 
+                for waiter in self._waiters:
+                    waiter.notify(self._pilots[pid], s)
+
                 if advance:
                     self.advance(pilot_dict, s, publish=publish, push=False)
 
@@ -506,6 +516,37 @@ class PilotManager(rpu.Component):
         else       : return ret[0]
 
 
+    # --------------------------------------------------------------------------
+    #
+    # Create a waiter for the given pilots, which is notified by
+    # `_update_pilot()` about all state transitions (see
+    # `UnitManager._add_waiter()`).
+    #
+    def _add_waiter(self, uids, states):
+
+        with self._pilots_lock:
+
+            for uid in uids:
+                if uid not in self._pilots:
+                    raise ValueError('pilot %s not known' % uid)
+
+            waiter = rpu.StateWaiter(uids, states)
+            for uid in uids:
+                waiter.notify(self._pilots[uid], self._pilots[uid].state)
+
+            self._waiters.append(waiter)
+
+        return waiter
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _remove_waiter(self, waiter):
+
+        with self._pilots_lock:
+            self._waiters.remove(waiter)
+
+
     # --------------------------------------------------------------------------
     #
     def wait_pilots(self, uids=None, state=None, timeout=None):
@@ -567,43 +608,20 @@ class PilotManager(rpu.Component):
 
         self._log.report.info('<<wait for %d pilot(s)\n\t' % len(uids))
 
-        start    = time.time()
-        to_check = None
-
-        with self._pilots_lock:
-
-            for uid in uids:
-                if uid not in self._pilots:
-                    raise ValueError('pilot %s not known' % uid)
-
-            to_check = [self._pilots[uid] for uid in uids]
-
-        # We don't want to iterate over all pilots again and again, as that would
-        # duplicate checks on pilots which were found in matching states.  So we
-        # create a list from which we drop the pilots as we find them in
-        # a matching state
-        self._log.report.idle(mode='start')
-        while to_check and not self._terminate.is_set():
-
-            self._log.report.idle()
-
-            to_check = [pilot for pilot in to_check \
-                               if pilot.state not in states and \
-                                  pilot.state not in rps.FINAL]
-
-            if to_check:
-
-                if timeout and (timeout <= (time.time() - start)):
-                    self._log.debug ("wait timed out")
-                    break
-
-                time.sleep (0.1)
-
+        # the waiter is notified on state changes, and hands out pilots as they
+        # match
+        waiter = self._add_waiter(uids, states)
+        try:
+            self._log.report.idle(mode='start')
+            for pilot in waiter.iterate(timeout):
+                self._log.report.idle()
+            self._log.report.idle(mode='stop')
 
-        self._log.report.idle(mode='stop')
+        finally:
+            self._remove_waiter(waiter)
 
-        if to_check: self._log.report.warn('>>timeout\n')
-        else       : self._log.report.ok(  '>>ok\n')
+        if waiter.pending: self._log.report.warn('>>timeout\n')
+        else             : self._log.report.ok(  '>>ok\n')
 
         # grab the current states to return
         state = None
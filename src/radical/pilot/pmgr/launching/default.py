@@ -729,6 +729,7 @@ class Default(PMGRLaunchingComponent):
         #   create  : use    if ve exists, otherwise create, then use
         #   use     : use    if ve exists, otherwise error,  then exit
         #   recreate: delete if ve exists, otherwise create, then use
+        #   cache   : unpack the cached ve bundle (create if needed), then use
         #      
         # examples   :
         #   virtenv@v0.20
@@ -963,6 +964,14 @@ class Default(PMGRLaunchingComponent):
         if 'RADICAL_PILOT_PROFILE' in os.environ :
             jd.environment['RADICAL_PILOT_PROFILE'] = 'TRUE'
 
+        if 'RADICAL_PILOT_PROFILE_FORMAT' in os.environ :
+            jd.environment['RADICAL_PILOT_PROFILE_FORMAT'] = \
+                    os.environ['RADICAL_PILOT_PROFILE_FORMAT']
+
+        if 'RADICAL_PILOT_BUNDLE_INTERVAL' in os.environ :
+            jd.environment['RADICAL_PILOT_BUNDLE_INTERVAL'] = \
+                    os.environ['RADICAL_PILOT_BUNDLE_INTERVAL']
+
         # for condor backends and the like which do not have shared FSs, we add
         # additional staging directives so that the backend system binds the
         # files from the session and pilot sandboxes to the pilot job.
@@ -108,6 +108,7 @@ class Session(rs.Session):
         self._cache['resource_sandbox'] = dict()
         self._cache['session_sandbox']  = dict()
         self._cache['pilot_sandbox']    = dict()
+        self._cache['sandbox_context']  = dict()
 
         # before doing anything else, set up the debug helper for the lifetime
         # of the session.
@@ -630,8 +631,13 @@ class Session(rs.Session):
         """
         This is a thin wrapper around `ru.Profiler()` which makes sure that
         profiles end up in a separate directory with the name of `session.uid`.
+        If `RADICAL_PILOT_PROFILE_FORMAT` is set to `binary`, a binary profile
+        is written instead of a CSV profile.
         """
 
+        if os.environ.get('RADICAL_PILOT_PROFILE_FORMAT') == 'binary':
+            return rpu.BinaryProfiler(name, path=self._logdir)
+
         return ru.Profiler(name, path=self._logdir)
 
 
@@ -655,7 +661,8 @@ class Session(rs.Session):
 
         result = self._dbs._c.update({'type' : 'session', 
                                       "uid"  : self.uid},
-                                     {"$set" : {"metadata": metadata}})
+                                     {"$set"         : {"metadata": metadata},
+                                      "$currentDate" : {"_mtime"  : True}})
 
 
     # --------------------------------------------------------------------------
@@ -1006,8 +1013,37 @@ class Session(rs.Session):
         self.is_valid()
 
         # we don't cache unit sandboxes, they are just a string concat.
-        pilot_sandbox = self._get_pilot_sandbox(pilot)
-        return "%s/%s/" % (pilot_sandbox, unit['uid'])
+        context = self._get_sandbox_context(pilot)
+        return "%s%s/" % (context['unit_prefix'], unit['uid'])
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _get_sandbox_context(self, pilot):
+        """
+        For a given pilot dict, return the sandbox URL strings which are needed
+        to bind units to that pilot.  The context is determined once per pilot,
+        so that the unit sandbox is a string concatenation:
+
+            unit_sandbox = context['unit_prefix'] + unit['uid'] + '/'
+        """
+
+        pid = pilot['uid']
+        with self._cache_lock:
+            if pid in self._cache['sandbox_context']:
+                return self._cache['sandbox_context'][pid]
+
+        # cache miss
+        pilot_sandbox = str(self._get_pilot_sandbox(pilot))
+        context = {'client_sandbox'   : str(self._get_client_sandbox()),
+                   'resource_sandbox' : str(self._get_resource_sandbox(pilot)),
+                   'pilot_sandbox'    : pilot_sandbox,
+                   'unit_prefix'      : '%s/' % pilot_sandbox}
+
+        with self._cache_lock:
+            self._cache['sandbox_context'][pid] = context
+
+        return context
 
 
     # -------------------------------------------------------------------------
@@ -5,10 +5,11 @@ import sys
 import radical.utils as ru
 
 from .constants import *
+from .          import utils as rpu
 
 # ------------------------------------------------------------------------------
 #
-def expand_description(descr):
+def expand_description(descr, sd_ids=None):
     """
     convert any simple, string based staging directive in the description into 
     its dictionary equivalent
@@ -28,23 +29,46 @@ def expand_description(descr):
     This method changes the given description in place - repeated calls on the
     same description instance will have no effect.  However, we expect this
     method to be called only once during unit construction.
+
+    If given, the staging directive IDs are taken from the `sd_ids` iterator.
     """
 
     if None == descr.get('input_staging') : descr['input_staging']  = list()
     if None == descr.get('output_staging'): descr['output_staging'] = list()
 
-    descr['input_staging' ] = expand_staging_directives(descr['input_staging' ])
-    descr['output_staging'] = expand_staging_directives(descr['output_staging'])
+    descr['input_staging' ] = expand_staging_directives(descr['input_staging' ],
+                                                        sd_ids)
+    descr['output_staging'] = expand_staging_directives(descr['output_staging'],
+                                                        sd_ids)
 
 
 # ------------------------------------------------------------------------------
 #
-def expand_staging_directives(sds):
+def expand_descriptions(descrs):
     """
-    Take an abbreviated or compressed staging directive and expand it.
+    Bulk version of `expand_description()`: the staging directive IDs for all
+    descriptions are generated as one block.
     """
 
-    log = ru.get_logger('radical.pilot.utils')
+    n_sds = 0
+    for descr in descrs:
+        for key in ['input_staging', 'output_staging']:
+            sds = descr.get(key)
+            if   isinstance(sds, list): n_sds += len(sds)
+            elif sds                  : n_sds += 1
+
+    sd_ids = iter(rpu.generate_id_block('sd', n_sds, ru.ID_SIMPLE))
+
+    for descr in descrs:
+        expand_description(descr, sd_ids)
+
+
+# ------------------------------------------------------------------------------
+#
+def expand_staging_directives(sds, sd_ids=None):
+    """
+    Take an abbreviated or compressed staging directive and expand it.
+    """
 
     if not sds:
         return []
@@ -67,7 +91,7 @@ def expand_staging_directives(sds):
             elif '<'  in sd: tgt, src = sd.split('<' , 2)
             else           : src, tgt = sd, os.path.basename(ru.Url(sd).path)
 
-            expanded = {'uid':      ru.generate_id('sd'),
+            expanded = {'uid':      _next_sd_id(sd_ids),
                         'source':   src.strip(),
                         'target':   tgt.strip(),
                         'action':   DEFAULT_ACTION,
@@ -91,7 +115,7 @@ def expand_staging_directives(sds):
             if not source:
                 raise Exception("Staging directive dict has no source member!")
 
-            expanded = {'uid':      ru.generate_id('sd'),
+            expanded = {'uid':      _next_sd_id(sd_ids),
                         'source':   source,
                         'target':   target,
                         'action':   action,
@@ -118,6 +142,14 @@ def expand_staging_directives(sds):
     return ret
 
 
+# ------------------------------------------------------------------------------
+#
+def _next_sd_id(sd_ids):
+
+    if sd_ids: return next(sd_ids)
+    else     : return ru.generate_id('sd')
+
+
 # ------------------------------------------------------------------------------
 #
 def complete_url(path, context, log=None):
@@ -190,5 +222,78 @@ def complete_url(path, context, log=None):
     log.debug('-> %s', purl)
     return purl
 
+
+# ------------------------------------------------------------------------------
+#
+def get_sandbox_context(unit, cache, local=False):
+    '''
+    Return the sandbox context for staging the given unit, as a dict with the
+    'unit', 'pilot' and 'resource' sandbox URLs (as strings), the 'endpoint'
+    (the sandbox URL without path), and the unit sandbox 'path'.  If `local` is
+    set, the URLs are translated into the `file://localhost` scope, for
+    components which live on the pilot's target resource.
+
+    Parsing URLs is not cheap, so the pilot context is only computed once and
+    kept in the given `cache` dict, keyed by the pilot sandbox.  The unit
+    sandbox is then derived by string concatenation.
+    '''
+
+    pilot_sandbox = unit['pilot_sandbox']
+    ctx           = cache.get(pilot_sandbox)
+
+    if not ctx:
+
+        psbox = ru.Url(pilot_sandbox)
+        rsbox = ru.Url(unit['resource_sandbox'])
+
+        if local:
+            for url in [psbox, rsbox]:
+                url.schema = 'file'
+                url.host   = 'localhost'
+
+        endpoint      = ru.Url(psbox)
+        endpoint.path = '/'
+
+        if local:
+            ctx = {'pilot'    : str(psbox),
+                   'resource' : str(rsbox)}
+        else:
+            ctx = {'pilot'    : pilot_sandbox,
+                   'resource' : unit['resource_sandbox']}
+
+        ctx['endpoint'] = str(endpoint)
+        ctx['path']     = psbox.path
+
+        cache[pilot_sandbox] = ctx
+
+    unit_sandbox = unit['unit_sandbox']
+
+    if unit_sandbox.startswith(pilot_sandbox):
+        rest      = unit_sandbox[len(pilot_sandbox):]
+        unit_url  = ctx['pilot'] + rest
+        unit_path = os.path.normpath(ctx['path'] + rest)
+
+        # like ru.Url, keep trailing slashes
+        if rest.endswith('/'):
+            unit_path += '/'
+
+    else:
+        # custom unit sandboxes are not relative to the pilot sandbox
+        url = ru.Url(unit_sandbox)
+        if local:
+            url.schema = 'file'
+            url.host   = 'localhost'
+            unit_url   = str(url)
+        else:
+            unit_url   = unit_sandbox
+        unit_path = url.path
+
+    return {'unit'     : unit_url,
+            'pilot'    : ctx['pilot'],
+            'resource' : ctx['resource'],
+            'endpoint' : ctx['endpoint'],
+            'path'     : unit_path}
+
+
 # ------------------------------------------------------------------------------
 
@@ -7,8 +7,10 @@ __license__   = "MIT"
 # definitions of metrics
 #
 UNIT_STATE           = 'UNIT_STATE'
+UNIT_STATES          = 'UNIT_STATES'      # bulk version of UNIT_STATE
 WAIT_QUEUE_SIZE      = 'WAIT_QUEUE_SIZE'
 UMGR_METRICS         = [UNIT_STATE, 
+                        UNIT_STATES,
                         WAIT_QUEUE_SIZE]
 
 PILOT_STATE          = 'PILOT_STATE'
@@ -65,8 +65,12 @@ class UMGRSchedulingComponent(rpu.Component):
                              rpc.UMGR_STAGING_INPUT_QUEUE)
 
         # Some schedulers care about states (of pilots and/or units), some
-        # don't.  Either way, we here subscribe to state updates.
-        self.register_subscriber(rpc.STATE_PUBSUB, self._base_state_cb)
+        # don't.  Either way, we here subscribe to state updates -- of all
+        # pilots (any pmgr's pilots can be added to our umgr), but only of the
+        # units of our umgr.
+        self.register_state_subscriber(self._base_state_cb,
+                                       [{'type' : 'pilot'},
+                                        {'type' : 'unit', 'owner' : self._umgr}])
 
         # Schedulers use that command channel to get information about
         # pilots being added or removed.
@@ -258,8 +262,10 @@ class UMGRSchedulingComponent(rpu.Component):
                                              'info'  : dict()
                                             }
 
-                    self._pilots[pid]['role']  = ADDED
-                    self._pilots[pid]['pilot'] = pilot
+                    self._pilots[pid]['role']    = ADDED
+                    self._pilots[pid]['pilot']   = pilot
+                    self._pilots[pid]['context'] = \
+                            self._session._get_sandbox_context(pilot)
                     self._log.debug('added pilot: %s', self._pilots[pid])
 
                 self._update_pilot_states(pilots)
@@ -318,13 +324,21 @@ class UMGRSchedulingComponent(rpu.Component):
         '''
         assign a unit to a pilot.
         This is also a good opportunity to determine the unit sandbox(es).
+        The sandbox context is determined when the pilot gets added, so that
+        this is cheap enough for large bulks of units.
         '''
 
-        unit['pilot'           ] = pilot['uid']
-        unit['client_sandbox'  ] = str(self._session._get_client_sandbox())
-        unit['resource_sandbox'] = str(self._session._get_resource_sandbox(pilot))
-        unit['pilot_sandbox'   ] = str(self._session._get_pilot_sandbox(pilot))
-        unit['unit_sandbox'    ] = str(self._session._get_unit_sandbox(unit, pilot))
+        pid     = pilot['uid']
+        context = self._pilots.get(pid, {}).get('context')
+
+        if not context:
+            context = self._session._get_sandbox_context(pilot)
+
+        unit['pilot'           ] = pid
+        unit['client_sandbox'  ] = context['client_sandbox']
+        unit['resource_sandbox'] = context['resource_sandbox']
+        unit['pilot_sandbox'   ] = context['pilot_sandbox']
+        unit['unit_sandbox'    ] = '%s%s/' % (context['unit_prefix'], unit['uid'])
 
 
     # --------------------------------------------------------------------------
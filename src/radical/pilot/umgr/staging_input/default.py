@@ -1,13 +1,17 @@
-
 __copyright__ = "Copyright 2013-2016, http://radical.rutgers.edu"
 __license__   = "MIT"
 
 
 import os
+import pipes
 import shutil
+import hashlib
+import threading
+import multiprocessing.pool
 
-import saga          as rs
-import radical.utils as ru
+import saga                 as rs
+import saga.utils.pty_shell as rsup
+import radical.utils        as ru
 
 from .... import pilot     as rp
 from ...  import utils     as rpu
@@ -16,7 +20,20 @@ from ...  import constants as rpc
 
 from .base import UMGRStagingInputComponent
 
-from ...staging_directives import complete_url
+from ...staging_directives import complete_url, get_sandbox_context
+
+
+# number of concurrent transfers per endpoint
+STAGING_THREADS = 4
+
+# max number of dirs to create with a single remote `mkdir -p`
+MKDIR_BULK_SIZE = 256
+
+# filesystem schemas for which we can run a remote shell to create sandboxes
+SHELL_SCHEMAS = {'sftp'    : 'ssh',
+                 'ssh'     : 'ssh',
+                 'gsisftp' : 'gsissh',
+                 'gsissh'  : 'gsissh'}
 
 
 # ==============================================================================
@@ -26,8 +43,14 @@ class Default(UMGRStagingInputComponent):
     This component performs all umgr side input staging directives for compute
     units.  It gets units from the umgr_staging_input_queue, in
     UMGR_STAGING_INPUT_PENDING state, will advance them to UMGR_STAGING_INPUT
-    state while performing the staging, and then moves then to the 
+    state while performing the staging, and then moves then to the
     AGENT_SCHEDULING_PENDING state, passing control to the agent.
+
+    Units are staged in bulks: the unit sandboxes are created with one remote
+    `mkdir -p` per endpoint, and transfers run concurrently on a thread pool per
+    endpoint.  Sources which are transferred to several units of the same pilot
+    are transferred only once, into the pilot's staging area, and the units'
+    directives are changed into LINK directives, which the agent enacts.
     """
 
     # --------------------------------------------------------------------------
@@ -41,8 +64,21 @@ class Default(UMGRStagingInputComponent):
     #
     def initialize_child(self):
 
-        # we keep a cache of SAGA dir handles
-        self._cache = dict()
+        # we keep a cache of SAGA dir handles, and of pilot sandbox contexts
+        self._cache     = dict()
+        self._sandboxes = dict()
+
+        # sources already transferred to pilot staging areas
+        self._staged    = dict()
+
+        # per endpoint: thread pools for transfers, and shells for sandbox
+        # creation.  Each pool thread uses its own SAGA dir handles.
+        self._pools     = dict()
+        self._shells    = dict()
+        self._handles   = list()
+        self._local     = threading.local()
+        self._lock      = threading.Lock()
+        self._n_threads = self._cfg.get('staging_threads', STAGING_THREADS)
 
         self.register_input(rps.UMGR_STAGING_INPUT_PENDING,
                             rpc.UMGR_STAGING_INPUT_QUEUE, self.work)
@@ -55,12 +91,21 @@ class Default(UMGRStagingInputComponent):
     #
     def finalize_child(self):
 
+        for pool in self._pools.values():
+            pool.close()
+            pool.join()
+
         try:
             for key in self._cache:
                 self._cache[key].close()
+            for handle in self._handles:
+                handle.close()
+            for shell in self._shells.values():
+                if shell:
+                    shell.finalize(kill_pty=True)
         except:
             pass
-            
+
 
     # --------------------------------------------------------------------------
     #
@@ -72,9 +117,8 @@ class Default(UMGRStagingInputComponent):
         self.advance(units, rps.UMGR_STAGING_INPUT, publish=True, push=False)
 
         # we first filter out any units which don't need any input staging, and
-        # advance them again as a bulk.  We work over the others one by one, and
-        # advance them individually, to avoid stalling from slow staging ops.
-        
+        # advance them again as a bulk.  The others are staged as a bulk, too.
+
         no_staging_units = list()
         staging_units    = list()
 
@@ -103,73 +147,274 @@ class Default(UMGRStagingInputComponent):
         if no_staging_units:
 
             # nothing to stage, push to the agent
-            self.advance(no_staging_units, rps.AGENT_STAGING_INPUT_PENDING, 
+            self.advance(no_staging_units, rps.AGENT_STAGING_INPUT_PENDING,
                          publish=True, push=True)
 
-        for unit,actionables in staging_units:
-            self._handle_unit(unit, actionables)
+        if staging_units:
+            self._handle_units(staging_units)
 
 
     # --------------------------------------------------------------------------
     #
-    def _handle_unit(self, unit, actionables):
+    def _handle_units(self, staging_units):
+
+        dirs      = dict()  # dirs to create, by endpoint
+        transfers = list()  # [unit, sd, src, tgt, tgt_context, sandbox context,
+                            #  dedup]
+        sources   = dict()  # number of deduplicable transfers per pilot and
+                            # source
+
+        for unit, actionables in staging_units:
+
+            src_context = {'pwd'      : os.getcwd(),                # !!!
+                           'unit'     : unit['unit_sandbox'],
+                           'pilot'    : unit['pilot_sandbox'],
+                           'resource' : unit['resource_sandbox']}
+            tgt_context = {'pwd'      : unit['unit_sandbox'],       # !!!
+                           'unit'     : unit['unit_sandbox'],
+                           'pilot'    : unit['pilot_sandbox'],
+                           'resource' : unit['resource_sandbox']}
+
+            # we have actionable staging directives, and thus we need a unit
+            # sandbox.
+            context = get_sandbox_context(unit, self._sandboxes)
+            dirs.setdefault(context['endpoint'], set()).add(context['path'])
+
+            for sd in actionables:
+
+                src = complete_url(sd['source'], src_context, self._log)
+                tgt = complete_url(sd['target'], tgt_context, self._log)
+
+                # only targets in the unit sandbox can be replaced by links:
+                # other targets may be shared with other units, or be used
+                # outside of RP.
+                dedup = self._in_sandbox(tgt, unit['unit_sandbox'])
+                if dedup:
+                    key = (unit['pilot_sandbox'], str(src))
+                    sources[key] = sources.get(key, 0) + 1
+
+                transfers.append([unit, sd, src, tgt, tgt_context, context,
+                                  dedup])
+
+        # sources which go to more than one unit sandbox of a pilot are
+        # transferred once, into the pilot's staging area.
+        shared = dict()  # [endpoint, src, tgt, name, stamp, uids] by pilot and source
+        jobs   = list()  # [endpoint, src, tgt, flags, uid, did]
+        deps   = dict()  # unit dependencies on shared transfers
+
+        for unit, sd, src, tgt, tgt_context, context, dedup in transfers:
+
+            uid      = unit['uid']
+            endpoint = context['endpoint']
+            key      = (unit['pilot_sandbox'], str(src))
+            stamp    = self._get_stamp(src)
+
+            if dedup and stamp and key + (stamp,) in self._staged:
+                name = self._staged[key + (stamp,)]
+
+            elif dedup and sources[key] > 1:
+
+                if key not in shared:
+                    name = '%s.%s' % (hashlib.md5(str(src) + str(stamp))
+                                             .hexdigest(),
+                                      os.path.basename(src.path))
+                    stgt = complete_url('pilot:///%s' % name, tgt_context,
+                                        self._log)
+                    dirs[endpoint].add(os.path.dirname(stgt.path))
+                    shared[key] = [endpoint, src, stgt, name, stamp, list()]
+
+                name = shared[key][3]
+                shared[key][5].append(uid)
+
+            else:
+                # no deduplication for this one
+                if rpc.CREATE_PARENTS in sd['flags']:
+                    flags = rs.filesystem.CREATE_PARENTS
+                else:
+                    flags = 0
+                jobs.append([endpoint, src, tgt, flags, uid, sd['uid']])
+                continue
+
+            # the agent will link the staged source into the unit sandbox
+            sd['action'] = rpc.LINK
+            sd['source'] = 'pilot:///%s' % name
+            deps.setdefault(uid, set()).add(key)
+
+        # create all sandboxes and staging areas
+        broken = set()
+        for endpoint in dirs:
+            try:
+                self._make_dirs(endpoint, sorted(dirs[endpoint]))
+            except Exception as e:
+                self._log.exception('sandbox creation failed on %s', endpoint)
+                broken.add(endpoint)
+
+        # run all transfers concurrently
+        results     = list()
+        failed      = set()
+        failed_keys = set()
+
+        for key, [endpoint, src, tgt, name, stamp, uids] in shared.iteritems():
+            if endpoint in broken:
+                failed.update(uids)
+                failed_keys.add(key)
+                continue
+            job = [endpoint, src, tgt, rs.filesystem.CREATE_PARENTS, None, name]
+            results.append([key, uids, self._submit(job)])
+
+        for job in jobs:
+            if job[0] in broken:
+                failed.add(job[4])
+                continue
+            results.append([None, [job[4]], self._submit(job)])
+
+        for key, uids, result in results:
+            if result.get():
+                failed.update(uids)
+                failed_keys.add(key)
+            elif key and shared[key][4]:
+                self._staged[key + (shared[key][4],)] = shared[key][3]
+
+        # a unit fails if any transfer it depends on failed
+        for uid, keys in deps.iteritems():
+            if keys & failed_keys:
+                failed.add(uid)
+
+        done   = [unit for unit, _ in staging_units if unit['uid'] not in failed]
+        failed = [unit for unit, _ in staging_units if unit['uid'] in failed]
+
+        # staging is done, we can advance the units at last
+        if done:
+            self.advance(done, rps.AGENT_STAGING_INPUT_PENDING,
+                         publish=True, push=True)
 
-        # FIXME: we should created unit sandboxes in a bulk
+        if failed:
+            self.advance(failed, rps.FAILED, publish=True, push=True)
 
-        uid = unit['uid']
 
-        src_context = {'pwd'      : os.getcwd(),                # !!!
-                       'unit'     : unit['unit_sandbox'], 
-                       'pilot'    : unit['pilot_sandbox'], 
-                       'resource' : unit['resource_sandbox']}
-        tgt_context = {'pwd'      : unit['unit_sandbox'],       # !!!
-                       'unit'     : unit['unit_sandbox'], 
-                       'pilot'    : unit['pilot_sandbox'], 
-                       'resource' : unit['resource_sandbox']}
+    # --------------------------------------------------------------------------
+    #
+    def _in_sandbox(self, url, sandbox):
 
-        # we have actionable staging directives, and thus we need a unit
-        # sandbox.
-        sandbox = rs.Url(unit["unit_sandbox"])
-        tmp     = rs.Url(unit["unit_sandbox"])
+        sandbox = ru.Url(sandbox)
+        if url.schema != sandbox.schema or url.host != sandbox.host:
+            return False
 
-        # url used for cache (sandbox url w/o path)
-        tmp.path = '/'
-        key = str(tmp)
-        self._log.debug('key %s / %s', key, tmp)
+        path = os.path.normpath(url.path)
+        return path.startswith(os.path.normpath(sandbox.path) + '/')
 
-        if key not in self._cache:
-            self._cache[key] = rs.filesystem.Directory(tmp, 
-                    session=self._session)
-        saga_dir = self._cache[key]
 
-        self._prof.prof("create sandbox", msg=str(sandbox))
-        saga_dir.make_dir(sandbox, flags=rs.filesystem.CREATE_PARENTS)
-        self._prof.prof("created sandbox", uid=uid)
+    # --------------------------------------------------------------------------
+    #
+    def _get_stamp(self, src):
 
-        # Loop over all transfer directives and execute them.
-        for sd in actionables:
+        # local files are staged only once, unless they change.  For other
+        # sources we can't tell, and only deduplicate within a bulk.
+        if src.schema != 'file' or src.host not in [None, '', 'localhost']:
+            return None
 
-            action = sd['action']
-            flags  = sd['flags']
-            did    = sd['uid']
-            src    = sd['source']
-            tgt    = sd['target']
+        try:
+            stat = os.stat(src.path)
+            return (stat.st_mtime, stat.st_size)
+        except OSError:
+            return None
 
-            self._prof.prof('staging_begin', uid=uid, msg=did)
 
-            src = complete_url(src, src_context, self._log)
-            tgt = complete_url(tgt, tgt_context, self._log)
+    # --------------------------------------------------------------------------
+    #
+    def _make_dirs(self, endpoint, dirs):
+
+        # create the given dirs on the endpoint, with as few remote operations
+        # as possible.  We fall back to SAGA's `make_dir` if we can't run
+        # a shell on the endpoint.
+        url = ru.Url(endpoint)
+
+        self._prof.prof('create sandboxes', msg='%s (%d)' % (endpoint, len(dirs)))
+
+        if url.schema == 'file' and url.host in [None, '', 'localhost']:
+            for path in dirs:
+                rpu.rec_makedir(path)
+
+        elif self._get_shell(endpoint):
+            shell = self._get_shell(endpoint)
+            for i in range(0, len(dirs), MKDIR_BULK_SIZE):
+                paths = ' '.join([pipes.quote(path) for path
+                                  in dirs[i:i + MKDIR_BULK_SIZE]])
+                ret, out, err = shell.run_sync('mkdir -p %s' % paths)
+                if ret:
+                    raise RuntimeError('mkdir failed on %s: %s %s'
+                                       % (endpoint, out, err))
+        else:
+            if endpoint not in self._cache:
+                self._cache[endpoint] = rs.filesystem.Directory(endpoint,
+                        session=self._session)
+            saga_dir = self._cache[endpoint]
+            for path in dirs:
+                saga_dir.make_dir(path, flags=rs.filesystem.CREATE_PARENTS)
+
+        self._prof.prof('created sandboxes', msg='%s (%d)' % (endpoint, len(dirs)))
 
-            if rpc.CREATE_PARENTS in flags:
-                copy_flags = rs.filesystem.CREATE_PARENTS
-            else:
-                copy_flags = 0
 
-            saga_dir.copy(src, tgt, flags=copy_flags)
+    # --------------------------------------------------------------------------
+    #
+    def _get_shell(self, endpoint):
+
+        if endpoint not in self._shells:
+
+            url    = ru.Url(endpoint)
+            schema = SHELL_SCHEMAS.get(url.schema)
+            shell  = None
+
+            if schema:
+                try:
+                    url.schema = schema
+                    url.path   = '/'
+                    shell = rsup.PTYShell(str(url), self._session)
+                except Exception as e:
+                    self._log.warn('no shell for %s, use saga: %s', endpoint, e)
+
+            self._shells[endpoint] = shell
+
+        return self._shells[endpoint]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _submit(self, job):
+
+        endpoint = job[0]
+
+        if endpoint not in self._pools:
+            n_threads = max(1, self._n_threads)
+            self._pools[endpoint] = multiprocessing.pool.ThreadPool(n_threads)
+
+        return self._pools[endpoint].apply_async(self._transfer, job)
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Run one transfer on a pool thread.  Returns the exception if that failed.
+    #
+    def _transfer(self, endpoint, src, tgt, flags, uid, did):
+
+        try:
+            handles = getattr(self._local, 'handles', None)
+            if handles is None:
+                handles = self._local.handles = dict()
+
+            if endpoint not in handles:
+                handles[endpoint] = rs.filesystem.Directory(endpoint,
+                        session=self._session)
+                with self._lock:
+                    self._handles.append(handles[endpoint])
+
+            self._prof.prof('staging_begin', uid=uid, msg=did)
+            handles[endpoint].copy(src, tgt, flags=flags)
             self._prof.prof('staging_end', uid=uid, msg=did)
 
-        # staging is done, we can advance the unit at last
-        self.advance(unit, rps.AGENT_STAGING_INPUT_PENDING, publish=True, push=True)
+        except Exception as e:
+            self._log.exception('transfer %s -> %s failed', src, tgt)
+            return e
 
 
 # ------------------------------------------------------------------------------
@@ -16,7 +16,7 @@ from ...  import constants as rpc
 
 from .base import UMGRStagingOutputComponent
 
-from ...staging_directives import complete_url
+from ...staging_directives import complete_url, get_sandbox_context
 
 
 # ==============================================================================
@@ -41,8 +41,9 @@ class Default(UMGRStagingOutputComponent):
     #
     def initialize_child(self):
 
-        # we keep a cache of SAGA dir handles
-        self._cache = dict()
+        # we keep a cache of SAGA dir handles, and of pilot sandbox contexts
+        self._cache     = dict()
+        self._sandboxes = dict()
 
         self.register_input(rps.UMGR_STAGING_OUTPUT_PENDING, 
                             rpc.UMGR_STAGING_OUTPUT_QUEUE, self.work)
@@ -125,15 +126,13 @@ class Default(UMGRStagingOutputComponent):
                        'pilot'    : unit['pilot_sandbox'], 
                        'resource' : unit['resource_sandbox']}
 
-        sandbox = rs.Url(unit["unit_sandbox"])
-        tmp     = rs.Url(unit["unit_sandbox"])
-
-        # url used for cache (sandbox url w/o path)
-        tmp.path = '/'
-        key = str(tmp)
+        # the sandbox endpoint (sandbox url w/o path) is used as key for the
+        # cache of saga handles
+        context = get_sandbox_context(unit, self._sandboxes)
+        key     = context['endpoint']
 
         if key not in self._cache:
-            self._cache[key] = rs.filesystem.Directory(tmp, 
+            self._cache[key] = rs.filesystem.Directory(key, 
                     session=self._session)
         saga_dir = self._cache[key]
 
@@ -166,7 +165,7 @@ class Default(UMGRStagingOutputComponent):
 
             # FIXME: this should be a proper test for absoluteness of URL
             if not tgt.path.startswith('/'):
-                tgt.path = '%s/%s' % (sandbox.path, tgt.path)
+                tgt.path = '%s/%s' % (context['path'], tgt.path)
 
             saga_dir.copy(src, tgt, flags=copy_flags)
 
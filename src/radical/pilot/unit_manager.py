@@ -5,7 +5,6 @@ __license__   = "MIT"
 
 import os
 import copy
-import time
 import pprint
 import threading
 
@@ -21,6 +20,12 @@ from . import compute_unit_description as rpcud
 from .umgr import scheduler as rpus
 
 
+# ------------------------------------------------------------------------------
+#
+# time to sleep between state event pulls (seconds)
+DB_FEED_SLEEPTIME = 0.1
+
+
 # ------------------------------------------------------------------------------
 #
 class UnitManager(rpu.Component):
@@ -90,6 +95,8 @@ class UnitManager(rpu.Component):
         self._pilots_lock = threading.RLock()
         self._units       = dict()
         self._units_lock  = threading.RLock()
+        self._waiters     = list()  # see `_add_waiter()`
+        self._cb_states   = dict()  # see `_call_unit_callbacks()`
         self._callbacks   = dict()
         self._cb_lock     = threading.RLock()
         self._terminate   = threading.Event()
@@ -120,6 +127,12 @@ class UnitManager(rpu.Component):
         self.start(spawn=False)
         self._log.info('started umgr %s', self._uid)
 
+        # callbacks are invoked by a dispatcher, off the state ingest path
+        self._cb_dispatcher = rpu.CallbackDispatcher(
+                                      n_threads = self._cfg.get('callback_threads', 1),
+                                      log       = self._log,
+                                      name      = '%s.cb' % self._uid)
+
         # only now we have a logger... :/
         self._log.report.info('<<create unit manager')
         self._prof.prof('create umgr', uid=self._uid)
@@ -134,20 +147,35 @@ class UnitManager(rpu.Component):
         self.register_output(rps.UMGR_STAGING_OUTPUT_PENDING, 
                              rpc.UMGR_STAGING_OUTPUT_QUEUE)
 
-        # register the state notification pull cb
-        # FIXME: we may want to have the frequency configurable
-        # FIXME: this should be a tailing cursor in the update worker
-        self.register_timed_cb(self._state_pull_cb, 
-                               timer=self._cfg['db_poll_sleeptime'])
+        # register the state notification pull cb.  If the DB supports it, we
+        # only pull the state changes from a tailed state event collection,
+        # which is cheap enough to be done at a higher frequency.  Otherwise
+        # we fall back to pulling all unit docs.
+        #
+        # Unit updates are guarded by `self._units_lock`, so the state and
+        # unit callbacks don't need to serialize against each other.
+        if self._session._dbs.has_state_events:
+            self.register_timed_cb(self._state_feed_cb, 
+                                   timer=self._cfg.get('db_feed_sleeptime', 
+                                                       DB_FEED_SLEEPTIME),
+                                   lock=rpu.CB_LOCK_CHANNEL)
+        else:
+            self.register_timed_cb(self._state_pull_cb, 
+                                   timer=self._cfg['db_poll_sleeptime'],
+                                   lock=rpu.CB_LOCK_CHANNEL)
 
         # register callback which pulls units back from agent
         # FIXME: this should be a tailing cursor in the update worker
         # FIXME: make frequency configurable
         self.register_timed_cb(self._unit_pull_cb, 
-                               timer=self._cfg['db_poll_sleeptime'])
+                               timer=self._cfg['db_poll_sleeptime'],
+                               lock=rpu.CB_LOCK_CHANNEL)
 
         # also listen to the state pubsub for unit state changes
-        self.register_subscriber(rpc.STATE_PUBSUB, self._state_sub_cb)
+        # we only subscribe to state updates of our own units
+        self.register_state_subscriber(self._state_sub_cb,
+                                       {'type' : 'unit', 'owner' : self.uid},
+                                       lock=rpu.CB_LOCK_CHANNEL)
 
         # let session know we exist
         self._session._register_umgr(self)
@@ -205,6 +233,11 @@ class UnitManager(rpu.Component):
         self._terminate.set()
         self.stop()
 
+        # wake up anybody waiting for units
+        with self._units_lock:
+            for waiter in self._waiters:
+                waiter.wake()
+
         self._log.report.info('<<close unit manager')
 
         # we don't want any callback invokations during shutdown
@@ -214,6 +247,8 @@ class UnitManager(rpu.Component):
             for m in rpt.UMGR_METRICS:
                 self._callbacks[m] = dict()
 
+        self._cb_dispatcher.stop()
+
         self._session.prof.prof('closed umgr', uid=self._uid)
         self._log.info("Closed UnitManager %s." % self._uid)
 
@@ -320,7 +355,8 @@ class UnitManager(rpu.Component):
             self._session._dbs._c.update(multi    = True,
                             spec     = {'type'  : 'unit',
                                         'uid'   : {'$in'     : uids}},
-                            document = {'$set'  : {'control' : 'umgr'}})
+                            document = {'$set'         : {'control' : 'umgr'},
+                                        '$currentDate' : {'_mtime'  : True}})
 
             to_restart = list()
 
@@ -365,11 +401,25 @@ class UnitManager(rpu.Component):
         #        worker
         units  = self._session._dbs.get_units(umgr_uid=self.uid)
 
-        for unit in units:
-            if not self._update_unit(unit, publish=True):
-                return False
+        return self._update_units(units, publish=True)
 
-        return True
+
+    #---------------------------------------------------------------------------
+    #
+    def _state_feed_cb(self):
+
+        if self._terminate.is_set():
+            return False
+
+        # only pull the state events which arrived since the last call
+        units = self._session._dbs.get_unit_events(umgr_uid=self.uid)
+
+        if units is None:
+            # we lost events, and need to fall back to a full state pull
+            self._log.warn('state events lost - pull all unit states')
+            return self._state_pull_cb()
+
+        return self._update_units(units, publish=True)
 
 
     #---------------------------------------------------------------------------
@@ -380,32 +430,18 @@ class UnitManager(rpu.Component):
             return False
 
         # pull units those units from the agent which are about to get back
-        # under umgr control, and push them into the respective queues
+        # under umgr control, and push them into the respective queues.  The
+        # claim is atomic, so no unit is pulled twice.
         # FIXME: this should also be based on a tailed cursor
-        # FIXME: Unfortunately, 'find_and_modify' is not bulkable, so we have
-        #        to use 'find'.  To avoid finding the same units over and over 
-        #        again, we update the 'control' field *before* running the next
-        #        find -- so we do it right here.
-        tgt_states  = rps.FINAL + [rps.UMGR_STAGING_OUTPUT_PENDING]
-        unit_cursor = self.session._dbs._c.find(spec={
-            'type'    : 'unit',
-            'umgr'    : self.uid,
-            'control' : 'umgr_pending'})
-
-        if not unit_cursor.count():
+        units = self._session._dbs.claim_units(pattern = {'umgr' : self.uid},
+                                               control = 'umgr',
+                                               limit   = None)
+
+        if not units:
             # no units whatsoever...
             self._log.info(" === units pulled:    0")
             return True  # this is not an error
 
-        # update the units to avoid pulling them again next time.
-        units = list(unit_cursor)
-        uids  = [unit['uid'] for unit in units]
-
-        self._session._dbs._c.update(multi    = True,
-                        spec     = {'type'  : 'unit',
-                                    'uid'   : {'$in'     : uids}},
-                        document = {'$set'  : {'control' : 'umgr'}})
-
         self._log.info("units pulled: %4d %s", len(units), [u['uid'] for u in units])
         self._prof.prof('get', msg="bulk size: %d" % len(units), uid=self.uid)
         for unit in units:
@@ -418,8 +454,7 @@ class UnitManager(rpu.Component):
             if old != new:
                 self._log.debug(" === unit  pulled %s: %s / %s", uid, old, new)
 
-            unit['state']   = new
-            unit['control'] = 'umgr'
+            unit['state'] = new
             self._prof.prof('get', msg="bulk size: %d" % len(units), uid=uid)
 
         # now we really own the CUs, and can start working on them (ie. push
@@ -446,56 +481,105 @@ class UnitManager(rpu.Component):
         if isinstance(arg, list): things =  arg
         else                    : things = [arg]
 
-        for thing in things:
+        # we got the state update from the state callback - don't publish it
+        # again
+        units = [thing for thing in things
+                       if 'type' in thing and thing['type'] == 'unit']
+
+        return self._update_units(units, publish=False)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _update_units(self, unit_dicts, publish=False):
+
+        # all state transitions in this bulk, as [unit, state]
+        transitions = list()
+
+        with self._units_lock:
+
+            for unit_dict in unit_dicts:
+
+                uid = unit_dict['uid']
+
+                # we don't care about units we don't know
+                if uid not in self._units:
+                    continue
 
-            if 'type' in thing and thing['type'] == 'unit':
+                # only update on state changes
+                current = self._units[uid].state
+                target  = unit_dict['state']
+                if current == target:
+                    continue
 
-                # we got the state update from the state callback - don't
-                # publish it again
-                if not self._update_unit(thing, publish=False):
-                    return False
+                target, passed = rps._unit_state_progress(uid, current, target)
+
+                if target in [rps.CANCELED, rps.FAILED]:
+                    # don't replay intermediate states
+                    passed = passed[-1:]
+
+                for s in passed:
+                    unit_dict['state'] = s
+                    self._units[uid]._update(unit_dict)
+                    self.advance(unit_dict, s, publish=publish, push=False)
+                    transitions.append([self._units[uid], s])
+
+            # We dispatch while holding the lock, so that transitions of the
+            # same unit ingested by different threads stay in order.
+            for unit, s in transitions:
+                self._cb_dispatcher.dispatch(unit.uid, self._call_unit_callbacks,
+                                             unit, s)
+
+            if transitions:
+                self._cb_dispatcher.dispatch(self._uid, self._call_bulk_callbacks,
+                                             [t[0] for t in transitions],
+                                             [t[1] for t in transitions])
 
         return True
 
 
     # --------------------------------------------------------------------------
     #
-    def _update_unit(self, unit_dict, publish=False):
-
-        # FIXME: this is breaking the bulk!
-
-        uid = unit_dict['uid']
+    # Create a waiter for the given units, which is notified by
+    # `_call_unit_callbacks()` about all state transitions.  Units whose
+    # callbacks have run for a matching state already are ticked off right
+    # away.  The waiter must be removed via `_remove_waiter()` when done.
+    #
+    def _add_waiter(self, uids, states):
 
         with self._units_lock:
 
-            # we don't care about units we don't know
-            if uid not in self._units:
-                return True
+            for uid in uids:
+                if uid not in self._units:
+                    raise ValueError('unit %s not known' % uid)
 
-            # only update on state changes
-            current = self._units[uid].state
-            target  = unit_dict['state']
-            if current == target:
-                return True
+            waiter = rpu.StateWaiter(uids, states)
+            for uid in uids:
+                waiter.notify(self._units[uid], self._cb_states[uid])
 
-            target, passed = rps._unit_state_progress(uid, current, target)
+            self._waiters.append(waiter)
 
-            if target in [rps.CANCELED, rps.FAILED]:
-                # don't replay intermediate states
-                passed = passed[-1:]
+        return waiter
 
-            for s in passed:
-                unit_dict['state'] = s
-                self._units[uid]._update(unit_dict)
-                self.advance(unit_dict, s, publish=publish, push=False)
 
-            return True
+    # --------------------------------------------------------------------------
+    #
+    def _remove_waiter(self, waiter):
+
+        with self._units_lock:
+            self._waiters.remove(waiter)
 
 
     # --------------------------------------------------------------------------
     #
+    # This is invoked by the callback dispatcher for each unit state
+    # transition, in order per unit.
+    #
     def _call_unit_callbacks(self, unit_obj, state):
 
+        # unit specific callbacks first
+        unit_obj._call_callbacks(state)
+
         with self._cb_lock:
             for cb_name, cb_val in self._callbacks[rpt.UNIT_STATE].iteritems():
 
@@ -505,6 +589,32 @@ class UnitManager(rpu.Component):
                 if cb_data: cb(unit_obj, state, cb_data)
                 else      : cb(unit_obj, state)
 
+        # only now let waiters know, so that callbacks for a state have been
+        # invoked when a wait for that state returns.  `unit_obj.state` may
+        # be ahead of `state` by now, so waiters added later check against
+        # `self._cb_states`, not against the unit state.
+        with self._units_lock:
+            self._cb_states[unit_obj.uid] = state
+            for waiter in self._waiters:
+                waiter.notify(unit_obj, state)
+
+
+    # --------------------------------------------------------------------------
+    #
+    # This is invoked by the callback dispatcher once per bulk of state
+    # transitions.
+    #
+    def _call_bulk_callbacks(self, units, states):
+
+        with self._cb_lock:
+            for cb_name, cb_val in self._callbacks[rpt.UNIT_STATES].iteritems():
+
+                cb      = cb_val['cb']
+                cb_data = cb_val['cb_data']
+
+                if cb_data: cb(units, states, cb_data)
+                else      : cb(units, states)
+
 
     # --------------------------------------------------------------------------
     #
@@ -712,40 +822,47 @@ class UnitManager(rpu.Component):
 
         self._log.report.info('<<submit %d unit(s)\n\t' % len(descriptions))
 
-        # we return a list of compute units
-        units = list()
-        for ud in descriptions:
+        # check all descriptions before creating any units
+        descrs = [ud.as_dict() for ud in descriptions]
+        for descr in descrs:
+
+            cores = descr.get('cores')
 
-            if not ud.executable:
+            if not descr.get('executable'):
                 raise ValueError('compute unit executable must be defined')
 
-            if not ud.cores:
+            if not cores:
                 raise ValueError('compute unit core count must be defined')
 
-            if float(ud.cores) != int(ud.cores):
+            if float(cores) != int(cores):
                 raise ValueError('compute unit core count must be an integer')
 
-            if int(ud.cores) <= 0:
+            if int(cores) <= 0:
                 raise ValueError('compute unit core count must be positive')
 
-            unit = ComputeUnit.create(umgr=self, descr=ud)
-            units.append(unit)
-
-            # keep units around
-            with self._units_lock:
-                self._units[unit.uid] = unit
+        if self._session._rec:
+            # record the unexpanded descriptions
+            rec_descrs = copy.deepcopy(descrs)
 
-            if self._session._rec:
-                ru.write_json(ud.as_dict(), "%s/%s.batch.%03d.json" \
-                        % (self._session._rec, unit.uid, self._rec_id))
+        # create all units as a bulk.  The unit dicts are used for the DB
+        # insert and the state advance below.
+        units, unit_docs = ComputeUnit.create_bulk(umgr=self, descrs=descrs)
 
-            self._log.report.progress()
+        # keep units around
+        with self._units_lock:
+            for unit in units:
+                self._units[unit.uid]     = unit
+                self._cb_states[unit.uid] = unit.state
 
         if self._session._rec:
+            for unit, descr in zip(units, rec_descrs):
+                ru.write_json(descr, "%s/%s.batch.%03d.json" \
+                        % (self._session._rec, unit.uid, self._rec_id))
             self._rec_id += 1
 
+        self._log.report.progress()
+
         # insert units into the database, as a bulk.
-        unit_docs = [unit.as_dict() for unit in units]
         self._session._dbs.insert_units(unit_docs)
 
         # Only after the insert can we hand the units over to the next
@@ -834,11 +951,85 @@ class UnitManager(rpu.Component):
 
         self.is_valid()
 
+        uids, states, ret_list = self._get_wait_args(uids, state)
+
+        self._log.report.info('<<wait for %d unit(s)\n\t' % len(uids))
+
+        # We don't iterate over all units again and again: the waiter is
+        # notified on state changes, and hands out units as they match.
+        waiter = self._add_waiter(uids, states)
+        try:
+            self._log.report.idle(mode='start')
+            for unit in waiter.iterate(timeout):
+
+                if   unit.state == rps.FAILED  : self._log.report.idle(color='error', c='-')
+                elif unit.state == rps.CANCELED: self._log.report.idle(color='warn',  c='*')
+                else                           : self._log.report.idle(color='ok',    c='+')
+
+            self._log.report.idle(mode='stop')
+
+        finally:
+            self._remove_waiter(waiter)
+
+        if waiter.pending: self._log.report.warn('>>timeout\n')
+        else             : self._log.report.ok(  '>>ok\n')
+
+        self.is_valid()
+
+        # grab the current states to return
+        with self._units_lock:
+            states = [self._units[uid].state for uid in uids]
+
+        # done waiting
+        if ret_list: return states
+        else       : return states[0]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def as_completed(self, uids=None, state=None, timeout=None):
+        """
+        Yields :class:`radical.pilot.ComputeUnit` instances as soon as they
+        reach a specific state, so that applications can react on each unit
+        without waiting for all of them.
+
+        **Example**::
+
+            for unit in umgr.as_completed(uids):
+                print '%s: %s' % (unit.uid, unit.state)
+
+        **Arguments:**
+
+            The arguments are the same as for :meth:`wait_units`.  Once the
+            timeout is reached, the iteration ends even if some units did not
+            yet reach the requested state.
+        """
+
+        self.is_valid()
+
+        uids, states, _ = self._get_wait_args(uids, state)
+
+        waiter = self._add_waiter(uids, states)
+        try:
+            for unit in waiter.iterate(timeout):
+                yield unit
+
+        finally:
+            self._remove_waiter(waiter)
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Normalize the arguments for `wait_units()` and `as_completed()`, and
+    # return the uids and states to wait for, and if a list was passed.
+    #
+    def _get_wait_args(self, uids, state):
+
         if not uids:
             with self._units_lock:
                 uids = list()
-                for uid,unit in self._units.iteritems():
-                    if unit.state not in rps.FINAL:
+                for uid in self._units:
+                    if self._cb_states[uid] not in rps.FINAL:
                         uids.append(uid)
 
         if not state:
@@ -853,63 +1044,7 @@ class UnitManager(rpu.Component):
             ret_list = False
             uids = [uids]
 
-        self._log.report.info('<<wait for %d unit(s)\n\t' % len(uids))
-
-        start    = time.time()
-        to_check = None
-
-        with self._units_lock:
-            to_check = [self._units[uid] for uid in uids]
-
-        # We don't want to iterate over all units again and again, as that would
-        # duplicate checks on units which were found in matching states.  So we
-        # create a list from which we drop the units as we find them in
-        # a matching state
-        self._log.report.idle(mode='start')
-        while to_check and not self._terminate.is_set():
-
-            # check timeout
-            if timeout and (timeout <= (time.time() - start)):
-                self._log.debug ("wait timed out")
-                break
-
-            time.sleep (0.1)
-
-            # FIXME: print percentage...
-            self._log.report.idle()
-          # print 'wait units: %s' % [[u.uid, u.state] for u in to_check]
-
-            check_again = list()
-            for unit in to_check:
-                if  unit.state not in states and \
-                    unit.state not in rps.FINAL:
-                    check_again.append(unit)
-                else:
-                    # stop watching this unit
-                    if unit.state in [rps.FAILED]:
-                        self._log.report.idle(color='error', c='-')
-                    elif unit.state in [rps.CANCELED]:
-                        self._log.report.idle(color='warn', c='*')
-                    else:
-                        self._log.report.idle(color='ok', c='+')
-
-            to_check = check_again
-
-            self.is_valid()
-
-        self._log.report.idle(mode='stop')
-
-        if to_check: self._log.report.warn('>>timeout\n')
-        else       : self._log.report.ok(  '>>ok\n')
-
-        # grab the current states to return
-        state = None
-        with self._units_lock:
-            states = [self._units[uid].state for uid in uids]
-
-        # done waiting
-        if ret_list: return states
-        else       : return states[0]
+        return uids, states, ret_list
 
 
     # --------------------------------------------------------------------------
@@ -959,16 +1094,30 @@ class UnitManager(rpu.Component):
         #       disable this optimization.
         #
         # FIXME: the effect of the env var is not well tested
+        with self._units_lock:
+            units = [self._units[uid] for uid in uids]
+
+        # units which may have reached an agent need to be canceled there,
+        # too.  We send one command per pilot, for all of its units.
+        to_agents = dict()
+        for unit in units:
+            if unit.pilot and unit.state not in rps.FINAL:
+                if unit.pilot not in to_agents:
+                    to_agents[unit.pilot] = list()
+                to_agents[unit.pilot].append(unit.uid)
+
         if 'RADICAL_PILOT_STRICT_CANCEL' not in os.environ:
-            with self._units_lock:
-                units = [self._units[uid] for uid  in uids ]
-            unit_docs = [unit.as_dict()   for unit in units]
+            unit_docs = [unit.as_dict() for unit in units]
             self.advance(unit_docs, state=rps.CANCELED, publish=True, push=True)
 
         # we *always* issue the cancellation command!
         self.publish(rpc.CONTROL_PUBSUB, {'cmd' : 'cancel_units', 
                                           'arg' : {'uids' : uids}})
 
+        for pid, pilot_uids in to_agents.iteritems():
+            self._session._dbs.pilot_command('cancel_units',
+                                             {'uids' : pilot_uids}, pid)
+
         # In the default case of calling 'advance' above, we just set the state,
         # so we *know* units are canceled.  But we nevertheless wait until that
         # state progression trickled through, so that the application will see
@@ -1001,9 +1150,25 @@ class UnitManager(rpu.Component):
             managed by this unit manager instance is changing.  It communicates
             the unit object instance and the units new state.
 
+          * `UNIT_STATES`: the bulk version of `UNIT_STATE`: fires once per
+            bulk of state updates, with a list of units and the list of their
+            respective new states::
+
+                def cb(units, states, cb_data)
+
+            A unit can show up more than once in a bulk, if it passed through
+            several states.  Use this for callbacks which are expensive to
+            invoke for each state transition individually.
+
           * `WAIT_QUEUE_SIZE`: fires when the number of unscheduled units (i.e.
             of units which have not been assigned to a pilot for execution)
             changes.
+
+        Unit state callbacks are not invoked in the thread which ingests state
+        updates, but by `callback_threads` dispatcher threads (see the umgr
+        config).  Callbacks for the same unit are invoked in order.  As the
+        unit may have progressed further by the time a callback is invoked,
+        callbacks should use the `state` passed, not `unit.state`.
         """
 
         # FIXME: the signature should be (self, metrics, cb, cb_data)
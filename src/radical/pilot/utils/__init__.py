@@ -20,6 +20,7 @@ logger  = _ru.get_logger('radical.pilot')
 #
 from .db_utils     import *
 from .prof_utils   import *
+from .prof_binary  import *
 from .misc         import *
 from .queue        import *
 from .pubsub       import *
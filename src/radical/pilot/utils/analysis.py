@@ -93,7 +93,48 @@ _info_entries = [
 
 # ------------------------------------------------------------------------------
 #
-tmp = None
+def _match(frame, filters):
+    """
+    return a boolean mask of the frame rows which match any of the filter dicts
+    in 'filters', where a row matches a filter dict if it matches all col/pat
+    pairs in that dict.
+    """
+
+    import numpy as np
+
+    ret = np.zeros(len(frame), dtype=bool)
+    for f in filters:
+        match = np.ones(len(frame), dtype=bool)
+        for col, pat in f.iteritems():
+            match &= (frame[col] == pat).values
+        ret |= match
+
+    return ret
+
+
+# ------------------------------------------------------------------------------
+#
+def _apply_unique(series, func):
+    """
+    apply 'func' to each unique value of the series (profile columns have only
+    few of those), and return the results as array aligned with the series.
+    """
+
+    import numpy  as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(series)
+    ret = [func(val) for val in uniques]
+
+    # factorize gives code -1 for NaN, which maps to the last entry
+    if (codes < 0).any(): ret.append(func(np.NaN))
+    else                : ret.append(None)
+
+    return np.array(ret, dtype=object)[codes]
+
+
+# ------------------------------------------------------------------------------
+#
 def add_concurrency (frame, tgt, spec):
     """
     add a column 'tgt' which is a cumulative sum of conditionals of another row.
@@ -133,73 +174,25 @@ def add_concurrency (frame, tgt, spec):
         add_concurrency (df, 'concurrently_running', spec)
     """
     
-    import numpy as np
+    import numpy  as np
+    import pandas as pd
 
-    # create a temporary row over which we can do the commulative sum
-    # --------------------------------------------------------------------------
-    def _conc (row, spec):
-
-        # row must match any filter dict in 'spec[in/out]' 
-        # for any filter dict it must match all col/pat pairs
-
-        # for each in filter
-        for f in spec['in']:
-            match = 1 
-            # for each col/val in that filter
-            for col, pat in f.iteritems():
-                if row[col] != pat:
-                    match = 0
-                    break
-            if match:
-                # one filter matched!
-              # print " + : %-20s : %.2f : %-20s : %s " % (row['uid'], row['time'], row['event'], row['message'])
-                return 1
-
-        # for each out filter
-        for f in spec['out']:
-            match = 1 
-            # for each col/val in that filter
-            for col, pat in f.iteritems():
-                if row[col] != pat:
-                    match = 0
-                    break
-            if match:
-                # one filter matched!
-              # print " - : %-20s : %.2f : %-20s : %s " % (row['uid'], row['time'], row['event'], row['message'])
-                return -1
-
-        # no filter matched
-      # print "   : %-20s : %.2f : %-20s : %s " % (row['uid'], row['time'], row['event'], row['message'])
-        return  np.NaN
-    # --------------------------------------------------------------------------
+    # rows matching an 'in' filter count +1, otherwise rows matching an 'out'
+    # filter count -1.  The cumsum skips all other rows (NaN).
+    conc = np.where(_match(frame, spec['in']),   1.0,
+           np.where(_match(frame, spec['out']), -1.0, np.NaN))
+    conc = pd.Series(conc, index=frame.index).cumsum()
+
+    # sanitize concurrency: negative values indicate incorrect event ordering,
+    # so we set the repesctive values to NaN
+    conc = conc.mask(conc < 0)
 
     # we only want to later look at changes of the concurrency -- leading or trailing 
     # idle times are to be ignored.  We thus set repeating values of the cumsum to NaN, 
     # so that they can be filtered out when ploting: df.dropna().plot(...).  
     # That specifically will limit the plotted time range to the area of activity. 
     # The full time range can still be plotted when ommitting the dropna() call.
-    # --------------------------------------------------------------------------
-    def _time (x):
-        global tmp
-        if     x != tmp: tmp = x
-        else           : x   = np.NaN
-        return x
-
-
-    # --------------------------------------------------------------------------
-    # sanitize concurrency: negative values indicate incorrect event ordering,
-    # so we set the repesctive values to 0
-    # --------------------------------------------------------------------------
-    def _abs (x):
-        if x < 0:
-            return np.NaN
-        return x
-    # --------------------------------------------------------------------------
-    
-    frame[tgt] = frame.apply(lambda row: _conc(row, spec), axis=1).cumsum()
-    frame[tgt] = frame.apply(lambda row: _abs (row[tgt]),  axis=1)
-    frame[tgt] = frame.apply(lambda row: _time(row[tgt]),  axis=1)
-  # print frame[[tgt, 'time']]
+    frame[tgt] = conc.where(conc != conc.shift())
 
     return frame
 
@@ -220,19 +213,22 @@ def add_frequency(frame, tgt, window, spec):
     The method looks backwards, so the resulting frequency column contains the
     frequency which applied *up to* that point in time.
     """
-    
-    # --------------------------------------------------------------------------
-    def _freq(t, _tmp, _window):
-        # get sequence of frame which falls within the time window, and return
-        # length of that sequence
-        return len(_tmp.uid[(_tmp.time > t-_window) & (_tmp.time <= t)])
-    # --------------------------------------------------------------------------
-    
+
+    import numpy  as np
+    import pandas as pd
+
     # filter the frame by the given spec
     tmp = frame
     for key,val in spec.iteritems():
         tmp = tmp[tmp[key].isin([val])]
-    frame[tgt] = tmp.time.apply(_freq, args=[tmp, window])
+
+    # count the events in (t-window, t] by bisecting the sorted event times
+    times = tmp['time'].values
+    ts    = np.sort(times)
+    freq  = np.searchsorted(ts, times,          side='right') \
+          - np.searchsorted(ts, times - window, side='right')
+
+    frame[tgt] = pd.Series(freq, index=tmp.index)
 
     return frame
 
@@ -248,27 +244,25 @@ def add_event_count(frame, tgt, spec):
     cumsum. 
     """
 
-    raise NotImplementedError('not yet implemented')
-
-    # --------------------------------------------------------------------------
-    def _ecnt(t, _tmp):
-        # get sequence of frame which falls within the time window, and return
-        # length of that sequence
-        return len(_tmp.uid[(_tmp.time <= t)])
-    # --------------------------------------------------------------------------
+    import numpy  as np
+    import pandas as pd
 
     # filter the frame by the given spec
     tmp = frame
     for key,val in spec.iteritems():
         tmp = tmp[tmp[key].isin([val])]
-    frame[tgt] = tmp.time.apply(_ecnt, args=[tmp])
+
+    # count the events up to (and including) t
+    times = tmp['time'].values
+    count = np.searchsorted(np.sort(times), times, side='right')
+
+    frame[tgt] = pd.Series(count, index=tmp.index)
 
     return frame
 
 
 # ------------------------------------------------------------------------------
 #
-t0 = None
 def calibrate_frame(frame, spec):
     """
     move the time axis of a profiling frame so that t_0 is at the first event
@@ -276,49 +270,14 @@ def calibrate_frame(frame, spec):
     'add_concurrency' (list of dicts with col:pat filters)
     """
 
-    # --------------------------------------------------------------------------
-    def _find_t0 (row, spec):
-
-        # row must match any filter dict in 'spec[in/out]' 
-        # for any filter dict it must match all col/pat pairs
-        global t0
-        if t0 is not None:
-            # already found t0
-            return
-
-        # for each col/val in that filter
-        for f in spec:
-            match = 1 
-            for col, pat in f.iteritems():
-                if row[col] != pat:
-                    match = 0
-                    break
-            if match:
-                # one filter matched!
-                t0 = row['time']
-                return
-    # --------------------------------------------------------------------------
-
-    # --------------------------------------------------------------------------
-    def _calibrate (row, t0):
-
-        if t0 is None:
-            # no t0...
-            return
+    match = _match(frame, spec)
 
-        return row['time'] - t0
-    # --------------------------------------------------------------------------
-
-    # we need to iterate twice over the frame: first to find t0, then to
-    # calibrate the time axis
-    global t0
-    t0 = None # no t0
-    frame.apply(lambda row: _find_t0  (row, spec), axis=1)
-
-    if t0 == None:
+    if not match.any():
         print "Can't recalibrate, no matching timestamp found"
         return
-    frame['time'] = frame.apply(lambda row: _calibrate(row, t0  ), axis=1)
+
+    t0 = frame['time'].values[match.argmax()]
+    frame['time'] = frame['time'] - t0
 
     return frame
 
@@ -471,11 +430,8 @@ def add_derived(df):
     df['allocation']     = operator.sub(df['as_allocated'], df['a_to_as'])
 
     # add a flag to indicate if a unit / pilot / ... is cloned
-    # --------------------------------------------------------------------------
-    def _cloned (row):
-        return 'clone' in row['uid'].lower()
-    # --------------------------------------------------------------------------
-    df['cloned'] = df.apply(lambda row: _cloned (row), axis=1)
+    df['cloned'] = _apply_unique(df['uid'], lambda uid: 'clone' in uid.lower()) \
+                   .astype(bool)
 
     return df
 
@@ -489,44 +445,55 @@ def add_info(df):
     analyse the data.
     """
 
-    import numpy as np
+    import numpy  as np
+    import pandas as pd
 
+    # all conditions are evaluated per unique column value, and are then
+    # combined as masks
+    factorized = dict()
+    def _contains(col, pat):
+        if col not in factorized:
+            factorized[col] = pd.factorize(df[col])
+        codes, uniques = factorized[col]
+        hits = np.array([pat in val for val in uniques] + [False], dtype=bool)
+        return hits[codes]
+
+    n_rows  = len(df)
+    info    = np.empty(n_rows, dtype=object)
+    info[:] = np.NaN
+
+    # the first matching entry of _info_entries wins
+    done = np.zeros(n_rows, dtype=bool)
+    for entry, name, event, msg in _info_entries:
+        match = _contains('name', name) & ~done
+        if event: match &= (df['event'] == event).values
+        if msg  : match &= (df['msg']   == msg  ).values
+        info[match] = entry
+        done       |= match
+
+    # otherwise we compose the info from the first matching name and event
+    # patterns, and flag pending and premature final states
     # --------------------------------------------------------------------------
-    def _info (row):
-        for info, name, event, msg in _info_entries:
-            if  (row['name'] and name  in row['name'] ) and \
-                (not event   or  event == row['event']) and \
-                (not msg     or  msg   == row['msg']  ):
-                return info
-
-        ret = ""
-        n   = 0  # 
-        for pat, pre in info_names.iteritems():
-            if pat in row['name']:
-                ret += pre
-                n   += 1
-                break
-        for pat, ev in _info_events.iteritems():
-            if ret and pat == row['event']:
-                ret += ev
-                n   += 1
-                break
-        for pat, s in _info_pending.iteritems():
-            if ret and pat in row['state']:
-                ret += s
-                break
-        # Also create separate info entries for Canceled and Failed units
-        for pat, f in _info_premature_final.iteritems():
-            if ret and pat in row['state']:
-                ret += f
-                break
-
-        if ret and n >= 2:
-            return ret
-        else:
-            return np.NaN
+    def _first(patterns, cond):
+        ret    = np.empty(n_rows, dtype=object)
+        ret[:] = ''
+        found  = np.zeros(n_rows, dtype=bool)
+        for pat, val in patterns.iteritems():
+            match = cond(pat) & ~found
+            ret[match] = val
+            found     |= match
+        return ret, found
     # --------------------------------------------------------------------------
-    df['info'] = df.apply(lambda row: _info (row), axis=1)
+
+    pre,  has_pre = _first(info_names,            lambda p: _contains('name',  p))
+    ev,   has_ev  = _first(_info_events,          lambda p: (df['event'] == p).values)
+    pend, _       = _first(_info_pending,         lambda p: _contains('state', p))
+    fin,  _       = _first(_info_premature_final, lambda p: _contains('state', p))
+
+    match       = ~done & has_pre & has_ev
+    info[match] = pre[match] + ev[match] + pend[match] + fin[match]
+
+    df['info'] = info
 
     return df
     
@@ -608,36 +575,38 @@ def add_states(df):
     previous state setting.
     """
     
-    import numpy as np
-
-    # --------------------------------------------------------------------------
-    _old_states = dict()
-    def _state_from (row):
-        old = np.NaN
-        if  row['uid']   and \
-            row['state'] and \
-            row['event'] == 'advance': 
-            old = _old_states.get(row['uid'], np.NaN)
-            if old == row['state']:
-                # no change in state...
-                old = np.NaN
-            else:
-                _old_states[row['uid']] = row['state']
-        return old
-    # --------------------------------------------------------------------------
-  # df['state_from'], df['state_to'] = zip(*df.apply(lambda row: _state(row), axis=1))
-    df['state_from'] = df.apply(lambda row: _state_from(row), axis=1)
+    import numpy  as np
+    import pandas as pd
 
-    _old_states = dict()
-    # --------------------------------------------------------------------------
-    def _state (row):
-        if  not row['uid']:
-            return np.NaN
-        if row['state']:
-            _old_states[row['uid']] = row['state']
-        return _old_states.get(row['uid'], '')
-    # --------------------------------------------------------------------------
-    df['state'] = df.apply(lambda row: _state(row), axis=1)
+    # python truthiness per row (NaN is truthy)
+    def _truth(col):
+        return _apply_unique(df[col], bool).astype(bool)
+
+    has_uid   = _truth('uid')
+    has_state = _truth('state')
+    uid_codes = pd.factorize(df['uid'])[0]
+    states    = df['state'].values
+
+    # 'state_from' is the previous state advanced to by the same uid, unless
+    # the state did not change
+    adv  = has_uid & has_state & (df['event'] == 'advance').values
+    sadv = pd.Series(states[adv])
+    prev = sadv.groupby(uid_codes[adv]).shift(1)
+    prev = prev.where(prev != sadv)
+
+    state_from      = np.empty(len(df), dtype=object)
+    state_from[:]   = np.NaN
+    state_from[adv] = prev.values
+    df['state_from'] = state_from
+
+    # 'state' is the last state set for the same uid, or '' if none was set yet
+    last  = pd.Series(np.where(has_state, np.arange(len(df)), -1))
+    last  = last.groupby(uid_codes).cummax().values
+    state = np.empty(len(df), dtype=object)
+    state[:]         = ''
+    state[last >= 0] = states[last[last >= 0]]
+    state[~has_uid]  = np.NaN
+    df['state'] = state
 
     return df
 
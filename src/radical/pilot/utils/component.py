@@ -3,6 +3,7 @@ import os
 import sys
 import copy
 import time
+import zlib
 import pprint
 import signal
 
@@ -25,6 +26,132 @@ from .pubsub     import PUBSUB_SUB     as rpu_PUBSUB_SUB
 from .pubsub     import PUBSUB_BRIDGE  as rpu_PUBSUB_BRIDGE
 
 
+# ------------------------------------------------------------------------------
+#
+# State updates can be partitioned over several update workers: if the state
+# pubsub bridge config sets `shards` to N > 1, each state update is published on
+# the topic of the shard its uid hashes to, and update worker instance `i` only
+# subscribes to the topic of shard `i`.  Subscribers to the plain state pubsub
+# topic still receive all updates, as topics are matched by prefix.
+#
+def get_shard(uid, shards):
+    """
+    Return the shard index for the given uid.  We can't use `hash()` here, as
+    that is not guaranteed to be stable across processes.
+    """
+
+    return (zlib.crc32(uid) & 0xffffffff) % shards
+
+
+# ------------------------------------------------------------------------------
+#
+def get_shard_topic(pubsub, shard):
+    """
+    Return the topic for the given shard of a pubsub channel.  The trailing dot
+    avoids prefix matches between, for example, shards 1 and 10.
+    """
+
+    return '%s.shard.%d.' % (pubsub, shard)
+
+
+# ------------------------------------------------------------------------------
+#
+# State updates are published on hierarchical topics, so that subscribers only
+# receive (and decode) the updates they are interested in:
+#
+#   <pubsub>.[shard.<n>.]unit.<umgr>.<pilot>.
+#   <pubsub>.[shard.<n>.]pilot.<pmgr>.
+#
+# Topics are matched by prefix: update workers subscribe to their shard (or the
+# plain pubsub name), managers only to the things they own.  Things which are
+# not yet bound to an owner or pilot are published with `NO_OWNER` in its place.
+#
+NO_OWNER = '-'
+
+def get_state_topic(pubsub, thing, shards=1):
+    """
+    Return the topic to publish the state update for the given thing on.  The
+    thing needs to carry its owner (`umgr` for units, `pmgr` for pilots), and
+    units also their `pilot`.
+    """
+
+    if shards > 1: prefix = get_shard_topic(pubsub, get_shard(thing['uid'], shards))
+    else         : prefix = '%s.' % pubsub
+
+    if thing['type'] == 'unit':
+        return '%sunit.%s.%s.' % (prefix, thing.get('umgr')  or NO_OWNER,
+                                          thing.get('pilot') or NO_OWNER)
+    else:
+        return '%spilot.%s.'   % (prefix, thing.get('pmgr')  or NO_OWNER)
+
+
+# ------------------------------------------------------------------------------
+#
+def get_state_topics(pubsub, filters, shards=1):
+    """
+    Return the topics to subscribe to for receiving the state updates selected
+    by the given filters.  A filter is a dict with the (optional) keys `type`
+    ('unit' or 'pilot'), `owner` (the umgr or pmgr uid) and `pilot` (units
+    only).  Keys can only be left unset from right to left, as topics are
+    matched by prefix.
+    """
+
+    if not isinstance(filters, list):
+        filters = [filters]
+
+    if shards > 1: prefixes = [get_shard_topic(pubsub, shard)
+                               for shard in range(shards)]
+    else         : prefixes = ['%s.' % pubsub]
+
+    topics = list()
+    for f in filters:
+
+        elems = [f.get('type'), f.get('owner'), f.get('pilot')]
+        while elems and not elems[-1]:
+            elems.pop()
+
+        if not all(elems):
+            raise ValueError('cannot filter state updates by %s' % f)
+
+        if elems and elems[0] == 'pilot' and len(elems) > 2:
+            raise ValueError('cannot filter pilot state updates by pilot')
+
+        for prefix in prefixes:
+            topics.append(prefix + ''.join(['%s.' % e for e in elems]))
+
+    return topics
+
+
+# ------------------------------------------------------------------------------
+#
+# Callback lock policies.  By default, all callbacks of a component (workers,
+# subscribers and timed callbacks) are serialized by one component lock.
+# Callbacks registered with `CB_LOCK_CHANNEL` are only serialized with the
+# callbacks on the same channel (input queue, pubsub, or timer), and callbacks
+# registered with `CB_LOCK_NONE` are not serialized at all.  The latter two
+# MUST protect any state they share with other callbacks.
+#
+CB_LOCK_EXCLUSIVE = 'exclusive'
+CB_LOCK_CHANNEL   = 'channel'
+CB_LOCK_NONE      = 'none'
+
+
+# ------------------------------------------------------------------------------
+#
+# Components which run as threads check their own threads every WATCH_INTERVAL
+# seconds (see `Component.start_thread()`).
+#
+WATCH_INTERVAL = 1.0
+
+
+# ------------------------------------------------------------------------------
+#
+class _NoLock(object):
+
+    def __enter__(self)      : pass
+    def __exit__(self, *args): pass
+
+
 # ==============================================================================
 #
 class Component(ru.Process):
@@ -149,7 +276,7 @@ class Component(ru.Process):
 
             # The type of bridge (queue or pubsub) is derived from the name.
             if bname.endswith('queue'):
-                bridge = rpu_Queue(session, bname, rpu_QUEUE_BRIDGE, bcfg_clone)
+                bridge = rpu_Queue.create(session, bname, rpu_QUEUE_BRIDGE, bcfg_clone)
 
             elif bname.endswith('pubsub'):
                 bridge = rpu_Pubsub(session, bname, rpu_PUBSUB_BRIDGE, bcfg_clone)
@@ -232,6 +359,15 @@ class Component(ru.Process):
                 raise ValueError('unknown component type (%s)' % cname)
 
             ctype = _ctypemap[cname]
+
+            # sharded update workers need exactly one instance per shard, or
+            # some shards would not be persisted at all
+            if cname == rpc.UPDATE_WORKER:
+                shards = cfg['bridges'].get(rpc.STATE_PUBSUB, {}).get('shards', 1)
+                if shards > 1 and cnum != shards:
+                    raise ValueError('need %d update workers for %d state '
+                                     'shards (not %d)' % (shards, shards, cnum))
+
             for i in range(cnum):
 
                 # for components, we pass on the original cfg (or rather a copy
@@ -248,8 +384,13 @@ class Component(ru.Process):
                 # merge the component config section (overwrite)
                 ru.dict_merge(tmp_cfg, ccfg, ru.OVERWRITE)
 
+                # components marked as `inproc` run as threads in this
+                # process, and can use inproc queues to talk to each other
                 comp = ctype.create(tmp_cfg, session)
-                comp.start()
+                if ccfg.get('inproc'):
+                    comp.start_thread()
+                else:
+                    comp.start()
 
                 log.info('%-30s starts %s',  tmp_cfg['owner'], comp.uid)
                 components.append(comp)
@@ -309,14 +450,19 @@ class Component(ru.Process):
         self._name       = cfg.get('name.%s' %  self._number,
                                    '%s.%s'   % (self._ctype, self._number))
 
-        self._bridges    = list()       # communication bridges
-        self._components = list()       # sub-components
-        self._inputs     = dict()       # queues to get things from
-        self._outputs    = dict()       # queues to send things to
-        self._workers    = dict()       # methods to work on things
-        self._publishers = dict()       # channels to send notifications to
-        self._threads    = dict()       # subscriber and idler threads
-        self._cb_lock    = mt.RLock()   # guard threaded callback invokations
+        self._bridges     = list()       # communication bridges
+        self._components  = list()       # sub-components
+        self._inputs      = dict()       # queues to get things from
+        self._outputs     = dict()       # queues to send things to
+        self._workers     = dict()       # methods to work on things
+        self._publishers  = dict()       # channels to send notifications to
+        self._threads     = dict()       # subscriber, idler and worker threads
+        self._cb_lock     = mt.RLock()   # guard threaded callback invokations
+        self._cb_locks    = dict()       # per channel callback locks
+        self._io_locks    = dict()       # guard channel use across threads
+        self._to_start    = list()       # input worker threads to start
+        self._cancel_set  = set()        # uids of things to cancel
+        self._cancel_lock = mt.RLock()   # guard the above
 
         if self._owner == self.uid:
             self._owner = 'root'
@@ -330,6 +476,9 @@ class Component(ru.Process):
         self._poll = None
         self._ctx  = None
 
+        self._inproc_thread = None  # set when running as thread (inproc)
+        self._inproc_term   = mt.Event()
+
         # initialize the Process base class for later fork.
         super(Component, self).__init__(name=self._uid, log=self._log)
 
@@ -400,8 +549,10 @@ class Component(ru.Process):
     #
     def _cancel_monitor_cb(self, topic, msg):
         """
-        We listen on the control channel for cancel requests, and append any
-        found UIDs to our cancel list.
+        We listen on the control channel for cancel requests, and add any
+        found UIDs to our cancel set.  UIDs are removed from that set again
+        once the respective things got canceled, or reached any other final
+        state in this component.
         """
 
         self.is_valid()
@@ -423,10 +574,10 @@ class Component(ru.Process):
             if not isinstance(uids, list):
                 uids = [uids]
 
-            self._log.debug('register for cancellation: %s', uids)
+            self._log.debug('register for cancellation: %d uids', len(uids))
 
             with self._cancel_lock:
-                self._cancel_list += uids
+                self._cancel_set.update(uids)
         else:
             pass
           # self._log.debug('command ignored: %s', cmd)
@@ -460,13 +611,14 @@ class Component(ru.Process):
     def ctype(self):
         return self._ctype
 
+    # components running as threads act as their own child
     @property
     def is_parent(self):
-        return self._ru_is_parent
+        return self._ru_is_parent and not self._inproc_thread
 
     @property
     def is_child(self):
-        return self._ru_is_child
+        return self._ru_is_child or bool(self._inproc_thread)
 
     @property
     def has_child(self):
@@ -524,19 +676,19 @@ class Component(ru.Process):
             # otherwise we would not be able to communicate bridge addresses to
             # the parent or child process (remember, this is *after* fork, the
             # cfg is already passed on).
-            if self._ru_is_parent and not self._ru_spawned:
+            if self.is_parent and not self._ru_spawned:
                 self._bridges = Component.start_bridges(self._cfg, 
                                                         self._session, 
                                                         self._log)
 
             # only one side will start sub-components: either the child, if it
             # exists, and only otherwise the parent
-            if self._ru_is_parent and not self._ru_spawned:
+            if self.is_parent and not self._ru_spawned:
                 self._components = Component.start_components(self._cfg, 
                                                               self._session, 
                                                               self._log)
             
-            elif self._ru_is_child:
+            elif self.is_child:
                 self._components = Component.start_components(self._cfg, 
                                                               self._session, 
                                                               self._log)
@@ -575,6 +727,11 @@ class Component(ru.Process):
     #
     def ru_initialize_parent(self):
 
+        # without a child process, threaded components initialize as child
+        if self._inproc_thread:
+            self.ru_initialize_child()
+            return
+
         # call component level initialize
         self.initialize_parent()
 
@@ -590,20 +747,24 @@ class Component(ru.Process):
         child initialization of component base class goes here
         """
 
-        spt.setproctitle('rp.%s' % self.uid)
+        # when running as a thread, the process and its I/O are not ours
+        if not self._inproc_thread:
 
-        if os.path.isdir(self._session.uid):
-            sys.stdout = open("%s/%s.out" % (self._session.uid, self.uid), "w")
-            sys.stderr = open("%s/%s.err" % (self._session.uid, self.uid), "w")
-        else:
-            sys.stdout = open("%s.out" % self.uid, "w")
-            sys.stderr = open("%s.err" % self.uid, "w")
+            spt.setproctitle('rp.%s' % self.uid)
+
+            if os.path.isdir(self._session.uid):
+                sys.stdout = open("%s/%s.out" % (self._session.uid, self.uid), "w")
+                sys.stderr = open("%s/%s.err" % (self._session.uid, self.uid), "w")
+            else:
+                sys.stdout = open("%s.out" % self.uid, "w")
+                sys.stderr = open("%s.err" % self.uid, "w")
 
 
         # set controller callback to handle cancellation requests
-        self._cancel_list = list()
+        self._cancel_set  = set()
         self._cancel_lock = mt.RLock()
-        self.register_subscriber(rpc.CONTROL_PUBSUB, self._cancel_monitor_cb)
+        self.register_subscriber(rpc.CONTROL_PUBSUB, self._cancel_monitor_cb,
+                                 lock=CB_LOCK_NONE)
 
         # call component level initialize
         self.initialize_child()
@@ -675,6 +836,10 @@ class Component(ru.Process):
     #
     def ru_finalize_parent(self):
 
+        if self._inproc_thread:
+            self.ru_finalize_child()
+            return
+
         # call component level finalize
         self.finalize_parent()
 
@@ -704,12 +869,85 @@ class Component(ru.Process):
         self._log.info('stop %s (%s : %s : %s) [%s]', self.uid, os.getpid(),
                        self.pid, ru.get_thread_name(), ru.get_caller_name())
 
+        # stop the work loop thread first, unless we are called from it
+        if self._inproc_thread:
+            self._inproc_term.set()
+            if  self._inproc_thread != mt.current_thread() \
+            and self._inproc_thread.is_alive():
+                self._inproc_thread.join(timeout)
+
         super(Component, self).stop(timeout)
 
 
     # --------------------------------------------------------------------------
     #
-    def register_input(self, states, input, worker):
+    def start_thread(self):
+        '''
+        Instead of forking a child process, run the component in a thread of
+        the current process.  The component then acts as its own child: the
+        child initializers are called right away (so that errors surface
+        here), and `work_cb()` is then called repeatedly in a separate thread,
+        until the component is stopped.
+
+        Components running in the same process can be connected by inproc
+        queues, which pass things by reference instead of serializing them.
+
+        The ru.Process is started without a child (`start(spawn=False)`), so
+        its watcher (which watches the socket to the child) is not started.
+        Instead, the work loop watches the component's threads.  If any of them
+        dies, the work loop ends, and `is_valid()` will report the component as
+        invalid.
+        '''
+
+        self._inproc_thread = mt.Thread(target=self._inproc_work_loop,
+                                        name='%s.work' % self.uid)
+        self._inproc_thread.daemon = True
+
+        # this calls the parent initializers, which redirect to the child ones
+        # (see `ru_initialize_parent()`), and stops the component on failure
+        self.start(spawn=False)
+
+        self._log.info('%s runs in thread %s', self.uid, self._inproc_thread.name)
+        self._inproc_thread.start()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _inproc_work_loop(self):
+
+        last = 0.0  # time of last thread check
+        try:
+            while not self._inproc_term.is_set():
+
+                if not self.work_cb():
+                    break
+
+                now = time.time()
+                if now - last >= WATCH_INTERVAL:
+                    self.watch_common()
+                    last = now
+
+        except Exception as e:
+            self._log.exception('work loop failed: %s' % e)
+
+        # signal our demise to `is_alive()`
+        self._inproc_term.set()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def is_alive(self, strict=True):
+
+        # a threaded component is gone when its work loop ended
+        if not strict and self._inproc_term.is_set():
+            return False
+
+        return super(Component, self).is_alive(strict)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def register_input(self, states, input, worker, threads=1, lock=None):
         """
         Using this method, the component can be connected to a queue on which
         things are received to be worked upon.  The given set of states (which
@@ -726,6 +964,12 @@ class Component(ru.Process):
 
         Worker invocation is synchronous, ie. the main event loop will only
         check for the next thing once the worker method returns.
+
+        If `threads` is larger than 1, the input is instead served by that many
+        threads, each with its own connection to the queue, which invoke the
+        worker concurrently.  That only makes sense for thread safe workers,
+        which should then be registered with a lock policy other than the
+        default `CB_LOCK_EXCLUSIVE` (see `CB_LOCK_*` above).
         """
 
         self.is_valid()
@@ -743,11 +987,23 @@ class Component(ru.Process):
         addr = self._cfg['bridges'][input]['addr_out']
         self._log.debug("using addr %s for input %s" % (addr, input))
 
-        q = rpu_Queue(self._session, input, rpu_QUEUE_OUTPUT, self._cfg, addr=addr)
-        self._inputs['name'] = {'queue'  : q,
-                                'states' : states}
+        cb_lock = self._get_cb_lock(lock, input)
+
+        if threads > 1:
+            q       = None
+            workers = self._create_workers(name, input, addr, states, cb_lock,
+                                           threads)
+        else:
+            q       = rpu_Queue.create(self._session, input, rpu_QUEUE_OUTPUT,
+                                       self._cfg, addr=addr)
+            workers = list()
+
+        self._inputs[name] = {'queue'   : q,
+                              'states'  : states,
+                              'lock'    : cb_lock,
+                              'workers' : workers}
 
-        self._log.debug('registered input %s', name)
+        self._log.debug('registered input %s (%d threads)', name, threads)
 
         # we want exactly one worker associated with a state -- but a worker can
         # be responsible for multiple states
@@ -782,7 +1038,17 @@ class Component(ru.Process):
           # raise ValueError('input %s not registered' % name)
             return
 
-        self._inputs[name]['queue'].stop()
+        if self._inputs[name]['queue']:
+            self._inputs[name]['queue'].stop()
+
+        with self._cb_lock:
+            for tname in self._inputs[name]['workers']:
+                thread = self._threads.pop(tname)
+                if thread in self._to_start:
+                    self._to_start.remove(thread)
+                else:
+                    thread.stop()  # implies join
+
         del(self._inputs[name])
         self._log.debug('unregistered input %s', name)
 
@@ -794,6 +1060,75 @@ class Component(ru.Process):
             self._log.debug('unregistered worker %s [%s]', worker.__name__, state)
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _get_cb_lock(self, policy, channel):
+
+        if policy in [None, CB_LOCK_EXCLUSIVE]:
+            return self._cb_lock
+
+        if policy == CB_LOCK_CHANNEL:
+            with self._cb_lock:
+                if channel not in self._cb_locks:
+                    self._cb_locks[channel] = mt.RLock()
+                return self._cb_locks[channel]
+
+        if policy == CB_LOCK_NONE:
+            return _NoLock()
+
+        raise ValueError('unknown callback lock policy %s' % policy)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _create_workers(self, name, input, addr, states, cb_lock, threads):
+        """
+        Create threads which serve the given input queue concurrently.  Returns
+        the thread names.  The threads are started by `work_cb()`, ie. once the
+        component is initialized and all its outputs are registered.
+        """
+
+        # ----------------------------------------------------------------------
+        class InputWorker(ru.Thread):
+
+            # ------------------------------------------------------------------
+            def __init__(self, name, log, q, states, cb_lock, work):
+                self._name    = name
+                self._log     = log
+                self._q       = q
+                self._states  = states
+                self._cb_lock = cb_lock
+                self._work    = work
+
+                super(InputWorker, self).__init__(name=self._name, log=self._log)
+
+            # ------------------------------------------------------------------
+            def work_cb(self):
+                self.is_valid()
+                self._work(self._q, self._states, self._cb_lock)
+                return True
+            def ru_finalize_common(self):
+                self._q.stop()
+        # ----------------------------------------------------------------------
+
+        tnames = list()
+        for i in range(threads):
+
+            tname  = '%s.worker.%d' % (name, i)
+            q      = rpu_Queue.create(self._session, input, rpu_QUEUE_OUTPUT,
+                                      self._cfg, addr=addr)
+            worker = InputWorker(name=tname, log=self._log, q=q, states=states,
+                                 cb_lock=cb_lock, work=self._work_on)
+
+            with self._cb_lock:
+                self._threads[tname] = worker
+                self._to_start.append(worker)
+
+            tnames.append(tname)
+
+        return tnames
+
+
     # --------------------------------------------------------------------------
     #
     def register_output(self, states, output=None):
@@ -834,8 +1169,9 @@ class Component(ru.Process):
                 self._log.debug("using addr %s for output %s" % (addr, output))
 
                 # non-final state, ie. we want a queue to push to
-                q = rpu_Queue(self._session, output, rpu_QUEUE_INPUT, self._cfg, addr=addr)
-                self._outputs[state] = q
+                q = rpu_Queue.create(self._session, output, rpu_QUEUE_INPUT, self._cfg, addr=addr)
+                self._outputs[state]  = q
+                self._io_locks[state] = mt.Lock()
 
                 self._log.debug('registered output    : %s : %s : %s' \
                      % (state, output, q.name))
@@ -873,12 +1209,14 @@ class Component(ru.Process):
 
     # --------------------------------------------------------------------------
     #
-    def register_timed_cb(self, cb, cb_data=None, timer=None):
+    def register_timed_cb(self, cb, cb_data=None, timer=None, lock=None):
         """
         Idle callbacks are invoked at regular intervals -- they are guaranteed
         to *not* be called more frequently than 'timer' seconds, no promise is
         made on a minimal call frequency.  The intent for these callbacks is to
         run lightweight work in semi-regular intervals.  
+
+        See `CB_LOCK_*` above for the `lock` policies.
         """
 
         self.is_valid()
@@ -938,7 +1276,8 @@ class Component(ru.Process):
             # ----------------------------------------------------------------------
 
             idler = Idler(name=name, timer=timer, log=self._log,
-                          cb=cb, cb_data=cb_data, cb_lock=self._cb_lock)
+                          cb=cb, cb_data=cb_data,
+                          cb_lock=self._get_cb_lock(lock, name))
             self._threads[name] = idler
 
         self.register_watchable(idler)
@@ -998,6 +1337,7 @@ class Component(ru.Process):
 
         q = rpu_Pubsub(self._session, pubsub, rpu_PUBSUB_PUB, self._cfg, addr=addr)
         self._publishers[pubsub] = q
+        self._io_locks[pubsub]   = mt.Lock()
 
         self._log.debug('registered publisher : %s : %s' % (pubsub, q.name))
 
@@ -1025,7 +1365,8 @@ class Component(ru.Process):
 
     # --------------------------------------------------------------------------
     #
-    def register_subscriber(self, pubsub, cb, cb_data=None):
+    def register_subscriber(self, pubsub, cb, cb_data=None, topic=None,
+                            lock=None):
         """
         This method is complementary to the register_publisher() above: it
         registers a subscription to a pubsub channel.  If a notification
@@ -1035,12 +1376,17 @@ class Component(ru.Process):
           callback(topic, msg)
           callback(topic, msg, cb_data)
 
-        where 'topic' is set to the name of the pubsub channel.
+        where 'topic' is set to the topic the message was published on.  If
+        a 'topic' (or a list of topics) is passed on registration, only messages
+        on topics starting with it are received -- by default, the pubsub name
+        is used, which covers all messages on the channel.
 
         The subscription will be handled in a separate thread, which implies
         that the callback invocation will also happen in that thread.  It is the
         caller's responsibility to ensure thread safety during callback
-        invocation.
+        invocation.  By default, callbacks are serialized with all other
+        callbacks of the component (see `CB_LOCK_*` above for other `lock`
+        policies).
         """
 
         self.is_valid()
@@ -1102,13 +1448,19 @@ class Component(ru.Process):
             def ru_finalize_common(self):
                 self._q.stop()
         # ----------------------------------------------------------------------
-        # create a pubsub subscriber (the pubsub name doubles as topic)
+        # create a pubsub subscriber (the pubsub name doubles as default topic)
         # FIXME: this should be moved into the thread child_init
+        if not topic:
+            topic = pubsub
+        if not isinstance(topic, list):
+            topic = [topic]
         q = rpu_Pubsub(self._session, pubsub, rpu_PUBSUB_SUB, self._cfg, addr=addr)
-        q.subscribe(pubsub)
+        for t in topic:
+            q.subscribe(t)
 
         subscriber = Subscriber(name=name, l=self._log, q=q, 
-                                cb=cb, cb_data=cb_data, cb_lock=self._cb_lock)
+                                cb=cb, cb_data=cb_data,
+                                cb_lock=self._get_cb_lock(lock, pubsub))
 
         with self._cb_lock:
             self._threads[name] = subscriber
@@ -1118,6 +1470,28 @@ class Component(ru.Process):
         self._log.debug('%s registered %s subscriber %s' % (self.uid, pubsub, name))
 
 
+    # --------------------------------------------------------------------------
+    #
+    def register_state_subscriber(self, cb, filters, cb_data=None, lock=None):
+        """
+        Subscribe to the state updates selected by the given filters (see
+        `get_state_topics()`), like:
+
+          self.register_state_subscriber(self._state_cb,
+                                         {'type' : 'unit', 'owner' : umgr})
+
+        Updates on other topics are filtered by ZMQ and are never decoded.  The
+        subscription is removed via `unregister_subscriber(STATE_PUBSUB, cb)`.
+        """
+
+        shards = self._cfg['bridges'][rpc.STATE_PUBSUB].get('shards', 1)
+        topics = get_state_topics(rpc.STATE_PUBSUB, filters, shards)
+
+        self._log.debug('subscribe to state topics %s', topics)
+        self.register_subscriber(rpc.STATE_PUBSUB, cb, cb_data=cb_data,
+                                 topic=topics, lock=lock)
+
+
     # --------------------------------------------------------------------------
     #
     def unregister_subscriber(self, pubsub, cb):
@@ -1147,19 +1521,21 @@ class Component(ru.Process):
     # --------------------------------------------------------------------------
     #
     def watch_common(self):
-        # FIXME: this is not used at the moment
         '''
-        This method is called repeatedly in the ru.Process watcher loop.  We use
-        it to watch all our threads, and will raise an exception if any of them
-        disappears.  This will initiate the ru.Process termination sequence.
+        This method is called repeatedly by the work loop of components which
+        run as threads (see `start_thread()`) -- other components are watched
+        by the ru.Process watcher.  We watch all our threads, and raise an
+        exception if any of them disappears.  This will end the work loop.
         '''
 
         self.is_valid()
 
         with self._cb_lock:
-            for tname in self._threads:
-                if not self._threads[tname].is_alive():
-                    raise RuntimeError('%s thread %s died', self.uid, tname)
+            for tname, thread in self._threads.iteritems():
+                if thread in self._to_start:
+                    continue  # not yet started
+                if not thread.is_alive():
+                    raise RuntimeError('%s thread %s died' % (self.uid, tname))
 
 
     # --------------------------------------------------------------------------
@@ -1176,82 +1552,110 @@ class Component(ru.Process):
 
         self.is_valid()
 
-        # if no action occurs in this iteration, idle
-        if not self._inputs:
+        if self._to_start:
+            with self._cb_lock:
+                for worker in self._to_start:
+                    worker.start()
+                    self.register_watchable(worker)
+                    self._session._to_stop.append(worker)
+                self._to_start = list()
+
+        # if no action occurs in this iteration, idle.  Inputs with worker
+        # threads are served by those.
+        inputs = [i for i in self._inputs.values() if i['queue']]
+        if not inputs:
             time.sleep(0.1)
             return True
 
-        for name in self._inputs:
-            input  = self._inputs[name]['queue']
-            states = self._inputs[name]['states']
+        for i in inputs:
+            if not self._work_on(i['queue'], i['states'], i['lock']):
+                return True
 
-            # FIXME: a simple, 1-thing caching mechanism would likely
-            #        remove the req/res overhead completely (for any
-            #        non-trivial worker).
-            things = input.get_nowait(1000) # timeout in microseconds
+        # keep work_cb registered
+        return True
 
-            if not things:
-                return True
 
-            if not isinstance(things, list):
-                things = [things]
+    # --------------------------------------------------------------------------
+    #
+    def _work_on(self, input, states, cb_lock):
+        """
+        Get things from the given input queue, and route them to the respective
+        worker methods.  Returns False if no things were received.
+        """
+
+        # FIXME: a simple, 1-thing caching mechanism would likely
+        #        remove the req/res overhead completely (for any
+        #        non-trivial worker).
+        things = input.get_nowait(1000) # timeout in microseconds
 
-            # the worker target depends on the state of things, so we 
-            # need to sort the things into buckets by state before 
-            # pushing them
-            buckets = dict()
-            for thing in things:
-                state = thing['state']
-                if not state in buckets:
-                    buckets[state] = list()
-                buckets[state].append(thing)
+        if not things:
+            return False
 
-            # We now can push bulks of things to the workers
+        if not isinstance(things, list):
+            things = [things]
 
-            for state,things in buckets.iteritems():
+        # the worker target depends on the state of things, so we 
+        # need to sort the things into buckets by state before 
+        # pushing them
+        buckets = dict()
+        for thing in things:
+            state = thing['state']
+            if not state in buckets:
+                buckets[state] = list()
+            buckets[state].append(thing)
+
+        # We now can push bulks of things to the workers
 
-                assert(state in states), 'inconsistent state'
-                assert(state in self._workers), 'no worker for state %s' % state
+        for state,things in buckets.iteritems():
 
-                try:
-                    to_cancel = list()
-                    for thing in things:
-                        uid   = thing['uid']
-                        ttype = thing['type']
-                        state = thing['state']
+            assert(state in states), 'inconsistent state'
+            assert(state in self._workers), 'no worker for state %s' % state
 
-                        # FIXME: this can become expensive over time
-                        #        if the cancel list is never cleaned
-                        if uid in self._cancel_list:
-                            with self._cancel_lock:
-                                self._cancel_list.remove(uid)
-                            to_cancel.append(thing)
+            try:
+                for thing in things:
+                    uid   = thing['uid']
+                    ttype = thing['type']
+                    state = thing['state']
 
-                        self._log.debug('got %s (%s)', ttype, uid)
-                        self._prof.prof(event='get', state=state, uid=uid, msg=input.name)
-                        self._prof.prof(event='work start', state=state, uid=uid)
+                    self._log.debug('got %s (%s)', ttype, uid)
+                    self._prof.prof(event='get', state=state, uid=uid, msg=input.name)
 
+                # things to be canceled are not passed on to the worker.  The
+                # cancel set is pruned when they are advanced to CANCELED.
+                if self._cancel_set:
+                    with self._cancel_lock:
+                        to_cancel = [thing for thing in things
+                                           if thing['uid'] in self._cancel_set]
                     if to_cancel:
-                        self.advance(to_cancel, rps.CANCELED, publish=True, push=False)
+                        canceled = set([thing['uid'] for thing in to_cancel])
+                        things   = [thing for thing in things
+                                          if thing['uid'] not in canceled]
+                        self.advance(to_cancel, rps.CANCELED, publish=True,
+                                     push=False)
+                        if not things:
+                            continue
 
-                    with self._cb_lock:
-                        self._workers[state](things)
+                for thing in things:
+                    self._prof.prof(event='work start', state=state,
+                                    uid=thing['uid'])
 
-                    for thing in things:
-                        self._prof.prof(event='work done ', state=state, uid=uid)
+                with cb_lock:
+                    self._workers[state](things)
 
-                except Exception as e:
-                    # this is not fatal -- only the 'things' fail, not
-                    # the component
+                for thing in things:
+                    self._prof.prof(event='work done ', state=state, uid=thing['uid'])
 
-                    self._log.exception("worker %s failed", self._workers[state])
-                    self.advance(things, rps.FAILED, publish=True, push=False)
+            except Exception as e:
+                # this is not fatal -- only the 'things' fail, not
+                # the component
 
-                    for thing in things:
-                        self._prof.prof(event='failed', msg=str(e), 
-                                        uid=thing['uid'], state=state)
+                self._log.exception("worker %s failed", self._workers[state])
+                self.advance(things, rps.FAILED, publish=True, push=False)
+
+                for thing in things:
+                    self._prof.prof(event='failed', msg=str(e), 
+                                    uid=thing['uid'], state=state)
 
-        # keep work_cb registered
         return True
 
     # --------------------------------------------------------------------------
@@ -1307,6 +1711,11 @@ class Component(ru.Process):
             self._log.debug('advance bulk: %s [%s]', uid, len(things))
             self._prof.prof('advance', uid=uid, state=thing['state'], timestamp=timestamp)
 
+            # cancel requests are moot once things are final
+            if self._cancel_set and thing['state'] in rps.FINAL:
+                with self._cancel_lock:
+                    self._cancel_set.discard(uid)
+
             if not thing['state'] in buckets:
                 buckets[thing['state']] = list()
             buckets[thing['state']].append(thing)
@@ -1314,19 +1723,26 @@ class Component(ru.Process):
         # should we publish state information on the state pubsub?
         if publish:
 
-            to_publish = list()
+            # the topic depends on the thing's owner (and pilot), which are not
+            # part of the published (partial) update, so we sort by topic here
+            shards     = self._cfg['bridges'][rpc.STATE_PUBSUB].get('shards', 1)
+            to_publish = dict()
 
             # If '$all' is set, we update the complete thing_dict.  
             # Things in final state are also published in full.
             # If '$set' is set, we also publish all keys listed in there.
             # In all other cases, we only send 'uid', 'type' and 'state'.
             for thing in things:
+                topic = get_state_topic(rpc.STATE_PUBSUB, thing, shards)
+                if topic not in to_publish:
+                    to_publish[topic] = list()
+
                 if '$all' in thing:
                     del(thing['$all'])
-                    to_publish.append(thing)
+                    to_publish[topic].append(thing)
 
                 elif thing['state'] in rps.FINAL:
-                    to_publish.append(thing)
+                    to_publish[topic].append(thing)
 
                 else:
                     tmp = {'uid'   : thing['uid'],
@@ -1334,9 +1750,11 @@ class Component(ru.Process):
                            'state' : thing['state']}
                     for key in thing.get('$set', []):
                         tmp[key] = thing[key]
-                    to_publish.append(tmp)
+                    to_publish[topic].append(tmp)
 
-            self.publish(rpc.STATE_PUBSUB, {'cmd': 'update', 'arg': to_publish})
+            for topic, updates in to_publish.iteritems():
+                self.publish(rpc.STATE_PUBSUB, {'cmd': 'update', 'arg': updates},
+                             topic=topic)
             ts = time.time()
             for thing in things:
                 self._prof.prof('publish', uid=thing['uid'], state=thing['state'], timestamp=ts)
@@ -1378,18 +1796,21 @@ class Component(ru.Process):
 
                 output = self._outputs[_state]
 
+                # never carry $all across component boundaries!  Inproc queues
+                # pass things by reference, so we can't touch them after put
+                for thing in _things:
+                    if '$all' in thing:
+                        del(thing['$all'])
+
                 # push the thing down the drain
                 # FIXME: we should assert that the things are in a PENDING state.
                 #        Better yet, enact the *_PENDING transition right here...
                 self._log.debug('put bulk %s: %s', _state, len(_things))
-                output.put(_things)
+                with self._io_locks[_state]:
+                    output.put(_things)
 
                 ts = time.time()
                 for thing in _things:
-                    
-                    # never carry $all across component boundaries!
-                    if '$all' in thing:
-                        del(thing['$all'])
 
                     uid = thing['uid']
 
@@ -1400,9 +1821,11 @@ class Component(ru.Process):
 
     # --------------------------------------------------------------------------
     #
-    def publish(self, pubsub, msg):
+    def publish(self, pubsub, msg, topic=None):
         """
-        push information into a publication channel
+        push information into a publication channel.  State updates are
+        published on the state topics of the things (see `get_state_topic()`),
+        all other messages on the given topic, which defaults to the pubsub name.
         """
 
         self.is_valid()
@@ -1413,7 +1836,29 @@ class Component(ru.Process):
         if not self._publishers[pubsub]:
             raise RuntimeError("no route for '%s' notification: %s" % (pubsub, msg))
 
-        self._publishers[pubsub].put(pubsub, msg)
+        if pubsub == rpc.STATE_PUBSUB and msg.get('cmd') == 'update' \
+                                       and not topic:
+
+            # partition the updates by topic.  The shard (if any) is part of the
+            # topic, so all updates for any one uid end up, in order, at the
+            # same update worker
+            shards = self._cfg['bridges'][pubsub].get('shards', 1)
+            parts  = dict()
+            for thing in msg['arg']:
+                t = get_state_topic(pubsub, thing, shards)
+                parts.setdefault(t, list()).append(thing)
+
+            with self._io_locks[pubsub]:
+                for t, things in parts.iteritems():
+                    self._publishers[pubsub].put(t, {'cmd': 'update',
+                                                     'arg': things})
+            return
+
+        if not topic:
+            topic = pubsub
+
+        with self._io_locks[pubsub]:
+            self._publishers[pubsub].put(topic, msg)
 
 
 
@@ -1,15 +1,24 @@
 
 import os
 import sys
+import json
 import time
+import sqlite3
+import calendar
 import datetime
+import collections
 import pymongo
 
 import radical.utils as ru
 from   radical.pilot.states import *
 
 
-_CACHE_BASEDIR = '/tmp/rp_cache_%d/' % os.getuid ()
+_CACHE_BASEDIR   = '/tmp/rp_cache_%d/' % os.getuid ()
+_CACHE_TIMEOUT   = 60.0   # seconds to wait for a locked cache
+_CACHE_HWM_SLACK =  1.0   # seconds to re-fetch before the high-water mark
+
+# unit docs and high-water marks of caches we used before, by cache file
+_cache_units = dict()
 
 
 # ------------------------------------------------------------------------------
@@ -40,7 +49,9 @@ def bson2json (bson_data) :
 def get_session_ids(db) :
 
     # this is not bein cashed, as the session list can and will change freqently
-    return db.collection_names(include_system_collections=False)
+    # NOTE: we skip the state event collections which accompany the sessions
+    return [name for name in db.collection_names(include_system_collections=False)
+                 if not name.endswith('.events')]
 
 
 # ------------------------------------------------------------------------------
@@ -51,30 +62,97 @@ def get_last_session(db) :
     return get_session_ids(db)[-1]
 
 
+# ------------------------------------------------------------------------------
+def _mtime2epoch(mtime) :
+
+    # '_mtime' is set by the database server, as naive UTC datetime
+    return calendar.timegm(mtime.utctimetuple()) + mtime.microsecond / 1000000.0
+
+
+# ------------------------------------------------------------------------------
+def _read_cache(cache) :
+
+    # read the unit docs and the high-water mark from a session cache
+    units = collections.OrderedDict()
+    hwm   = None
+
+    if  not os.path.isfile(cache) :
+        return units, hwm
+
+    conn = sqlite3.connect(cache, timeout=_CACHE_TIMEOUT)
+    try :
+        for uid, doc in conn.execute('SELECT uid, doc FROM units ORDER BY rowid') :
+            units[uid] = ru.parse_json(doc)
+        for value, in conn.execute("SELECT value FROM meta WHERE key = 'hwm'") :
+            hwm = float(value)
+    finally :
+        conn.close()
+
+    return units, hwm
+
+
+# ------------------------------------------------------------------------------
+def _write_cache(cache, units, hwm) :
+
+    # store the given unit docs and the high-water mark in the session cache.
+    # Docs are updated in place, so that the unit order is kept.
+    conn = sqlite3.connect(cache, timeout=_CACHE_TIMEOUT)
+    try :
+        with conn :
+            conn.execute('CREATE TABLE IF NOT EXISTS units '
+                         '(uid TEXT PRIMARY KEY, doc TEXT)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                         '(key TEXT PRIMARY KEY, value TEXT)')
+            for unit in units :
+                doc = json.dumps(unit)
+                cur = conn.execute('UPDATE units SET doc = ? WHERE uid = ?',
+                                   (doc, unit['uid']))
+                if  not cur.rowcount :
+                    conn.execute('INSERT INTO units (uid, doc) VALUES (?, ?)',
+                                 (unit['uid'], doc))
+            if  hwm is not None :
+                conn.execute('INSERT OR REPLACE INTO meta (key, value) '
+                             "VALUES ('hwm', ?)", (repr(hwm),))
+    finally :
+        conn.close()
+
+
 # ------------------------------------------------------------------------------
 def get_session_docs(db, sid, cache=None, cachedir=None) :
 
-    # session docs may have been cached in /tmp/rp_cache_<uid>/<sid>.json -- in that
-    # case we pull it from there instead of the database, which will be much
-    # quicker.  Also, we do cache any retrieved docs to that place, for later
-    # use.  An optional cachdir parameter changes that default location for
-    # lookup and storage.
+    # session docs are cached in /tmp/rp_cache_<uid>/<sid>.db.  The small doc
+    # types (session, managers, pilots) are always pulled from the database,
+    # but unit docs are only pulled if they changed since the last call, as
+    # recorded by the high-water mark of their '_mtime' fields.  The cache can
+    # thus be used on live sessions.  An optional cachedir parameter changes
+    # the default location for lookup and storage.
+    #
+    # An explicitly given cache file with a full session snapshot, as written
+    # by earlier versions, is used instead of the database.
+    if  cache and cache.endswith('.json') :
+        try :
+            if  os.path.isfile (cache) :
+                return ru.read_json (cache)
+        except Exception as e :
+            # continue w/o cache
+            sys.stderr.write ("warning: cannot read session cache at %s (%s)\n" % (cache, e))
+
     if  not cachedir :
         cachedir = _CACHE_BASEDIR
 
-    if  not cache :
-        cache = "%s/%s.json" % (cachedir, sid)
-
-    try :
-        if  os.path.isfile (cache) :
-          # print 'using cache: %s' % cache
-            return ru.read_json (cache)
-    except Exception as e :
-        # continue w/o cache
-        sys.stderr.write ("warning: cannot read session cache at %s (%s)\n" % (cache, e))
+    if  not cache or cache.endswith('.json') :
+        cache = "%s/%s.db" % (cachedir, sid)
 
+    if  cache in _cache_units :
+        units, hwm = _cache_units[cache]
+    else :
+        try :
+            units, hwm = _read_cache(cache)
+        except Exception as e :
+            # continue w/o cache
+            sys.stderr.write ("warning: cannot read session cache at %s (%s)\n" % (cache, e))
+            units, hwm = collections.OrderedDict(), None
 
-    # cache not used or not found -- go to db
     json_data = dict()
 
     # convert bson to json, i.e. serialize the ObjectIDs into strings.
@@ -82,7 +160,6 @@ def get_session_docs(db, sid, cache=None, cachedir=None) :
     json_data['pmgr'   ] = bson2json(list(db[sid].find({'type' : 'pmgr'   })))
     json_data['pilot'  ] = bson2json(list(db[sid].find({'type' : 'pilot'  })))
     json_data['umgr'   ] = bson2json(list(db[sid].find({'type' : 'umgr'   })))
-    json_data['unit'   ] = bson2json(list(db[sid].find({'type' : 'unit'   })))
 
     if  len(json_data['session']) == 0 :
         raise ValueError ('no session %s in db (was `cleanup` disabled on `session.close()`?)' % sid)
@@ -93,24 +170,57 @@ def get_session_docs(db, sid, cache=None, cachedir=None) :
     # there can only be one session, not a list of one
     json_data['session'] = json_data['session'][0]
 
-    # we want to add a list of handled units to each pilot doc
-    for pilot in json_data['pilot'] :
+    # sessions created by older versions have no modification times on their
+    # docs.  We pull those units once, and then rely on the cache.
+    if  '_mtime' not in json_data['session'] :
+        if  units :
+            spec = None
+        else :
+            spec = {'type' : 'unit'}
+
+    # units which have not been updated yet have no modification time, and
+    # are always pulled.  We go back a bit beyond the high-water mark, to
+    # be safe against concurrent updates.
+    elif hwm is not None :
+        since = datetime.datetime.utcfromtimestamp(hwm - _CACHE_HWM_SLACK)
+        spec  = {'type' : 'unit',
+                 '$or'  : [{'_mtime' : {'$gte'    : since}},
+                           {'_mtime' : {'$exists' : False}}]}
+    else :
+        spec = {'type' : 'unit'}
+
+    changed = list()
+    if  spec :
+        docs = list(db[sid].find(spec))
+        for doc in docs :
+            if  '_mtime' in doc :
+                mtime = _mtime2epoch(doc['_mtime'])
+                if  hwm is None or mtime > hwm :
+                    hwm = mtime
+        changed = bson2json(docs)
+
+    for unit in changed :
+        units[unit['uid']] = unit
+
+    json_data['unit'] = units.values()
 
-        pilot['unit_ids'] = list()
-
-        for unit in json_data['unit'] :
-
-            if  unit['pilot'] == pilot['uid']:
-                pilot['unit_ids'].append (unit['uid'])
+    # we want to add a list of handled units to each pilot doc
+    unit_ids = dict()
+    for unit in json_data['unit'] :
+        unit_ids.setdefault(unit['pilot'], list()).append(unit['uid'])
 
-    # if we got here, we did not find a cached version -- thus add this dataset
-    # to the cache
-    try :
-        os.system ('mkdir -p %s' % cachedir)
-        ru.write_json (json_data, "%s/%s.json" % (cachedir, sid))
-    except Exception as e :
-        # we can live without cache, no problem...
-        pass
+    for pilot in json_data['pilot'] :
+        pilot['unit_ids'] = unit_ids.get(pilot['uid'], list())
+
+    # add the changed docs to the cache
+    _cache_units[cache] = [units, hwm]
+    if  changed :
+        try :
+            os.system ('mkdir -p %s' % cachedir)
+            _write_cache(cache, changed, hwm)
+        except Exception as e :
+            # we can live without cache, no problem...
+            pass
 
     return json_data
 
@@ -127,7 +237,8 @@ def get_session_slothist(db, sid, cache=None, cachedir=None) :
       tuple (string  , list (tuple (string  , int    ) ), list (tuple (string   , datetime ) ) )
     """
 
-    docs = get_session_docs(db, sid, cache, cachedir)
+    docs  = get_session_docs(db, sid, cache, cachedir)
+    units = dict([[unit['uid'], unit] for unit in docs['unit']])
 
     ret = dict()
 
@@ -152,30 +263,30 @@ def get_session_slothist(db, sid, cache=None, cachedir=None) :
                 slot_infos  [slot_name] = list()
                 slot_started[slot_name] = sys.maxint
 
-        for unit_doc in docs['unit'] :
-            if unit_doc['pilot'] == pilot_doc['uid'] :
-
-                started  = None
-                finished = None
-                for event in sorted (unit_doc['state_history'], 
-                                     key=lambda x: x['timestamp']) :
-                    if started :
-                        finished = event['timestamp']
-                        break
-                    if event['state'] == AGENT_EXECUTING :
-                        started = event['timestamp']
-
-                if not started or not finished :
-                  # print "no start/finish for cu %s - ignored" % unit_doc['uid']
+        for uid in pilot_doc['unit_ids'] :
+            unit_doc = units[uid]
+
+            started  = None
+            finished = None
+            for event in sorted (unit_doc['state_history'], 
+                                 key=lambda x: x['timestamp']) :
+                if started :
+                    finished = event['timestamp']
+                    break
+                if event['state'] == AGENT_EXECUTING :
+                    started = event['timestamp']
+
+            if not started or not finished :
+              # print "no start/finish for cu %s - ignored" % unit_doc['uid']
+                continue
+
+            for slot_id in unit_doc['slots'] :
+                if slot_id not in slot_infos :
+                  # print "slot %s for pilot %s unknown - ignored" % (slot_id, pilot_id)
                     continue
-
-                for slot_id in unit_doc['slots'] :
-                    if slot_id not in slot_infos :
-                      # print "slot %s for pilot %s unknown - ignored" % (slot_id, pilot_id)
-                        continue
                     
-                    slot_infos[slot_id].append([started, finished])
-                    slot_started[slot_id] = min(started, slot_started[slot_id])
+                slot_infos[slot_id].append([started, finished])
+                slot_started[slot_id] = min(started, slot_started[slot_id])
 
         for slot_id in slot_infos :
             slot_infos[slot_id].sort(key=lambda x: float(x[0]))
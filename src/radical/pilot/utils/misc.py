@@ -3,6 +3,7 @@ import os
 import sys
 import copy
 import time
+import Queue
 import errno
 import datetime
 import pymongo
@@ -67,6 +68,18 @@ def rec_makedir(target):
             raise
 
 
+# ------------------------------------------------------------------------------
+#
+def generate_id_block(prefix, n, mode=ru.ID_CUSTOM):
+    """
+    Generate a list of `n` IDs via `ru.generate_id(prefix, mode)`.  The IDs are
+    only consecutive if no other thread generates IDs for the same prefix at
+    the same time.
+    """
+
+    return [ru.generate_id(prefix, mode) for _ in xrange(n)]
+
+
 # ------------------------------------------------------------------------------
 #
 _hostip = None
@@ -156,5 +169,188 @@ def hostip(req=None, black_list=None, pref_list=None, logger=None):
     return ip
 
 
-# ----------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+#
+class StateWaiter(object):
+    """
+    Waits for a set of things (units or pilots) to reach one of the given
+    states, or any final state.  The manager owning the things calls `notify()`
+    on every state transition, and ticks things off that way.  Waiting threads
+    block until a thing is ticked off -- nobody polls, and nobody rescans the
+    set of things.
+    """
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, uids, states):
+
+        self._pending = set(uids)
+        self._states  = set(states) | set(FINAL)
+        self._queue   = Queue.Queue()
+        self._n       = len(self._pending)
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def pending(self):
+        """
+        Number of things not yet returned to the waiting thread.
+        """
+
+        return self._n
+
+
+    # --------------------------------------------------------------------------
+    #
+    def notify(self, thing, state):
+        """
+        Tick off the given thing if it is waited for, and has reached one of the
+        waited-for states.  Should be called with the manager's lock held, so
+        that no state transition gets lost while a waiter is set up.
+        """
+
+        if thing.uid in self._pending and state in self._states:
+            self._pending.remove(thing.uid)
+            self._queue.put(thing)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def wake(self):
+        """
+        Make waiting threads return, even if things are still pending.
+        """
+
+        self._queue.put(None)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def __iter__(self):
+        """
+        Yield the things as they are ticked off, until all are (or until
+        `wake()` is called).
+        """
+
+        while self._n:
+
+            thing = self._queue.get()
+            if thing is None:
+                return
+
+            self._n -= 1
+            yield thing
+
+
+    # --------------------------------------------------------------------------
+    #
+    def iterate(self, timeout=None):
+        """
+        Like `__iter__`, but stop after `timeout` seconds.
+        """
+
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, self.wake)
+            timer.daemon = True
+            timer.start()
+
+        try:
+            for thing in self:
+                yield thing
+        finally:
+            if timer:
+                timer.cancel()
+
+
+# ------------------------------------------------------------------------------
+#
+class CallbackDispatcher(object):
+    """
+    Runs callbacks on a set of worker threads, so that slow callbacks don't
+    stall the thread which dispatches them (usually the one ingesting state
+    updates).  Each call is dispatched with a key (like a unit uid), and all
+    calls with the same key run on the same thread, in dispatch order.  With
+    zero threads, calls run right away, in the dispatching thread.
+
+    Exceptions raised by callbacks are logged and otherwise ignored.
+    """
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, n_threads, log, name='cb'):
+
+        self._log     = log
+        self._queues  = list()
+        self._threads = list()
+
+        for i in range(n_threads):
+
+            queue  = Queue.Queue()
+            thread = threading.Thread(target=self._work, args=[queue],
+                                      name='%s.%04d' % (name, i))
+            thread.daemon = True
+            thread.start()
+
+            self._queues.append(queue)
+            self._threads.append(thread)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def dispatch(self, key, call, *args):
+
+        if not self._queues:
+            self._call(call, args)
+
+        else:
+            idx = hash(key) % len(self._queues)
+            self._queues[idx].put([call, args])
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _call(self, call, args):
+
+        try:
+            call(*args)
+        except Exception:
+            self._log.exception('callback %s failed', call)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _work(self, queue):
+
+        while True:
+
+            item = queue.get()
+            if item is None:
+                break
+
+            self._call(*item)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def stop(self):
+        """
+        Run all calls dispatched so far, then stop the worker threads.
+        """
+
+        for queue in self._queues:
+            queue.put(None)
+
+        # callbacks may well stop the dispatcher they run on
+        current = threading.current_thread()
+        for thread in self._threads:
+            if thread is not current:
+                thread.join()
+
+        self._queues  = list()
+        self._threads = list()
+
+
+# ------------------------------------------------------------------------------
 
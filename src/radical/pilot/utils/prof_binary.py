@@ -0,0 +1,626 @@
+
+__copyright__ = "Copyright 2016, http://radical.rutgers.edu"
+__license__   = "MIT"
+
+
+import os
+import csv
+import json
+import mmap
+import time
+import atexit
+import signal
+import struct
+import weakref
+import threading
+
+import radical.utils as ru
+
+
+# ------------------------------------------------------------------------------
+#
+# Binary profiles are a compact alternative to the CSV profiles written by
+# `ru.Profiler`, and can be loaded without parsing.
+#
+# A binary profile (`<name>.bprof`) is a sequence of self-contained chunks which
+# are only ever appended.  A chunk consists of
+#
+#   - a header  : magic, number and size of the interned strings, number of
+#                 records, number of uids, and min / max time of the records
+#   - strings   : the strings used in this chunk, '\0' separated
+#   - uids      : the string ids of all uids recorded in this chunk (uint32)
+#   - records   : fixed-width records: the time (float64), and the string ids
+#                 of event, comp, thread, uid, state and msg (uint32)
+#
+# All sections are padded to 8 bytes.  A chunk is written in a single `write()`
+# to a file opened in append mode, so that several writers can share
+# a profile, as they can for CSV profiles.
+#
+# The chunk headers are an index of the profile by uid and time.  Readers cache
+# that index in `<name>.bprof.idx`, and use it to only touch the chunks they
+# need.
+#
+BPROF_EXT     = '.bprof'
+BPROF_IDX_EXT = '.idx'
+BPROF_MAGIC   = 'RPBC'
+BPROF_CHUNK   = 1024      # records per chunk for profilers
+BPROF_FLUSH   = 3.0       # max. seconds a profiler buffers records
+
+_fields = ru.Profiler.fields
+_header = struct.Struct('<4sIIIIIdd')    # magic, n_strings, strings size,
+                                         # n_records, n_uids, (unused),
+                                         # t_min, t_max
+_record = struct.Struct('<dIIIIII')      # time, event, comp, thread, uid,
+                                         # state, msg
+
+
+def _pad(size):
+    return (8 - size % 8) % 8
+
+
+def _str(val):
+    if val is None             : return ''
+    if isinstance(val, unicode): return val.encode('utf-8')
+    return str(val).replace('\0', '')
+
+
+# ------------------------------------------------------------------------------
+#
+# Writers with a flush interval are flushed by a daemon thread, so that records
+# don't linger in the buffer of an idle writer.  They are also flushed on exit
+# and on SIGTERM.  Only writers created by the current process are flushed: a
+# forked child also inherits the buffers of its parent.
+#
+_writers       = weakref.WeakSet()
+_writers_lock  = threading.RLock()  # SIGTERM may hit `_register_writer()`
+_flusher_pid   = None
+_hooked        = False  # exit and SIGTERM handlers are installed
+_sigterm_prev  = None
+
+
+def _flush_writers(stale=False):
+
+    with _writers_lock:
+        writers = list(_writers)
+
+    for writer in writers:
+        if writer._pid == os.getpid():
+            try:
+                writer.flush(stale=stale)
+            except Exception:
+                pass  # profiles are best effort
+
+
+def _flusher():
+
+    while True:
+        time.sleep(1.0)
+        _flush_writers(stale=True)
+
+
+def _on_sigterm(signum, frame):
+
+    _flush_writers()
+
+    # pass the signal on to the previous handler, or apply the default action
+    if callable(_sigterm_prev):
+        _sigterm_prev(signum, frame)
+
+    elif _sigterm_prev != signal.SIG_IGN:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+def _register_writer(writer):
+
+    global _flusher_pid, _hooked, _sigterm_prev
+
+    with _writers_lock:
+
+        _writers.add(writer)
+
+        if _flusher_pid == os.getpid():
+            return
+
+        # first writer in this process
+        _flusher_pid   = os.getpid()
+        thread         = threading.Thread(target=_flusher, name='bprof.flusher')
+        thread.daemon  = True
+        thread.start()
+
+        # forked children inherit the handlers
+        if not _hooked:
+            _hooked = True
+            atexit.register(_flush_writers)
+            try:
+                _sigterm_prev = signal.signal(signal.SIGTERM, _on_sigterm)
+            except ValueError:
+                # python only supports signals in main threads
+                pass
+
+
+# ------------------------------------------------------------------------------
+#
+class BinaryProfileWriter(object):
+    """
+    Collects profile records, and appends them to a binary profile in chunks of
+    `chunk_size` records.  If a `flush_interval` is given, records are written
+    at the latest after that many seconds (give or take a second), and when the
+    process exits or receives SIGTERM.  This class is thread safe.
+    """
+
+    def __init__(self, fname, chunk_size=BPROF_CHUNK, flush_interval=None):
+
+        self._fname          = fname
+        self._chunk_size     = chunk_size
+        self._flush_interval = flush_interval
+        self._flushed        = time.time()
+        self._records        = list()
+        self._writing        = False
+        self._lock           = threading.RLock()  # SIGTERM may hit `write()`
+        self._pid            = os.getpid()
+        self._fd             = os.open(fname,
+                                       os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                                       0o644)
+
+        if flush_interval:
+            _register_writer(self)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def fileno(self):
+
+        return self._fd
+
+
+    # --------------------------------------------------------------------------
+    #
+    def write(self, time, event, comp, thread, uid, state, msg):
+
+        with self._lock:
+            self._records.append([float(time), event, comp, thread, uid,
+                                  state, msg])
+            if len(self._records) >= self._chunk_size:
+                self._write_chunk()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def flush(self, stale=False):
+        """
+        Write all buffered records -- if `stale` is set, only if the last write
+        is longer ago than the flush interval.
+        """
+
+        with self._lock:
+            if stale:
+                if not self._flush_interval:
+                    return
+                if time.time() - self._flushed < self._flush_interval:
+                    return
+            self._write_chunk()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+
+        with self._lock:
+            if self._fd is None:
+                return
+            self._write_chunk()
+            os.close(self._fd)
+            self._fd = None
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _write_chunk(self):
+
+        # a chunk interrupted by SIGTERM is completed by the interrupted call
+        if self._writing:
+            return
+
+        if not self._records or self._fd is None:
+            self._flushed = time.time()
+            return
+
+        self._writing = True
+        try:
+            self._write_records()
+        finally:
+            self._writing = False
+            self._flushed = time.time()
+
+
+    def _write_records(self):
+
+        records       = self._records
+        self._records = list()
+
+        strings = dict()   # string -> id
+        uids    = set()    # ids of uids
+        data    = list()
+
+        for rec in records:
+            ids = [strings.setdefault(_str(s), len(strings)) for s in rec[1:]]
+            if rec[4]:
+                uids.add(ids[3])
+            data.append(_record.pack(rec[0], *ids))
+
+        table    = sorted(strings, key=strings.get)
+        strtab   = '\0'.join(table)
+        strtab  += '\0' * _pad(len(strtab))
+        uids     = sorted(uids)
+        uidtab   = struct.pack('<%dI' % len(uids), *uids)
+        uidtab  += '\0' * _pad(len(uidtab))
+        times    = [rec[0] for rec in records]
+
+        chunk = _header.pack(BPROF_MAGIC, len(table), len(strtab),
+                             len(records), len(uids), 0,
+                             min(times), max(times)) \
+              + strtab + uidtab + ''.join(data)
+
+        while chunk:
+            n     = os.write(self._fd, chunk)
+            chunk = chunk[n:]
+
+
+# ------------------------------------------------------------------------------
+#
+class BinaryProfiler(ru.Profiler):
+    """
+    A drop-in replacement for `ru.Profiler` which writes a binary profile.  It
+    is enabled by the same env variables.  Events are written in chunks, so
+    only `flush()` and `close()` make sure that all events are on disk -- but
+    they are not buffered for longer than `BPROF_FLUSH` seconds.
+    """
+
+    def __init__(self, name, ns=None, path=None):
+
+        if not ns:
+            ns = name
+
+        # check if this profile is enabled via an env variable
+        if ru.get_env_ns('profile', ns) is None:
+            self._enabled = False
+            return
+
+        self._enabled = True
+        self._path    = path
+        self._name    = name
+
+        if not self._path:
+            self._path = os.getcwd()
+
+        self._ts_zero, self._ts_abs, self._ts_mode = self._timestamp_init()
+
+        try:
+            os.makedirs(self._path)
+        except OSError:
+            pass  # already exists
+
+        self._handle = BinaryProfileWriter("%s/%s%s"
+                                           % (self._path, self._name, BPROF_EXT),
+                                           flush_interval=BPROF_FLUSH)
+
+        # write time normalization info
+        self._handle.write(self.timestamp(), 'sync_abs', self._name,
+                           ru.get_thread_name(), '', '',
+                           "%s:%s:%s:%s:%s" % (ru.get_hostname(),
+                                               ru.get_hostip(),
+                                               self._ts_zero,
+                                               self._ts_abs,
+                                               self._ts_mode))
+
+
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+
+        if self._enabled and self._handle:
+            self.prof("END")
+            self._handle.close()
+            self._handle = None
+
+
+    # --------------------------------------------------------------------------
+    #
+    def flush(self, verbose=True):
+
+        if not self._enabled: return
+        if not self._handle : return
+
+        if verbose:
+            self.prof("flush")
+
+        self._handle.flush()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def prof(self, event, uid=None, state=None, msg=None, timestamp=None,
+             comp=None, tid=None):
+
+        if not self._enabled: return
+        if not self._handle : return
+
+        if timestamp is None: timestamp = self.timestamp()
+        if comp      is None: comp      = self._name
+        if tid       is None: tid       = ru.get_thread_name()
+
+        # if uid is a list, then recursively call self.prof for each uid given
+        if isinstance(uid, list):
+            for _uid in uid:
+                self.prof(event=event, uid=_uid, state=state, msg=msg,
+                          timestamp=timestamp, comp=comp, tid=tid)
+            return
+
+        self._handle.write(timestamp, event, comp, tid, uid, state, msg)
+
+
+# ------------------------------------------------------------------------------
+#
+class BinaryProfile(object):
+    """
+    Read access to a binary profile.  The profile is memory mapped, and only the
+    chunks which can contain matching records are decoded when the profile is
+    queried for a set of uids and / or a time range.
+    """
+
+    def __init__(self, fname):
+
+        self._fname = fname
+        self._size  = os.path.getsize(fname)
+        self._mm    = None
+
+        if self._size:
+            with open(fname, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), self._size,
+                                     access=mmap.ACCESS_READ)
+
+        self._chunks = self._load_index()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+
+        if self._mm:
+            self._mm.close()
+            self._mm = None
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def uids(self):
+
+        ret = set()
+        for chunk in self._chunks:
+            ret.update(chunk[4])
+        return ret
+
+
+    # --------------------------------------------------------------------------
+    #
+    def __len__(self):
+
+        return sum([chunk[1] for chunk in self._chunks])
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _load_index(self):
+        """
+        Load the cached index, and extend it by all chunks which have been
+        appended since it was written.  An index entry is
+
+            [offset, n_records, t_min, t_max, uids]
+        """
+
+        fidx   = self._fname + BPROF_IDX_EXT
+        chunks = list()
+        offset = 0
+
+        try:
+            with open(fidx, 'r') as f:
+                idx = json.load(f)
+            if idx['size'] <= self._size:
+                chunks = idx['chunks']
+                offset = idx['size']
+        except Exception:
+            pass  # no (usable) index
+
+        if offset == self._size:
+            return chunks
+
+        while offset + _header.size <= self._size:
+
+            magic, n_strings, s_strings, n_records, n_uids, _, t_min, t_max \
+                    = _header.unpack_from(self._mm, offset)
+
+            s_uids = n_uids * 4 + _pad(n_uids * 4)
+            end    = offset + _header.size + s_strings + s_uids \
+                            + n_records * _record.size
+
+            # a chunk may still be in the process of being written
+            if magic != BPROF_MAGIC or end > self._size:
+                break
+
+            table = self._strings(offset, n_strings, s_strings)
+            uids  = struct.unpack_from('<%dI' % n_uids, self._mm,
+                                       offset + _header.size + s_strings)
+
+            chunks.append([offset, n_records, t_min, t_max,
+                           [table[uid] for uid in uids]])
+            offset = end
+
+        try:
+            with open(fidx, 'w') as f:
+                json.dump({'size' : offset, 'chunks' : chunks}, f)
+        except Exception:
+            pass  # index is a cache only
+
+        return chunks
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _strings(self, offset, n_strings, s_strings):
+
+        start = offset + _header.size
+        return self._mm[start:start + s_strings].split('\0')[:n_strings]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _select(self, uids, t_min, t_max):
+        """
+        find the chunks which can contain records for the given uids and time
+        range, and return them along with their string tables and the offset
+        of their records.
+        """
+
+        if uids is not None:
+            uids = set(uids)
+
+        for offset, n_records, c_min, c_max, c_uids in self._chunks:
+
+            if t_min is not None and c_max < t_min: continue
+            if t_max is not None and c_min > t_max: continue
+            if uids  is not None and not uids.intersection(c_uids): continue
+
+            _, n_strings, s_strings, _, n_uids, _, _, _ \
+                    = _header.unpack_from(self._mm, offset)
+
+            table = self._strings(offset, n_strings, s_strings)
+            start = offset + _header.size + s_strings \
+                           + n_uids * 4 + _pad(n_uids * 4)
+
+            yield table, start, n_records
+
+
+    # --------------------------------------------------------------------------
+    #
+    def rows(self, uids=None, t_min=None, t_max=None):
+        """
+        Return all matching records as a list of dicts, in the same format as
+        `read_profiles()` does for CSV profiles.
+        """
+
+        if uids is not None:
+            uids = set(uids)
+
+        ret = list()
+        for table, start, n_records in self._select(uids, t_min, t_max):
+
+            for i in range(n_records):
+
+                rec = _record.unpack_from(self._mm, start + i * _record.size)
+                row = dict(zip(_fields, [rec[0]] + [table[s] for s in rec[1:]]))
+
+                if t_min is not None and row['time'] < t_min: continue
+                if t_max is not None and row['time'] > t_max: continue
+                if uids  is not None and row['uid'] not in uids: continue
+
+                ret.append(row)
+
+        return ret
+
+
+    # --------------------------------------------------------------------------
+    #
+    def frame(self, uids=None, t_min=None, t_max=None):
+        """
+        Return all matching records as a pandas frame, in the same format as
+        `read_profile_frame()` does for CSV profiles (but w/o `prof` column).
+        The records are read directly from the memory map.
+        """
+
+        import numpy  as np
+        import pandas as pd
+
+        dtype = np.dtype([('time', '<f8')] + [(f, '<u4') for f in _fields[1:]])
+
+        if uids is not None:
+            uids = set(uids)
+
+        strings = dict()   # string -> id over all chunks
+        columns = dict([[f, list()] for f in _fields])
+
+        for table, start, n_records in self._select(uids, t_min, t_max):
+
+            recs  = np.frombuffer(self._mm, dtype=dtype, count=n_records,
+                                  offset=start)
+            remap = np.array([strings.setdefault(s, len(strings))
+                              for s in table], dtype=np.int32)
+            mask  = np.ones(n_records, dtype=bool)
+
+            if t_min is not None: mask &= recs['time'] >= t_min
+            if t_max is not None: mask &= recs['time'] <= t_max
+            if uids  is not None: mask &= np.in1d(recs['uid'],
+                                      [i for i, s in enumerate(table) if s in uids])
+
+            recs = recs[mask]
+            columns['time'].append(recs['time'])
+            for f in _fields[1:]:
+                columns[f].append(remap[recs[f]])
+
+        table = sorted(strings, key=strings.get)
+        data  = dict()
+
+        for f in _fields:
+
+            if columns[f]: col = np.concatenate(columns[f])
+            elif f == 'time': col = np.zeros(0, dtype=float)
+            else            : col = np.zeros(0, dtype=np.int32)
+
+            if   f == 'time': data[f] = col
+            elif f == 'msg' : data[f] = np.array(table, dtype=object)[col]
+            else            : data[f] = pd.Categorical.from_codes(col, table) \
+                                          .remove_unused_categories()
+
+        return pd.DataFrame(data, columns=_fields)
+
+
+# ------------------------------------------------------------------------------
+#
+def convert_profile(src, tgt=None, chunk_size=65536):
+    """
+    Convert a CSV profile into a binary profile, and return the name of the
+    binary profile.  `tgt` defaults to `src` with a `.bprof` extension, and is
+    overwritten if it exists.
+    """
+
+    if not tgt:
+        tgt = os.path.splitext(src)[0] + BPROF_EXT
+
+    for fname in [tgt, tgt + BPROF_IDX_EXT]:
+        if os.path.exists(fname):
+            os.unlink(fname)
+
+    writer = BinaryProfileWriter(tgt, chunk_size=chunk_size)
+
+    with open(src, 'r') as csvfile:
+        for row in csv.reader(csvfile):
+
+            # skip header and empty lines
+            if not row or row[0].startswith('#'):
+                continue
+
+            # pad incomplete rows
+            row += [''] * (len(_fields) - len(row))
+            writer.write(*row[:len(_fields)])
+
+    writer.close()
+
+    # create the index
+    BinaryProfile(tgt).close()
+
+    return tgt
+
+
+# ------------------------------------------------------------------------------
+
@@ -5,10 +5,13 @@ import copy
 import glob
 import time
 import threading
+import multiprocessing
 
 import radical.utils               as ru
 from   radical.pilot import states as rps
 
+from .prof_binary import BinaryProfile, BPROF_EXT
+
 
 # ------------------------------------------------------------------------------
 #
@@ -27,6 +30,13 @@ NTP_DIFF_WARN_LIMIT = 1.0
 _prof_fields  = ['time', 'name', 'uid', 'state', 'event', 'msg']
 
 
+# ------------------------------------------------------------------------------
+#
+def _is_agent_0(pname):
+
+    return 'agent_0.prof' in pname or 'agent_0%s' % BPROF_EXT in pname
+
+
 # ------------------------------------------------------------------------------
 #
 def prof2frame(prof):
@@ -133,11 +143,19 @@ def read_profiles(profiles):
     """
     We read all profiles as CSV files and parse them.  For each profile,
     we back-calculate global time (epoch) from the synch timestamps.
+    Binary profiles (`*.bprof`) are read from their memory map.
     """
     ret    = dict()
     fields = ru.Profiler.fields
 
     for prof in profiles:
+
+        if prof.endswith(BPROF_EXT):
+            bprof     = BinaryProfile(prof)
+            ret[prof] = bprof.rows()
+            bprof.close()
+            continue
+
         rows = list()
         with open(prof, 'r') as csvfile:
             reader = csv.DictReader(csvfile, fieldnames=fields)
@@ -233,6 +251,7 @@ def combine_profiles(profs):
 
       # print 'store time sync %-35s (%-35s) %6.1f' \
       #         % (os.path.basename(pname), host_id, t_off)
+        t_host[host_id] = t_off
 
     unsynced = set()
     for pname, prof in profs.iteritems():
@@ -269,7 +288,7 @@ def combine_profiles(profs):
             if row['event'] == 'QED':
                 c_qed += 1
 
-            if 'agent_0.prof' in pname    and \
+            if _is_agent_0(pname)         and \
                 row['event'] == 'advance' and \
                 row['state'] == rps.PMGR_ACTIVE:
                 hostmap[row['uid']] = host_id
@@ -401,6 +420,237 @@ def clean_profile(profile, sid):
     return ret
 
 
+# ------------------------------------------------------------------------------
+#
+# The methods below are the columnar equivalents of `read_profiles()`,
+# `combine_profiles()` and `clean_profile()`: all profiles live in a single
+# pandas frame, with categorical columns for the (highly repetitive) string
+# fields.  They need pandas, and are considerably faster and leaner for large
+# sessions.  `frame2prof()` converts the result back into a list of event dicts,
+# as the methods above produce.
+#
+# Rows with the same timestamp are kept in profile order (in the order of the
+# profiles passed to `read_profile_frame()`), and in file order within
+# a profile.  Incomplete profile rows get empty strings for missing fields.
+#
+_prof_categories = ['event', 'comp', 'thread', 'uid', 'state']
+
+
+# ------------------------------------------------------------------------------
+#
+def _read_profile_frame(pname):
+    """
+    parse a single profile into a frame -- this runs in the worker processes
+    of `read_profile_frame()`.
+    """
+
+    import pandas as pd
+
+    fields = ru.Profiler.fields
+
+    if pname.endswith(BPROF_EXT):
+        bprof = BinaryProfile(pname)
+        frame = bprof.frame()
+        bprof.close()
+        return frame
+
+    try:
+        frame = pd.read_csv(pname, header=None, names=fields, dtype=str,
+                            na_filter=False, index_col=False)
+    except pd.errors.EmptyDataError:
+        frame = pd.DataFrame(columns=fields)
+
+    # skip header
+    frame = frame[~frame['time'].str.startswith('#')].copy()
+
+    frame['time'] = frame['time'].astype(float)
+    for col in _prof_categories:
+        frame[col] = frame[col].astype('category')
+
+    return frame
+
+
+# ------------------------------------------------------------------------------
+#
+def read_profile_frame(profiles, procs=None):
+    """
+    Read all given profiles into a single frame, parsing them in `procs`
+    processes (default: one per CPU).  The frame has the columns of
+    `ru.Profiler.fields`, plus a `prof` column which names the profile each
+    row originates from.
+    """
+
+    import numpy  as np
+    import pandas as pd
+
+    from pandas.api.types import union_categoricals
+
+    profiles = list(profiles)
+    fields   = ru.Profiler.fields
+
+    if not profiles:
+        frame = _read_profile_frame(os.devnull)
+        frame['prof'] = pd.Categorical([])
+        return frame
+
+    if procs is None:
+        procs = multiprocessing.cpu_count()
+    procs = min(procs, len(profiles))
+
+    if procs > 1:
+        pool = multiprocessing.Pool(procs)
+        try:
+            frames = pool.map(_read_profile_frame, profiles, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        frames = [_read_profile_frame(pname) for pname in profiles]
+
+    columns = dict()
+    for col in fields:
+        if col in _prof_categories:
+            columns[col] = union_categoricals([f[col] for f in frames])
+        else:
+            columns[col] = np.concatenate([f[col].values for f in frames])
+
+    codes = np.repeat(np.arange(len(profiles)), [len(f) for f in frames])
+    columns['prof'] = pd.Categorical.from_codes(codes, categories=profiles)
+
+    return pd.DataFrame(columns, columns=fields + ['prof'])
+
+
+# ------------------------------------------------------------------------------
+#
+def combine_profile_frame(frame):
+    """
+    This is `combine_profiles()` for a frame as returned by
+    `read_profile_frame()`: it drops unsynced profiles, corrects all timestamps
+    by the start time and the per-host NTP offsets, and sorts the rows by time.
+    It returns the combined frame, accuracy and the pilot-host map.
+    """
+
+    # the first row of each profile contains the sync info
+    first = frame.drop_duplicates('prof')
+    first = first[first['msg'] != '']
+    frame = frame[frame['prof'].isin(first['prof'])]
+
+    if not len(first):
+        return [frame.drop('prof', axis=1).reset_index(drop=True), 0, dict()]
+
+    t_min = first['time'].min()
+
+    sync  = first['msg'].str.split(':', expand=True)
+    sync.columns  = ['host', 'ip', 't_sys', 't_ntp', 't_mode']
+    sync['prof']  = first['prof'].astype(str)
+    sync['host']  = sync['host'] + ':' + sync['ip']
+    sync['t_off'] = sync['t_sys'].astype(float) - sync['t_ntp'].astype(float)
+
+    # determine the correction per host -- we always use the first match
+    ntp    = sync[sync['t_mode'] != 'sys']
+    t_host = ntp.drop_duplicates('host').set_index('host')['t_off']
+    t_diff = ntp['t_off'] - ntp['host'].map(t_host)
+
+    accuracy = max(0, t_diff.max()) if len(ntp) else 0
+
+    for idx in t_diff[t_diff.abs() > NTP_DIFF_WARN_LIMIT].index:
+        host = ntp['host'][idx]
+        print 'conflict sync   %-35s (%-35s) %6.1f : %6.1f :  %12.5f' \
+                % (os.path.basename(ntp['prof'][idx]), host,
+                   ntp['t_off'][idx], t_host[host], t_diff[idx])
+
+    # correct profile timestamps, with one offset per profile
+    hosts = sync.set_index('prof')['host']
+    t_off = hosts.map(t_host).fillna(0.0)
+    t_off = t_off.reindex(frame['prof'].cat.categories).fillna(0.0)
+
+    time  = frame['time'].values - t_min
+    time -= t_off.values[frame['prof'].cat.codes]
+
+    # derive the pilot-host map from the agent_0 profiles
+    agent_0 = [pname for pname in hosts.index if _is_agent_0(pname)]
+    active  = frame[frame['prof'].isin(agent_0)            &
+                    (frame['event'] == 'advance')          &
+                    (frame['state'] == rps.PMGR_ACTIVE)]
+    hostmap = dict()
+    for uid, pname in zip(active['uid'].tolist(), active['prof'].tolist()):
+        hostmap[uid] = hosts[pname]
+
+    # sort by time (keeping the order of concurrent events) and return
+    frame = frame.drop('prof', axis=1)
+    frame['time'] = time
+    frame = frame.sort_values('time', kind='mergesort')
+
+    return [frame.reset_index(drop=True), accuracy, hostmap]
+
+
+# ------------------------------------------------------------------------------
+#
+def clean_profile_frame(frame, sid):
+    """
+    This is `clean_profile()` for a frame as returned by
+    `combine_profile_frame()`.  Instead of walking the events, duplicated state
+    transitions are dropped per uid and state, and `CANCELED` transitions are
+    dropped for all uids which have a different final state.
+    """
+
+    import numpy  as np
+    import pandas as pd
+
+    # we derive entity_type from the uid -- but funnel events w/o uid into the
+    # session
+    uids   = frame['uid'].cat.categories
+    etypes = [uid.split('.', 1)[0] if uid else 'session' for uid in uids]
+    ecats  = sorted(set(etypes))
+    ecodes = np.array([ecats.index(etype) for etype in etypes], dtype=int)
+    entity = pd.Categorical.from_codes(ecodes[frame['uid'].cat.codes], ecats)
+
+    if '' in uids:
+        frame = frame.copy()
+        if sid not in uids:
+            frame['uid'] = frame['uid'].cat.add_categories([sid])
+        frame.loc[frame['uid'] == '', 'uid'] = sid
+        frame['uid'] = frame['uid'].cat.remove_unused_categories()
+
+    is_state = (frame['event'] == 'advance').values
+
+    assert((frame['state'][is_state] != '').all()), 'cannot advance w/o state'
+
+    # only the first transition into any state counts, and a final state
+    # cancels any CANCELED state
+    states = frame[is_state].drop_duplicates(['uid', 'state'])
+    final  = states['state'].isin(rps.FINAL) & (states['state'] != rps.CANCELED)
+    final  = states['uid'][final].unique()
+    states = states[~((states['state'] == rps.CANCELED) &
+                      (states['uid'].isin(final)))]
+
+    keep = ~is_state
+    keep[frame.index.get_indexer(states.index)] = True
+
+    ret = frame[keep].drop('event', axis=1)
+    ret['entity_type'] = entity[keep]
+    ret['event_type']  = pd.Categorical.from_codes(is_state[keep].astype(int),
+                                                   ['event', 'state'])
+
+    # sort by time and return
+    ret = ret.sort_values('time', kind='mergesort')
+
+    return ret.reset_index(drop=True)
+
+
+# ------------------------------------------------------------------------------
+#
+def frame2prof(frame):
+    """
+    convert a profile frame into a list of profile rows, ie. of dicts.
+    """
+
+    cols = list(frame.columns)
+    rows = zip(*[frame[col].tolist() for col in cols])
+
+    return [dict(zip(cols, row)) for row in rows]
+
+
 # ------------------------------------------------------------------------------
 #
 def get_session_profile(sid, src=None):
@@ -410,16 +660,25 @@ def get_session_profile(sid, src=None):
 
     if os.path.exists(src):
         # we have profiles locally
-        profiles  = glob.glob("%s/*.prof"   % src)
-        profiles += glob.glob("%s/*/*.prof" % src)
+        profiles  = glob.glob("%s/*.prof"    % src)
+        profiles += glob.glob("%s/*/*.prof"  % src)
+        profiles += glob.glob("%s/*.bprof"   % src)
+        profiles += glob.glob("%s/*/*.bprof" % src)
     else:
         # need to fetch profiles
         from .session import fetch_profiles
         profiles = fetch_profiles(sid=sid, skip_existing=True)
 
-    profs              = read_profiles(profiles)
-    prof, acc, hostmap = combine_profiles(profs)
-    prof               = clean_profile(prof, sid)
+    try:
+        frame               = read_profile_frame(profiles)
+        frame, acc, hostmap = combine_profile_frame(frame)
+        prof                = frame2prof(clean_profile_frame(frame, sid))
+
+    except ImportError:
+        # no pandas
+        profs              = read_profiles(profiles)
+        prof, acc, hostmap = combine_profiles(profs)
+        prof               = clean_profile(prof, sid)
 
     return prof, acc, hostmap
 
@@ -8,6 +8,7 @@ import time
 import errno
 import pprint
 import msgpack
+import collections
 
 import Queue           as pyq
 import setproctitle    as spt
@@ -27,6 +28,14 @@ QUEUE_BRIDGE  = 'bridge'
 QUEUE_OUTPUT  = 'output'
 QUEUE_ROLES   = [QUEUE_INPUT, QUEUE_BRIDGE, QUEUE_OUTPUT]
 
+# --------------------------------------------------------------------------
+# defines for queue kinds, selected per bridge via the `kind` config key
+#
+QUEUE_REQREP  = 'reqrep'
+QUEUE_BATCHED = 'batched'
+QUEUE_INPROC  = 'inproc'
+QUEUE_KINDS   = [QUEUE_REQREP, QUEUE_BATCHED, QUEUE_INPROC]
+
 _BRIDGE_TIMEOUT  =     1  # how long to wait for bridge startup
 _LINGER_TIMEOUT  =   250  # ms to linger after close
 _HIGH_WATER_MARK =     0  # number of messages to buffer before dropping
@@ -99,10 +108,25 @@ def _uninterruptible(f, *args, **kwargs):
 # the same identifier, they will get the same queue instance.
 
 
+# ------------------------------------------------------------------------------
+#
+def _get_bridge_cfg(qname, cfg):
+
+    # bridges get their own config, queue ends get the component config
+    return cfg.get('bridges', {}).get(qname, cfg)
+
+
 # ==============================================================================
 #
 class Queue(ru.Process):
 
+    # zmq socket types for the input end, the bridge's in and out ends, and for
+    # the output end of the queue
+    _SOCKET_INPUT      = zmq.PUSH
+    _SOCKET_BRIDGE_IN  = zmq.PULL
+    _SOCKET_BRIDGE_OUT = zmq.REP
+    _SOCKET_OUTPUT     = zmq.REQ
+
     def __init__(self, session, qname, role, cfg, addr=None):
         """
         This Queue type sets up an zmq channel of this kind:
@@ -172,7 +196,7 @@ class Queue(ru.Process):
             self._ctx = zmq.Context()
             self._session._to_destroy.append(self._ctx)
 
-            self._q   = self._ctx.socket(zmq.PUSH)
+            self._q   = self._ctx.socket(self._SOCKET_INPUT)
             self._q.linger = _LINGER_TIMEOUT
             self._q.hwm    = _HIGH_WATER_MARK
             self._q.connect(self._addr)
@@ -213,13 +237,33 @@ class Queue(ru.Process):
             self._ctx = zmq.Context()
             self._session._to_destroy.append(self._ctx)
 
-            self._q   = self._ctx.socket(zmq.REQ)
+            self._q   = self._ctx.socket(self._SOCKET_OUTPUT)
             self._q.linger = _LINGER_TIMEOUT
             self._q.hwm    = _HIGH_WATER_MARK
             self._q.connect(self._addr)
             self.start(spawn=False)
 
 
+    # --------------------------------------------------------------------------
+    #
+    @staticmethod
+    def create(session, qname, role, cfg, addr=None):
+        """
+        Create a queue end of the kind configured for the queue's bridge.  For
+        bridges, `cfg` is the bridge config itself -- for inputs and outputs it
+        is the component config, which holds the bridge config under
+        `cfg['bridges'][qname]`.
+        """
+
+        kind = _get_bridge_cfg(qname, cfg).get('kind', QUEUE_REQREP)
+
+        if   kind == QUEUE_REQREP : return Queue       (session, qname, role, cfg, addr)
+        elif kind == QUEUE_BATCHED: return BatchedQueue(session, qname, role, cfg, addr)
+        elif kind == QUEUE_INPROC : return InprocQueue (session, qname, role, cfg, addr)
+        else:
+            raise ValueError('unknown queue kind %s for %s' % (kind, qname))
+
+
     # --------------------------------------------------------------------------
     #
     @property
@@ -272,12 +316,12 @@ class Queue(ru.Process):
         self._ctx = zmq.Context()
         self._session._to_destroy.append(self._ctx)
 
-        self._in = self._ctx.socket(zmq.PULL)
+        self._in = self._ctx.socket(self._SOCKET_BRIDGE_IN)
         self._in.linger = _LINGER_TIMEOUT
         self._in.hwm    = _HIGH_WATER_MARK
         self._in.bind(self._addr)
 
-        self._out = self._ctx.socket(zmq.REP)
+        self._out = self._ctx.socket(self._SOCKET_BRIDGE_OUT)
         self._out.linger = _LINGER_TIMEOUT
         self._out.hwm    = _HIGH_WATER_MARK
         self._out.bind(self._addr)
@@ -446,5 +490,386 @@ class Queue(ru.Process):
                 return None
 
 
+# ==============================================================================
+#
+class BatchedQueue(Queue):
+    """
+    This queue has the same topology and the same put/get semantics as the
+    `Queue` above, but avoids a network round trip per message:
+
+        input \                    / output
+               -- PULL | ROUTER --
+        input /                    \ output
+
+    Outputs connect via DEALER sockets and grant *credits* to the bridge
+    (initially `prefetch`, then one more for each message received), and the
+    bridge sends one bulk per credit.  Consumers which have credits are served
+    round-robin, and messages are forwarded in the order they arrived, so
+    fairness and ordering are the same as for the REQ/REP queue, but the next
+    bulk is already in flight while the consumer works on the current one.
+
+    Inputs collect messages and send them as one batch when `flush_size`
+    messages are collected, or at the latest after `flush_time` seconds.
+
+    All settings are taken from the bridge config:
+
+        kind       : 'batched'
+        prefetch   : number of bulks a consumer may hold      (default: 1)
+        flush_size : number of messages to batch on put()    (default: 1)
+        flush_time : max time to delay a batch (seconds)     (default: 0.1)
+
+    `stall_hwm` and `bulk_size` are interpreted as for the REQ/REP queue.
+    """
+
+    _SOCKET_INPUT      = zmq.PUSH
+    _SOCKET_BRIDGE_IN  = zmq.PULL
+    _SOCKET_BRIDGE_OUT = zmq.ROUTER
+    _SOCKET_OUTPUT     = zmq.DEALER
+
+    def __init__(self, session, qname, role, cfg, addr=None):
+
+        bcfg = _get_bridge_cfg(qname, cfg)
+
+        self._prefetch   = max(1, bcfg.get('prefetch',   1))
+        self._flush_size = max(1, bcfg.get('flush_size', 1))
+        self._flush_time =        bcfg.get('flush_time', 0.1)
+
+        self._buffer     = list()  # input : messages to be sent
+        self._granted    = False   # output: initial credits sent
+        self._flusher    = None    # input : thread for timed flushes
+        self._flush_term = mt.Event()
+
+        self._pending    = list()              # bridge: stalled messages
+        self._release    = collections.deque() # bridge: released messages
+        self._credits    = dict()              # bridge: consumer credits
+        self._ready      = collections.deque() # bridge: consumers w/ credits
+
+        super(BatchedQueue, self).__init__(session, qname, role, cfg, addr)
+
+        if self._role == QUEUE_INPUT and self._flush_size > 1:
+
+            self._flusher = mt.Thread(target=self._flush_loop,
+                                      name='%s.flusher' % self._uid)
+            self._flusher.daemon = True
+            self._flusher.start()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def ru_initialize_child(self):
+
+        super(BatchedQueue, self).ru_initialize_child()
+
+        # report consumers which went away, instead of silently dropping the
+        # messages we route to them
+        self._out.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self._poll.register(self._in, zmq.POLLIN)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def ru_finalize_common(self):
+
+        if self._role == QUEUE_INPUT:
+            self._flush_term.set()
+            with self._lock:
+                self._flush()
+
+        super(BatchedQueue, self).ru_finalize_common()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def work_cb(self):
+
+        # Unlike the REQ/REP bridge, we never block for longer than a poll
+        # timeout, so that the bridge can always terminate cleanly, even while
+        # stalling messages.
+
+        events = dict(_uninterruptible(self._poll.poll, 100))
+
+        if self._in in events:
+            while True:
+                try:
+                    data = self._in.recv(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                msg = msgpack.unpackb(data)
+                if isinstance(msg, list):
+                    self._pending += msg
+                else:
+                    self._pending.append(msg)
+
+        if self._out in events:
+            while True:
+                try:
+                    cid, data = self._out.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                credits = self._credits.get(cid, 0)
+                if not credits:
+                    self._ready.append(cid)
+                self._credits[cid] = credits + msgpack.unpackb(data)
+
+        if len(self._pending) >= self._stall_hwm:
+            self._release.extend(self._pending)
+            self._pending = list()
+
+        while self._release and self._ready:
+
+            cid = self._ready.popleft()
+
+            if self._bulk_size <= 0:
+                bulk = list(self._release)
+            else:
+                bulk = [self._release.popleft() for _ in
+                        range(min(self._bulk_size, len(self._release)))]
+
+            try:
+                _uninterruptible(self._out.send_multipart,
+                                 [cid, msgpack.packb(bulk)])
+
+            except zmq.ZMQError as e:
+                if e.errno != zmq.EHOSTUNREACH:
+                    raise
+                # consumer is gone - requeue the bulk in front, and forget
+                # about the consumer
+                self._log.warn('lost consumer %s', cid)
+                if self._bulk_size > 0:
+                    self._release.extendleft(reversed(bulk))
+                del(self._credits[cid])
+                continue
+
+            if self._bulk_size <= 0:
+                self._release.clear()
+
+            self._credits[cid] -= 1
+            if self._credits[cid]:
+                self._ready.append(cid)
+
+            if self._debug:
+                self._log.debug('sent %s to %s', len(bulk), cid)
+
+        return True
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _flush(self):
+
+        # call with self._lock held
+        if self._buffer:
+            data = msgpack.packb(self._buffer)
+            self._buffer = list()
+            _uninterruptible(self._q.send, data)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _flush_loop(self):
+
+        while not self._flush_term.wait(self._flush_time):
+            with self._lock:
+                self._flush()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def put(self, msg):
+
+        if not self._role == QUEUE_INPUT:
+            raise RuntimeError("queue %s (%s) can't put()" % (self._qname, self._role))
+
+        with self._lock:
+
+            if isinstance(msg, list):
+                self._buffer += msg
+            else:
+                self._buffer.append(msg)
+
+            if len(self._buffer) >= self._flush_size:
+                self._flush()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _recv(self, timeout):
+
+        # call with self._lock held.  Grant the initial credits on first use,
+        # and replace each credit used as soon as we receive the message.
+        if not self._granted:
+            _uninterruptible(self._q.send, msgpack.packb(self._prefetch))
+            self._granted = True
+
+        if not _uninterruptible(self._q.poll, flags=zmq.POLLIN, timeout=timeout):
+            return None
+
+        data = _uninterruptible(self._q.recv)
+        _uninterruptible(self._q.send, msgpack.packb(1))
+
+        return msgpack.unpackb(data)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def get(self):
+
+        if not self._role == QUEUE_OUTPUT:
+            raise RuntimeError("queue %s (%s) can't get()" % (self._qname, self._role))
+
+        with self._lock:
+            return self._recv(timeout=None)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def get_nowait(self, timeout=None): # timeout in ms
+
+        if not self._role == QUEUE_OUTPUT:
+            raise RuntimeError("queue %s (%s) can't get_nowait()" % (self._qname, self._role))
+
+        with self._lock:
+            return self._recv(timeout=timeout)
+
+
+# ==============================================================================
+#
+# In-process queues, by queue name, along with the pid of the process which
+# created them.  The pid lets us detect queue ends which got created in a forked
+# child process, where they would silently lead nowhere.
+#
+_inproc_queues = dict()
+_inproc_lock   = mt.Lock()
+
+
+class InprocQueue(object):
+    """
+    This queue connects components which live in the same process (see the
+    `inproc` component setting): the bridge is a plain `Queue.Queue` in the
+    process' memory, and things are passed by reference, without any
+    serialization.  The semantics are those of the other queues -- ownership of
+    a thing passes to the consumer with `put()`, so the producer must not touch
+    it after that.
+
+    All producers and consumers of an inproc queue MUST live in the process
+    which created the bridge -- queue ends created anywhere else will raise
+    a `RuntimeError`.  `stall_hwm` and `bulk_size` are ignored: bulks are
+    passed on as they are put.
+    """
+
+    def __init__(self, session, qname, role, cfg, addr=None):
+
+        self._session = session
+        self._qname   = qname
+        self._role    = role
+
+        assert(self._role in QUEUE_ROLES), 'invalid role %s' % self._role
+
+        self._uid  = "%s.%s" % (self._qname.replace('_', '.'), self._role)
+        self._uid  = ru.generate_id(self._uid)
+        self._log  = self._session._get_logger(self._uid,
+                          level=cfg.get('log_level', 'debug'))
+        self._addr = 'inproc://%s' % self._qname
+
+        with _inproc_lock:
+
+            if self._role == QUEUE_BRIDGE:
+                if qname in _inproc_queues:
+                    raise RuntimeError('inproc queue %s exists' % qname)
+                _inproc_queues[qname] = [os.getpid(), pyq.Queue()]
+
+            elif qname not in _inproc_queues or \
+                 _inproc_queues[qname][0] != os.getpid():
+                raise RuntimeError('inproc queue %s not in this process (%s)'
+                                  % (qname, os.getpid()))
+
+            self._q = _inproc_queues[qname][1]
+
+        self._log.info("create %s - %s - %s", self._qname, self._role, self._addr)
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def name(self):
+        return self._uid
+
+    @property
+    def uid(self):
+        return self._uid
+
+    @property
+    def qname(self):
+        return self._qname
+
+    @property
+    def role(self):
+        return self._role
+
+    @property
+    def addr(self):
+        return self._addr
+
+    @property
+    def addr_in(self):
+        assert(self._role == QUEUE_BRIDGE), 'addr_in only set on bridges'
+        return self._addr
+
+    @property
+    def addr_out(self):
+        assert(self._role == QUEUE_BRIDGE), 'addr_out only set on bridges'
+        return self._addr
+
+
+    # --------------------------------------------------------------------------
+    #
+    def is_alive(self, strict=True):
+        return True
+
+    def is_valid(self, term=True):
+        return True
+
+    def stop(self, timeout=None):
+
+        if self._role == QUEUE_BRIDGE:
+            with _inproc_lock:
+                _inproc_queues.pop(self._qname, None)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def put(self, msg):
+
+        if not self._role == QUEUE_INPUT:
+            raise RuntimeError("queue %s (%s) can't put()" % (self._qname, self._role))
+
+        self._q.put(msg)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def get(self):
+
+        if not self._role == QUEUE_OUTPUT:
+            raise RuntimeError("queue %s (%s) can't get()" % (self._qname, self._role))
+
+        return self._q.get()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def get_nowait(self, timeout=None): # timeout in ms
+
+        if not self._role == QUEUE_OUTPUT:
+            raise RuntimeError("queue %s (%s) can't get_nowait()" % (self._qname, self._role))
+
+        try:
+            if timeout: return self._q.get(True, timeout / 1000.0)
+            else      : return self._q.get_nowait()
+
+        except pyq.Empty:
+            return None
+
+
 # ------------------------------------------------------------------------------
 
@@ -3,7 +3,9 @@ import os
 import sys
 import glob
 import saga
+import Queue
 import tarfile
+import threading
 
 import radical.utils as ru
 from   radical.pilot.states  import *
@@ -11,16 +13,178 @@ from   radical.pilot.states  import *
 from db_utils import *
 
 
+# number of concurrent bundle transfers per host
+FETCH_CONCURRENCY = 4
+
+
+# ------------------------------------------------------------------------------
+#
+def _fetch_bundle(pid, sandbox_url, bundle, patterns, tgt_url, session=None,
+        skip_existing=False):
+    '''
+    Fetch a pilot bundle (a tarball like `<pilot_id>.prof.tgz`) from the pilot
+    sandbox.  If no (non-empty) bundle is available, the sandbox files matching
+    the given patterns are fetched individually to `$tgt/$pilot_id/`.
+
+    returns ['bundle', file name] or ['files', list of file names]
+    '''
+
+    ftgt = saga.Url('%s/%s' % (tgt_url, bundle))
+
+    if skip_existing and os.path.isfile(ftgt.path) \
+            and os.stat(ftgt.path).st_size > 0:
+        return ['bundle', ftgt.path]
+
+    sandbox = saga.filesystem.Directory(sandbox_url, session=session)
+
+    try:
+        # the pilot touches empty bundles on startup, which we ignore
+        if sandbox.is_file(bundle):
+            bundle_file = saga.filesystem.File("%s%s" % (sandbox_url, bundle),
+                                               session=session)
+            bundle_file.copy(ftgt, flags=saga.filesystem.CREATE_PARENTS)
+            bundle_file.close()
+
+            if os.path.isfile(ftgt.path) and os.stat(ftgt.path).st_size > 0:
+                sandbox.close()
+                return ['bundle', ftgt.path]
+
+            if os.path.isfile(ftgt.path):
+                os.unlink(ftgt.path)
+
+    except saga.DoesNotExist:
+        pass
+
+    files = list()
+    for pattern in patterns:
+        for fname in sandbox.list(pattern):
+
+            ftgt = saga.Url('%s/%s/%s' % (tgt_url, pid, fname))
+            files.append("%s" % ftgt.path)
+
+            if skip_existing and os.path.isfile(ftgt.path) \
+                             and os.stat(ftgt.path).st_size > 0:
+                continue
+
+            src_file = saga.filesystem.File("%s%s" % (sandbox_url, fname),
+                                            session=session)
+            src_file.copy(ftgt, flags=saga.filesystem.CREATE_PARENTS)
+            src_file.close()
+
+    sandbox.close()
+    return ['files', files]
+
+
+# ------------------------------------------------------------------------------
+#
+def _fetch_bundles(pilots, bundle, patterns, tgt_url, access=None,
+        session=None, skip_existing=False, concurrency=None, log=None,
+        what='files'):
+    '''
+    Fetch the bundles for all pilots (see `_fetch_bundle()`), and extract them
+    into `$tgt/$pilot_id/`.  Bundles are fetched concurrently, with at most
+    `concurrency` transfers per host.  Fetched bundles are extracted while other
+    transfers are still running.
+
+    returns list of file names
+    '''
+
+    if not concurrency:
+        concurrency = FETCH_CONCURRENCY
+
+    ret   = list()
+    done  = Queue.Queue()
+    hosts = dict()
+
+    for pilot in pilots:
+
+        sandbox_url = saga.Url(pilot['pilot_sandbox'])
+
+        if access:
+            # Allow to use a different access schema than used for the the run.
+            # Useful if you ran from the headnode, but would like to retrieve
+            # the files to your desktop (Hello Titan).
+            access_url = saga.Url(access)
+            sandbox_url.schema = access_url.schema
+            sandbox_url.host   = access_url.host
+
+        hosts.setdefault(sandbox_url.host, list()).append([pilot['uid'],
+                                                           sandbox_url])
+
+    # ------------------------------------------------------------------------
+    def _fetcher(todo):
+        # fetch bundles for one host, until none are left
+        while True:
+            try:
+                pid, sandbox_url = todo.pop(0)
+            except IndexError:
+                return
+            try:
+                log.debug("fetch %s for '%s'", what, pid)
+                done.put([pid, _fetch_bundle(pid, sandbox_url,
+                                             bundle % pid, patterns, tgt_url,
+                                             session, skip_existing)])
+            except Exception as e:
+                log.exception('failed to fetch %s for %s', what, pid)
+                done.put([pid, e])
+    # ------------------------------------------------------------------------
+
+    for host, todo in hosts.iteritems():
+        for _ in range(min(concurrency, len(todo))):
+            thread = threading.Thread(target=_fetcher, args=[todo])
+            thread.daemon = True
+            thread.start()
+
+    for _ in pilots:
+
+        while True:
+            try:
+                pid, res = done.get(timeout=1.0)
+                break
+            except Queue.Empty:
+                pass
+
+        if isinstance(res, Exception):
+            log.report.error("- %s (%s)\n" % (pid, what))
+            continue
+
+        mode, fnames = res
+        if mode == 'files':
+            ret.extend(fnames)
+            log.report.ok("+ %s (%s)\n" % (pid, what))
+            continue
+
+        pdir = "%s/%s" % (tgt_url.path, pid)
+        log.info("Extract tarball %s to '%s'.", fnames, pdir)
+        try:
+            tarball = tarfile.open(fnames)
+            tarball.extractall(pdir)
+            tarball.close()
+
+            for pattern in patterns:
+                ret.extend(glob.glob("%s/%s" % (pdir, pattern)))
+            os.unlink(fnames)
+
+        except Exception as e:
+            log.warn('could not extract tarball %s [%s]', fnames, e)
+
+        log.report.ok("+ %s (%s)\n" % (pid, what))
+
+    return ret
+
+
 # ------------------------------------------------------------------------------
 #
 def fetch_profiles (sid, dburl=None, src=None, tgt=None, access=None, 
-        session=None, skip_existing=False, fetch_client=False, log=None):
+        session=None, skip_existing=False, fetch_client=False, log=None,
+        concurrency=None):
     '''
     sid: session for which all profiles are fetched
     src: dir to look for client session profiles ($src/$sid/*.prof)
     tgt: dir to store the profile in
          - $tgt/$sid/*.prof,
          - $tgt/$sid/$pilot_id/*.prof)
+    concurrency: number of concurrent transfers per host
 
     returns list of file names
     '''
@@ -59,7 +223,8 @@ def fetch_profiles (sid, dburl=None, src=None, tgt=None, access=None,
 
     # first fetch session profile
     if fetch_client:
-        client_profiles = glob.glob("%s/%s/*.prof" % (src, sid))
+        client_profiles  = glob.glob("%s/%s/*.prof"  % (src, sid))
+        client_profiles += glob.glob("%s/%s/*.bprof" % (src, sid))
         if not client_profiles:
             raise RuntimeError('no client profiles in %s/%s' % (src, sid))
 
@@ -88,99 +253,9 @@ def fetch_profiles (sid, dburl=None, src=None, tgt=None, access=None,
     log.debug("Session: %s", sid)
     log.debug("Number of pilots in session: %d", num_pilots)
 
-    for pilot in pilots:
-
-        try:
-            log.debug("processing pilot '%s'", pilot['uid'])
-
-            sandbox_url = saga.Url(pilot['pilot_sandbox'])
-
-            if access:
-                # Allow to use a different access schema than used for the the run.
-                # Useful if you ran from the headnode, but would like to retrieve
-                # the profiles to your desktop (Hello Titan).
-                access_url = saga.Url(access)
-                sandbox_url.schema = access_url.schema
-                sandbox_url.host   = access_url.host
-
-              # print "Overriding remote sandbox: %s" % sandbox_url
-
-            sandbox = saga.filesystem.Directory (sandbox_url, session=session)
-
-            # Try to fetch a tarball of profiles, so that we can get them all in one (SAGA) go!
-            PROFILES_TARBALL = '%s.prof.tgz' % pilot['uid']
-            tarball_available = False
-            try:
-                if sandbox.is_file(PROFILES_TARBALL):
-                    log.warn("Profiles tarball exists")
-
-                    ftgt = saga.Url('%s/%s' % (tgt_url, PROFILES_TARBALL))
-
-                    if skip_existing and os.path.isfile(ftgt.path) \
-                            and os.stat(ftgt.path).st_size > 0:
-
-                        log.info("skip fetching of '%s/%s' to '%s'.", 
-                                 sandbox_url, PROFILES_TARBALL, tgt_url)
-                        tarball_available = True
-                    else:
-
-                        log.info("fetch '%s%s' to '%s'.", sandbox_url, 
-                                 PROFILES_TARBALL, tgt_url)
-
-                        prof_file = saga.filesystem.File("%s%s" % (sandbox_url, PROFILES_TARBALL), session=session)
-                        prof_file.copy(ftgt, flags=saga.filesystem.CREATE_PARENTS)
-                        prof_file.close()
-
-                        tarball_available = True
-                else:
-                    log.warn("profiles tarball doesnt exists!")
-
-            except saga.DoesNotExist:
-                log.exception("exception(TODO): profiles tarball doesnt exists!")
-
-            try:
-                os.mkdir("%s/%s" % (tgt_url.path, pilot['uid']))
-            except OSError:
-                pass
-
-            # We now have a local tarball
-            if tarball_available:
-                log.info("Extract tarball %s to '%s'.", ftgt.path, tgt_url.path)
-                try:
-                    tarball = tarfile.open(ftgt.path, mode='r:gz')
-                    tarball.extractall("%s/%s" % (tgt_url.path, pilot['uid']))
-
-                    profiles = glob.glob("%s/%s/*.prof" % (tgt_url.path, pilot['uid']))
-                    ret.extend(profiles)
-                    os.unlink(ftgt.path)
-
-                except Exception as e:
-                    log.warn('could not extract tarball %s [%s]', ftgt.path, e)
-
-                # If extract succeeded, no need to fetch individual profiles
-                log.report.ok("+ %s (profiles)\n" % pilot['uid'])
-                continue
-
-            # If we dont have a tarball (for whichever reason), fetch individual profiles
-            profiles = sandbox.list('*.prof')
-            for prof in profiles:
-
-                ret.append("%s" % ftgt.path)
-                ftgt = saga.Url('%s/%s/%s' % (tgt_url, pilot['uid'], prof))
-
-                if skip_existing and os.path.isfile(ftgt.path) \
-                                 and os.stat(ftgt.path).st_size > 0:
-                    pass
-                else:
-                    prof_file = saga.filesystem.File("%s%s" % (sandbox_url, prof), session=session)
-                    prof_file.copy(ftgt, flags=saga.filesystem.CREATE_PARENTS)
-                    prof_file.close()
-
-            log.report.ok("+ %s (profiles)\n" % pilot['uid'])
-
-        except Exception as e:
-            log.report.error("- %s (profiles)\n" % pilot['uid'])
-            log.exception('failed to fet profile for %s', pilot['uid'])
+    ret += _fetch_bundles(pilots, '%s.prof.tgz', ['*.prof', '*.bprof'],
+                          tgt_url, access, session, skip_existing,
+                          concurrency, log, 'profiles')
 
     return ret
 
@@ -188,11 +263,13 @@ def fetch_profiles (sid, dburl=None, src=None, tgt=None, access=None,
 # ------------------------------------------------------------------------------
 #
 def fetch_logfiles (sid, dburl=None, src=None, tgt=None, access=None, 
-        session=None, skip_existing=False, fetch_client=False, log=None):
+        session=None, skip_existing=False, fetch_client=False, log=None,
+        concurrency=None):
     '''
     sid: session for which all logfiles are fetched
     src: dir to look for client session logfiles
     tgt: dir to store the logfile in
+    concurrency: number of concurrent transfers per host
 
     returns list of file names
     '''
@@ -253,104 +330,13 @@ def fetch_logfiles (sid, dburl=None, src=None, tgt=None, access=None,
     log.info("Session: %s", sid)
     log.info("Number of pilots in session: %d", num_pilots)
 
-
-    for pilot in pilots:
-
-        try:
-            sandbox_url = saga.Url(pilot['pilot_sandbox'])
-
-            if access:
-                # Allow to use a different access schema than used for the the run.
-                # Useful if you ran from the headnode, but would like to retrieve
-                # the logfiles to your desktop (Hello Titan).
-                access_url = saga.Url(access)
-                sandbox_url.schema = access_url.schema
-                sandbox_url.host   = access_url.host
-
-            sandbox  = saga.filesystem.Directory (sandbox_url, session=session)
-
-            # Try to fetch a tarball of logfiles, so that we can get them all in one (SAGA) go!
-            LOGILES_TARBALL   = '%s.log.tgz' % pilot['uid']
-            tarball_available = False
-            try:
-                if sandbox.is_file(LOGILES_TARBALL):
-
-                    log.info("logfiles tarball exists")
-                    ftgt = saga.Url('%s/%s' % (tgt_url, LOGILES_TARBALL))
-
-                    if skip_existing and os.path.isfile(ftgt.path) \
-                            and os.stat(ftgt.path).st_size > 0:
-
-                        log.info("Skip fetching of '%s/%s' to '%s'.", 
-                                 sandbox_url, LOGILES_TARBALL, tgt_url)
-                        tarball_available = True
-                    else:
-
-                        log.info("Fetching '%s%s' to '%s'.", 
-                                sandbox_url, LOGILES_TARBALL, tgt_url)
-                        log_file = saga.filesystem.File("%s%s" % (sandbox_url, LOGILES_TARBALL), session=session)
-                        log_file.copy(ftgt, flags=saga.filesystem.CREATE_PARENTS)
-                        log_file.close()
-
-                        tarball_available = True
-                else:
-                    log.warn("logiles tarball doesnt exists")
-
-            except saga.DoesNotExist:
-                log.warn("logfiles tarball doesnt exists")
-
-            try:
-                os.mkdir("%s/%s" % (tgt_url.path, pilot['uid']))
-            except OSError:
-                pass
-
-            # We now have a local tarball
-            if tarball_available:
-                log.debug("Extract tarball %s to %s", ftgt.path, tgt_url.path)
-
-                try:
-                    tarball = tarfile.open(ftgt.path)
-                    tarball.extractall("%s/%s" % (tgt_url.path, pilot['uid']))
-
-                    logfiles = glob.glob("%s/%s/*.log" % (tgt_url.path, pilot['uid']))
-                    log.info("tarball %s extracted to '%s/%s/'.", 
-                            ftgt.path, tgt_url.path, pilot['uid'])
-                    ret.extend(logfiles)
-                    os.unlink(ftgt.path)
-
-                except Exception as e:
-                    log.warn('could not extract tarball %s [%s]', ftgt.path, e)
-
-                # If extract succeeded, no need to fetch individual logfiles
-                log.report.ok("+ %s (logfiles)\n" % pilot['uid'])
-                continue
-
-            # If we dont have a tarball (for whichever reason), fetch individual logfiles
-            logfiles = sandbox.list('*.log')
-
-            for log in logfiles:
-
-                ftgt = saga.Url('%s/%s/%s' % (tgt_url, pilot['uid'], log))
-                ret.append("%s" % ftgt.path)
-
-                if skip_existing and os.path.isfile(ftgt.path) \
-                                 and os.stat(ftgt.path).st_size > 0:
-
-                    continue
-
-                log_file = saga.filesystem.File("%s%s" % (sandbox_url, log), session=session)
-                log_file.copy(ftgt, flags=saga.filesystem.CREATE_PARENTS)
-                log_file.close()
-
-            log.report.ok("+ %s (logfiles)\n" % pilot['uid'])
-
-        except Exception as e:
-            log.report.error("- %s (logfiles)\n" % pilot['uid'])
+    ret += _fetch_bundles(pilots, '%s.log.tgz', ['*.log'],
+                          tgt_url, access, session, skip_existing,
+                          concurrency, log, 'logfiles')
 
     return ret
 
 
-
 # ------------------------------------------------------------------------------
 #
 def fetch_json(sid, dburl=None, tgt=None, skip_existing=False, session=None,
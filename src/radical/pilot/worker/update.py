@@ -5,19 +5,48 @@ __license__   = "MIT"
 
 import time
 import threading
+import collections
 import pymongo
 
 import radical.utils as ru
 
 from .. import utils     as rpu
+from .. import states    as rps
 from .. import constants as rpc
 
+from ..db.database import STATE_EVENTS_POSTFIX
+
 
 # ==============================================================================
 #
 DEFAULT_BULK_COLLECTION_TIME =  1.0  # seconds
 DEFAULT_BULK_COLLECTION_SIZE =  100  # seconds
 
+# unit fields which are copied into state events -- these are the fields
+# `ComputeUnit._update()` evaluates.
+STATE_EVENT_KEYS = ['uid', 'type', 'umgr', 'state', 'stdout', 'stderr',
+                    'exit_code', 'pilot', 'resource_sandbox', 'pilot_sandbox',
+                    'unit_sandbox', 'client_sandbox']
+
+# fields which are also written to unit and pilot docs by others than the
+# update workers (see `DBSession.claim_units()`, `DBSession.pilot_command()`,
+# `UnitManager._unit_pull_cb()`, `Agent_0.finalize_parent()`).  Our record of
+# what we pushed can't tell if those are still current, so they are always set.
+SHARED_KEYS = ['state', 'control', 'lease', 'cmd', 'stdout', 'stderr',
+               'logfile', 'finished']
+
+
+# ------------------------------------------------------------------------------
+#
+def _digest(val):
+    """
+    We don't keep copies of the pushed values (descriptions can be large), but
+    a hash of their repr.  Equal values with different reprs (like dicts built
+    in different order) only cause a redundant push.
+    """
+
+    return hash(repr(val))
+
 
 # ==============================================================================
 #
@@ -28,6 +57,15 @@ class Update(rpu.Worker):
     triplets of collection name, query dict, and update dict.  Update requests
     will be collected into bulks over some time (BULK_COLLECTION_TIME) and
     number (BULK_COLLECTION_SIZE) to reduce number of roundtrips.
+
+    If the state pubsub is configured with N `shards`, N update workers are
+    started, and each of them only receives (and persists) the updates for the
+    uids which hash into its own shard.
+
+    Within a bulk, all updates for the same entity are coalesced into a single
+    update op, and only those fields are sent which changed since the last
+    successful push for that entity (but see `SHARED_KEYS`).  As each entity
+    thus has at most one op per bulk, the bulks can be executed unordered.
     """
 
     # --------------------------------------------------------------------------
@@ -59,17 +97,37 @@ class Update(rpu.Worker):
         _, db, _, _, _   = ru.mongodb_connect(self._dburl)
         self._mongo_db   = db
         self._coll       = self._mongo_db[self._session_id]
-        self._bulk       = self._coll.initialize_ordered_bulk_op()
         self._last       = time.time()        # time of last bulk push
         self._uids       = list()             # list of collected uids
-        self._lock       = threading.RLock()  # protect _bulk
+        self._pending    = collections.OrderedDict()  # coalesced updates
+        self._pushed     = dict()             # digests of pushed fields
+        self._events     = list()             # state events for this bulk
+        self._lock       = threading.RLock()  # protect _pending
+
+        # counters for update ops, before and after coalescing
+        self._ops_in     = 0
+        self._ops_out    = 0
+
+        # sessions created by older versions have no state event collection
+        ename = self._session_id + STATE_EVENTS_POSTFIX
+        if ename in self._mongo_db.collection_names():
+            self._ecoll  = self._mongo_db[ename]
+        else:
+            self._ecoll  = None
 
         self._bct        = self._cfg.get('bulk_collection_time',
                                           DEFAULT_BULK_COLLECTION_TIME)
         self._bcs        = self._cfg.get('bulk_collection_size',
                                           DEFAULT_BULK_COLLECTION_SIZE)
 
-        self.register_subscriber(rpc.STATE_PUBSUB, self._state_cb)
+        # if state updates are sharded, we only subscribe to our own shard
+        topic  = None
+        shards = self._cfg['bridges'][rpc.STATE_PUBSUB].get('shards', 1)
+        if shards > 1:
+            topic = rpu.get_shard_topic(rpc.STATE_PUBSUB, self._cfg['number'])
+            self._log.info('update shard %d of %d', self._cfg['number'], shards)
+
+        self.register_subscriber(rpc.STATE_PUBSUB, self._state_cb, topic=topic)
         self.register_timed_cb(self._idle_cb, timer=self._bct)
 
 
@@ -87,6 +145,9 @@ class Update(rpu.Worker):
         self.unregister_timed_cb(self._idle_cb)
         self.unregister_subscriber(rpc.STATE_PUBSUB, self._state_cb)
 
+        self._log.info('update ops: %d received, %d pushed',
+                       self._ops_in, self._ops_out)
+
 
     # --------------------------------------------------------------------------
     #
@@ -106,17 +167,56 @@ class Update(rpu.Worker):
             and len(self._uids) < self._bcs:
             return False
 
+        # one op per entity -- which we can thus send unordered.  The server
+        # stamps the modification time, which is used for incremental reads
+        # of the session (see `rpu.get_session_docs()`).
+        bulk = self._coll.initialize_unordered_bulk_op()
+        for uid, update in self._pending.iteritems():
+            bulk.find  ({'uid'  : uid, 
+                         'type' : update['type']}) \
+                .update({'$set'         : update['set'], 
+                         '$push'        : {'states' : {'$each' : update['states']}},
+                         '$currentDate' : {'_mtime' : True}})
+
         try:
-            res = self._bulk.execute()
+            res = bulk.execute()
             self._log.debug("bulk update result: %s", res)
+        except pymongo.errors.BulkWriteError as e:
+            self._log.exception('bulk exec error: %s' % e.details)
+            # we only know which ops failed if the write concern was met
+            uids = self._pending.keys()
+            if e.details.get('writeConcernErrors'):
+                self._update_pushed(uids)
+            else:
+                self._update_pushed([uids[err['index']]
+                                     for err in e.details.get('writeErrors', [])])
+            raise
         except pymongo.errors.OperationFailure as e:
             self._log.exception('bulk exec error: %s' % e.details)
+            self._update_pushed(self._pending.keys())
             raise
         except Exception as e:
             self._log.exception('mongodb error: %s', e)
+            self._update_pushed(self._pending.keys())
             raise
 
-        self._prof.prof('update bulk pushed (%d)' % len(self._uids),
+        self._update_pushed()
+
+        self._ops_out += len(self._pending)
+        self._log.debug('update ops: %d received, %d pushed (%d / %d total)',
+                        len(self._uids), len(self._pending),
+                        self._ops_in, self._ops_out)
+
+        # the documents are updated -- now let state event consumers know
+        if self._events:
+            try:
+                self._ecoll.insert(self._events)
+            except Exception as e:
+                self._log.exception('mongodb event error: %s', e)
+                raise
+
+        self._prof.prof('update bulk pushed (%d / %d)' 
+                        % (len(self._uids), len(self._pending)),
                         uid=self._owner)
 
         for entry in self._uids:
@@ -131,13 +231,38 @@ class Update(rpu.Worker):
                                 uid=uid)
 
         # empty bulk, refresh state
-        self._last = now
-        self._bulk = self._coll.initialize_ordered_bulk_op()
-        self._uids = list()
+        self._last    = now
+        self._uids    = list()
+        self._pending = collections.OrderedDict()
+        self._events  = list()
 
         return True
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _update_pushed(self, failed=None):
+        """
+        After a bulk execute, record the fields pushed for the pending uids.
+        For uids in `failed` we don't know what the DB holds, so we forget what
+        we pushed before, too.  Final things won't be updated anymore.
+        """
+
+        failed = set(failed or [])
+
+        for uid, update in self._pending.iteritems():
+
+            if uid in failed or update['final']:
+                self._pushed.pop(uid, None)
+                continue
+
+            # values are digested, as the things may change after we got them
+            pushed = self._pushed.setdefault(uid, dict())
+            for key, val in update['set'].iteritems():
+                if key not in SHARED_KEYS:
+                    pushed[key] = _digest(val)
+
+
     # --------------------------------------------------------------------------
     #
     def _idle_cb(self):
@@ -219,7 +344,7 @@ class Update(rpu.Worker):
 
             if 'clone' in uid:
                 # we don't push clone states to DB
-                return True
+                continue
 
             self._prof.prof('get', msg="update %s state to %s" % (ttype, state),
                             uid=uid)
@@ -227,30 +352,50 @@ class Update(rpu.Worker):
             if not state:
                 # nothing to push
                 self._prof.prof('get', msg="update %s state ignored" % ttype, uid=uid)
-                return True
-
-            # create an update document
-            update_dict          = dict()
-            update_dict['$set']  = dict()
-            update_dict['$push'] = dict()
-
-            for key,val in thing.iteritems():
-                # we never set _id, states (to avoid index clash, duplicated ops)
-                if key not in ['_id', 'states']:
-                    update_dict['$set'][key] = val
-
-            # we set state, put (more importantly) we push the state onto the
-            # 'states' list, so that we can later get state progression in sync with
-            # the state model, even if they have been pushed here out-of-order
-            update_dict['$push']['states'] = state
+                continue
 
             with self._lock:
 
-                # push the update request onto the bulk
                 self._uids.append([uid, ttype, state])
-                self._bulk.find  ({'uid'  : uid, 
-                                   'type' : ttype}) \
-                          .update(update_dict)
+                self._ops_in += 1
+
+                # coalesce with any pending update for the same thing
+                if uid not in self._pending:
+                    self._pending[uid] = {'type'   : ttype,
+                                          'set'    : dict(),
+                                          'states' : list(),
+                                          'final'  : False}
+                update = self._pending[uid]
+                pushed = self._pushed.get(uid, {})
+
+                for key,val in thing.iteritems():
+                    # we never set _id, states (to avoid index clash,
+                    # duplicated ops), nor _mtime (which the server stamps),
+                    # and we only set what changed since the last push, unless
+                    # the bulk already sets the field.  We always set the
+                    # fields others write to as well.
+                    if key in ['_id', 'states', '_mtime']:
+                        continue
+                    if  key not in SHARED_KEYS     and \
+                        key not in update['set']   and \
+                        key in pushed and pushed[key] == _digest(val):
+                        continue
+                    update['set'][key] = val
+
+                # we set state, put (more importantly) we push the state onto
+                # the 'states' list, so that we can later get state progression
+                # in sync with the state model, even if they have been pushed
+                # here out-of-order
+                update['states'].append(state)
+
+                # no need to remember fields of final things
+                if state in rps.FINAL:
+                    update['final'] = True
+
+                if self._ecoll is not None and ttype == 'unit':
+                    self._events.append({key : thing[key]
+                                         for key in STATE_EVENT_KEYS
+                                         if thing.get(key) is not None})
 
             self._prof.prof('bulk', msg='bulked (%s)' % state, uid=uid)
             self._log.debug('bulked %s [%s] %s', uid, state, self.uid)
@@ -92,6 +92,53 @@ class TestUnit(unittest.TestCase):
 
         session.close()
 
+    #-------------------------------------------------------------------------
+    #
+    def test__unit_as_completed(self):
+        """ Test if units are handed out as they complete.
+        """
+        session = radical.pilot.Session(database_url=DBURL, database_name=DBNAME)
+
+        pm = radical.pilot.PilotManager(session=session)
+
+        cpd = radical.pilot.ComputePilotDescription()
+        cpd.resource = "local.localhost"
+        cpd.cores = 2
+        cpd.runtime = 5
+        cpd.sandbox = "/tmp/radical.pilot.sandbox.unittests"
+        cpd.cleanup = True
+
+        pilot = pm.submit_pilots(pilot_descriptions=cpd)
+
+        um = radical.pilot.UnitManager(
+            session=session,
+            scheduler=radical.pilot.SCHED_DIRECT_SUBMISSION
+        )
+        um.add_pilots(pilot)
+
+        cuds = list()
+        for sleep in ['20', '1']:
+            cudesc = radical.pilot.ComputeUnitDescription()
+            cudesc.cores = 1
+            cudesc.executable = "/bin/sleep"
+            cudesc.arguments = [sleep]
+            cuds.append(cudesc)
+
+        cus  = um.submit_units(cuds)
+        uids = [cu.uid for cu in cus]
+
+        # the short unit completes first
+        done = [cu.uid for cu in um.as_completed(uids, timeout=5*60)]
+        assert done == list(reversed(uids))
+
+        for cu in cus:
+            assert cu.state == radical.pilot.DONE
+
+        # units which are final already are handed out right away
+        assert [cu.uid for cu in um.as_completed(uids[:1])] == uids[:1]
+
+        session.close()
+
     #-------------------------------------------------------------------------
     #
     def test__unit_cancel(self):
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for profile loading: we write a synthetic session of profiles, and
+compare the row based `read_profiles()`, `combine_profiles()` and
+`clean_profile()` against the columnar (pandas based) `read_profile_frame()`,
+`combine_profile_frame()` and `clean_profile_frame()`.  We also check that
+both produce the same profile.
+
+The session has `n_pilots` pilots on their own hosts, each with an agent_0
+and an executor profile, and `n_units` units per pilot.
+
+Usage: benchmark_profiles.py [n_pilots] [n_units] [workdir]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+import radical.utils        as ru
+import radical.pilot.utils  as rpu
+import radical.pilot.states as rps
+
+
+N_PILOTS =   16
+N_UNITS  = 1000
+
+SID      = 'rp.session.bench.0000'
+
+UNIT_STATES = [rps.AGENT_STAGING_INPUT_PENDING, rps.AGENT_STAGING_INPUT,
+               rps.AGENT_SCHEDULING_PENDING,    rps.AGENT_SCHEDULING,
+               rps.AGENT_EXECUTING_PENDING,     rps.AGENT_EXECUTING,
+               rps.AGENT_STAGING_OUTPUT_PENDING, rps.AGENT_STAGING_OUTPUT]
+
+
+# ------------------------------------------------------------------------------
+#
+def write_profile(fname, host, t_zero, t_off, rows):
+
+    with open(fname, 'w') as f:
+        f.write('#%s\n' % ','.join(ru.Profiler.fields))
+        f.write('%.4f,sync_abs,agent_0,MainThread,,,%s:%s:%s:%s:ntp\n'
+                % (t_zero, host[0], host[1], t_zero, t_zero - t_off))
+        for row in rows:
+            f.write('%.4f,%s,%s,%s,%s,%s,%s\n' % row)
+
+
+# ------------------------------------------------------------------------------
+#
+def create_session(workdir, n_pilots, n_units):
+
+    profiles = list()
+    t_start  = time.time()
+
+    for p in range(n_pilots):
+
+        pid    = 'pilot.%04d' % p
+        host   = ['node%04d' % p, '10.0.%d.%d' % (p / 256, p % 256)]
+        t_zero = t_start + random.random()
+        t_off  = random.random() * 0.1
+        pdir   = '%s/%s' % (workdir, pid)
+
+        os.makedirs(pdir)
+
+        # agent_0 activates the pilot, and pushes the units through staging
+        # and scheduling.  The executor profile has all execution events.
+        agent  = [(t_zero + 1, 'advance', 'agent_0', 'MainThread', pid,
+                   rps.PMGR_ACTIVE, '')]
+        execer = list()
+
+        for u in range(n_units):
+
+            uid = 'unit.%06d' % (p * n_units + u)
+            t   = t_zero + 2 + u * 0.001
+
+            for i, state in enumerate(UNIT_STATES):
+                rows = execer if 'EXECUTING' in state else agent
+                rows.append((t + i * 0.01, 'advance', 'agent_0', 'Worker-1',
+                             uid, state, ''))
+
+            execer.append((t + 0.052, 'exec_start', 'agent_executing.0000',
+                           'Watcher', uid, '', ''))
+            execer.append((t + 0.058, 'exec_stop', 'agent_executing.0000',
+                           'Watcher', uid, '', ''))
+
+            # some state transitions are recorded twice, and some units are
+            # canceled before or after they finish
+            if not u % 10:
+                agent.append((t + 0.09, 'advance', 'agent_0', 'Worker-2', uid,
+                              rps.AGENT_STAGING_OUTPUT, 'dup'))
+            if not u % 7:
+                agent.append((t + 0.1, 'advance', 'agent_0', 'Worker-1', uid,
+                              rps.CANCELED, ''))
+            if u % 3:
+                agent.append((t + 0.11, 'advance', 'agent_0', 'Worker-1', uid,
+                              rps.DONE, ''))
+
+            # session level events (w/o uid)
+            if not u % 100:
+                agent.append((t + 0.05, 'flush', 'agent_0', 'MainThread', '',
+                              '', ''))
+
+        agent.sort()
+        execer.sort()
+
+        for name, rows in [['agent_0',              agent ],
+                           ['agent_executing.0000', execer]]:
+            fname = '%s/%s.prof' % (pdir, name)
+            write_profile(fname, host, t_zero, t_off, rows)
+            profiles.append(fname)
+
+    return profiles
+
+
+# ------------------------------------------------------------------------------
+#
+def canonical(prof):
+
+    # events with the same timestamp can be in any order.  We only compare
+    # hashes, to keep memory in check for large profiles.
+    return sorted([hash(tuple(sorted(event.items()))) for event in prof])
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1: N_PILOTS = int(sys.argv[1])
+    if len(sys.argv) > 2: N_UNITS  = int(sys.argv[2])
+    if len(sys.argv) > 3: workdir  = sys.argv[3]
+    else                : workdir  = tempfile.mkdtemp(prefix='rp.bench.')
+
+    print 'pilots: %d  units: %d  (%s)' % (N_PILOTS, N_UNITS, workdir)
+
+    profiles = create_session(workdir, N_PILOTS, N_UNITS)
+
+    start              = time.time()
+    profs              = rpu.read_profiles(profiles)
+    read               = time.time()
+    prof, acc, hostmap = rpu.combine_profiles(profs)
+    combined           = time.time()
+    prof               = rpu.clean_profile(prof, SID)
+    done               = time.time()
+
+    print '%-10s : read %8.2fs, combine %8.2fs, clean %8.2fs : %d events' \
+        % ('rows', read - start, combined - read, done - combined, len(prof))
+
+    # use the same profile order, so that concurrent events are combined in
+    # the same order
+    start                 = time.time()
+    frame                 = rpu.read_profile_frame(profs.keys())
+    read                  = time.time()
+    frame, f_acc, f_hosts = rpu.combine_profile_frame(frame)
+    combined              = time.time()
+    frame                 = rpu.clean_profile_frame(frame, SID)
+    done                  = time.time()
+    f_prof                = rpu.frame2prof(frame)
+
+    print '%-10s : read %8.2fs, combine %8.2fs, clean %8.2fs : %d events' \
+        % ('frame', read - start, combined - read, done - combined, len(f_prof))
+
+    print 'same accuracy: %s' % (acc     == f_acc)
+    print 'same hostmap : %s' % (hostmap == f_hosts)
+    print 'same profile : %s' % (canonical(prof) == canonical(f_prof))
+
+    if len(sys.argv) <= 3:
+        shutil.rmtree(workdir)
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+"""
+Microbenchmark for the REQ/REP, the batched ZMQ and the inproc queue
+implementations.
+
+For each queue kind we start a bridge, one input and one output end, and
+measure
+
+  - throughput: time to push N messages through the queue, with the consumer
+                draining concurrently
+  - latency   : round trip time of single messages (put, then get)
+
+Usage: benchmark_queue.py [n_msgs]
+"""
+
+import sys
+import time
+import logging
+import threading
+
+import radical.pilot.utils as rpu
+
+
+N   = 10000   # number of messages for throughput
+LAT =  1000   # number of messages for latency
+
+
+# ------------------------------------------------------------------------------
+#
+class BenchSession(object):
+    """
+    The queues only need a logger and a place to register their zmq contexts
+    with -- we don't need a full (DB backed) session for that.
+    """
+
+    def __init__(self):
+        self._to_destroy = list()
+        logging.basicConfig(level=logging.ERROR)
+
+    def _get_logger(self, name, level=None):
+        log = logging.getLogger(name)
+        log.setLevel(logging.ERROR)
+        return log
+
+    def close(self):
+        for ctx in self._to_destroy:
+            ctx.destroy()
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(session, name, bcfg, n):
+
+    bcfg = dict(bcfg)
+    bcfg['log_level'] = 'error'
+
+    bridge = rpu.Queue.create(session, name, rpu.QUEUE_BRIDGE, bcfg)
+    bcfg['addr_in']  = str(bridge.addr_in)
+    bcfg['addr_out'] = str(bridge.addr_out)
+
+    ccfg  = {'bridges' : {name : bcfg}}
+    q_in  = rpu.Queue.create(session, name, rpu.QUEUE_INPUT,  ccfg, bcfg['addr_in'])
+    q_out = rpu.Queue.create(session, name, rpu.QUEUE_OUTPUT, ccfg, bcfg['addr_out'])
+
+    # throughput: a producer thread pushes, we drain
+    def produce():
+        for i in range(n):
+            q_in.put({'uid' : 'unit.%06d' % i, 'state' : 'NEW'})
+
+    start = time.time()
+    producer = threading.Thread(target=produce)
+    producer.start()
+
+    seen = 0
+    while seen < n:
+        msgs = q_out.get_nowait(1000)
+        if msgs:
+            if isinstance(msgs, list): seen += len(msgs)
+            else                     : seen += 1
+    producer.join()
+    tput = n / (time.time() - start)
+
+    # latency: one message at a time.  Batching inputs only flush on timeout
+    # here, so this measures the worst case for `flush_time`.
+    lat = list()
+    for i in range(LAT):
+        start = time.time()
+        q_in.put({'uid' : 'unit.%06d' % i, 'state' : 'NEW'})
+        while not q_out.get_nowait(1000):
+            pass
+        lat.append(time.time() - start)
+    lat.sort()
+
+    print '%-30s : %10.1f msgs/s | latency median %8.3f ms, 99%% %8.3f ms' \
+        % (name, tput, lat[len(lat) / 2] * 1000, lat[int(len(lat) * 0.99)] * 1000)
+
+    q_in.stop()
+    q_out.stop()
+    bridge.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        N = int(sys.argv[1])
+
+    session = BenchSession()
+
+    print 'n: %d' % N
+
+    bench(session, 'reqrep_queue', {'kind'       : rpu.QUEUE_REQREP,
+                                    'stall_hwm'  : 1,
+                                    'bulk_size'  : 0}, N)
+
+    bench(session, 'batched_queue', {'kind'       : rpu.QUEUE_BATCHED,
+                                     'stall_hwm'  : 1,
+                                     'bulk_size'  : 0,
+                                     'prefetch'   : 1,
+                                     'flush_size' : 1}, N)
+
+    bench(session, 'batched_prefetch_queue', {'kind'       : rpu.QUEUE_BATCHED,
+                                              'stall_hwm'  : 1,
+                                              'bulk_size'  : 0,
+                                              'prefetch'   : 4,
+                                              'flush_size' : 64,
+                                              'flush_time' : 0.01}, N)
+
+    # inproc queues only work within one process, but we include them here as
+    # the lower bound for queue overhead
+    bench(session, 'inproc_queue', {'kind' : rpu.QUEUE_INPROC}, N)
+
+    session.close()
+
+
+# ------------------------------------------------------------------------------
+
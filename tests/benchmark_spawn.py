@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""
+Spawn rate benchmark for the Popen executor, using the FORK launch method.
+
+We skip the component setup (no bridges, no session), and only exercise the
+path from a bulk of units handed to `work()` to the reaped processes: sandbox
+preparation, launch script rendering, spawning and watching.  The benchmark is
+run with sequential and with concurrent sandbox preparation, with launch
+scripts in the sandbox and in node-local tmp, and with units spawned by
+`subprocess.Popen` and by spawner helpers.
+
+Usage: benchmark_spawn.py [n_units] [workdir]
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+
+import helpers
+
+
+N = 1000
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(workdir, name, cfg, n):
+
+    executor = helpers.create_executor(workdir, cfg)
+    units    = helpers.create_executing_units(n, name)
+
+    start = time.time()
+    executor.work(units)
+    spawned = time.time()
+
+    while len(executor.done) < n:
+        time.sleep(0.01)
+    done = time.time()
+
+    executor.finalize_child()
+
+    failed = len([cu for cu in executor.done if cu['exit_code']])
+    print '%-20s : %8.1f units/s spawned, %8.1f units/s done  (%d failed)' \
+        % (name, n / (spawned - start), n / (done - start), failed)
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1: N       = int(sys.argv[1])
+    if len(sys.argv) > 2: workdir = sys.argv[2]
+    else                : workdir = tempfile.mkdtemp(prefix='rp.bench.')
+
+    print 'n: %d  (%s)' % (N, workdir)
+
+    cfg = {'session_id' : 'rp.session.bench',
+           'pilot_id'   : 'pilot.0000',
+           'agent_name' : 'agent_0'}
+
+    bench(workdir, 'sequential', dict(cfg), N)
+    bench(workdir, 'threads',    dict(cfg, sandbox_threads=8), N)
+    bench(workdir, 'threads+tmp', dict(cfg, sandbox_threads=8,
+                                            launch_script_tmp=True), N)
+    bench(workdir, 'helper',      dict(cfg, spawner_helpers=1), N)
+    bench(workdir, 'helpers',     dict(cfg, spawner_helpers=4), N)
+    bench(workdir, 'helpers+tmp', dict(cfg, spawner_helpers=4,
+                                            sandbox_threads=8,
+                                            launch_script_tmp=True), N)
+
+    if len(sys.argv) <= 2:
+        shutil.rmtree(workdir)
+    shutil.rmtree('%s/rp.%s.%s' % (tempfile.gettempdir(), cfg['session_id'],
+                                   cfg['pilot_id']), ignore_errors=True)
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""
+Submission rate benchmark for `UnitManager.submit_units()`.
+
+We skip the component setup (no bridges, no session, no DB), and only exercise
+the client side of the unit submission: description checks and expansion, unit
+creation, and the state advances.  Units are created one by one (as
+`submit_units()` used to do), and as a bulk, via `submit_units()`.
+
+Usage: benchmark_submit.py [n_units] [bulk_size]
+"""
+
+import sys
+import time
+
+import radical.pilot           as rp
+import radical.pilot.states    as rps
+
+from radical.pilot.compute_unit import ComputeUnit
+
+import helpers
+
+
+N    = 10000
+BULK = 1000
+
+
+# ------------------------------------------------------------------------------
+#
+class BenchDB(object):
+
+    def insert_units(self, unit_docs):
+        pass
+
+
+# ------------------------------------------------------------------------------
+#
+def create_umgr():
+
+    # state updates are recorded, not published
+    return helpers.create_umgr(helpers.Session(dbs=BenchDB()))
+
+
+# ------------------------------------------------------------------------------
+#
+def create_descriptions(n):
+
+    descrs = list()
+    for i in range(n):
+        cud = rp.ComputeUnitDescription()
+        cud.executable     = '/bin/date'
+        cud.arguments      = ['-u']
+        cud.cores          = 1
+        cud.input_staging  = ['input.dat']
+        cud.output_staging = ['output.dat']
+        descrs.append(cud)
+
+    return descrs
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_single(n, bulk):
+
+    umgr   = create_umgr()
+    descrs = create_descriptions(n)
+
+    start = time.time()
+    for i in range(0, n, bulk):
+        units = [ComputeUnit.create(umgr=umgr, descr=ud)
+                 for ud in descrs[i:i + bulk]]
+        docs  = [unit.as_dict() for unit in units]
+        umgr.advance(docs, rps.UMGR_SCHEDULING_PENDING, publish=True, push=True)
+    stop = time.time()
+
+    print '%-10s : %8.1f units/s' % ('single', n / (stop - start))
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_bulk(n, bulk):
+
+    umgr   = create_umgr()
+    descrs = create_descriptions(n)
+
+    start = time.time()
+    for i in range(0, n, bulk):
+        umgr.submit_units(descrs[i:i + bulk])
+    stop = time.time()
+
+    assert len(umgr._units) == n
+
+    print '%-10s : %8.1f units/s' % ('bulk', n / (stop - start))
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1: N    = int(sys.argv[1])
+    if len(sys.argv) > 2: BULK = int(sys.argv[2])
+
+    print 'n: %d  (bulk size: %d)' % (N, BULK)
+
+    bench_single(N, BULK)
+    bench_bulk  (N, BULK)
+
+
+# ------------------------------------------------------------------------------
+
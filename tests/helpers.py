@@ -0,0 +1,288 @@
+""" Shared helpers for component tests
+
+Components are created via their regular constructor, but are not started:
+tests can then invoke work methods, callbacks and `advance()` directly.  The
+test session provides what components, queues and pubsubs need from a session
+(logger, profiler, and registries for later cleanup), but has no DB.
+"""
+
+import os
+import copy
+import logging
+import tempfile
+import unittest
+import threading
+
+import pymongo
+
+import radical.utils           as ru
+import radical.pilot           as rp
+import radical.pilot.utils     as rpu
+import radical.pilot.states    as rps
+import radical.pilot.types     as rpt
+import radical.pilot.constants as rpc
+
+
+# ------------------------------------------------------------------------------
+#
+# DB tests need a MongoDB server, given as 'mongodb://host:port/db' in
+# RADICAL_PILOT_DBURL.  For the installation of a MongoDB server, refer to the
+# MongoDB website: http://docs.mongodb.org/manual/installation/
+#
+DBURL = os.getenv('RADICAL_PILOT_DBURL')
+
+_db_error = list()  # cached result of the DB check
+
+
+def requires_db(cls):
+    """
+    Class decorator which skips the tests if no MongoDB server is available.
+    """
+
+    if not _db_error:
+        if not DBURL:
+            _db_error.append('RADICAL_PILOT_DBURL (MongoDB server URL) '
+                             'is not defined')
+        else:
+            try:
+                pymongo.MongoClient(DBURL, connectTimeoutMS=2000).close()
+                _db_error.append(None)
+            except pymongo.errors.PyMongoError as e:
+                _db_error.append('no MongoDB server at %s (%s)' % (DBURL, e))
+
+    if _db_error[0]:
+        return unittest.skip(_db_error[0])(cls)
+    return cls
+
+
+# ------------------------------------------------------------------------------
+#
+class Reporter(object):
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+# ------------------------------------------------------------------------------
+#
+class Session(object):
+    """
+    A session without DB.  Things registered for termination are stopped and
+    destroyed on `close()`, in reverse order.
+    """
+
+    def __init__(self, dbs=None):
+
+        self.uid         = 'rp.session.test'
+        self._cfg        = dict()
+        self._rec        = None
+        self._dbs        = dbs
+        self._to_stop    = list()
+        self._to_destroy = list()
+
+        self._log        = logging.getLogger('radical.pilot.test')
+        self._log.report = Reporter()
+
+    def is_valid(self, term=True):
+        return True
+
+    def _get_logger(self, name, level=None):
+        return self._log
+
+    def _get_profiler(self, name, level=None):
+        return ru.Profiler('radical.pilot.test')
+
+    def close(self):
+
+        for thing in reversed(self._to_stop):
+            try:
+                thing.stop()
+            except Exception:
+                self._log.exception('could not stop %s', thing)
+
+        for ctx in self._to_destroy:
+            ctx.destroy()
+
+        self._to_stop    = list()
+        self._to_destroy = list()
+
+
+# ------------------------------------------------------------------------------
+#
+class Publisher(object):
+    """
+    Records published messages as `[topic, msg]` pairs.
+    """
+
+    def __init__(self):
+        self.msgs = list()
+
+    def put(self, topic, msg):
+        self.msgs.append([topic, msg])
+
+    def stop(self):
+        pass
+
+
+# ------------------------------------------------------------------------------
+#
+def create_component(session, cfg=None, uid='component.0000', comp=None):
+    """
+    Create a component with the given config, but don't start it.  If `comp` is
+    given, that (not yet initialized) instance of a component class is used,
+    otherwise a plain `rpu.Component` is created.  Components expect the
+    bridges for the state and control pubsubs to be configured.
+    """
+
+    if not comp:
+        comp = rpu.Component.__new__(rpu.Component)
+
+    if cfg: cfg = copy.deepcopy(cfg)
+    else  : cfg = dict()
+
+    cfg.setdefault('bridges', dict())
+    cfg['bridges'].setdefault(rpc.STATE_PUBSUB,   dict())
+    cfg['bridges'].setdefault(rpc.CONTROL_PUBSUB, dict())
+
+    comp._uid = uid
+    rpu.Component.__init__(comp, cfg, session)
+
+    return comp
+
+
+# ------------------------------------------------------------------------------
+#
+def record_publisher(comp, pubsub=rpc.STATE_PUBSUB):
+    """
+    Let the component publish to a `Publisher` which records all messages on
+    the given pubsub, instead of to a pubsub bridge.
+    """
+
+    publisher = Publisher()
+
+    comp._publishers[pubsub] = publisher
+    comp._io_locks[pubsub]   = threading.Lock()
+
+    return publisher
+
+
+# ------------------------------------------------------------------------------
+#
+def create_executor(workdir, cfg):
+    """
+    Create a Popen executor which runs units in `workdir`, with the FORK launch
+    method, and start its watcher.  Units advanced by the executor are recorded
+    in `executor.done` (executed) and `executor.failed` (not executed).  Call
+    `finalize_child()` when done.
+    """
+
+    from radical.pilot.agent.executing.popen import Popen
+    from radical.pilot.agent.lm.fork         import Fork
+
+    cfg = dict(cfg)
+    cfg.setdefault('session_id', 'rp.session.test')
+    cfg.setdefault('pilot_id',   'pilot.0000')
+    cfg.setdefault('agent_name', 'agent_0')
+
+    executor = Popen.__new__(Popen)
+    executor._uid           = 'agent.executing.0000'
+    executor._log           = logging.getLogger('radical.pilot.test')
+    executor._prof          = Reporter()
+    executor._cfg           = cfg
+    executor._pwd           = workdir
+    executor._cu_tmp        = tempfile.gettempdir()
+    executor._env_cu_export = dict()
+    executor._terminate     = threading.Event()
+    executor.gtod           = '%s/gtod' % workdir
+
+    executor.done    = list()
+    executor.failed  = list()
+    executor.publish = lambda *args, **kwargs : None
+
+    def advance(cu, state, **kwargs):
+        if   state == rps.AGENT_STAGING_OUTPUT_PENDING: executor.done.append(cu)
+        elif state == rps.FAILED                      : executor.failed.append(cu)
+    executor.advance = advance
+
+    launcher = Fork.__new__(Fork)
+    launcher.name           = 'Fork'
+    launcher.launch_command = ''
+
+    executor._task_launcher = launcher
+    executor._mpi_launcher  = None
+
+    executor._configure_watch()
+    executor._configure_spawn()
+
+    executor._watcher = threading.Thread(target=executor._watch)
+    executor._watcher.daemon = True
+    executor._watcher.start()
+
+    return executor
+
+
+# ------------------------------------------------------------------------------
+#
+def create_executing_units(n, tag, executable='/bin/true', arguments=None):
+    """
+    Create `n` units which are ready to be handed to an executor.
+    """
+
+    units = list()
+    for i in range(n):
+        units.append({'uid'          : 'unit.%s.%06d' % (tag, i),
+                      'type'         : 'unit',
+                      'state'        : rps.AGENT_EXECUTING_PENDING,
+                      'opaque_slots' : {'task_slots'   : ['localhost:0'],
+                                        'task_offsets' : [0],
+                                        'lm_info'      : {}},
+                      'description'  : {'executable'   : executable,
+                                        'arguments'    : list(arguments or []),
+                                        'environment'  : {},
+                                        'pre_exec'     : [],
+                                        'post_exec'    : [],
+                                        'stdout'       : None,
+                                        'stderr'       : None,
+                                        'cores'        : 1,
+                                        'mpi'          : False}})
+    return units
+
+
+# ------------------------------------------------------------------------------
+#
+def create_umgr(session, uid='umgr.0000'):
+    """
+    Create a unit manager which can submit units, but has no components,
+    bridges or DB connection of its own.  Submitted units are dropped after
+    advancing them to `UMGR_SCHEDULING_PENDING`.  State updates can be fed
+    via `_update_units()`, and invoke callbacks and waiters as usual.
+    """
+
+    # the unit manager state which `submit_units()` and `wait_units()` need,
+    # as set by the constructor before initializing the component
+    umgr = rp.UnitManager.__new__(rp.UnitManager)
+    umgr._pilots      = dict()
+    umgr._pilots_lock = threading.RLock()
+    umgr._units       = dict()
+    umgr._units_lock  = threading.RLock()
+    umgr._waiters     = list()
+    umgr._cb_states   = dict()
+    umgr._callbacks   = dict()
+    umgr._cb_lock     = threading.RLock()
+    umgr._closed      = False
+    umgr._rec_id      = 0
+
+    for m in rpt.UMGR_METRICS:
+        umgr._callbacks[m] = dict()
+
+    umgr = create_component(session, cfg={'owner' : uid}, uid=uid, comp=umgr)
+    umgr._cb_dispatcher = rpu.CallbackDispatcher(1, umgr._log)
+
+    umgr.register_output(rps.UMGR_SCHEDULING_PENDING)
+    record_publisher(umgr)
+
+    return umgr
+
+
+# ------------------------------------------------------------------------------
+
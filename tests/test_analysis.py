@@ -0,0 +1,434 @@
+""" Regression tests for the vectorized profile analysis methods
+"""
+
+import random
+import unittest
+
+import numpy  as np
+import pandas as pd
+
+import radical.pilot.utils as rpu
+
+from radical.pilot.utils.analysis import info_names, _info_entries, \
+                                         _info_events, _info_pending, \
+                                         _info_premature_final
+
+
+#-----------------------------------------------------------------------------
+#
+# The row-wise implementations which the vectorized methods replaced.  We
+# keep them as reference for the regression tests below.
+#
+tmp = None
+t0  = None
+
+def _legacy_add_concurrency (frame, tgt, spec):
+    
+    import numpy as np
+
+    # create a temporary row over which we can do the commulative sum
+    # --------------------------------------------------------------------------
+    def _conc (row, spec):
+
+        # row must match any filter dict in 'spec[in/out]' 
+        # for any filter dict it must match all col/pat pairs
+
+        # for each in filter
+        for f in spec['in']:
+            match = 1 
+            # for each col/val in that filter
+            for col, pat in f.iteritems():
+                if row[col] != pat:
+                    match = 0
+                    break
+            if match:
+                # one filter matched!
+                return 1
+
+        # for each out filter
+        for f in spec['out']:
+            match = 1 
+            # for each col/val in that filter
+            for col, pat in f.iteritems():
+                if row[col] != pat:
+                    match = 0
+                    break
+            if match:
+                # one filter matched!
+                return -1
+
+        # no filter matched
+        return  np.NaN
+    # --------------------------------------------------------------------------
+
+    # we only want to later look at changes of the concurrency -- leading or trailing 
+    # idle times are to be ignored.  We thus set repeating values of the cumsum to NaN, 
+    # so that they can be filtered out when ploting: df.dropna().plot(...).  
+    # That specifically will limit the plotted time range to the area of activity. 
+    # The full time range can still be plotted when ommitting the dropna() call.
+    # --------------------------------------------------------------------------
+    def _time (x):
+        global tmp
+        if     x != tmp: tmp = x
+        else           : x   = np.NaN
+        return x
+
+
+    # --------------------------------------------------------------------------
+    # sanitize concurrency: negative values indicate incorrect event ordering,
+    # so we set the repesctive values to 0
+    # --------------------------------------------------------------------------
+    def _abs (x):
+        if x < 0:
+            return np.NaN
+        return x
+    # --------------------------------------------------------------------------
+    
+    frame[tgt] = frame.apply(lambda row: _conc(row, spec), axis=1).cumsum()
+    frame[tgt] = frame.apply(lambda row: _abs (row[tgt]),  axis=1)
+    frame[tgt] = frame.apply(lambda row: _time(row[tgt]),  axis=1)
+
+    return frame
+
+
+# ------------------------------------------------------------------------------
+#
+def _legacy_add_frequency(frame, tgt, window, spec):
+    
+    # --------------------------------------------------------------------------
+    def _freq(t, _tmp, _window):
+        # get sequence of frame which falls within the time window, and return
+        # length of that sequence
+        return len(_tmp.uid[(_tmp.time > t-_window) & (_tmp.time <= t)])
+    # --------------------------------------------------------------------------
+    
+    # filter the frame by the given spec
+    tmp = frame
+    for key,val in spec.iteritems():
+        tmp = tmp[tmp[key].isin([val])]
+    frame[tgt] = tmp.time.apply(_freq, args=[tmp, window])
+
+    return frame
+
+
+# ------------------------------------------------------------------------------
+#
+def _legacy_add_event_count(frame, tgt, spec):
+
+    # --------------------------------------------------------------------------
+    def _ecnt(t, _tmp):
+        # get sequence of frame which falls within the time window, and return
+        # length of that sequence
+        return len(_tmp.uid[(_tmp.time <= t)])
+    # --------------------------------------------------------------------------
+
+    # filter the frame by the given spec
+    tmp = frame
+    for key,val in spec.iteritems():
+        tmp = tmp[tmp[key].isin([val])]
+    frame[tgt] = tmp.time.apply(_ecnt, args=[tmp])
+
+    return frame
+
+
+# ------------------------------------------------------------------------------
+#
+def _legacy_calibrate_frame(frame, spec):
+
+    # --------------------------------------------------------------------------
+    def _find_t0 (row, spec):
+
+        # row must match any filter dict in 'spec[in/out]' 
+        # for any filter dict it must match all col/pat pairs
+        global t0
+        if t0 is not None:
+            # already found t0
+            return
+
+        # for each col/val in that filter
+        for f in spec:
+            match = 1 
+            for col, pat in f.iteritems():
+                if row[col] != pat:
+                    match = 0
+                    break
+            if match:
+                # one filter matched!
+                t0 = row['time']
+                return
+    # --------------------------------------------------------------------------
+
+    # --------------------------------------------------------------------------
+    def _calibrate (row, t0):
+
+        if t0 is None:
+            # no t0...
+            return
+
+        return row['time'] - t0
+    # --------------------------------------------------------------------------
+
+    # we need to iterate twice over the frame: first to find t0, then to
+    # calibrate the time axis
+    global t0
+    t0 = None # no t0
+    frame.apply(lambda row: _find_t0  (row, spec), axis=1)
+
+    if t0 == None:
+        print "Can't recalibrate, no matching timestamp found"
+        return
+    frame['time'] = frame.apply(lambda row: _calibrate(row, t0  ), axis=1)
+
+    return frame
+
+
+# ------------------------------------------------------------------------------
+#
+def _legacy_add_derived(df):
+    
+    import operator
+
+    # TODO: The fields these are derived from are outdated by now!
+    df['executor_queue'] = operator.sub(df['ewo_get'],      df['as_to_ewo'])
+    df['raw_runtime']    = operator.sub(df['ewa_complete'], df['ewo_launch'])
+    df['full_runtime']   = operator.sub(df['uw_push_done'], df['as_to_ewo'])
+    df['watch_delay']    = operator.sub(df['ewa_get'],      df['ewo_to_ewa'])
+    df['allocation']     = operator.sub(df['as_allocated'], df['a_to_as'])
+
+    # add a flag to indicate if a unit / pilot / ... is cloned
+    # --------------------------------------------------------------------------
+    def _cloned (row):
+        return 'clone' in row['uid'].lower()
+    # --------------------------------------------------------------------------
+    df['cloned'] = df.apply(lambda row: _cloned (row), axis=1)
+
+    return df
+
+
+# ------------------------------------------------------------------------------
+#
+def _legacy_add_info(df):
+
+    import numpy as np
+
+    # --------------------------------------------------------------------------
+    def _info (row):
+        for info, name, event, msg in _info_entries:
+            if  (row['name'] and name  in row['name'] ) and \
+                (not event   or  event == row['event']) and \
+                (not msg     or  msg   == row['msg']  ):
+                return info
+
+        ret = ""
+        n   = 0  # 
+        for pat, pre in info_names.iteritems():
+            if pat in row['name']:
+                ret += pre
+                n   += 1
+                break
+        for pat, ev in _info_events.iteritems():
+            if ret and pat == row['event']:
+                ret += ev
+                n   += 1
+                break
+        for pat, s in _info_pending.iteritems():
+            if ret and pat in row['state']:
+                ret += s
+                break
+        # Also create separate info entries for Canceled and Failed units
+        for pat, f in _info_premature_final.iteritems():
+            if ret and pat in row['state']:
+                ret += f
+                break
+
+        if ret and n >= 2:
+            return ret
+        else:
+            return np.NaN
+    # --------------------------------------------------------------------------
+    df['info'] = df.apply(lambda row: _info (row), axis=1)
+
+    return df
+
+
+# ------------------------------------------------------------------------------
+#
+def _legacy_add_states(df):
+    
+    import numpy as np
+
+    # --------------------------------------------------------------------------
+    _old_states = dict()
+    def _state_from (row):
+        old = np.NaN
+        if  row['uid']   and \
+            row['state'] and \
+            row['event'] == 'advance': 
+            old = _old_states.get(row['uid'], np.NaN)
+            if old == row['state']:
+                # no change in state...
+                old = np.NaN
+            else:
+                _old_states[row['uid']] = row['state']
+        return old
+    # --------------------------------------------------------------------------
+    df['state_from'] = df.apply(lambda row: _state_from(row), axis=1)
+
+    _old_states = dict()
+    # --------------------------------------------------------------------------
+    def _state (row):
+        if  not row['uid']:
+            return np.NaN
+        if row['state']:
+            _old_states[row['uid']] = row['state']
+        return _old_states.get(row['uid'], '')
+    # --------------------------------------------------------------------------
+    df['state'] = df.apply(lambda row: _state(row), axis=1)
+
+    return df
+
+
+
+#-----------------------------------------------------------------------------
+#
+def create_profile(n_units=50, seed=42):
+    """
+    create a profile frame (in the layout the analysis methods expect) with
+    the events and states the analysis methods look for, plus some noise:
+    events w/o uid, repeated and out-of-order state transitions, and
+    concurrent events.
+    """
+
+    rnd    = random.Random(seed)
+    names  = [e[1] for e in _info_entries] + info_names.keys() \
+           + ['MainThread', 'SomethingElse', '']
+    events = [e[2] for e in _info_entries] + _info_events.keys() + ['other']
+    msgs   = [e[3] for e in _info_entries] + ['', 'noise']
+    states = ['New', 'PendingInputStaging', 'StagingInput', 'Executing',
+              'StagingOutput', 'Done', 'Failed', 'Canceled',
+              'AgentStagingInputPending', '']
+
+    rows = list()
+    for u in range(n_units):
+        uid = 'unit.%06d' % u
+        if not u % 7:
+            uid += '.clone'
+        for _ in range(40):
+            rows.append({'time'  : round(rnd.uniform(0, 100), 1),
+                         'name'  : rnd.choice(names),
+                         'uid'   : rnd.choice([uid, uid, uid, '']),
+                         'state' : rnd.choice(states),
+                         'event' : rnd.choice(events),
+                         'msg'   : rnd.choice(msgs)})
+
+    frame = pd.DataFrame(rows, columns=['time', 'name', 'uid', 'state',
+                                        'event', 'msg'])
+    return frame.sort_values('time', kind='mergesort').reset_index(drop=True)
+
+
+#-----------------------------------------------------------------------------
+#
+class TestAnalysis(unittest.TestCase):
+
+    def setUp(self):
+
+        global tmp, t0
+        tmp = None
+        t0  = None
+
+        self.frame = create_profile()
+
+    def check(self, new, old, cols):
+
+        for col in cols:
+            pd.testing.assert_series_equal(new[col], old[col])
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__add_concurrency(self):
+        """ Test add_concurrency against the row-wise implementation.
+        """
+
+        spec = {'in'  : [{'state' : 'Executing', 'event' : 'advance'}],
+                'out' : [{'state' : 'Done'},
+                         {'state' : 'Failed'},
+                         {'state' : 'Canceled'}]}
+
+        new = rpu.add_concurrency(self.frame.copy(), 'conc', spec)
+        old = _legacy_add_concurrency(self.frame.copy(), 'conc', spec)
+
+        self.check(new, old, ['conc'])
+        assert new['conc'].notnull().any()
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__add_frequency(self):
+        """ Test add_frequency and add_event_count against the row-wise
+            implementations.
+        """
+
+        spec = {'event' : 'advance'}
+
+        new = rpu.add_frequency(self.frame.copy(), 'freq', 2.5, spec)
+        old = _legacy_add_frequency(self.frame.copy(), 'freq', 2.5, spec)
+        self.check(new, old, ['freq'])
+
+        new = rpu.add_event_count(self.frame.copy(), 'count', spec)
+        old = _legacy_add_event_count(self.frame.copy(), 'count', spec)
+        self.check(new, old, ['count'])
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__calibrate_frame(self):
+        """ Test calibrate_frame against the row-wise implementation.
+        """
+
+        spec = [{'state' : 'Executing'}, {'event' : 'exec'}]
+
+        new = rpu.calibrate_frame(self.frame.copy(), spec)
+        old = _legacy_calibrate_frame(self.frame.copy(), spec)
+        self.check(new, old, ['time'])
+
+        assert rpu.calibrate_frame(self.frame.copy(), [{'state' : 'x'}]) is None
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__add_info(self):
+        """ Test add_info and add_states against the row-wise implementations.
+        """
+
+        new = rpu.add_info(self.frame.copy())
+        old = _legacy_add_info(self.frame.copy())
+        self.check(new, old, ['info'])
+        assert new['info'].notnull().any()
+
+        new = rpu.add_states(self.frame.copy())
+        old = _legacy_add_states(self.frame.copy())
+        self.check(new, old, ['state_from', 'state'])
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__add_derived(self):
+        """ Test add_derived against the row-wise implementation.
+        """
+
+        cols  = ['ewo_get', 'as_to_ewo', 'ewa_complete', 'ewo_launch',
+                 'uw_push_done', 'ewa_get', 'ewo_to_ewa', 'as_allocated',
+                 'a_to_as']
+        frame = self.frame[self.frame['uid'] != ''].copy()
+        for i, col in enumerate(cols):
+            frame[col] = frame['time'] * (i + 1)
+
+        new = rpu.add_derived(frame.copy())
+        old = _legacy_add_derived(frame.copy())
+        self.check(new, old, ['executor_queue', 'raw_runtime', 'full_runtime',
+                              'watch_delay', 'allocation', 'cloned'])
+
+
+#-----------------------------------------------------------------------------
+
@@ -0,0 +1,220 @@
+""" Batched queue tests
+"""
+
+import time
+import unittest
+
+import zmq
+import msgpack
+
+import helpers
+
+from radical.pilot.utils.queue import Queue, QUEUE_BRIDGE, QUEUE_INPUT, \
+                                      QUEUE_OUTPUT
+
+
+#-----------------------------------------------------------------------------
+#
+class Consumer(object):
+    """
+    A bare consumer socket, which grants credits explicitly.
+    """
+
+    def __init__(self, ctx, addr):
+
+        self._q = ctx.socket(zmq.DEALER)
+        self._q.linger = 0
+        self._q.connect(addr)
+
+    def grant(self, credits):
+
+        self._q.send(msgpack.packb(credits))
+
+    def recv(self, timeout=1000):
+
+        if not self._q.poll(timeout=timeout):
+            return None
+        return msgpack.unpackb(self._q.recv())
+
+    def recv_all(self, timeout=500):
+
+        msgs = list()
+        bulk = self.recv(timeout)
+        while bulk is not None:
+            msgs += bulk
+            bulk  = self.recv(timeout)
+        return msgs
+
+    def close(self):
+
+        self._q.close()
+
+
+#-----------------------------------------------------------------------------
+#
+class TestBatchedQueue(unittest.TestCase):
+
+    def setUp(self):
+
+        self.session = helpers.Session()
+        self.ctx     = zmq.Context()
+        self.queues  = list()
+        self.cfg     = None
+
+    def tearDown(self):
+
+        for queue in reversed(self.queues):
+            queue.stop()
+
+        self.ctx.destroy(linger=0)
+        self.session.close()
+
+    def create(self, **bcfg):
+
+        bcfg['kind'] = 'batched'
+
+        bridge = Queue.create(self.session, 'test_queue', QUEUE_BRIDGE, bcfg)
+        self.queues.append(bridge)
+
+        bcfg['addr_in']  = str(bridge.addr_in)
+        bcfg['addr_out'] = str(bridge.addr_out)
+        self.cfg = {'bridges' : {'test_queue' : bcfg}}
+
+        return self.create_end(QUEUE_INPUT)
+
+    def create_end(self, role):
+
+        bcfg  = self.cfg['bridges']['test_queue']
+        addr  = bcfg['addr_out'] if role == QUEUE_OUTPUT else bcfg['addr_in']
+        queue = Queue.create(self.session, 'test_queue', role, self.cfg, addr)
+        self.queues.append(queue)
+
+        return queue
+
+    def consumer(self):
+
+        return Consumer(self.ctx, self.cfg['bridges']['test_queue']['addr_out'])
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__credits(self):
+        """ Test that the bridge sends one bulk per credit.
+        """
+
+        q_in     = self.create(bulk_size=2)
+        consumer = self.consumer()
+
+        for i in range(10):
+            q_in.put(i)
+
+        # no credits, no messages
+        assert consumer.recv(timeout=300) is None
+
+        consumer.grant(2)
+        assert consumer.recv() == [0, 1]
+        assert consumer.recv() == [2, 3]
+        assert consumer.recv(timeout=300) is None
+
+        consumer.grant(10)
+        assert consumer.recv_all() == [4, 5, 6, 7, 8, 9]
+
+        # credits left over are used for new messages
+        q_in.put(10)
+        assert consumer.recv() == [10]
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__lost_consumer(self):
+        """ Test that bulks for consumers which went away are requeued.
+        """
+
+        q_in  = self.create(bulk_size=1)
+        gone  = self.consumer()
+        alive = self.consumer()
+
+        # the first consumer is served first, but is gone by the time the
+        # messages arrive
+        gone.grant(5)
+        time.sleep(0.2)
+        alive.grant(1)
+        time.sleep(0.2)
+        gone.close()
+        time.sleep(0.2)
+
+        for i in range(5):
+            q_in.put(i)
+
+        assert alive.recv() == [0]
+        alive.grant(10)
+        assert alive.recv_all() == [1, 2, 3, 4]
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__flush_size(self):
+        """ Test that inputs send a batch once `flush_size` messages are put.
+        """
+
+        q_in  = self.create(bulk_size=0, flush_size=10, flush_time=60.0)
+        q_out = self.create_end(QUEUE_OUTPUT)
+
+        for i in range(9):
+            q_in.put(i)
+        assert q_out.get_nowait(300) is None
+
+        q_in.put(9)
+        assert q_out.get_nowait(1000) == range(10)
+
+        # lists are added as a whole
+        q_in.put(range(10, 25))
+        assert q_out.get_nowait(1000) == range(10, 25)
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__flush_time(self):
+        """ Test that inputs send a partial batch after `flush_time`.
+        """
+
+        q_in  = self.create(bulk_size=0, flush_size=10, flush_time=0.2)
+        q_out = self.create_end(QUEUE_OUTPUT)
+
+        start = time.time()
+        for i in range(3):
+            q_in.put(i)
+        assert q_out.get_nowait(2000) == range(3)
+        assert time.time() - start < 1.0
+
+        # and stopping the input flushes as well
+        q_in.put(3)
+        q_in.stop()
+        self.queues.remove(q_in)
+        assert q_out.get_nowait(2000) == [3]
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__ordering(self):
+        """ Test that consumers are served round-robin, and that all messages
+            arrive once, in order.
+        """
+
+        q_in      = self.create(bulk_size=1)
+        consumers = [self.consumer() for _ in range(3)]
+
+        for consumer in consumers:
+            consumer.grant(100)
+            time.sleep(0.1)
+
+        for i in range(300):
+            q_in.put(i)
+
+        msgs = [consumer.recv_all() for consumer in consumers]
+        for i in range(len(consumers)):
+            assert msgs[i] == range(i, 300, 3)
+
+
+#-----------------------------------------------------------------------------
+
@@ -0,0 +1,169 @@
+""" Binary profile tests
+"""
+
+import os
+import time
+import signal
+import shutil
+import tempfile
+import unittest
+
+import radical.pilot.utils as rpu
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+
+FIELDS = ['time', 'event', 'comp', 'thread', 'uid', 'state', 'msg']
+
+
+#-----------------------------------------------------------------------------
+#
+class TestBinaryProfile(unittest.TestCase):
+
+    def setUp(self):
+
+        self.pwd   = tempfile.mkdtemp(prefix='rp.test.')
+        self.fname = '%s/test.bprof' % self.pwd
+        self.rows  = list()
+
+        for i in range(100):
+            self.rows.append({'time'   : 1000.0 + i,
+                              'event'  : 'advance',
+                              'comp'   : 'agent_0',
+                              'thread' : 'MainThread',
+                              'uid'    : 'unit.%04d' % (i % 10),
+                              'state'  : 'STATE_%d' % (i / 10),
+                              'msg'    : ''})
+        self.write(self.rows)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.pwd)
+
+    def write(self, rows):
+
+        writer = rpu.BinaryProfileWriter(self.fname, chunk_size=16)
+        for row in rows:
+            writer.write(*[row[k] for k in FIELDS])
+        writer.close()
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__rows(self):
+        """ Test that records and queries round-trip through the profile.
+        """
+
+        bprof = rpu.BinaryProfile(self.fname)
+        assert len(bprof)    == 100
+        assert bprof.rows()  == self.rows
+        assert bprof.uids    == set(['unit.%04d' % i for i in range(10)])
+
+        rows = bprof.rows(uids=['unit.0003'], t_min=1020.0, t_max=1050.0)
+        assert rows == [row for row in self.rows
+                            if row['uid'] == 'unit.0003'
+                            and 1020.0 <= row['time'] <= 1050.0]
+        bprof.close()
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__index(self):
+        """ Test that the index is cached, and extended for appended chunks.
+        """
+
+        rpu.BinaryProfile(self.fname).close()
+        assert os.path.isfile(self.fname + rpu.BPROF_IDX_EXT)
+
+        more = [dict(row, time=row['time'] + 100.0) for row in self.rows]
+        self.write(more)
+
+        # a chunk which is still being written is ignored
+        with open(self.fname, 'a') as f:
+            f.write(rpu.BPROF_MAGIC + '\0' * 12)
+
+        bprof = rpu.BinaryProfile(self.fname)
+        assert len(bprof)   == 200
+        assert bprof.rows() == self.rows + more
+        bprof.close()
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__flush(self):
+        """ Test that buffered records are written on time and on SIGTERM.
+        """
+
+        fname  = '%s/flush.bprof' % self.pwd
+        writer = rpu.BinaryProfileWriter(fname, flush_interval=0.1)
+        for row in self.rows[:10]:
+            writer.write(*[row[k] for k in FIELDS])
+
+        start = time.time()
+        while not os.path.getsize(fname) and time.time() - start < 5.0:
+            time.sleep(0.1)
+        assert os.path.getsize(fname)
+
+        # the child is killed while its writer still buffers records
+        pid = os.fork()
+        if not pid:
+            try:
+                writer = rpu.BinaryProfileWriter(fname, flush_interval=100.0)
+                for row in self.rows[10:20]:
+                    writer.write(*[row[k] for k in FIELDS])
+                os.kill(os.getpid(), signal.SIGTERM)
+                time.sleep(5.0)
+            finally:
+                os._exit(1)
+
+        _, status = os.waitpid(pid, 0)
+        assert os.WIFSIGNALED(status)
+        assert os.WTERMSIG(status) == signal.SIGTERM
+
+        writer.close()
+        bprof = rpu.BinaryProfile(fname)
+        assert bprof.rows() == self.rows[:20]
+        bprof.close()
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__convert(self):
+        """ Test that converted CSV profiles read the same as the original.
+        """
+
+        src = '%s/test.prof' % self.pwd
+        with open(src, 'w') as f:
+            f.write('#%s\n' % ','.join(FIELDS))
+            for row in self.rows:
+                f.write('%.4f,%s,%s,%s,%s,%s,%s\n'
+                        % tuple([row[k] for k in FIELDS]))
+
+        tgt   = rpu.convert_profile(src)
+        profs = rpu.read_profiles([src, tgt])
+
+        assert tgt == '%s/test.bprof' % self.pwd
+        assert profs[src] == profs[tgt]
+
+
+    #-------------------------------------------------------------------------
+    #
+    @unittest.skipIf(pandas is None, 'pandas not available')
+    def test__frame(self):
+        """ Test that frames contain the same records as rows.
+        """
+
+        bprof = rpu.BinaryProfile(self.fname)
+        frame = bprof.frame(uids=['unit.0001', 'unit.0002'], t_max=1060.0)
+        rows  = bprof.rows (uids=['unit.0001', 'unit.0002'], t_max=1060.0)
+
+        assert rpu.frame2prof(frame) == rows
+        assert str(frame['uid'].dtype) == 'category'
+        bprof.close()
+
+
+#-----------------------------------------------------------------------------
+
@@ -0,0 +1,77 @@
+""" Callback dispatcher tests
+"""
+
+import time
+import logging
+import threading
+import unittest
+
+import radical.pilot.utils as rpu
+
+
+#-----------------------------------------------------------------------------
+#
+class TestCallbackDispatcher(unittest.TestCase):
+
+    #-------------------------------------------------------------------------
+    #
+    def test__ordering(self):
+        """ Test that calls with the same key run in order, on one thread.
+        """
+
+        calls = dict()
+        def cb(key, val):
+            calls.setdefault(key, list()).append([val, threading.current_thread()])
+
+        disp = rpu.CallbackDispatcher(4, logging.getLogger('radical.pilot.test'))
+        for val in range(100):
+            for key in ['unit.%04d' % i for i in range(10)]:
+                disp.dispatch(key, cb, key, val)
+        disp.stop()
+
+        assert len(calls) == 10
+        for key in calls:
+            assert [c[0] for c in calls[key]] == range(100)
+            assert len(set([c[1] for c in calls[key]])) == 1
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__slow_callback(self):
+        """ Test that slow callbacks don't block the dispatching thread, and
+            that failing callbacks don't stop the dispatcher.
+        """
+
+        done = list()
+        def slow(key):
+            time.sleep(0.5)
+            done.append(key)
+
+        def fail(key):
+            raise RuntimeError('oops')
+
+        disp  = rpu.CallbackDispatcher(1, logging.getLogger('radical.pilot.test'))
+        start = time.time()
+        disp.dispatch('a', fail, 'a')
+        disp.dispatch('a', slow, 'a')
+        disp.dispatch('b', slow, 'b')
+        assert time.time() - start < 0.5
+
+        disp.stop()
+        assert done == ['a', 'b']
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__inline(self):
+        """ Test that without threads, calls run right away.
+        """
+
+        done = list()
+        disp = rpu.CallbackDispatcher(0, logging.getLogger('radical.pilot.test'))
+        disp.dispatch('a', done.append, 'a')
+        assert done == ['a']
+
+
+#-----------------------------------------------------------------------------
+
@@ -0,0 +1,112 @@
+""" Component cancellation tests
+"""
+
+import time
+import unittest
+
+import radical.pilot.states    as rps
+import radical.pilot.constants as rpc
+
+from radical.pilot.utils.queue import Queue, QUEUE_BRIDGE, QUEUE_INPUT
+
+import helpers
+
+
+#-----------------------------------------------------------------------------
+#
+class TestCancel(unittest.TestCase):
+
+    def setUp(self):
+
+        cfg = {'bridges' : {'test_queue' : {'kind'     : 'inproc',
+                                            'addr_out' : 'inproc://test_queue'}}}
+
+        # we connect one inproc input queue, and record what gets published
+        self.session   = helpers.Session()
+        self.comp      = helpers.create_component(self.session, cfg)
+        self.publisher = helpers.record_publisher(self.comp)
+        self.bridge    = Queue.create(self.session, 'test_queue', QUEUE_BRIDGE,
+                                      cfg['bridges']['test_queue'])
+        self.input     = Queue.create(self.session, 'test_queue', QUEUE_INPUT,
+                                      self.comp.cfg)
+        self.done      = list()
+
+    def tearDown(self):
+
+        self.session.close()
+        self.bridge.stop()
+
+    def work(self, things):
+
+        self.done += [thing['uid'] for thing in things]
+
+    def things(self, n, state='TEST'):
+
+        return [{'uid'   : 'unit.%06d' % i,
+                 'type'  : 'unit',
+                 'state' : state} for i in range(n)]
+
+    def canceled(self):
+
+        ret = list()
+        for _, msg in self.publisher.msgs:
+            ret += [thing['uid'] for thing in msg['arg']
+                                 if  thing['state'] == rps.CANCELED]
+        return sorted(ret)
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__work_on(self):
+        """ Test that canceled things are not passed on to the worker.
+        """
+
+        comp = self.comp
+        comp.register_input('TEST', 'test_queue', self.work)
+        comp._cancel_monitor_cb(rpc.CONTROL_PUBSUB,
+                                {'cmd' : 'cancel_units',
+                                 'arg' : {'uids' : ['unit.000001',
+                                                    'unit.000003',
+                                                    'unit.000009']}})
+
+        self.input.put(self.things(5))
+        comp.work_cb()
+
+        assert self.done       == ['unit.000000', 'unit.000002', 'unit.000004']
+        assert self.canceled() == ['unit.000001', 'unit.000003']
+
+        # the cancel set only retains the unit we did not see
+        assert comp._cancel_set == set(['unit.000009'])
+
+        # all things canceled
+        self.input.put(self.things(10)[9:])
+        comp.work_cb()
+
+        assert len(self.done) == 3
+        assert not comp._cancel_set
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__prune(self):
+        """ Test that cancel requests are pruned once things are final.
+        """
+
+        comp   = self.comp
+        things = self.things(50000)
+        uids   = [thing['uid'] for thing in things]
+
+        start = time.time()
+        comp._cancel_monitor_cb(rpc.CONTROL_PUBSUB,
+                                {'cmd' : 'cancel_units',
+                                 'arg' : {'uids' : uids}})
+        assert len(comp._cancel_set) == 50000
+
+        comp.advance(things[:25000], rps.DONE,     publish=False, push=False)
+        comp.advance(things[25000:], rps.CANCELED, publish=False, push=False)
+        assert not comp._cancel_set
+        assert time.time() - start < 5
+
+
+#-----------------------------------------------------------------------------
+
@@ -0,0 +1,76 @@
+""" In-process (threaded) component tests
+"""
+
+import time
+import unittest
+
+import radical.pilot.utils     as rpu
+import radical.pilot.constants as rpc
+
+import helpers
+
+
+#-----------------------------------------------------------------------------
+#
+class TestComponentThread(unittest.TestCase):
+
+    def setUp(self):
+
+        cfg = {'bridges' : {rpc.LOG_PUBSUB     : dict(),
+                            rpc.STATE_PUBSUB   : dict(),
+                            rpc.CONTROL_PUBSUB : dict()}}
+
+        self.session = helpers.Session()
+        self.bridges = rpu.Component.start_bridges(cfg, self.session,
+                                                   self.session._log)
+        self.comp    = helpers.create_component(self.session, cfg)
+        self.calls   = 0
+
+    def tearDown(self):
+
+        self.session.close()
+
+        for bridge in self.bridges:
+            bridge.stop()
+
+    def idle(self):
+
+        # the idler thread ends once this returns False
+        self.calls += 1
+        return self.calls < 3
+
+    def wait_invalid(self, timeout):
+
+        start = time.time()
+        while time.time() - start < timeout:
+            if not self.comp.is_alive(strict=False):
+                return True
+            time.sleep(0.1)
+        return False
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__start_thread(self):
+        """ Test that a component runs in a thread, and is watched.
+        """
+
+        comp = self.comp
+        comp.start_thread()
+
+        # no watcher process and socket are involved
+        assert comp.is_child
+        assert not comp.has_child
+        assert comp.is_valid()
+        assert not self.wait_invalid(rpu.WATCH_INTERVAL * 2)
+
+        # a dying thread gets detected
+        comp.register_timed_cb(self.idle, timer=0.1)
+        assert self.wait_invalid(rpu.WATCH_INTERVAL * 5)
+        assert self.calls == 3
+
+        assert not comp.is_valid()
+
+
+#-----------------------------------------------------------------------------
+
@@ -0,0 +1,132 @@
+""" Component callback locking and worker thread tests
+"""
+
+import time
+import threading
+import unittest
+
+import radical.pilot.utils as rpu
+
+from radical.pilot.utils.queue import Queue, QUEUE_BRIDGE, QUEUE_INPUT
+
+import helpers
+
+
+#-----------------------------------------------------------------------------
+#
+class TestComponentWorkers(unittest.TestCase):
+
+    def setUp(self):
+
+        cfg = {'bridges' : {'test_queue' : {'kind'     : 'inproc',
+                                            'addr_out' : 'inproc://test_queue'}}}
+
+        self.session = helpers.Session()
+        self.comp    = helpers.create_component(self.session, cfg)
+        self.bridge  = Queue.create(self.session, 'test_queue', QUEUE_BRIDGE,
+                                    cfg['bridges']['test_queue'])
+        self.input   = Queue.create(self.session, 'test_queue', QUEUE_INPUT,
+                                    self.comp.cfg)
+        self.done    = list()
+
+    def tearDown(self):
+
+        self.session.close()
+        self.bridge.stop()
+
+    def work(self, things):
+
+        time.sleep(0.2)
+        self.done.append([threading.current_thread().name,
+                          [thing['uid'] for thing in things]])
+
+    def things(self, n):
+
+        return [{'uid'   : 'unit.%04d' % i,
+                 'type'  : 'unit',
+                 'state' : 'TEST'} for i in range(n)]
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__lock_policies(self):
+        """ Test that callback locks are assigned per policy.
+        """
+
+        comp = self.comp
+
+        assert comp._get_cb_lock(None, 'a')                  is comp._cb_lock
+        assert comp._get_cb_lock(rpu.CB_LOCK_EXCLUSIVE, 'a') is comp._cb_lock
+
+        lock_a = comp._get_cb_lock(rpu.CB_LOCK_CHANNEL, 'a')
+        lock_b = comp._get_cb_lock(rpu.CB_LOCK_CHANNEL, 'b')
+        assert lock_a is comp._get_cb_lock(rpu.CB_LOCK_CHANNEL, 'a')
+        assert lock_a is not lock_b
+        assert lock_a is not comp._cb_lock
+
+        with comp._get_cb_lock(rpu.CB_LOCK_NONE, 'a'):
+            pass
+
+        with self.assertRaises(ValueError):
+            comp._get_cb_lock('unknown', 'a')
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__worker_threads(self):
+        """ Test that several threads work on an input concurrently.
+        """
+
+        comp = self.comp
+        comp.register_input('TEST', 'test_queue', self.work, threads=4,
+                            lock=rpu.CB_LOCK_NONE)
+
+        # threads are only started by the component's work loop, which has no
+        # other input to serve
+        assert len(comp._to_start) == 4
+        start = time.time()
+        comp.work_cb()
+        assert not comp._to_start
+
+        things = self.things(8)
+        for i in range(4):
+            self.input.put(things[i * 2:i * 2 + 2])
+
+        while len(self.done) < 4 and time.time() - start < 5:
+            time.sleep(0.01)
+
+        assert time.time() - start < 0.6
+        assert sorted(sum([uids for _, uids in self.done], [])) \
+                == [thing['uid'] for thing in things]
+        assert len(set([name for name, _ in self.done])) > 1
+
+        comp.unregister_input('TEST', 'test_queue', self.work)
+        assert not comp._threads
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__exclusive(self):
+        """ Test that the default policy serializes worker invocations.
+        """
+
+        comp = self.comp
+        comp.register_input('TEST', 'test_queue', self.work)
+
+        self.input.put(self.things(1))
+
+        # a worker invoked by the work loop holds the component lock
+        holder = threading.Thread(target=comp.work_cb)
+        holder.start()
+        time.sleep(0.1)
+
+        assert not comp._cb_lock.acquire(False)
+
+        holder.join()
+        assert comp._cb_lock.acquire(False)
+        comp._cb_lock.release()
+        assert len(self.done) == 1
+
+
+#-----------------------------------------------------------------------------
+
@@ -0,0 +1,111 @@
+""" Profile and logfile bundle fetching tests
+"""
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+import pymongo
+import radical.utils       as ru
+import radical.pilot.utils as rpu
+
+import helpers
+
+DBURL = helpers.DBURL
+
+
+#-----------------------------------------------------------------------------
+#
+@helpers.requires_db
+class TestFetchBundles(unittest.TestCase):
+
+    def setUp(self):
+
+        self.sid   = ru.generate_id('rp.session.test.%(counter)04d', ru.ID_CUSTOM)
+        self.pwd   = tempfile.mkdtemp(prefix='rp.test.')
+        self.mongo = pymongo.MongoClient(DBURL)
+        self.coll  = self.mongo.get_default_database()[self.sid]
+
+        self.coll.insert({'_id'  : self.sid,
+                          'uid'  : self.sid,
+                          'type' : 'session'})
+
+        # pilot 0 and 1 have bundles, pilot 2 has only individual files, and
+        # pilot 3 has the empty bundle created on pilot startup.
+        for i in range(4):
+
+            pid     = 'pilot.%04d' % i
+            sandbox = '%s/sandbox/%s' % (self.pwd, pid)
+            os.makedirs(sandbox)
+
+            for name in ['agent_0.prof', 'agent_0.log', 'agent_0.cfg']:
+                with open('%s/%s' % (sandbox, name), 'w') as f:
+                    f.write('%s %s\n' % (pid, name))
+
+            if i < 2:
+                for ext, names in [['prof', ['agent_0.prof']],
+                                   ['log',  ['agent_0.log', 'agent_0.cfg']]]:
+                    tarball = tarfile.open('%s/%s.%s.tgz'
+                                           % (sandbox, pid, ext), 'w:gz')
+                    for name in names:
+                        tarball.add('%s/%s' % (sandbox, name), name)
+                    tarball.close()
+
+            elif i == 3:
+                open('%s/%s.prof.tgz' % (sandbox, pid), 'w').close()
+
+            self.coll.insert({'_id'           : pid,
+                              'uid'           : pid,
+                              'type'          : 'pilot',
+                              'pilot_sandbox' : 'file://localhost%s/' % sandbox})
+
+    def tearDown(self):
+
+        self.coll.drop()
+        self.mongo.close()
+        shutil.rmtree(self.pwd)
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__fetch_profiles(self):
+        """ Test that profiles are fetched from bundles or as files.
+        """
+
+        tgt   = '%s/tgt' % self.pwd
+        profs = rpu.fetch_profiles(self.sid, dburl=DBURL, tgt=tgt,
+                                   concurrency=2)
+
+        expected = ['%s/%s/pilot.%04d/agent_0.prof' % (tgt, self.sid, i)
+                    for i in range(4)]
+
+        assert sorted([os.path.normpath(p) for p in profs]) == expected
+        for i, fname in enumerate(expected):
+            assert open(fname).read() == 'pilot.%04d agent_0.prof\n' % i
+
+        # bundles are removed after extraction
+        assert not os.path.exists('%s/%s/pilot.0000.prof.tgz' % (tgt, self.sid))
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__fetch_logfiles(self):
+        """ Test that logfiles are fetched, and bundles are fully extracted.
+        """
+
+        tgt  = '%s/tgt' % self.pwd
+        logs = rpu.fetch_logfiles(self.sid, dburl=DBURL, tgt=tgt)
+
+        expected = ['%s/%s/pilot.%04d/agent_0.log' % (tgt, self.sid, i)
+                    for i in range(4)]
+
+        assert sorted([os.path.normpath(l) for l in logs]) == expected
+        for i in range(2):
+            assert os.path.isfile('%s/%s/pilot.%04d/agent_0.cfg'
+                                  % (tgt, self.sid, i))
+
+
+#-----------------------------------------------------------------------------
+
@@ -0,0 +1,182 @@
+""" Popen executor tests
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import radical.pilot.states as rps
+
+from radical.pilot.agent.executing import popen
+
+import helpers
+
+
+def open_fds():
+
+    return len(os.listdir('/proc/self/fd'))
+
+
+#-----------------------------------------------------------------------------
+#
+class TestPopen(unittest.TestCase):
+
+    def setUp(self):
+
+        self.pwd      = tempfile.mkdtemp(prefix='rp.test.')
+        self.executor = None
+
+    def tearDown(self):
+
+        if self.executor:
+            self.executor.finalize_child()
+        shutil.rmtree(self.pwd)
+
+    def create(self, **cfg):
+
+        self.executor = helpers.create_executor(self.pwd, cfg)
+        return self.executor
+
+    def wait(self, n, timeout=30.0):
+
+        executor = self.executor
+        start    = time.time()
+        while len(executor.done) + len(executor.failed) < n:
+            assert time.time() - start < timeout, 'units not reaped'
+            time.sleep(0.05)
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__fds(self):
+        """ Test that a bulk does not hold files open for all its units.
+        """
+
+        executor = self.create(sandbox_threads=8)
+        spawn    = executor.spawn
+        fds      = list()
+
+        def counting_spawn(*args, **kwargs):
+            fds.append(open_fds())
+            return spawn(*args, **kwargs)
+        executor.spawn = counting_spawn
+
+        before = open_fds()
+        executor.work(helpers.create_executing_units(200, 'fds'))
+        self.wait(200)
+
+        assert len(executor.done) == 200
+        assert max(fds) - before < 50
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__fds_on_error(self):
+        """ Test that units which can't be spawned don't leak files.
+        """
+
+        executor = self.create()
+
+        def broken_template(launcher, descr):
+            raise RuntimeError('no template')
+        executor._get_template = broken_template
+
+        before = open_fds()
+        executor.work(helpers.create_executing_units(50, 'error'))
+
+        assert len(executor.failed) == 50
+        assert open_fds() == before
+
+
+    #-------------------------------------------------------------------------
+    #
+    def check_reaped(self, n):
+
+        executor = self.executor
+        self.wait(n)
+
+        assert len(executor.done) == n
+        assert not executor.failed
+        assert not executor._cus_to_watch
+
+        for cu in executor.done:
+            if cu['description']['executable'] == '/bin/false':
+                assert cu['exit_code']    == 1
+                assert cu['target_state'] == rps.FAILED
+            else:
+                assert cu['exit_code']    == 0
+                assert cu['target_state'] == rps.DONE
+            assert 'utime' in cu['rusage']
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__reap_pidfd(self):
+        """ Test that exited units are detected via pidfds.
+        """
+
+        fd = popen._pidfd_open(os.getpid())
+        if fd is None:
+            self.skipTest('no pidfd support')
+        os.close(fd)
+
+        # the poll delay is only used to check for termination -- units must
+        # be reaped as soon as they exit
+        executor = self.create(db_poll_sleeptime=10.0)
+        assert executor._use_pidfd
+
+        units = helpers.create_executing_units(10, 'pidfd', '/bin/sleep', ['0.1']) \
+              + helpers.create_executing_units(10, 'pidfd.false', '/bin/false')
+        start = time.time()
+        executor.work(units)
+        self.check_reaped(20)
+        assert time.time() - start < 5.0
+        assert not executor._pidfds
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__reap_polling(self):
+        """ Test that exited units are detected by polling without pidfds.
+        """
+
+        pidfd_open = popen._pidfd_open
+        try:
+            popen._pidfd_open = lambda pid: None
+            executor = self.create(db_poll_sleeptime=0.1)
+        finally:
+            popen._pidfd_open = pidfd_open
+
+        assert not executor._use_pidfd
+        assert executor._poll_delay == 0.1
+
+        units = helpers.create_executing_units(10, 'poll', '/bin/sleep', ['0.1']) \
+              + helpers.create_executing_units(10, 'poll.false', '/bin/false')
+        executor.work(units)
+        self.check_reaped(20)
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__reap_many(self):
+        """ Test that many units exiting at once are all reaped once.
+        """
+
+        executor = self.create(db_poll_sleeptime=0.1, sandbox_threads=8)
+
+        units = helpers.create_executing_units(150, 'many') \
+              + helpers.create_executing_units(50, 'many.false', '/bin/false')
+        executor.work(units)
+        self.check_reaped(200)
+
+        uids = [cu['uid'] for cu in executor.done]
+        assert len(set(uids)) == 200
+
+        # nothing is left to reap
+        self.assertRaises(OSError, os.waitpid, -1, os.WNOHANG)
+
+
+#-----------------------------------------------------------------------------
+
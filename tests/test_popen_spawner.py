@@ -0,0 +1,233 @@
+""" Popen spawner helper tests
+"""
+
+import os
+import time
+import errno
+import shutil
+import select
+import signal
+import logging
+import tempfile
+import unittest
+
+import radical.pilot.states as rps
+
+from radical.pilot.agent.executing import popen
+
+import helpers
+
+
+#-----------------------------------------------------------------------------
+#
+class TestSpawner(unittest.TestCase):
+    """ Test the protocol of the spawner helper.
+    """
+
+    def setUp(self):
+
+        self.pwd     = tempfile.mkdtemp(prefix='rp.test.')
+        self.spawner = popen._Spawner(logging.getLogger('radical.pilot.test'))
+
+    def tearDown(self):
+
+        self.spawner.stop()
+        shutil.rmtree(self.pwd)
+
+    def spawn(self, uid, args, cwd=None):
+
+        self.spawner.spawn(uid, args, cwd or self.pwd,
+                           '%s/%s.out' % (self.pwd, uid),
+                           '%s/%s.err' % (self.pwd, uid))
+
+    def events(self, n, timeout=10.0):
+
+        events = list()
+        start  = time.time()
+        while len(events) < n:
+            assert time.time() - start < timeout, 'missing events'
+            select.select([self.spawner], [], [], 0.1)
+            evs = self.spawner.events()
+            assert evs is not None, 'spawner helper died'
+            events += evs
+
+        return events
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__spawn(self):
+        """ Test that spawned units report start and exit, with output.
+        """
+
+        self.spawn('unit.0000', 'echo hello; echo world >&2; exit 3')
+
+        started, exited = self.events(2)
+        assert started['ev']  == 'started'
+        assert started['uid'] == 'unit.0000'
+        assert exited['ev']   == 'exited'
+        assert exited['uid']  == 'unit.0000'
+        assert exited['pid']  == started['pid']
+
+        assert os.WIFEXITED(exited['status'])
+        assert os.WEXITSTATUS(exited['status']) == 3
+        for key in ['utime', 'stime', 'maxrss']:
+            assert key in exited
+
+        with open('%s/unit.0000.out' % self.pwd) as f:
+            assert f.read() == 'hello\n'
+        with open('%s/unit.0000.err' % self.pwd) as f:
+            assert f.read() == 'world\n'
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__kill(self):
+        """ Test that units can be killed, and are reported as signaled.
+        """
+
+        self.spawn('unit.0000', 'exec sleep 100')
+        started = self.events(1)[0]
+        assert started['ev'] == 'started'
+
+        self.spawner.kill('unit.0000')
+        exited = self.events(1)[0]
+        assert exited['ev'] == 'exited'
+        assert os.WIFSIGNALED(exited['status'])
+        assert os.WTERMSIG(exited['status']) == signal.SIGKILL
+
+        # killing units which are gone is a no-op
+        self.spawner.kill('unit.0000')
+        self.spawner.kill('unit.9999')
+        self.spawn('unit.0001', 'true')
+        assert [ev['ev'] for ev in self.events(2)] == ['started', 'exited']
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__bad_cwd(self):
+        """ Test that units which can't be set up exit with 127.
+        """
+
+        self.spawn('unit.0000', 'true', cwd='%s/missing' % self.pwd)
+
+        started, exited = self.events(2)
+        assert started['ev'] == 'started'
+        assert exited['ev']  == 'exited'
+        assert os.WEXITSTATUS(exited['status']) == 127
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__many(self):
+        """ Test that events for many units arrive complete, once per unit.
+        """
+
+        uids = ['unit.%04d' % i for i in range(200)]
+        for uid in uids:
+            self.spawn(uid, 'exit %d' % (int(uid[-4:]) % 7))
+
+        events  = self.events(400)
+        started = dict()
+        exited  = dict()
+        for ev in events:
+            if ev['ev'] == 'started':
+                assert ev['uid'] not in exited
+                started[ev['uid']] = ev['pid']
+            else:
+                assert ev['ev'] == 'exited'
+                exited[ev['uid']] = ev
+
+        assert sorted(started) == uids
+        assert sorted(exited)  == uids
+        for uid in uids:
+            assert exited[uid]['pid'] == started[uid]
+            assert os.WEXITSTATUS(exited[uid]['status']) == int(uid[-4:]) % 7
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__eof(self):
+        """ Test that the helper terminates when its input is closed.
+        """
+
+        self.spawner.stop()
+        assert self.spawner._proc.returncode == 0
+        assert self.spawner.events() is None
+
+
+#-----------------------------------------------------------------------------
+#
+class TestSpawnerDeath(unittest.TestCase):
+    """ Test how the executor handles spawner helpers which die.
+    """
+
+    def setUp(self):
+
+        self.pwd      = tempfile.mkdtemp(prefix='rp.test.')
+        self.executor = helpers.create_executor(self.pwd,
+                                                {'spawner_helpers'   : 1,
+                                                 'db_poll_sleeptime' : 0.1})
+        self.pids     = list()
+
+    def tearDown(self):
+
+        # units of dead helpers are not killed
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+        self.executor.finalize_child()
+        shutil.rmtree(self.pwd)
+
+    def wait(self, check, timeout=10.0):
+
+        start = time.time()
+        while not check():
+            assert time.time() - start < timeout, 'timeout'
+            time.sleep(0.05)
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__helper_death(self):
+        """ Test that the units of a dead helper fail, and that new units are
+            spawned by the executor itself.
+        """
+
+        executor = self.executor
+        spawner  = executor._spawners[0]
+
+        executor.work(helpers.create_executing_units(5, 'lost', '/bin/sleep',
+                                                     ['100']))
+
+        def started():
+            cus = executor._cus_to_watch.values()
+            return len(cus) == 5 and all([cu['proc'].pid for cu in cus])
+        self.wait(started)
+        self.pids = [cu['proc'].pid for cu in executor._cus_to_watch.values()]
+
+        spawner._proc.kill()
+        spawner._proc.wait()
+
+        self.wait(lambda: len(executor.done) == 5)
+        assert not executor._spawners
+        assert not executor._cus_to_watch
+        for cu in executor.done:
+            assert cu['exit_code']    == -1
+            assert cu['target_state'] == rps.FAILED
+            assert 'lost the spawner' in cu['stderr']
+
+        executor.work(helpers.create_executing_units(5, 'forked'))
+        self.wait(lambda: len(executor.done) == 10)
+        for cu in executor.done[5:]:
+            assert cu['exit_code'] == 0
+            assert 'rusage' in cu
+        assert not executor.failed
+
+
+#-----------------------------------------------------------------------------
+
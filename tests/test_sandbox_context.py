@@ -0,0 +1,80 @@
+""" Sandbox context tests
+"""
+
+import unittest
+
+import radical.utils as ru
+
+from radical.pilot.staging_directives import get_sandbox_context
+
+
+PILOT_SANDBOX    = 'sftp://host.edu/home/u/radical.pilot.sandbox/rp.session.0000/pilot.0000/'
+RESOURCE_SANDBOX = 'sftp://host.edu/home/u/radical.pilot.sandbox'
+
+
+#-----------------------------------------------------------------------------
+#
+class TestSandboxContext(unittest.TestCase):
+
+    def unit(self, uid, unit_sandbox=None):
+
+        if not unit_sandbox:
+            unit_sandbox = '%s/%s/' % (PILOT_SANDBOX, uid)
+
+        return {'uid'              : uid,
+                'unit_sandbox'     : unit_sandbox,
+                'pilot_sandbox'    : PILOT_SANDBOX,
+                'resource_sandbox' : RESOURCE_SANDBOX}
+
+    def localize(self, url):
+
+        url        = ru.Url(url)
+        url.schema = 'file'
+        url.host   = 'localhost'
+        return url
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__remote(self):
+        """ Test that the remote context uses the unit's sandbox strings.
+        """
+
+        cache = dict()
+        for i in range(3):
+            unit = self.unit('unit.%04d' % i)
+            ctx  = get_sandbox_context(unit, cache)
+
+            assert ctx['unit']     == unit['unit_sandbox']
+            assert ctx['pilot']    == PILOT_SANDBOX
+            assert ctx['resource'] == RESOURCE_SANDBOX
+            assert ctx['endpoint'] == 'sftp://host.edu/'
+            assert ctx['path']     == ru.Url(unit['unit_sandbox']).path
+
+        # the pilot context is only computed once
+        assert cache.keys() == [PILOT_SANDBOX]
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__local(self):
+        """ Test that the local context translates sandboxes to file://.
+        """
+
+        cache   = dict()
+        custom  = 'sftp://host.edu/scratch/unit.0001/'
+        units   = [self.unit('unit.0000'), self.unit('unit.0001', custom)]
+
+        for unit in units:
+            ctx = get_sandbox_context(unit, cache, local=True)
+
+            unit_sandbox = self.localize(unit['unit_sandbox'])
+            assert ctx['unit']     == str(unit_sandbox)
+            assert ctx['pilot']    == str(self.localize(PILOT_SANDBOX))
+            assert ctx['resource'] == str(self.localize(RESOURCE_SANDBOX))
+            assert ctx['endpoint'] == 'file://localhost/'
+            assert ctx['path']     == unit_sandbox.path
+
+
+#-----------------------------------------------------------------------------
+
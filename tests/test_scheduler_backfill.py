@@ -0,0 +1,242 @@
+""" Agent scheduler wait pool and backfill tests
+"""
+
+import unittest
+
+import radical.pilot.utils     as rpu
+import radical.pilot.states    as rps
+import radical.pilot.constants as rpc
+
+from radical.pilot.utils.queue                     import Queue, QUEUE_OUTPUT
+from radical.pilot.agent.scheduler.base            import WaitPool
+from radical.pilot.agent.scheduler.continuous_fast import ContinuousFast
+
+import helpers
+
+
+def unit(uid, cores):
+
+    return {'uid'          : uid,
+            'type'         : 'unit',
+            'state'        : rps.AGENT_SCHEDULING_PENDING,
+            'description'  : {'cores' : cores},
+            'opaque_slots' : None}
+
+
+#-----------------------------------------------------------------------------
+#
+class TestWaitPool(unittest.TestCase):
+
+    def setUp(self):
+
+        self.pool = WaitPool()
+        for uid, cores in [['a', 2], ['b', 1], ['c', 4], ['d', 1], ['e', 2]]:
+            self.pool.append(unit(uid, cores))
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__order(self):
+        """ Test that units leave the pool in arrival order.
+        """
+
+        pool = self.pool
+        uids = list()
+
+        assert len(pool) == 5
+
+        while pool.head():
+            cu = pool.head()
+            assert cu is pool.pop(cu['description']['cores'])
+            uids.append(cu['uid'])
+
+        assert uids == ['a', 'b', 'c', 'd', 'e']
+        assert len(pool) == 0
+        assert pool.head() is None
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__sizes(self):
+        """ Test the lookup of units by size.
+        """
+
+        pool = self.pool
+
+        assert pool.head_of(1)['uid'] == 'b'
+        assert pool.head_of(2)['uid'] == 'a'
+        assert pool.head_of(3) is None
+
+        assert pool.sizes_below(1) == []
+        assert pool.sizes_below(4) == [1, 2]
+        assert pool.sizes_below(5) == [1, 2, 4]
+
+        # units taken out of order leave the arrival order of the others intact
+        assert pool.pop(1)['uid'] == 'b'
+        assert pool.pop(1)['uid'] == 'd'
+        assert pool.head_of(1)     is None
+        assert pool.sizes_below(4) == [2]
+        assert pool.head()['uid']  == 'a'
+
+        assert pool.pop(2)['uid']  == 'a'
+        assert pool.head()['uid']  == 'c'
+
+
+#-----------------------------------------------------------------------------
+#
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+
+        self.session = helpers.Session()
+
+    def tearDown(self):
+
+        self.session.close()
+
+        for bridge in self.bridges:
+            bridge.stop()
+
+    def create(self, backfill):
+
+        # two nodes with 4 cores each
+        cfg = {'pilot_id'                 : 'pilot.0000',
+               'scheduler_backfill'       : backfill,
+               'scheduler_backfill_limit' : 3,
+               'lrms_info'                : {'name'           : 'test',
+                                             'lm_info'        : dict(),
+                                             'node_list'      : ['node_0',
+                                                                 'node_1'],
+                                             'cores_per_node' : 4},
+               'bridges' : {rpc.AGENT_SCHEDULING_QUEUE  : {'kind' : 'inproc'},
+                            rpc.AGENT_EXECUTING_QUEUE   : {'kind' : 'inproc'},
+                            rpc.AGENT_UNSCHEDULE_PUBSUB : dict(),
+                            rpc.AGENT_RESCHEDULE_PUBSUB : dict()}}
+
+        self.bridges = rpu.Component.start_bridges(cfg, self.session,
+                                                   self.session._log)
+
+        sched = helpers.create_component(self.session, cfg,
+                                         uid='agent.scheduling.0000',
+                                         comp=ContinuousFast.__new__(ContinuousFast))
+        helpers.record_publisher(sched)
+        sched.initialize_child()
+
+        self.executing = Queue.create(self.session, rpc.AGENT_EXECUTING_QUEUE,
+                                      QUEUE_OUTPUT, sched.cfg)
+        self.units     = dict()
+        self.sched     = sched
+
+    def submit(self, *specs):
+
+        units = list()
+        for uid, cores in specs:
+            self.units[uid] = unit(uid, cores)
+            units.append(self.units[uid])
+
+        self.sched.work(units)
+
+    def finish(self, *uids):
+
+        # the scheduler also reschedules on the notification published by
+        # `unschedule_cb()`, but we don't wait for that
+        for uid in uids:
+            self.sched.unschedule_cb(rpc.AGENT_UNSCHEDULE_PUBSUB,
+                                     self.units[uid])
+            self.sched.reschedule_cb(rpc.AGENT_RESCHEDULE_PUBSUB,
+                                     self.units[uid])
+
+    def scheduled(self):
+
+        ret = list()
+        while True:
+            units = self.executing.get_nowait(10)
+            if not units:
+                return ret
+            ret += [cu['uid'] for cu in units]
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__fifo(self):
+        """ Test that without backfilling, no unit passes a blocked unit.
+        """
+
+        self.create(backfill=False)
+
+        self.submit(*[['f%d' % i, 1] for i in range(8)])
+        assert len(self.scheduled()) == 8
+
+        self.submit(['big', 8], ['s0', 1], ['s1', 1])
+        self.finish('f0', 'f1')
+        assert self.scheduled() == []
+
+        self.finish('f2', 'f3', 'f4', 'f5', 'f6', 'f7')
+        assert self.scheduled() == ['big']
+
+        self.finish('big')
+        assert self.scheduled() == ['s0', 's1']
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__backfill_limit(self):
+        """ Test that backfilled units don't starve a blocked unit.
+        """
+
+        self.create(backfill=True)
+
+        self.submit(*[['f%d' % i, 1] for i in range(8)])
+        assert len(self.scheduled()) == 8
+
+        # 'big' is blocked, and smaller units are backfilled as cores free up
+        self.submit(['big', 8], ['s0', 1], ['s1', 2], ['s2', 1])
+        self.finish('f0')
+        assert self.scheduled() == ['s0']
+        self.finish('f1')
+        assert self.scheduled() == ['s2']
+        self.finish('f2')
+        assert self.scheduled() == []
+        self.finish('f3')
+        assert self.scheduled() == ['s1']
+
+        # the limit is reached: freed cores are kept for 'big', and neither
+        # waiting nor newly arriving units pass it anymore
+        self.finish('f4')
+        self.submit(['s3', 1])
+        assert self.scheduled() == []
+
+        self.finish('f5', 'f6', 'f7', 's0', 's2')
+        assert self.scheduled() == []
+
+        self.finish('s1')
+        assert self.scheduled() == ['big']
+
+        # once 'big' is done, the others follow
+        self.finish('big')
+        assert self.scheduled() == ['s3']
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__backfill_sizes(self):
+        """ Test that larger units are backfilled when smaller ones don't fit.
+        """
+
+        self.create(backfill=True)
+
+        self.submit(*[['f%d' % i, 1] for i in range(8)])
+        assert len(self.scheduled()) == 8
+
+        # 's4' needs a free node, while 'm5' can span node boundaries
+        self.submit(['big', 8], ['s4', 4], ['m5', 5])
+        self.finish('f1', 'f2', 'f3', 'f4')
+        assert self.scheduled() == []
+
+        # node_0:1-3 and node_1:0-1 are free now
+        self.finish('f5')
+        assert self.scheduled() == ['m5']
+
+
+#-----------------------------------------------------------------------------
+
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import random
+import logging
+
+from radical.pilot.agent.scheduler.continuous      import Continuous
+from radical.pilot.agent.scheduler.continuous_fast import ContinuousFast
+
+
+# ------------------------------------------------------------------------------
+#
+def create_scheduler(cls, nodes, cores_per_node):
+
+    # we only exercise the slot allocator, so we skip the component setup
+    sched = cls.__new__(cls)
+    sched._uid                 = 'agent.scheduling.0000'
+    sched._log                 = logging.getLogger('radical.pilot.test')
+    sched._lrms_info           = {'name' : 'test'}
+    sched._lrms_lm_info        = dict()
+    sched._lrms_node_list      = nodes
+    sched._lrms_cores_per_node = cores_per_node
+    sched._configure()
+
+    return sched
+
+
+# ------------------------------------------------------------------------------
+#
+def test_continuous_fast():
+    """
+    ContinuousFast must hand out exactly the same slots as Continuous for any
+    sequence of allocations and releases.
+    """
+
+    random.seed(42)
+
+    for _ in range(100):
+
+        n_nodes        = random.randint(1, 16)
+        cores_per_node = random.randint(1, 16)
+        nodes          = ['node_%03d' % i for i in range(n_nodes)]
+
+        old   = create_scheduler(Continuous,     nodes, cores_per_node)
+        new   = create_scheduler(ContinuousFast, nodes, cores_per_node)
+        alloc = list()
+
+        for _ in range(200):
+
+            if alloc and random.random() < 0.4:
+                slots = alloc.pop(random.randrange(len(alloc)))
+                old._release_slot(slots)
+                new._release_slot(slots)
+
+            else:
+                if random.random() < 0.7:
+                    cores = random.randint(1, cores_per_node)
+                else:
+                    cores = random.randint(1, n_nodes * cores_per_node)
+
+                old_slots = old._allocate_slot(cores)
+                new_slots = new._allocate_slot(cores)
+
+                assert old_slots == new_slots, (cores, old_slots, new_slots)
+
+                if old_slots:
+                    alloc.append(old_slots)
+
+            assert old.slot_status()['slotstate'] == \
+                   new.slot_status()['slotstate']
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    test_continuous_fast()
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,110 @@
+""" Session cache tests
+"""
+
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+
+import pymongo
+import radical.utils       as ru
+import radical.pilot.utils as rpu
+
+import helpers
+
+DBURL = helpers.DBURL
+
+
+#-----------------------------------------------------------------------------
+#
+@helpers.requires_db
+class TestSessionCache(unittest.TestCase):
+
+    def setUp(self):
+
+        self.sid   = ru.generate_id('rp.session.test.%(counter)04d', ru.ID_CUSTOM)
+        self.pwd   = tempfile.mkdtemp(prefix='rp.test.')
+        self.mongo = pymongo.MongoClient(DBURL)
+        self.db    = self.mongo.get_default_database()
+        self.coll  = self.db[self.sid]
+        self.mtime = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+
+        self.coll.insert({'_id'    : self.sid,
+                          'uid'    : self.sid,
+                          'type'   : 'session',
+                          '_mtime' : self.mtime})
+        self.coll.insert([{'_id'   : 'pilot.%04d' % i,
+                           'uid'   : 'pilot.%04d' % i,
+                           'type'  : 'pilot'} for i in range(2)])
+        self.coll.insert([{'_id'    : 'unit.%04d' % i,
+                           'uid'    : 'unit.%04d' % i,
+                           'type'   : 'unit',
+                           'pilot'  : 'pilot.%04d' % (i % 2),
+                           'state'  : 'NEW',
+                           '_mtime' : self.mtime + datetime.timedelta(seconds=i)}
+                          for i in range(10)])
+
+    def tearDown(self):
+
+        self.coll.drop()
+        self.mongo.close()
+        shutil.rmtree(self.pwd)
+        rpu.db_utils._cache_units.clear()
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__session_docs(self):
+        """ Test that units are grouped by pilot.
+        """
+
+        docs = rpu.get_session_docs(self.db, self.sid, cachedir=self.pwd)
+
+        assert docs['session']['uid'] == self.sid
+        assert len(docs['unit'])      == 10
+
+        for pilot in docs['pilot']:
+            assert pilot['unit_ids'] == [unit['uid'] for unit in docs['unit']
+                                         if unit['pilot'] == pilot['uid']]
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__incremental(self):
+        """ Test that only units modified since the last read are fetched.
+        """
+
+        rpu.get_session_docs(self.db, self.sid, cachedir=self.pwd)
+        assert os.path.isfile('%s/%s.db' % (self.pwd, self.sid))
+
+        # a change w/o modification time is not picked up, as the unit is
+        # cached -- but updated and new units are.
+        self.coll.update({'uid'  : 'unit.0001'},
+                         {'$set' : {'state' : 'IGNORED'}})
+        self.coll.update({'uid'  : 'unit.0002'},
+                         {'$set' : {'state' : 'DONE'},
+                          '$currentDate' : {'_mtime' : True}})
+        self.coll.insert({'_id'   : 'unit.0010',
+                          'uid'   : 'unit.0010',
+                          'type'  : 'unit',
+                          'pilot' : 'pilot.0000',
+                          'state' : 'NEW'})
+
+        for _ in range(2):
+
+            docs   = rpu.get_session_docs(self.db, self.sid, cachedir=self.pwd)
+            states = dict([[unit['uid'], unit['state']] for unit in docs['unit']])
+
+            assert len(docs['unit'])    == 11
+            assert states['unit.0001']  == 'NEW'
+            assert states['unit.0002']  == 'DONE'
+            assert states['unit.0010']  == 'NEW'
+            assert docs['unit'][-1]['uid'] == 'unit.0010'
+
+            # read the cache from disk for the second round
+            rpu.db_utils._cache_units.clear()
+
+
+#-----------------------------------------------------------------------------
+
@@ -0,0 +1,78 @@
+""" State event feed tests
+"""
+
+import logging
+import unittest
+
+import radical.utils as ru
+
+from radical.pilot.db import DBSession
+from pymongo import MongoClient
+
+import helpers
+
+DBURL = helpers.DBURL
+
+
+#-----------------------------------------------------------------------------
+#
+@helpers.requires_db
+class TestStateEvents(unittest.TestCase):
+
+    def setUp(self):
+
+        self.sid = ru.generate_id('rp.session.test.%(counter)04d', ru.ID_CUSTOM)
+        self.dbs = DBSession(sid=self.sid, dburl=DBURL, cfg={},
+                             logger=logging.getLogger('radical.pilot.test'))
+
+    def tearDown(self):
+
+        self.dbs.close(delete=True)
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__unit_events(self):
+        """ Test that only new events for the given umgr are returned.
+        """
+
+        assert self.dbs.has_state_events
+        assert self.dbs.get_unit_events('umgr.0000') == []
+
+        self.dbs._e.insert([{'type' : 'unit', 'umgr' : 'umgr.0000',
+                             'uid'  : 'unit.0000', 'state' : 'NEW'},
+                            {'type' : 'unit', 'umgr' : 'umgr.0001',
+                             'uid'  : 'unit.0001', 'state' : 'NEW'}])
+
+        events = self.dbs.get_unit_events('umgr.0000')
+        assert [e['uid'] for e in events] == ['unit.0000']
+        assert self.dbs.get_unit_events('umgr.0000') == []
+
+        self.dbs._e.insert({'type' : 'unit', 'umgr' : 'umgr.0000',
+                            'uid'  : 'unit.0000', 'state' : 'DONE'})
+
+        events = self.dbs.get_unit_events('umgr.0000')
+        assert [e['state'] for e in events] == ['DONE']
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__tailed_find(self):
+        """ Test that tailed_find delivers events until the cb returns False.
+        """
+
+        self.dbs._e.insert({'type' : 'unit', 'umgr' : 'umgr.0000',
+                            'uid'  : 'unit.0000', 'state' : 'NEW'})
+        seen = list()
+
+        def cb(docs, cb_data):
+            cb_data.extend(docs)
+            return not cb_data
+
+        self.dbs.tailed_find('events', {'type' : 'unit'}, [], cb, seen)
+
+        assert [e['uid'] for e in seen] == ['unit.0000']
+
+
+#-----------------------------------------------------------------------------
+
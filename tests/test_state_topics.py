@@ -0,0 +1,112 @@
+""" State pubsub topic tests
+"""
+
+import unittest
+
+import radical.pilot.utils     as rpu
+import radical.pilot.states    as rps
+import radical.pilot.constants as rpc
+
+import helpers
+
+
+#-----------------------------------------------------------------------------
+#
+class TestStateTopics(unittest.TestCase):
+
+    def setUp(self):
+
+        self.session = helpers.Session()
+
+    def tearDown(self):
+
+        self.session.close()
+
+    def create(self, shards=1):
+
+        # we only record what gets published
+        cfg  = {'bridges' : {rpc.STATE_PUBSUB : {'shards' : shards}}}
+        comp = helpers.create_component(self.session, cfg)
+
+        self.publisher = helpers.record_publisher(comp)
+
+        return comp
+
+    def units(self):
+
+        return [{'uid' : 'unit.0000', 'type' : 'unit', 'state' : None,
+                 'umgr': 'umgr.0000', 'pilot': 'pilot.0000'},
+                {'uid' : 'unit.0001', 'type' : 'unit', 'state' : None,
+                 'umgr': 'umgr.0000', 'pilot': None},
+                {'uid' : 'unit.0002', 'type' : 'unit', 'state' : None,
+                 'umgr': 'umgr.00001','pilot': 'pilot.0000'},
+                {'uid' : 'pilot.0000', 'type' : 'pilot', 'state' : None,
+                 'pmgr': 'pmgr.0000'}]
+
+    def received(self, filters, shards=1):
+
+        topics = rpu.get_state_topics(rpc.STATE_PUBSUB, filters, shards)
+        ret    = list()
+        for topic, msg in self.publisher.msgs:
+            if [t for t in topics if topic.startswith(t)]:
+                ret += [thing['uid'] for thing in msg['arg']]
+        return sorted(ret)
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__topics(self):
+        """ Test that subscribers only match the updates they filter for.
+        """
+
+        comp = self.create()
+        comp.advance(self.units(), rps.NEW, publish=True, push=False)
+
+        assert self.received({'type' : 'unit', 'owner' : 'umgr.0000'}) \
+                == ['unit.0000', 'unit.0001']
+        assert self.received({'type'  : 'unit', 'owner' : 'umgr.0000',
+                              'pilot' : 'pilot.0000'}) == ['unit.0000']
+        assert self.received([{'type' : 'pilot'},
+                              {'type' : 'unit', 'owner' : 'umgr.00001'}]) \
+                == ['pilot.0000', 'unit.0002']
+        assert self.received({}) \
+                == ['pilot.0000', 'unit.0000', 'unit.0001', 'unit.0002']
+
+        # the plain pubsub name still covers all updates
+        for topic, _ in self.publisher.msgs:
+            assert topic.startswith(rpc.STATE_PUBSUB)
+
+        # only the state is published, not the routing information
+        for _, msg in self.publisher.msgs:
+            for thing in msg['arg']:
+                assert sorted(thing.keys()) == ['state', 'type', 'uid']
+
+        with self.assertRaises(ValueError):
+            rpu.get_state_topics(rpc.STATE_PUBSUB, {'type'  : 'unit',
+                                                    'pilot' : 'pilot.0000'})
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__shards(self):
+        """ Test that state topics are combined with shard topics.
+        """
+
+        comp = self.create(shards=3)
+        comp.advance(self.units(), rps.NEW, publish=True, push=False)
+
+        for shard in range(3):
+            prefix = rpu.get_shard_topic(rpc.STATE_PUBSUB, shard)
+            for topic, msg in self.publisher.msgs:
+                for thing in msg['arg']:
+                    assert topic.startswith(prefix) == \
+                           (rpu.get_shard(thing['uid'], 3) == shard)
+
+        assert self.received({'type' : 'unit', 'owner' : 'umgr.0000'}, 3) \
+                == ['unit.0000', 'unit.0001']
+        assert self.received({'type' : 'pilot', 'owner' : 'pmgr.0000'}, 3) \
+                == ['pilot.0000']
+
+
+#-----------------------------------------------------------------------------
+
@@ -0,0 +1,157 @@
+""" Bulk unit submission tests
+"""
+
+import time
+import unittest
+
+import radical.pilot        as rp
+import radical.pilot.states as rps
+
+import helpers
+
+
+#-----------------------------------------------------------------------------
+#
+class TestSubmitUnits(unittest.TestCase):
+
+    def setUp(self):
+
+        self.advanced = list()
+        self.inserted = list()
+
+        # we only exercise the submission: units are inserted into a fake DB,
+        # and we record the state advances
+        dbs = type('DBSession', (object,), {})()
+        dbs.insert_units = lambda docs: self.inserted.extend(docs)
+
+        self.session = helpers.Session(dbs=dbs)
+        self.umgr    = helpers.create_umgr(self.session)
+
+        advance = self.umgr.advance
+        def record(units, state=None, *args, **kwargs):
+            units = units if isinstance(units, list) else [units]
+            self.advanced.append([[u['uid'] for u in units], state])
+            advance(units, state, *args, **kwargs)
+        self.umgr.advance = record
+
+    def tearDown(self):
+
+        self.umgr._cb_dispatcher.stop()
+        self.session.close()
+
+    def descr(self, **kwargs):
+
+        cud = rp.ComputeUnitDescription()
+        cud.executable     = '/bin/date'
+        cud.cores          = 1
+        cud.input_staging  = ['input.dat']
+        cud.output_staging = ['output.dat', 'output.log']
+
+        for key, val in kwargs.iteritems():
+            cud.set_attribute(key, val)
+
+        return cud
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__bulk(self):
+        """ Test that units are created and advanced as a bulk.
+        """
+
+        units = self.umgr.submit_units([self.descr() for _ in range(10)])
+        uids  = [unit.uid for unit in units]
+
+        # ids are consecutive
+        counters = [int(uid.split('.')[-1]) for uid in uids]
+        assert counters == range(counters[0], counters[0] + 10)
+
+        # one advance for NEW, one for UMGR_SCHEDULING_PENDING
+        assert self.advanced == [[uids, rps.NEW],
+                                 [uids, rps.UMGR_SCHEDULING_PENDING]]
+        assert [doc['uid'] for doc in self.inserted] == uids
+        assert sorted(self.umgr.list_units())       == uids
+
+        # staging directives are expanded, with unique ids
+        sd_ids = set()
+        for unit, doc in zip(units, self.inserted):
+            assert unit.state == rps.NEW
+            assert doc['description'] == unit.description
+            for sd in doc['description']['input_staging'] + \
+                      doc['description']['output_staging']:
+                assert sd['source'] in ['input.dat', 'output.dat', 'output.log']
+                sd_ids.add(sd['uid'])
+        assert len(sd_ids) == 30
+
+        # unit docs don't share the unit's description
+        self.inserted[0]['description']['input_staging'][0]['source'] = 'x'
+        assert units[0].description['input_staging'][0]['source'] == 'input.dat'
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__invalid(self):
+        """ Test that no unit is created if any description is invalid.
+        """
+
+        descrs = [self.descr(), self.descr(cores=0), self.descr()]
+
+        with self.assertRaises(ValueError):
+            self.umgr.submit_units(descrs)
+
+        assert not self.advanced
+        assert not self.inserted
+        assert not self.umgr.list_units()
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__callbacks(self):
+        """ Test that unit callbacks are created on registration only.
+        """
+
+        unit   = self.umgr.submit_units(self.descr())
+        states = list()
+
+        assert unit._callbacks is None
+        unit._call_callbacks(rps.NEW)
+
+        unit.register_callback(lambda u, s: states.append([u.uid, s]))
+        unit._call_callbacks(rps.UMGR_SCHEDULING_PENDING)
+
+        assert states == [[unit.uid, rps.UMGR_SCHEDULING_PENDING]]
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__wait(self):
+        """ Test that waits return only after the callbacks for the state
+            waited for have run.
+        """
+
+        units  = self.umgr.submit_units([self.descr() for _ in range(2)])
+        states = list()
+
+        def slow_cb(unit, state):
+            time.sleep(0.5)
+            states.append([unit.uid, state])
+
+        for unit in units:
+            unit.register_callback(slow_cb)
+
+        self.umgr._update_units([{'type'  : 'unit',
+                                  'uid'   : units[0].uid,
+                                  'state' : rps.FAILED}])
+        assert units[0].state == rps.FAILED
+        assert units[0].wait() == rps.FAILED
+        assert states == [[units[0].uid, rps.FAILED]]
+
+        self.umgr._update_units([{'type'  : 'unit',
+                                  'uid'   : units[1].uid,
+                                  'state' : rps.CANCELED}])
+        assert self.umgr.wait_units() == [rps.CANCELED]
+        assert states[1:] == [[units[1].uid, rps.CANCELED]]
+
+
+#-----------------------------------------------------------------------------
+
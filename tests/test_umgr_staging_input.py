@@ -0,0 +1,189 @@
+""" UMGR input staging tests
+"""
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+
+import radical.utils     as ru
+import radical.pilot     as rp
+import radical.pilot.states    as rps
+import radical.pilot.constants as rpc
+
+from radical.pilot.umgr.staging_input.default import Default
+
+
+#-----------------------------------------------------------------------------
+#
+class TestUMGRStagingInput(unittest.TestCase):
+
+    def setUp(self):
+
+        self.pwd      = tempfile.mkdtemp(prefix='rp.test.')
+        self.advanced = list()
+
+        os.mkdir('%s/client' % self.pwd)
+        for name in ['shared.dat', 'unit.0000.dat', 'unit.0001.dat',
+                     'unit.0002.dat']:
+            with open('%s/client/%s' % (self.pwd, name), 'w') as f:
+                f.write(name)
+
+        # we only exercise the staging, so we skip the component setup
+        stager = Default.__new__(Default)
+        stager._uid     = 'umgr.staging.input.0000'
+        stager._cfg     = {'staging_threads' : 2}
+        stager._log     = logging.getLogger('radical.pilot.test')
+        stager._prof    = ru.Profiler('radical.pilot.test')
+        stager._session = None
+
+        stager.register_input  = lambda *args, **kwargs: None
+        stager.register_output = lambda *args, **kwargs: None
+        stager.advance         = lambda units, state=None, publish=None, \
+                                 push=None: self.advanced.append([units, state])
+        stager.initialize_child()
+
+        self.stager = stager
+
+    def tearDown(self):
+
+        self.stager.finalize_child()
+        shutil.rmtree(self.pwd)
+
+    def unit(self, uid, sources, target='unit:///%s'):
+
+        sandbox = 'file://localhost%s/pilot.0000/' % self.pwd
+        sds     = list()
+        for i, source in enumerate(sources):
+            sds.append({'uid'    : 'sd.%04d' % i,
+                        'source' : 'file://localhost%s/client/%s'
+                                   % (self.pwd, source),
+                        'target' : target % source,
+                        'action' : rpc.TRANSFER,
+                        'flags'  : [rpc.CREATE_PARENTS]})
+
+        return {'uid'              : uid,
+                'description'      : {'input_staging' : sds},
+                'resource_sandbox' : 'file://localhost%s' % self.pwd,
+                'pilot_sandbox'    : sandbox,
+                'unit_sandbox'     : '%s/%s/' % (sandbox, uid)}
+
+    def states(self):
+
+        ret = dict()
+        for units, state in self.advanced:
+            for unit in units:
+                ret[unit['uid']] = state
+        return ret
+
+    def staged(self):
+
+        return os.listdir('%s/pilot.0000/staging_area' % self.pwd)
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__bulk(self):
+        """ Test that shared sources are transferred once, and linked.
+        """
+
+        units = [self.unit('unit.%04d' % i, ['shared.dat', 'unit.%04d.dat' % i])
+                 for i in range(3)]
+        units.append(self.unit('unit.0003', []))
+
+        self.stager.work(units)
+
+        assert self.states() == {'unit.0000' : rps.AGENT_STAGING_INPUT_PENDING,
+                                 'unit.0001' : rps.AGENT_STAGING_INPUT_PENDING,
+                                 'unit.0002' : rps.AGENT_STAGING_INPUT_PENDING,
+                                 'unit.0003' : rps.AGENT_STAGING_INPUT_PENDING}
+
+        staged = self.staged()
+        assert len(staged) == 1
+        assert staged[0].endswith('.shared.dat')
+
+        for i, unit in enumerate(units[:3]):
+
+            shared, own = unit['description']['input_staging']
+            assert shared['action'] == rpc.LINK
+            assert shared['source'] == 'pilot:///%s' % staged[0]
+            assert own['action']    == rpc.TRANSFER
+
+            fname = '%s/pilot.0000/%s/unit.%04d.dat' % (self.pwd, unit['uid'], i)
+            assert open(fname).read() == 'unit.%04d.dat' % i
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__reuse(self):
+        """ Test that staged sources are reused unless they change.
+        """
+
+        self.stager.work([self.unit('unit.%04d' % i, ['shared.dat'])
+                          for i in range(2)])
+        staged = self.staged()
+
+        unit = self.unit('unit.0002', ['shared.dat'])
+        self.stager.work([unit])
+
+        assert self.staged() == staged
+        assert unit['description']['input_staging'][0]['source'] \
+                == 'pilot:///%s' % staged[0]
+
+        # a changed source is staged again
+        time.sleep(0.01)
+        with open('%s/client/shared.dat' % self.pwd, 'w') as f:
+            f.write('changed')
+
+        self.stager.work([self.unit('unit.%04d' % i, ['shared.dat'])
+                          for i in range(3, 5)])
+        assert len(self.staged()) == 2
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__shared_target(self):
+        """ Test that targets outside of unit sandboxes are not deduplicated.
+        """
+
+        units = [self.unit('unit.%04d' % i, ['shared.dat'], 'pilot:///%s')
+                 for i in range(2)]
+        units.append(self.unit('unit.0002', ['shared.dat'], '%s'))
+
+        self.stager.work(units)
+
+        assert self.states() == {'unit.0000' : rps.AGENT_STAGING_INPUT_PENDING,
+                                 'unit.0001' : rps.AGENT_STAGING_INPUT_PENDING,
+                                 'unit.0002' : rps.AGENT_STAGING_INPUT_PENDING}
+
+        for unit in units:
+            sd = unit['description']['input_staging'][0]
+            assert sd['action'] == rpc.TRANSFER
+
+        # 'pilot:///' is the pilot's staging area, but nothing else is staged
+        assert self.staged() == ['shared.dat']
+        fname = '%s/pilot.0000/unit.0002/shared.dat' % self.pwd
+        assert open(fname).read() == 'shared.dat'
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__failed(self):
+        """ Test that units fail if any of their transfers fail.
+        """
+
+        units = [self.unit('unit.0000', ['missing.dat', 'unit.0000.dat']),
+                 self.unit('unit.0001', ['missing.dat']),
+                 self.unit('unit.0002', ['unit.0002.dat'])]
+
+        self.stager.work(units)
+
+        assert self.states() == {'unit.0000' : rps.FAILED,
+                                 'unit.0001' : rps.FAILED,
+                                 'unit.0002' : rps.AGENT_STAGING_INPUT_PENDING}
+
+
+#-----------------------------------------------------------------------------
+
@@ -0,0 +1,127 @@
+""" Unit claim tests
+"""
+
+import logging
+import unittest
+
+import radical.utils as ru
+
+from radical.pilot.db import DBSession
+
+import helpers
+
+DBURL = helpers.DBURL
+
+
+#-----------------------------------------------------------------------------
+#
+@helpers.requires_db
+class TestUnitClaim(unittest.TestCase):
+
+    def setUp(self):
+
+        self.sid = ru.generate_id('rp.session.test.%(counter)04d', ru.ID_CUSTOM)
+        self.dbs = DBSession(sid=self.sid, dburl=DBURL, cfg={},
+                             logger=logging.getLogger('radical.pilot.test'))
+
+        self.dbs._c.insert([{'_id'     : 'unit.%04d' % i,
+                             'uid'     : 'unit.%04d' % i,
+                             'type'    : 'unit',
+                             'pilot'   : 'pilot.%04d' % (i % 2),
+                             'control' : 'agent_pending',
+                             'cmd'     : list(),
+                             'states'  : ['AGENT_STAGING_INPUT_PENDING']}
+                            for i in range(100)])
+
+    def tearDown(self):
+
+        self.dbs.close(delete=True)
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__claim_units(self):
+        """ Test that claims are bounded, and never return a unit twice.
+        """
+
+        claimed = list()
+        while True:
+            units = self.dbs.claim_units({'pilot' : 'pilot.0000'}, 'agent',
+                                         limit=16)
+            if not units:
+                break
+            assert len(units) <= 16
+            claimed += units
+
+        uids = [u['uid'] for u in claimed]
+        assert len(uids) == 50
+        assert len(set(uids)) == 50
+
+        for unit in claimed:
+            assert unit['pilot']   == 'pilot.0000'
+            assert unit['control'] == 'agent'
+            assert 'lease'  not in unit
+            assert '_mtime' not in unit
+            assert 'cmd'   not in unit
+
+        # the other pilot's units are untouched
+        assert self.dbs._c.find({'pilot'   : 'pilot.0001',
+                                 'control' : 'agent_pending'}).count() == 50
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__claim_concurrent(self):
+        """ Test that concurrent claims from several sessions don't overlap.
+        """
+
+        other = DBSession(sid=self.sid, dburl=DBURL, cfg={},
+                          logger=logging.getLogger('radical.pilot.test'))
+        try:
+            uids = list()
+            for _ in range(10):
+                for dbs in [self.dbs, other]:
+                    units = dbs.claim_units({}, 'agent', limit=8)
+                    uids += [u['uid'] for u in units]
+
+            assert len(uids)      == 100
+            assert len(set(uids)) == 100
+
+        finally:
+            other.close(delete=False)
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__claim_race(self):
+        """ Test that units claimed by others between our fetch and our claim
+            are not returned.
+        """
+
+        other = DBSession(sid=self.sid, dburl=DBURL, cfg={},
+                          logger=logging.getLogger('radical.pilot.test'))
+        theirs = list()
+        find   = self.dbs._c.find
+
+        def racing_find(*args, **kwargs):
+            docs = list(find(*args, **kwargs))
+            if not theirs:
+                theirs.extend(other.claim_units({}, 'agent', limit=10))
+            return docs
+
+        try:
+            self.dbs._c.find = racing_find
+            ours = self.dbs.claim_units({}, 'agent', limit=30)
+
+            mine   = set([u['uid'] for u in ours])
+            others = set([u['uid'] for u in theirs])
+            assert len(mine)   == 20
+            assert len(others) == 10
+            assert len(mine | others) == 30
+
+        finally:
+            other.close(delete=False)
+
+
+#-----------------------------------------------------------------------------
+
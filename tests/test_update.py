@@ -0,0 +1,257 @@
+""" Update worker tests
+"""
+
+import time
+import logging
+import datetime
+import threading
+import unittest
+import collections
+
+import pymongo
+
+import radical.pilot.states as rps
+
+from radical.pilot.worker.update import Update, SHARED_KEYS
+
+import helpers
+
+
+#-----------------------------------------------------------------------------
+#
+class Collection(object):
+    """
+    Records the ops of executed bulks, or fails the execution with `error`.
+    """
+
+    def __init__(self):
+
+        self.bulks = list()
+        self.error = None
+
+    def initialize_unordered_bulk_op(self):
+
+        return Bulk(self)
+
+
+class Bulk(object):
+
+    def __init__(self, coll):
+
+        self._coll  = coll
+        self._query = None
+        self._ops   = list()
+
+    def find(self, query):
+
+        self._query = query
+        return self
+
+    def update(self, update):
+
+        self._ops.append([self._query, update])
+
+    def execute(self):
+
+        if self._coll.error:
+            raise self._coll.error
+        self._coll.bulks.append(self._ops)
+        return dict()
+
+
+#-----------------------------------------------------------------------------
+#
+class TestUpdate(unittest.TestCase):
+
+    def setUp(self):
+
+        # the worker state `initialize_child()` would set up, minus the DB
+        # connection and the subscriptions
+        self.coll   = Collection()
+        self.worker = Update.__new__(Update)
+
+        self.worker._uid     = 'update.0000'
+        self.worker._owner   = 'agent_0'
+        self.worker._log     = logging.getLogger('radical.pilot.test')
+        self.worker._prof    = helpers.Reporter()
+        self.worker._coll    = self.coll
+        self.worker._ecoll   = None
+        self.worker._last    = time.time()
+        self.worker._uids    = list()
+        self.worker._pending = collections.OrderedDict()
+        self.worker._pushed  = dict()
+        self.worker._events  = list()
+        self.worker._lock    = threading.RLock()
+        self.worker._ops_in  = 0
+        self.worker._ops_out = 0
+        self.worker._bct     = 1000.0
+        self.worker._bcs     = 1000
+
+    def update(self, *things):
+
+        self.worker._state_cb(None, {'cmd' : 'update', 'arg' : list(things)})
+
+    def push(self):
+
+        self.worker._timed_bulk_execute(flush=True)
+        return self.coll.bulks[-1]
+
+    def unit(self, uid, state, **kwargs):
+
+        thing = {'uid'         : uid,
+                 'type'        : 'unit',
+                 'state'       : state,
+                 'control'     : 'agent',
+                 'description' : {'executable' : '/bin/date'},
+                 'states'      : list()}
+        thing.update(kwargs)
+        return thing
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__coalesce(self):
+        """ Test that updates of the same thing end up in one op per bulk.
+        """
+
+        self.update(self.unit('unit.0000', rps.AGENT_SCHEDULING),
+                    self.unit('unit.0001', rps.AGENT_SCHEDULING))
+        self.update(self.unit('unit.0000', rps.AGENT_EXECUTING_PENDING,
+                              slots={'nodes' : ['node.0']},
+                              _mtime=datetime.datetime.utcnow()))
+
+        assert len(self.worker._pending) == 2
+        assert self.worker._ops_in == 3
+
+        ops = self.push()
+        assert [op[0]['uid'] for op in ops] == ['unit.0000', 'unit.0001']
+
+        query, update = ops[0]
+        assert query == {'uid' : 'unit.0000', 'type' : 'unit'}
+        assert update['$set']['state'] == rps.AGENT_EXECUTING_PENDING
+        assert update['$set']['slots'] == {'nodes' : ['node.0']}
+        assert update['$push']['states']['$each'] == \
+                [rps.AGENT_SCHEDULING, rps.AGENT_EXECUTING_PENDING]
+        assert '_id'    not in update['$set']
+        assert '_mtime' not in update['$set']
+        assert 'states' not in update['$set']
+
+        assert not self.worker._pending
+        assert self.worker._ops_out == 2
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__delta(self):
+        """ Test that only fields changed since the last push are sent.
+        """
+
+        descr = {'executable' : '/bin/date', 'arguments' : ['-u']}
+
+        self.update(self.unit('unit.0000', rps.AGENT_SCHEDULING,
+                              description=descr, exit_code=None))
+        update = self.push()[0][1]
+        assert update['$set']['description'] == descr
+
+        # unchanged fields are dropped
+        self.update(self.unit('unit.0000', rps.AGENT_EXECUTING_PENDING,
+                              description=descr, exit_code=None))
+        update = self.push()[0][1]
+        assert 'description' not in update['$set']
+        assert 'exit_code'   not in update['$set']
+
+        # changed fields are sent, also if the thing was changed in place
+        descr['arguments'].append('-R')
+        self.update(self.unit('unit.0000', rps.AGENT_EXECUTING,
+                              description=descr, exit_code=0))
+        update = self.push()[0][1]
+        assert update['$set']['description'] == descr
+        assert update['$set']['exit_code']   == 0
+
+        # a field which changes within a bulk is sent, even if it changes back
+        self.update(self.unit('unit.0000', rps.AGENT_STAGING_OUTPUT_PENDING,
+                              description=descr, exit_code=1),
+                    self.unit('unit.0000', rps.AGENT_STAGING_OUTPUT,
+                              description=descr, exit_code=0))
+        update = self.push()[0][1]
+        assert update['$set']['exit_code'] == 0
+        assert 'description' not in update['$set']
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__shared_keys(self):
+        """ Test that fields which others write to are always sent.
+        """
+
+        self.update(self.unit('unit.0000', rps.AGENT_SCHEDULING,
+                              stdout='', stderr=''))
+        self.push()
+
+        self.update(self.unit('unit.0000', rps.AGENT_EXECUTING_PENDING,
+                              stdout='', stderr=''))
+        update = self.push()[0][1]
+        for key in ['state', 'control', 'stdout', 'stderr']:
+            assert key in SHARED_KEYS
+            assert key in update['$set']
+
+        for key in SHARED_KEYS:
+            assert key not in self.worker._pushed['unit.0000']
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__final(self):
+        """ Test that nothing is remembered for things in a final state.
+        """
+
+        self.update(self.unit('unit.0000', rps.AGENT_SCHEDULING),
+                    self.unit('unit.0001', rps.AGENT_SCHEDULING))
+        self.push()
+        assert sorted(self.worker._pushed) == ['unit.0000', 'unit.0001']
+
+        self.update(self.unit('unit.0000', rps.DONE))
+        self.push()
+        assert sorted(self.worker._pushed) == ['unit.0001']
+
+
+    #-------------------------------------------------------------------------
+    #
+    def test__failed(self):
+        """ Test that after failed ops, all fields are sent again.
+        """
+
+        uids = ['unit.%04d' % i for i in range(3)]
+
+        self.update(*[self.unit(uid, rps.AGENT_SCHEDULING) for uid in uids])
+        self.push()
+        assert sorted(self.worker._pushed) == uids
+
+        # only the op for the second unit failed
+        self.update(*[self.unit(uid, rps.AGENT_EXECUTING_PENDING)
+                      for uid in uids])
+        self.coll.error = pymongo.errors.BulkWriteError(
+                                  {'writeErrors' : [{'index' : 1}]})
+        self.assertRaises(pymongo.errors.BulkWriteError,
+                          self.worker._timed_bulk_execute, True)
+        assert sorted(self.worker._pushed) == [uids[0], uids[2]]
+
+        # we don't know what failed -- forget all
+        self.worker._pending = collections.OrderedDict()
+        self.update(*[self.unit(uid, rps.AGENT_EXECUTING_PENDING)
+                      for uid in uids])
+        self.coll.error = pymongo.errors.OperationFailure('oops')
+        self.assertRaises(pymongo.errors.OperationFailure,
+                          self.worker._timed_bulk_execute, True)
+        assert not self.worker._pushed
+
+        # the next push sends the full things again
+        self.coll.error      = None
+        self.worker._pending = collections.OrderedDict()
+        self.update(*[self.unit(uid, rps.AGENT_EXECUTING) for uid in uids])
+        for _, update in self.push():
+            assert 'description' in update['$set']
+
+
+#-----------------------------------------------------------------------------
+